@@ -0,0 +1,197 @@
+"""Retention policy and the compressed cold archive that expired messages move to."""
+import heapq
+import json
+import os
+import threading
+import zlib
+from bisect import insort
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from compact import toMicros
+from inbox import bySeq
+
+BLOCK_FILE = "blocks.dat"
+INDEX_FILE = "index.jsonl"
+
+
+def audienceOf(message) -> str:
+    # Direct messages are filed under their recipient, group messages under the group, as in the inbox.
+    return f"g:{message.group}" if message.group else f"u:{message.recipient}"
+
+
+def audiencesFor(userName: str, groupNames: Iterable[str]) -> List[str]:
+    return [f"u:{userName}"] + [f"g:{groupName}" for groupName in groupNames]
+
+
+class RetentionPolicy:
+    """How long messages stay hot: `hot` for everything, with optional per-group overrides."""
+
+    def __init__(self, hot: timedelta = timedelta(days=30), groups: Optional[Dict[str, timedelta]] = None):
+        self.hot = hot
+        self.groups = dict(groups or {})
+
+    def shortest(self) -> timedelta:
+        # No message younger than this can be expired, which bounds the scan for candidates.
+        return min([self.hot, *self.groups.values()])
+
+    def expired(self, message, now: datetime) -> bool:
+        keep = self.groups.get(message.group, self.hot) if message.group else self.hot
+        return message.timestampUs < toMicros(now - keep)
+
+
+class ArchiveSpan:
+    """Where one audience's messages sit inside one block: a slice of the block plus its seq and time range."""
+
+    __slots__ = ("firstSeq", "lastSeq", "firstUs", "lastUs", "block", "start", "end")
+
+    def __init__(self, firstSeq: int, lastSeq: int, firstUs: int, lastUs: int, block: int, start: int, end: int):
+        self.firstSeq, self.lastSeq, self.firstUs, self.lastUs = firstSeq, lastSeq, firstUs, lastUs
+        self.block, self.start, self.end = block, start, end
+
+    def __lt__(self, other: "ArchiveSpan"):
+        return self.firstSeq < other.firstSeq
+
+    def overlaps(self, sinceUs: Optional[int], beforeUs: Optional[int], beforeSeq: Optional[int]) -> bool:
+        return ((sinceUs is None or self.lastUs >= sinceUs) and (beforeUs is None or self.firstUs < beforeUs)
+                and (beforeSeq is None or self.firstSeq < beforeSeq))
+
+
+class MessageArchive:
+    """Append-only store of zlib-compressed message blocks in `directory`, with a time-range index.
+
+    Each archiving pass sorts its messages by audience (recipient or group), then seq, and cuts them
+    into blocks of up to `blockSize`, so a user's archived history sits in a few contiguous slices.
+    index.jsonl records every block's offset and, per audience, its slice and seq/time range; it is
+    written after the block data, so a torn write leaves at most unreferenced bytes. Reads only
+    decompress blocks whose ranges overlap the request, and recently read blocks stay decoded in
+    an LRU cache of `cacheBlocks` entries. Appending messages that are already archived is a no-op,
+    so a retention pass interrupted before the hot store dropped them can simply be rerun.
+    """
+
+    def __init__(self, directory: str, blockSize: int = 256, cacheBlocks: int = 64, level: int = 6):
+        os.makedirs(directory, exist_ok=True)
+        self.blockPath = os.path.join(directory, BLOCK_FILE)
+        self.indexPath = os.path.join(directory, INDEX_FILE)
+        self.blockSize = blockSize
+        self.cacheBlocks = cacheBlocks
+        self.level = level
+        self.messageFactory: Callable[[tuple], object] = tuple
+        self.lock = threading.RLock()
+        self.blocks: List[Tuple[int, int]] = []  # (offset, length) in blocks.dat
+        self.spans: Dict[str, List[ArchiveSpan]] = {}
+        self.archivedThrough: Dict[str, int] = {}  # Newest archived seq per audience
+        self.cache: "OrderedDict[int, List]" = OrderedDict()
+        self.count = 0
+        self.lastSeq = 0
+        if os.path.exists(self.indexPath):
+            with open(self.indexPath) as f:
+                for line in f:
+                    self.track(json.loads(line))
+
+    def __len__(self):
+        return self.count
+
+    def track(self, entry: dict) -> None:
+        block = len(self.blocks)
+        self.blocks.append((entry["offset"], entry["length"]))
+        self.count += entry["count"]
+        for audience, (firstSeq, lastSeq, firstUs, lastUs, start, end) in entry["audiences"].items():
+            insort(self.spans.setdefault(audience, []), ArchiveSpan(firstSeq, lastSeq, firstUs, lastUs, block, start, end))
+            self.archivedThrough[audience] = max(self.archivedThrough.get(audience, 0), lastSeq)
+            self.lastSeq = max(self.lastSeq, lastSeq)
+
+    def append(self, messages: Iterable) -> int:
+        """Archive `messages`, skipping any already archived; returns how many were written."""
+        with self.lock:
+            # Passes archive each audience's oldest messages, so seqs up to its newest archived one are repeats.
+            fresh = [message for message in messages if message.seq > self.archivedThrough.get(audienceOf(message), 0)]
+            ordered = sorted(fresh, key=lambda message: (audienceOf(message), message.seq))
+            for start in range(0, len(ordered), self.blockSize):
+                self.writeBlock(ordered[start:start + self.blockSize])
+        return len(ordered)
+
+    def writeBlock(self, messages: List) -> None:
+        rows = [(m.seq, m.sender, m.recipient, m.group, m.content, m.timestampUs) for m in messages]
+        data = zlib.compress(json.dumps(rows, separators=(",", ":")).encode(), self.level)
+        audiences, position = {}, 0
+        for audience, run in groupby(messages, key=audienceOf):
+            run = list(run)
+            audiences[audience] = [run[0].seq, run[-1].seq, min(m.timestampUs for m in run),
+                                   max(m.timestampUs for m in run), position, position + len(run)]
+            position += len(run)
+        with open(self.blockPath, "ab") as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        entry = {"offset": offset, "length": len(data), "count": len(messages), "audiences": audiences}
+        with open(self.indexPath, "a") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.track(entry)
+
+    def read(self, block: int) -> List:
+        with self.lock:
+            messages = self.cache.get(block)
+            if messages is not None:
+                self.cache.move_to_end(block)
+                return messages
+            offset, length = self.blocks[block]
+            with open(self.blockPath, "rb") as f:
+                f.seek(offset)
+                rows = json.loads(zlib.decompress(f.read(length)))
+            messages = [self.messageFactory(tuple(row)) for row in rows]
+            self.cache[block] = messages
+            if len(self.cache) > self.cacheBlocks:
+                self.cache.popitem(last=False)
+            return messages
+
+    def spansFor(self, userName: str, groupNames: Iterable[str], sinceUs: Optional[int] = None,
+                 beforeUs: Optional[int] = None, beforeSeq: Optional[int] = None) -> List[List[ArchiveSpan]]:
+        found = []
+        for audience in audiencesFor(userName, groupNames):
+            spans = [span for span in self.spans.get(audience, ()) if span.overlaps(sinceUs, beforeUs, beforeSeq)]
+            if spans:
+                found.append(spans)
+        return found
+
+    def newestFirst(self, spans: List[ArchiveSpan], sinceUs: Optional[int], beforeUs: Optional[int],
+                    beforeSeq: Optional[int]) -> Iterator:
+        for span in reversed(spans):
+            for message in reversed(self.read(span.block)[span.start:span.end]):
+                if ((sinceUs is None or message.timestampUs >= sinceUs) and (beforeUs is None or message.timestampUs < beforeUs)
+                        and (beforeSeq is None or message.seq < beforeSeq)):
+                    yield message
+
+    def messagesFor(self, userName: str, groupNames: Iterable[str]) -> List:
+        """All archived messages visible to a user, oldest first."""
+        streams = [[m for span in spans for m in self.read(span.block)[span.start:span.end]]
+                   for spans in self.spansFor(userName, groupNames)]
+        return list(heapq.merge(*streams, key=bySeq))
+
+    def withArchived(self, hot: Iterator, userName: str, groupNames: Iterable[str], since: Optional[datetime] = None,
+                     before: Optional[datetime] = None, beforeSeq: Optional[int] = None) -> Iterator:
+        """Extend a newest-first stream of hot messages with the user's archived ones, in seq order.
+
+        Blocks are only decompressed once the hot stream reaches the newest archived seq, so pages
+        served entirely from the hot window never touch the archive files.
+        """
+        sinceUs = toMicros(since) if since is not None else None
+        beforeUs = toMicros(before) if before is not None else None
+        found = self.spansFor(userName, groupNames, sinceUs, beforeUs, beforeSeq)
+        if not found:
+            yield from hot
+            return
+        newest = max(spans[-1].lastSeq for spans in found)
+        for message in hot:
+            if message.seq < newest:
+                archived = [self.newestFirst(spans, sinceUs, beforeUs, beforeSeq) for spans in found]
+                yield from heapq.merge(iter([message]), hot, *archived, key=bySeq, reverse=True)
+                return
+            yield message
+        yield from heapq.merge(*(self.newestFirst(spans, sinceUs, beforeUs, beforeSeq) for spans in found),
+                               key=bySeq, reverse=True)
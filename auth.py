@@ -0,0 +1,154 @@
+"""Password hashing and the session-token cache that keeps the KDF cost off every request but the login."""
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Callable, Optional, Tuple
+
+SCRYPT = "scrypt"
+PBKDF2 = "pbkdf2_sha256"
+# Some OpenSSL builds ship without scrypt; PBKDF2 is always available.
+DEFAULT_ALGORITHM = SCRYPT if hasattr(hashlib, "scrypt") else PBKDF2
+
+
+def b64(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+class PasswordHasher:
+    """Salted KDF hashes encoded as "scrypt$n$r$p$salt$hash" or "pbkdf2_sha256$iterations$salt$hash".
+
+    The cost parameters are stored in each hash, so raising them later still verifies old hashes and
+    needsRehash reports which ones to upgrade. Values in neither format are legacy plaintext.
+    """
+
+    def __init__(self, algorithm: str = DEFAULT_ALGORITHM, n: int = 2 ** 14, r: int = 8, p: int = 1,
+                 iterations: int = 600000, saltBytes: int = 16):
+        if algorithm not in (SCRYPT, PBKDF2):
+            raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.n, self.r, self.p = n, r, p
+        self.iterations = iterations
+        self.saltBytes = saltBytes
+        self.dummy: Optional[str] = None
+
+    def hash(self, password: str) -> str:
+        salt = secrets.token_bytes(self.saltBytes)
+        if self.algorithm == SCRYPT:
+            digest = self.scrypt(password, salt, self.n, self.r, self.p)
+            return f"{SCRYPT}${self.n}${self.r}${self.p}${b64(salt)}${b64(digest)}"
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, self.iterations)
+        return f"{PBKDF2}${self.iterations}${b64(salt)}${b64(digest)}"
+
+    @staticmethod
+    def scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        # OpenSSL's default memory cap is too low for some cost settings, so allow what n and r need.
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 2 ** 20, dklen=32)
+
+    @staticmethod
+    def identify(encoded: str) -> Optional[str]:
+        algorithm = encoded.split("$", 1)[0]
+        fields = encoded.count("$")
+        if (algorithm == SCRYPT and fields == 5) or (algorithm == PBKDF2 and fields == 3):
+            return algorithm
+        return None
+
+    def verify(self, password: str, encoded: str) -> bool:
+        """Check `password` against a stored hash (or legacy plaintext) in constant time."""
+        algorithm = self.identify(encoded)
+        try:
+            if algorithm == SCRYPT:
+                _, n, r, p, salt, expected = encoded.split("$")
+                digest = self.scrypt(password, unb64(salt), int(n), int(r), int(p))
+            elif algorithm == PBKDF2:
+                _, iterations, salt, expected = encoded.split("$")
+                digest = hashlib.pbkdf2_hmac("sha256", password.encode(), unb64(salt), int(iterations))
+            else:
+                return hmac.compare_digest(password.encode(), encoded.encode())
+            return hmac.compare_digest(digest, unb64(expected))
+        except ValueError:
+            return False
+
+    def verifyUnknown(self, password: str) -> bool:
+        # Spend the same time on unknown user names as on known ones, so timing does not reveal which exist.
+        if self.dummy is None:
+            self.dummy = self.hash(secrets.token_urlsafe(16))
+        self.verify(password, self.dummy)
+        return False
+
+    def needsRehash(self, encoded: str) -> bool:
+        algorithm = self.identify(encoded)
+        if algorithm != self.algorithm:
+            return True
+        if algorithm == SCRYPT:
+            return encoded.split("$")[1:4] != [str(self.n), str(self.r), str(self.p)]
+        return encoded.split("$")[1] != str(self.iterations)
+
+
+class SessionCache:
+    """Expiring session tokens for users who have logged in; verifying one is a dict lookup.
+
+    Only a SHA-256 digest of each token is kept, so the cache (or a dump of it) holds nothing a client
+    could present, and lookups are keyed by the digest rather than by attacker-chosen bytes. Sessions
+    expire `ttl` after login; past `maxSessions` the oldest are dropped first.
+    """
+
+    def __init__(self, ttl: timedelta = timedelta(hours=12), maxSessions: int = 100000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl.total_seconds()
+        self.maxSessions = maxSessions
+        self.clock = clock
+        self.lock = threading.Lock()
+        # Issued in order with a fixed ttl, so the oldest entry is always the first to expire.
+        self.sessions: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def issue(self, userName: str) -> str:
+        token = secrets.token_urlsafe(32)
+        now = self.clock()
+        with self.lock:
+            while self.sessions and (len(self.sessions) >= self.maxSessions or next(iter(self.sessions.values()))[1] <= now):
+                self.sessions.popitem(last=False)
+            self.sessions[self.key(token)] = (userName, now + self.ttl)
+        return token
+
+    def verify(self, token: str) -> Optional[str]:
+        """The user name a live token belongs to, or None."""
+        key = self.key(token)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                return None
+            if session[1] <= self.clock():
+                del self.sessions[key]
+                return None
+            return session[0]
+
+    def revoke(self, token: str) -> bool:
+        with self.lock:
+            return self.sessions.pop(self.key(token), None) is not None
+
+    def revokeUser(self, userName: str) -> int:
+        with self.lock:
+            keys = [key for key, (name, _) in self.sessions.items() if name == userName]
+            for key in keys:
+                del self.sessions[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.sessions.clear()
@@ -0,0 +1,86 @@
+"""Authentication throughput: password logins at full KDF cost versus requests verified by session token.
+
+Run from the repository root:
+    python -m benchmarks.bench_auth [--users 2000] [--logins 50] [--requests 20000] [--algorithm scrypt] [--threads 1]
+
+A request here is what an authenticated page open does: resolve the caller, then read a page of messages.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from auth import DEFAULT_ALGORITHM, PBKDF2, SCRYPT, PasswordHasher
+from benchmarks.cohort import generateCohort
+from logconfig import configureLogging
+from main import DatabaseManager, MessageController
+from storage import MemoryStorage
+
+PASSWORD = "cohort password"
+
+
+def throughput(function, items, threads):
+    start = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(function, items))
+    else:
+        results = [function(item) for item in items]
+    return len(items) / (time.perf_counter() - start), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--algorithm", choices=(SCRYPT, PBKDF2), default=DEFAULT_ALGORITHM)
+    parser.add_argument("--n", type=int, default=2 ** 14, help="scrypt cost")
+    parser.add_argument("--iterations", type=int, default=600000, help="PBKDF2 cost")
+    parser.add_argument("--threads", type=int, default=1, help="hashlib releases the GIL while hashing")
+    parser.add_argument("--seed", type=int, default=20)
+    args = parser.parse_args()
+
+    configureLogging(silent=True)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    cohort = generateCohort(dbmngr, args.users, args.groups, args.messages, args.seed)
+    hasher = PasswordHasher(args.algorithm, n=args.n, iterations=args.iterations)
+    dbmngr.usePasswordHasher(hasher)
+    # The cohort was imported with a cheap hash; give the accounts that log in a real one.
+    accounts = [cohort.rng.choice(cohort.users) for _ in range(args.logins)]
+    for user in set(accounts):
+        user.password = hasher.hash(PASSWORD)
+        dbmngr.userCredentials[user.userName]["passwordHash"] = user.password
+    messenger = MessageController(dbmngr)
+
+    loginRate, tokens = throughput(lambda user: dbmngr.login(user.userName, PASSWORD), accounts, args.threads)
+    assert all(tokens), "every login should succeed"
+    unknownRate, _ = throughput(lambda user: dbmngr.login(user.userName + "?", PASSWORD), accounts, args.threads)
+    requests = [tokens[i % len(tokens)] for i in range(args.requests)]
+    verifyRate, users = throughput(dbmngr.authenticate, requests, args.threads)
+    assert all(users), "every token should verify"
+
+    def withToken(token):
+        return list(messenger.getMessagePage(dbmngr.authenticate(token), limit=20))
+
+    def withPassword(user):
+        dbmngr.login(user.userName, PASSWORD)
+        return list(messenger.getMessagePage(user, limit=20))
+
+    tokenRequestRate, _ = throughput(withToken, requests, args.threads)
+    passwordRequestRate, _ = throughput(withPassword, accounts, args.threads)
+
+    cost = f"n={args.n}" if args.algorithm == SCRYPT else f"iterations={args.iterations}"
+    print(f"{args.algorithm} ({cost}), {args.threads} thread(s)")
+    print(f"{'operation':>34}{'per second':>14}{'us each':>12}")
+    for label, rate in (("login", loginRate), ("login, unknown user", unknownRate), ("token verification", verifyRate),
+                        ("page request, token", tokenRequestRate), ("page request, password each time", passwordRequestRate)):
+        print(f"{label:>34}{rate:>14.0f}{1e6 / rate:>12.1f}")
+    dbmngr.usePasswordHasher(PasswordHasher())
+    dbmngr.useStorage(MemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Batched sends versus looping over the single-message calls: one announcement to many groups, many messages to one user.
+
+Run from the repository root:
+    python -m benchmarks.bench_broadcast [--groups 50] [--batch 20] [--rounds 200] [--members 30]
+
+Each backend starts empty. SQLite runs on a file in a temporary directory with its default batched commits.
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.cohort import CHEAP_HASHER
+from logconfig import configureLogging
+from main import DatabaseManager, MessageController, StudyGroupController, User
+from snapshot import SnapshotStorage
+from storage import MemoryStorage, SQLiteStorage
+
+
+def setUp(dbmngr, storage, groupCount, members):
+    dbmngr.useStorage(storage)
+    controller = StudyGroupController(dbmngr)
+    users = [User(f"broadcastUser{i}", "password", f"broadcastUser{i}@example.com") for i in range(members)]
+    for user in users:
+        dbmngr.saveUser(user)
+    instructor = users[0]
+    groups = [controller.createStudyGroup(f"section{i}", "CS3377", "ECSW", datetime(2024, 9, 1) + timedelta(days=i),
+                                          members, instructor) for i in range(groupCount)]
+    for group in groups:
+        for user in users[1:]:
+            controller.joinStudyGroup(group.groupID, user)
+    return instructor, users[1], groups
+
+
+def rates(loop, batch, rounds, messagesPerRound):
+    # Alternated round by round, so both see the same store size. The collector is off while timing, as in
+    # bench_metrics: its full passes over the growing store otherwise land on whichever side triggers them.
+    seconds = [0.0, 0.0]
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            for i, operation in enumerate((loop, batch)):
+                start = time.perf_counter()
+                operation()
+                seconds[i] += time.perf_counter() - start
+    finally:
+        gc.enable()
+    return [rounds * messagesPerRound / elapsed for elapsed in seconds]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--groups", type=int, default=50, help="groups per announcement")
+    parser.add_argument("--batch", type=int, default=20, help="messages per direct batch")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--members", type=int, default=30, help="members of every group")
+    args = parser.parse_args()
+
+    configureLogging(silent=True)
+    dbmngr = DatabaseManager()
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    messenger = MessageController(dbmngr)
+    contents = [f"reminder {i}: bring a laptop" for i in range(args.batch)]
+
+    print(f"{'backend':>10}{'workload':>14}{'loop msg/s':>13}{'batch msg/s':>13}{'speedup':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        backends = [("memory", MemoryStorage), ("sqlite", lambda: SQLiteStorage(os.path.join(directory, "study.db"))),
+                    ("snapshot", lambda: SnapshotStorage(os.path.join(directory, "snapshots"), snapshotEvery=None))]
+        for label, storage in backends:
+            instructor, student, groups = setUp(dbmngr, storage(), args.groups, args.members)
+            workloads = [
+                ("broadcast", args.groups,
+                 lambda: [messenger.sendGroupMessage(instructor, group, "Quiz moved to Friday") for group in groups],
+                 lambda: messenger.broadcastGroupMessage(instructor, groups, "Quiz moved to Friday")),
+                ("direct batch", args.batch,
+                 lambda: [messenger.sendMessage(instructor, student, content) for content in contents],
+                 lambda: messenger.sendMessages(instructor, student, contents)),
+            ]
+            for workload, perRound, loop, batch in workloads:
+                looped, batched = rates(loop, batch, args.rounds, perRound)
+                print(f"{label:>10}{workload:>14}{looped:>13.0f}{batched:>13.0f}{batched / looped:>8.1f}x")
+            dbmngr.flush()
+        dbmngr.useStorage(MemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
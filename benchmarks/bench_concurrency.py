@@ -0,0 +1,63 @@
+"""Join/leave throughput from a thread pool, spread over many groups versus piled onto one group.
+
+Run from the repository root:
+    python -m benchmarks.bench_concurrency [--operations 200000] [--threads 1 2 4 8 16]
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.cohort import CHEAP_HASHER
+from main import DatabaseManager, StudyGroupController, User
+from storage import MemoryStorage
+
+
+def setUp(groupCount):
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    controller = StudyGroupController(dbmngr)
+    users = [User(f"poolUser{i}", "password", f"poolUser{i}@example.com") for i in range(2000)]
+    for user in users:
+        dbmngr.saveUser(user)
+    groups = [controller.createStudyGroup(f"poolGroup{i}", "CS3377", "ECSW", datetime.now(), 25, users[i])
+              for i in range(groupCount)]
+    return controller, users, groups
+
+
+def run(controller, users, groups, threads, operations):
+    def work(seed):
+        rng = random.Random(seed)
+        for _ in range(operations // threads):
+            group, user = rng.choice(groups), rng.choice(users)
+            if rng.random() < 0.5:
+                controller.joinStudyGroup(group.groupID, user)
+            else:
+                controller.removeFromStudyGroup(group.groupID, user)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(work, range(threads)))
+    elapsed = time.perf_counter() - start
+    for group in groups:
+        assert len(group.members) <= group.maxSize
+    return operations / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operations", type=int, default=200000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    print(f"{'threads':>8}{'1000 groups (ops/s)':>22}{'1 group (ops/s)':>18}")
+    for threads in args.threads:
+        spread = run(*setUp(1000), threads, args.operations)
+        hot = run(*setUp(1), threads, args.operations)
+        print(f"{threads:>8}{spread:>22.0f}{hot:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
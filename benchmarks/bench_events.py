@@ -0,0 +1,86 @@
+"""Send throughput with change-feed subscribers attached: none, a quick one, a slow one and an asyncio stream.
+
+Run from the repository root:
+    python -m benchmarks.bench_events [--sends 50000] [--slow-ms 5]
+
+Also reports how far behind each subscriber was when the last send returned, and its delivery batch size.
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from benchmarks.cohort import CHEAP_HASHER
+from events import MessageSaved
+from logconfig import configureLogging
+from main import DatabaseManager, MessageController, User
+from storage import MemoryStorage
+
+
+def sendAll(messenger, users, sends):
+    start = time.perf_counter()
+    for i in range(sends):
+        messenger.sendMessage(users[i % len(users)], users[(i + 1) % len(users)], "see you at the library")
+    return sends / (time.perf_counter() - start)
+
+
+def streamInBackground(bus, counts):
+    async def consume():
+        async for batch in bus.stream(types=(MessageSaved,)):
+            counts.append(len(batch))
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    consumer = asyncio.run_coroutine_threadsafe(consume(), loop)
+    while not bus.sleepers:  # subscribed and waiting
+        time.sleep(0.001)
+    return loop, consumer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sends", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--slow-ms", type=float, default=5.0, help="time the slow subscriber spends per batch")
+    args = parser.parse_args()
+
+    configureLogging(silent=True)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    users = [User(f"eventUser{i}", "password", f"eventUser{i}@example.com") for i in range(args.users)]
+    for user in users:
+        dbmngr.saveUser(user)
+    messenger = MessageController(dbmngr)
+    bus = dbmngr.events
+
+    def slow(batch):
+        time.sleep(args.slow_ms / 1e3)
+
+    print(f"{'subscriber':>12}{'sends/s':>12}{'behind at end':>15}{'mean batch':>12}")
+    for label in ("none", "quick", "slow", "asyncio"):
+        dbmngr.useStorage(MemoryStorage())
+        counts, subscription, stream = [], None, None
+        if label == "quick":
+            subscription = bus.subscribe(lambda batch: counts.append(len(batch)))
+        elif label == "slow":
+            subscription = bus.subscribe(lambda batch: (slow(batch), counts.append(len(batch))))
+        elif label == "asyncio":
+            stream = streamInBackground(bus, counts)
+        rate = sendAll(messenger, users, args.sends)
+        behind = args.sends - sum(counts)
+        if subscription is not None:
+            subscription.close()
+        if stream is not None:
+            loop, consumer = stream
+            consumer.cancel()
+            loop.call_soon_threadsafe(loop.stop)
+        if counts:
+            print(f"{label:>12}{rate:>12.0f}{behind:>15}{sum(counts) / len(counts):>12.1f}")
+        else:
+            print(f"{label:>12}{rate:>12.0f}")
+    dbmngr.useStorage(MemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
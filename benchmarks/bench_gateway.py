@@ -0,0 +1,93 @@
+"""Load test for the WebSocket gateway: many concurrent connections receiving group fan-out.
+
+Run from the repository root (raise `ulimit -n` for more than ~1000 connections):
+    python -m benchmarks.bench_gateway [--connections 2000] [--group-size 50] [--messages 200]
+"""
+import argparse
+import asyncio
+import resource
+import statistics
+import time
+from datetime import datetime
+
+from benchmarks.cohort import CHEAP_HASHER
+from gateway import MessageGateway, WebSocketClient
+from logconfig import configureLogging
+from main import DatabaseManager, MessageController, StudyGroupController, User
+from storage import MemoryStorage
+
+
+async def run(connections, groupSize, messages):
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    controller, messageController = StudyGroupController(dbmngr), MessageController(dbmngr)
+    users = [User(f"wsUser{i}", "password", f"wsUser{i}@example.com") for i in range(connections)]
+    for user in users:
+        dbmngr.saveUser(user)
+    groups = []
+    for start in range(0, connections, groupSize):
+        members = users[start:start + groupSize]
+        group = controller.createStudyGroup(f"wsGroup{start}", "CS3377", "ECSW", datetime.now(), groupSize, members[0])
+        for member in members[1:]:
+            controller.joinStudyGroup(group.groupID, member)
+        groups.append(group)
+
+    gateway = MessageGateway(dbmngr, controller, messageController, port=0, queueSize=1024)
+    await gateway.start()
+    tokens = [dbmngr.login(user.userName, "password") for user in users]
+    clients = []
+    connectStart = time.perf_counter()
+    for batch in range(0, connections, 200):
+        clients.extend(await asyncio.gather(*(WebSocketClient.connect("127.0.0.1", gateway.port)
+                                              for _ in users[batch:batch + 200])))
+    for client, token in zip(clients, tokens):
+        await client.send({"type": "hello", "token": token})
+    await asyncio.gather(*(client.receive() for client in clients))
+    connectSeconds = time.perf_counter() - connectStart
+
+    perGroup = max(messages // len(groups), 1)
+    expected = perGroup * groupSize
+    latencies = []
+
+    async def consume(client):
+        for _ in range(expected // groupSize):
+            payload = await client.receive()
+            latencies.append(time.time() - datetime.fromisoformat(payload["timestamp"]).timestamp())
+
+    consumers = [asyncio.create_task(consume(client)) for client in clients]
+    sendStart = time.perf_counter()
+    for i in range(perGroup):
+        for group in groups:
+            messageController.sendGroupMessage(group.members[0], group, f"announcement {i}")
+        await asyncio.sleep(0)
+    await asyncio.gather(*consumers)
+    sendSeconds = time.perf_counter() - sendStart
+
+    for client in clients:
+        await client.close()
+    await gateway.stop()
+    return connectSeconds, sendSeconds, len(latencies), latencies, gateway.dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--group-size", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.connections * 2 + 64)), hard))
+    configureLogging(silent=True)
+
+    connectSeconds, sendSeconds, deliveries, latencies, dropped = asyncio.run(
+        run(args.connections, args.group_size, args.messages))
+    latencies.sort()
+    print(f"connections        {args.connections} (connected and identified in {connectSeconds:.2f}s)")
+    print(f"deliveries         {deliveries} in {sendSeconds:.2f}s = {deliveries / sendSeconds:.0f}/s, dropped {dropped}")
+    print(f"push latency p50   {statistics.median(latencies) * 1000:.2f} ms")
+    print(f"push latency p99   {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
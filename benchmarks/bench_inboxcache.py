@@ -0,0 +1,66 @@
+"""Reopening the chat page: getMessage with and without the inbox cache, on an idle and a busy cohort.
+
+Run from the repository root:
+    python -m benchmarks.bench_inboxcache [--users 20000] [--groups 2000] [--messages 1000000] [--reads 20000]
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.cohort import generateCohort
+from inbox import InboxCache
+from logconfig import configureLogging
+from main import DatabaseManager, MessageController
+from storage import MemoryStorage
+
+
+def run(messenger, reads, sendEvery=0, senders=()):
+    # With sendEvery set, one of `senders` posts to their group before every sendEvery-th page open.
+    latencies = []
+    for i, user in enumerate(reads):
+        if sendEvery and i % sendEvery == 0:
+            sender, group = senders[i // sendEvery % len(senders)]
+            messenger.sendGroupMessage(sender, group, "room changed to the library")
+        start = time.perf_counter()
+        messenger.getMessage(user)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.mean(latencies) * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--groups", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--reads", type=int, default=20000)
+    parser.add_argument("--active", type=int, default=2000, help="users who keep reopening the page")
+    parser.add_argument("--send-every", type=int, default=20, help="reads between group messages in the busy run")
+    parser.add_argument("--max-mib", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=19)
+    args = parser.parse_args()
+
+    configureLogging(silent=True)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    cohort = generateCohort(dbmngr, args.users, args.groups, args.messages, args.seed)
+    messenger = MessageController(dbmngr)
+    active = cohort.rng.sample(cohort.users, min(args.active, len(cohort.users)))
+    reads = [cohort.rng.choice(active) for _ in range(args.reads)]
+    senders = [(group.members[0], group) for group in cohort.rng.sample(cohort.groups, min(100, len(cohort.groups)))]
+
+    print(f"{args.reads} page opens by {len(active)} users; busy run sends a group message every {args.send_every} reads")
+    print(f"{'':>10}{'idle mean (us)':>16}{'p99':>10}{'busy mean (us)':>16}{'p99':>10}{'hit rate':>10}{'cache MiB':>11}")
+    for label, cache in (("uncached", None), ("cached", InboxCache(maxBytes=args.max_mib * 2 ** 20))):
+        dbmngr.useInboxCache(cache)
+        idle = run(messenger, reads)
+        busyRun = run(messenger, reads, args.send_every, senders)
+        stats = cache.stats() if cache is not None else {"hitRate": 0.0, "bytes": 0}
+        print(f"{label:>10}{idle[0]:>16.1f}{idle[1]:>10.1f}{busyRun[0]:>16.1f}{busyRun[1]:>10.1f}"
+              f"{stats['hitRate']:>10.0%}{stats['bytes'] / 2 ** 20:>11.1f}")
+    dbmngr.useInboxCache(InboxCache())
+    dbmngr.useStorage(MemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Controller throughput with synchronous per-operation output (the old print() behaviour) versus the
+queued logger and silent mode.
+
+Run from the repository root:
+    python -m benchmarks.bench_logging [--operations 20000] [--output /dev/stdout]
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.cohort import CHEAP_HASHER
+from logconfig import configureLogging, stopLogging
+from main import DatabaseManager, MessageController, StudyGroupController, StudyGroupGUI, User
+from storage import MemoryStorage
+
+
+def workload(operations, seed):
+    rng = random.Random(seed)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    gui = StudyGroupGUI(StudyGroupController(dbmngr), MessageController(dbmngr))
+    users = [User(f"logUser{i}", "password", f"logUser{i}@example.com") for i in range(1000)]
+    for user in users:
+        dbmngr.saveUser(user)
+    groups = [gui.createStudyGroup(f"logGroup{i}", "CS3377", "ECSW", datetime.now(), 20, users[i]) for i in range(100)]
+
+    start = time.perf_counter()
+    for i in range(operations):
+        kind = i % 4
+        if kind == 0:
+            gui.joinStudyGroup(rng.choice(groups).groupID, rng.choice(users))
+        elif kind == 1:
+            group = rng.choice(groups)
+            gui.sendGroupMessage(group.members[0], group, "hello group")
+        elif kind == 2:
+            gui.sendDirectMessage(rng.choice(users), rng.choice(users), "hello")
+        else:
+            group = rng.choice(groups)
+            gui.removeFromStudyGroup(group.groupID, group.members[-1])
+    return operations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operations", type=int, default=20000)
+    parser.add_argument("--output", help="where log lines go (default: a temporary file)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = args.output or os.path.join(tempdir, "log.txt")
+        with open(path, "w") as stream:
+            modes = {
+                "sync DEBUG (old print)": dict(level=logging.DEBUG, stream=stream, queued=False),
+                "queued DEBUG": dict(level=logging.DEBUG, stream=stream),
+                "queued WARNING": dict(level=logging.WARNING, stream=stream),
+                "silent": dict(silent=True),
+            }
+            results = {}
+            for name, options in modes.items():
+                configureLogging(**options)
+                results[name] = workload(args.operations, args.seed)
+                stopLogging()
+    configureLogging(silent=True)
+
+    baseline = results["sync DEBUG (old print)"]
+    print(f"{'mode':<26}{'ops/sec':>12}{'speedup':>10}")
+    for name, opsPerSec in results.items():
+        print(f"{name:<26}{opsPerSec:>12.0f}{opsPerSec / baseline:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Memory held by users and messages: the old dict-backed models versus the slotted ones.
+
+Run from the repository root:
+    python -m benchmarks.bench_memory [--users 100000] [--messages 1000000]
+
+Both representations are built from the same stream of freshly decoded records, as a storage
+backend would hand them over, and measured with tracemalloc.
+"""
+import argparse
+import gc
+import threading
+import tracemalloc
+from datetime import datetime
+from uuid import uuid4
+
+from compact import fromMicros, toMicros
+from main import Message, User
+
+
+class LegacyUser:
+    # The pre-slots User: an instance __dict__ per user.
+    def __init__(self, userID, userName, password, email):
+        self.userID = userID
+        self.userName = userName
+        self.password = password
+        self.email = email
+        self.groups = []
+        self.lock = threading.RLock()
+
+
+class LegacyMessage:
+    # The pre-slots Message: an instance __dict__, a datetime and unshared name strings.
+    def __init__(self, seq, sender, recipient, group, content, timestamp):
+        self.sender = sender
+        self.recipient = recipient
+        self.content = content
+        self.timestamp = timestamp
+        self.group = group
+        self.seq = seq
+
+
+def userRecords(count):
+    for i in range(count):
+        yield str(uuid4()), f"user{i}", f"password{i}", f"user{i}@example.com"
+
+
+def messageRecords(count, userCount):
+    start = toMicros(datetime(2024, 9, 1))
+    for seq in range(1, count + 1):
+        sender, recipient = f"user{seq % userCount}", f"user{(seq * 7) % userCount}"
+        if seq % 4 == 0:
+            yield seq, sender, None, f"group{seq % 500}", f"message {seq}", start + seq * 1000
+        else:
+            yield seq, sender, recipient, None, f"message {seq}", start + seq * 1000
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    objects = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return objects, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=1000000)
+    args = parser.parse_args()
+
+    rows = [
+        ("users", args.users,
+         lambda: [LegacyUser(*record) for record in userRecords(args.users)],
+         lambda: [User.fromRecord(record) for record in userRecords(args.users)]),
+        ("messages", args.messages,
+         lambda: [LegacyMessage(seq, sender, recipient, group, content, fromMicros(timestamp))
+                  for seq, sender, recipient, group, content, timestamp in messageRecords(args.messages, args.users)],
+         lambda: [Message.fromRecord(record) for record in messageRecords(args.messages, args.users)]),
+    ]
+    print(f"{'objects':>10}{'count':>10}{'old (MB)':>11}{'new (MB)':>11}{'old B/obj':>11}{'new B/obj':>11}{'saved':>8}")
+    for label, total, legacy, compact in rows:
+        old, oldSize = measure(legacy)
+        del old
+        new, newSize = measure(compact)
+        del new
+        print(f"{label:>10}{total:>10}{oldSize / 2**20:>11.1f}{newSize / 2**20:>11.1f}"
+              f"{oldSize / total:>11.0f}{newSize / total:>11.0f}{1 - newSize / oldSize:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Cost of the metrics layer per call: never enabled, enabled, and enabled then disabled again.
+
+Run from the repository root:
+    python -m benchmarks.bench_metrics [--calls 20000] [--rounds 7]
+
+Disabling puts the original methods back, so the "disabled" column should match "off" within noise.
+Each cell is the best of --rounds runs, with the collector paused, to keep noise out of the comparison.
+"""
+import argparse
+import gc
+import time
+from datetime import timedelta
+
+from benchmarks.cohort import generateCohort
+from logconfig import configureLogging
+from main import DatabaseManager, MessageController, StudyGroupController, disableMetrics, enableMetrics
+from storage import MemoryStorage
+
+
+def workload(cohort, controller, messenger, calls):
+    rng, db = cohort.rng, cohort.dbManager
+    users = [rng.choice(cohort.users) for _ in range(calls)]
+    groups = [rng.choice(cohort.groups) for _ in range(calls)]
+    dates = [cohort.randomDate() for _ in range(calls)]
+    courses = [rng.choice(db.validCourses) for _ in range(calls)]
+
+    def lookups():
+        for user in users:
+            db.getUser(user.userID)
+
+    def searches():
+        for course, date in zip(courses, dates):
+            controller.searchStudyGroups(course=course, since=date, before=date + timedelta(days=7))
+
+    def joins():
+        for group, user in zip(groups, users):
+            if controller.joinStudyGroup(group.groupID, user):
+                controller.removeFromStudyGroup(group.groupID, user)
+
+    def sends():
+        for sender, recipient in zip(users, reversed(users)):
+            messenger.sendMessage(sender, recipient, "see you at the library")
+
+    def pages():
+        for user in users:
+            list(messenger.getMessagePage(user, limit=20))
+
+    return {"getUser": lookups, "searchStudyGroups": searches, "join + leave": joins, "sendMessage": sends,
+            "getMessagePage": pages}
+
+
+def timeOnce(function, calls):
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        function()
+        return (time.perf_counter() - start) / calls * 1e9
+    finally:
+        gc.enable()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=16)
+    args = parser.parse_args()
+
+    configureLogging(silent=True)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    cohort = generateCohort(dbmngr, 5000, 500, 100000, args.seed)
+    controller, messenger = StudyGroupController(dbmngr), MessageController(dbmngr)
+    operations = workload(cohort, controller, messenger, args.calls)
+
+    originals = {cls: dict(vars(cls)) for cls in (StudyGroupController, MessageController, DatabaseManager)}
+    off = {name: min(timeOnce(run, args.calls) for _ in range(args.rounds)) for name, run in operations.items()}
+    # Alternate the enabled and disabled rounds so drift on a noisy machine hits both columns alike.
+    enabled, disabled, recorded = {}, {}, 0
+    for _ in range(args.rounds):
+        metrics = enableMetrics()
+        for name, run in operations.items():
+            enabled[name] = min(enabled.get(name, float("inf")), timeOnce(run, args.calls))
+        recorded += sum(stats["count"] for stats in metrics.snapshot().values())
+        disableMetrics()
+        for name, run in operations.items():
+            disabled[name] = min(disabled.get(name, float("inf")), timeOnce(run, args.calls))
+    restored = all(dict(vars(cls)) == methods for cls, methods in originals.items())
+
+    print(f"{recorded} calls recorded while enabled; original methods restored after disabling: {restored}")
+    print(f"{'operation':>18}{'off (ns)':>11}{'enabled (ns)':>14}{'cost':>8}{'disabled (ns)':>15}{'cost':>8}")
+    for name in operations:
+        print(f"{name:>18}{off[name]:>11.0f}{enabled[name]:>14.0f}{enabled[name] / off[name] - 1:>+8.0%}"
+              f"{disabled[name]:>15.0f}{disabled[name] / off[name] - 1:>+8.0%}")
+    dbmngr.useStorage(MemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Nightly recommendation batch and incremental rescoring versus scoring one user at a time in Python.
+
+Run from the repository root (needs numpy):
+    python -m benchmarks.bench_recommend [--users 50000] [--groups 5000] [--sample 200]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.cohort import CHEAP_HASHER
+from main import DatabaseManager, StudyGroupController, User
+from recommend import DEFAULT_WEIGHTS, RecommendationEngine, timeSlot
+from storage import MemoryStorage
+
+
+def setUp(userCount, groupCount, rng):
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+    users = [{"name": f"recUser{i}", "password": "password", "email": f"recUser{i}@example.com"} for i in range(userCount)]
+    groups = [{"groupName": f"recGroup{i}", "course": rng.choice(dbmngr.validCourses), "location": rng.choice(dbmngr.validLocations),
+               "date": (start + timedelta(hours=rng.randrange(14 * 24))).isoformat(), "maxSize": rng.randint(4, 30),
+               "creator": f"recUser{rng.randrange(userCount)}"} for i in range(groupCount)]
+    memberships = [{"groupName": f"recGroup{rng.randrange(groupCount)}", "userName": f"recUser{rng.randrange(userCount)}"}
+                   for _ in range(2 * userCount)]
+    report = dbmngr.importRoster(users, groups, memberships)
+    return dbmngr, report
+
+
+def scoreOneUser(user, groups):
+    # The straightforward per-user loop the engine replaces.
+    w = DEFAULT_WEIGHTS
+
+    def mix(member, attribute):
+        values = [attribute(group) for group in member.groups]
+        return {value: values.count(value) / len(values) for value in values}
+
+    courseMix = mix(user, lambda group: group.course)
+    locationMix = mix(user, lambda group: group.location)
+    timeMix = mix(user, lambda group: timeSlot(group.date))
+    scored = []
+    for group in groups:
+        if group in user.groups or len(group.members) >= group.maxSize:
+            continue
+        memberMixes = [mix(member, lambda g: g.course) for member in group.members]
+        shared = sum(courseMix.get(course, 0) * share for m in memberMixes for course, share in m.items()) / len(memberMixes)
+        scored.append((w["course"] * courseMix.get(group.course, 0) + w["members"] * shared
+                       + w["location"] * locationMix.get(group.location, 0) + w["time"] * timeMix.get(timeSlot(group.date), 0)
+                       + w["capacity"] * (group.maxSize - len(group.members)) / group.maxSize, group.groupName))
+    return sorted(scored, reverse=True)[:10]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--groups", type=int, default=5000)
+    parser.add_argument("--sample", type=int, default=200, help="users scored by the Python loop, extrapolated")
+    parser.add_argument("--changes", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=12)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    dbmngr, report = setUp(args.users, args.groups, rng)
+    users, groups = dbmngr.users, dbmngr.studyGroups
+    print(f"{len(users)} users, {len(groups)} groups, {report.memberships + report.groups} memberships")
+
+    engine = RecommendationEngine(dbmngr, k=10)
+    start = time.perf_counter()
+    engine.build()
+    batch = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for user in rng.sample(users, args.sample):
+        scoreOneUser(user, groups)
+    loop = (time.perf_counter() - start) / args.sample * len(users)
+
+    engine.attach()
+    controller = StudyGroupController(dbmngr)
+    refreshes = []
+    for _ in range(args.changes):
+        controller.joinStudyGroup(rng.choice(groups).groupID, rng.choice(users))
+        start = time.perf_counter()
+        engine.recommend(rng.choice(users))
+        refreshes.append(time.perf_counter() - start)
+    extra = User("recLateJoiner", "password", "late@example.com")
+    dbmngr.saveUser(extra)
+    start = time.perf_counter()
+    engine.recommend(extra)
+    newUser = time.perf_counter() - start
+    engine.detach()
+
+    print(f"{'run':>34}{'seconds':>12}")
+    print(f"{'nightly batch (all users)':>34}{batch:>12.2f}")
+    print(f"{'per-user Python loop (estimated)':>34}{loop:>12.1f}")
+    print(f"{'join + recommend (mean)':>34}{sum(refreshes) / len(refreshes):>12.4f}")
+    print(f"{'new user + recommend':>34}{newUser:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Retention pass over a semester of messages: archive size, and read latency in the hot window and past it.
+
+Run from the repository root:
+    python -m benchmarks.bench_retention [--users 20000] [--groups 2000] [--messages 1000000] [--days 30]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+
+from archive import MessageArchive, RetentionPolicy
+from benchmarks.cohort import generateCohort
+from logconfig import configureLogging
+from main import DatabaseManager
+from storage import MemoryStorage
+
+
+def timed(function, users):
+    latencies = []
+    for user in users:
+        start = time.perf_counter()
+        function(user)
+        latencies.append(time.perf_counter() - start)
+    return statistics.mean(latencies) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--groups", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=30, help="hot window")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=18)
+    args = parser.parse_args()
+
+    configureLogging(silent=True)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    cohort = generateCohort(dbmngr, args.users, args.groups, args.messages, args.seed)
+    users = [cohort.rng.choice(cohort.users) for _ in range(args.queries)]
+    past = cohort.end - timedelta(days=2 * args.days)
+
+    def firstPage(user):
+        return list(dbmngr.iterMessagesForUser(user, limit=20))
+
+    def pastPage(user):
+        return list(dbmngr.iterMessagesForUser(user, before=past, limit=20))
+
+    rows = [("before", len(dbmngr.messages), timed(firstPage, users), timed(pastPage, users),
+             timed(dbmngr.getMessagesForUser, users[:100]))]
+    with tempfile.TemporaryDirectory() as directory:
+        archive = MessageArchive(directory)
+        dbmngr.useArchive(archive, RetentionPolicy(timedelta(days=args.days)))
+        start = time.perf_counter()
+        moved = dbmngr.applyRetention(cohort.end)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(archive.blockPath) + os.path.getsize(archive.indexPath)
+        print(f"{moved} messages older than {args.days} days archived in {elapsed:.1f}s: {size / 2 ** 20:.1f} MiB on disk "
+              f"({size / max(moved, 1):.0f} bytes/message) in {len(archive.blocks)} blocks")
+        rows.append(("after", len(dbmngr.messages), timed(firstPage, users), timed(pastPage, users),
+                     timed(dbmngr.getMessagesForUser, users[:100])))
+        print(f"{'':>8}{'hot messages':>14}{'first page (us)':>17}{'page past window (us)':>23}{'full history (us)':>19}")
+        for label, hot, first, deep, full in rows:
+            print(f"{label:>8}{hot:>14}{first:>17.1f}{deep:>23.1f}{full:>19.1f}")
+        dbmngr.useStorage(MemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Roster import time at growing sizes; per-row cost should stay flat.
+
+Run from the repository root:
+    python -m benchmarks.bench_roster [--sizes 1000 10000 100000] [--kdf-sizes 500]
+
+`--sizes` run with a token-cost password hasher, so they measure the import itself; `--kdf-sizes` run
+with the production hasher, whose cost a real roster pays. "in txn" is the time spent inside the storage
+transaction, i.e. how long other writers wait: password hashing happens before it opens.
+"""
+import argparse
+import random
+import time
+from contextlib import contextmanager
+
+from auth import PasswordHasher
+from benchmarks.cohort import CHEAP_HASHER
+from main import DatabaseManager
+from storage import MemoryStorage, SQLiteStorage
+
+
+def makeRoster(size, courses, locations, seed):
+    rng = random.Random(seed)
+    users = [{"name": f"student{i}", "password": f"password{i}", "email": f"student{i}@example.com"} for i in range(size)]
+    groupCount = max(size // 10, 1)
+    groups = [{
+        "groupName": f"group{i}", "course": rng.choice(courses), "location": rng.choice(locations),
+        "date": "2024-09-01T10:00", "maxSize": 12, "creator": f"student{i}",
+    } for i in range(groupCount)]
+    memberships = [{"groupName": f"group{rng.randrange(groupCount)}", "userName": f"student{i}"} for i in range(size)]
+    return users, groups, memberships
+
+
+def timeTransactions(storage):
+    # Wraps the backend's transaction() to add up the time spent in outermost transactions.
+    spent, depth = [0.0], [0]
+    transaction = storage.transaction
+
+    @contextmanager
+    def timed():
+        depth[0] += 1
+        start = time.perf_counter()
+        try:
+            with transaction():
+                yield
+        finally:
+            depth[0] -= 1
+            if not depth[0]:
+                spent[0] += time.perf_counter() - start
+
+    storage.transaction = timed
+    return spent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--kdf-sizes", type=int, nargs="*", default=[500], help="sizes also run with the production hasher")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    dbmngr = DatabaseManager()
+    print(f"{'backend':<8}{'hasher':>8}{'students':>10}{'seconds':>10}{'in txn':>10}{'us/row':>10}")
+    for backend in ("memory", "sqlite"):
+        runs = [("cheap", CHEAP_HASHER, size) for size in args.sizes]
+        runs += [("kdf", PasswordHasher(), size) for size in args.kdf_sizes]
+        for label, hasher, size in runs:
+            storage = MemoryStorage() if backend == "memory" else SQLiteStorage()
+            dbmngr.useStorage(storage)
+            dbmngr.usePasswordHasher(hasher)
+            inTransaction = timeTransactions(storage)
+            users, groups, memberships = makeRoster(size, dbmngr.getValidCourses(), dbmngr.getValidLocations(), args.seed)
+            rows = len(users) + len(groups) + len(memberships)
+            start = time.perf_counter()
+            dbmngr.importRoster(users, groups, memberships)
+            elapsed = time.perf_counter() - start
+            print(f"{backend:<8}{label:>8}{size:>10}{elapsed:>10.3f}{inTransaction[0]:>10.3f}{elapsed / rows * 1e6:>10.2f}")
+    dbmngr.usePasswordHasher(PasswordHasher())
+    dbmngr.useStorage(MemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Room conflict and time clash checks over a full semester calendar, indexed versus a linear scan.
+
+Run from the repository root:
+    python -m benchmarks.bench_schedule [--attempts 40000] [--weeks 16] [--queries 5000]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.cohort import CHEAP_HASHER
+from main import DatabaseManager, StudyGroupController, User
+from storage import MemoryStorage
+
+
+def randomSession(rng, start, weeks):
+    day = start + timedelta(days=rng.randrange(weeks * 7))
+    begin = day.replace(hour=8) + timedelta(minutes=15 * rng.randrange(14 * 4))
+    return begin, timedelta(minutes=rng.choice([60, 90, 120, 180]))
+
+
+def bruteForceConflicts(groups, location, begin, end):
+    return [group for group in groups if group.location == location and group.duration is not None
+            and group.date < end and begin < group.end]
+
+
+def timed(function, calls):
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter() - start)
+    return statistics.mean(latencies) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--attempts", type=int, default=40000, help="group creations attempted")
+    parser.add_argument("--weeks", type=int, default=16)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=13)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    controller = StudyGroupController(dbmngr)
+    users = [User(f"calUser{i}", "password", f"calUser{i}@example.com") for i in range(5000)]
+    for user in users:
+        dbmngr.saveUser(user)
+    semester = datetime(2024, 8, 19)
+
+    start = time.perf_counter()
+    created = 0
+    for i in range(args.attempts):
+        begin, duration = randomSession(rng, semester, args.weeks)
+        group = controller.createStudyGroup(f"calGroup{i}", rng.choice(dbmngr.validCourses), rng.choice(dbmngr.validLocations),
+                                            begin, 12, rng.choice(users), duration=duration)
+        created += group is not None
+    createRate = args.attempts / (time.perf_counter() - start)
+    groups = dbmngr.studyGroups
+
+    queries = []
+    for _ in range(args.queries):
+        begin, duration = randomSession(rng, semester, args.weeks)
+        queries.append((rng.choice(dbmngr.validLocations), begin, begin + duration))
+    for query in queries[:200]:
+        assert set(dbmngr.findRoomConflicts(*query)) == set(bruteForceConflicts(groups, *query))
+    indexed = timed(dbmngr.findRoomConflicts, queries)
+    brute = timed(lambda *query: bruteForceConflicts(groups, *query), queries[:500])
+
+    for _ in range(4 * len(users)):
+        controller.joinStudyGroup(rng.choice(groups).groupID, rng.choice(users))
+    clashChecks = [(rng.choice(users), rng.choice(groups)) for _ in range(args.queries)]
+    clashes = timed(dbmngr.findTimeClashes, clashChecks)
+
+    print(f"{args.attempts} bookings attempted over {args.weeks} weeks x {len(dbmngr.validLocations)} rooms: "
+          f"{created} accepted, {args.attempts - created} rejected as room conflicts ({createRate:.0f} creates/s)")
+    print(f"{'check':>28}{'mean (us)':>12}")
+    print(f"{'room conflict (indexed)':>28}{indexed:>12.1f}")
+    print(f"{'room conflict (linear scan)':>28}{brute:>12.1f}")
+    print(f"{'user time clash (indexed)':>28}{clashes:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
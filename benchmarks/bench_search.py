@@ -0,0 +1,78 @@
+"""Indexed study group search versus a brute-force filter over every group.
+
+Run from the repository root:
+    python -m benchmarks.bench_search [--groups 50000] [--queries 2000]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.cohort import CHEAP_HASHER
+from main import DatabaseManager, StudyGroupController, User
+from storage import MemoryStorage
+
+
+def setUp(groupCount, rng):
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    controller = StudyGroupController(dbmngr)
+    users = [User(f"searchUser{i}", "password", f"searchUser{i}@example.com") for i in range(2000)]
+    for user in users:
+        dbmngr.saveUser(user)
+    start = datetime(2024, 8, 19, 8)
+    for i in range(groupCount):
+        date = start + timedelta(hours=rng.randrange(16 * 7 * 24))
+        group = controller.createStudyGroup(f"searchGroup{i}", rng.choice(dbmngr.validCourses), rng.choice(dbmngr.validLocations),
+                                            date, rng.randint(2, 8), rng.choice(users))
+        for user in rng.sample(users, rng.randrange(8)):
+            controller.joinStudyGroup(group.groupID, user)
+    return dbmngr, controller, start
+
+
+def bruteForce(groups, course, location, since, before, minOpenSeats):
+    return sorted((group for group in groups
+                   if group.course == course and group.location == location
+                   and since <= group.date < before and group.maxSize - len(group.members) >= minOpenSeats),
+                  key=lambda group: (group.date, group.groupID))
+
+
+def timeQueries(search, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(*query)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.mean(latencies) * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--groups", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    dbmngr, controller, start = setUp(args.groups, rng)
+    groups = dbmngr.studyGroups
+    queries = []
+    for _ in range(args.queries):
+        since = start + timedelta(days=rng.randrange(16 * 7))
+        queries.append((rng.choice(dbmngr.validCourses), rng.choice(dbmngr.validLocations), since, since + timedelta(days=7), 1))
+    for query in queries[:100]:
+        assert controller.searchStudyGroups(*query) == bruteForce(groups, *query)
+
+    indexed = timeQueries(controller.searchStudyGroups, queries)
+    brute = timeQueries(lambda *query: bruteForce(groups, *query), queries)
+    print(f"{len(groups)} groups, {args.queries} queries (\"open <course> groups in <location> within a week\")")
+    print(f"{'method':>12}{'mean (us)':>12}{'p99 (us)':>12}")
+    print(f"{'indexed':>12}{indexed[0]:>12.1f}{indexed[1]:>12.1f}")
+    print(f"{'brute force':>12}{brute[0]:>12.1f}{brute[1]:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Throughput of a join/leave/group-message mix: one process versus ShardRouter over 1, 2, 4... worker processes.
+
+Run from the repository root:
+    python -m benchmarks.bench_sharding [--workers 1 2 4 8] [--operations 100000] [--threads 64] [--groups 2000]
+
+Scaling is bounded by the cores actually available (printed first) and by the router process, which
+pickles every call: its CPU time per operation is reported, and 1e6 / that is the most one router can
+forward. The single-process run is the StudyGroupGUI the router replaces.
+"""
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.cohort import CHEAP_HASHER
+from logconfig import configureLogging
+from main import DatabaseManager, MessageController, StudyGroupController, StudyGroupGUI, User
+from shard import ShardRouter
+from storage import MemoryStorage
+
+
+def setUp(gui, users, groupCount):
+    return [gui.createStudyGroup(f"shardGroup{i}", "CS3377", "ECSW", datetime(2024, 9, 1), 25, users[i % len(users)])
+            for i in range(groupCount)]
+
+
+def run(gui, users, groups, threads, operations, messageShare):
+    def work(seed):
+        rng = random.Random(seed)
+        for _ in range(operations // threads):
+            group = rng.choice(groups)
+            roll = rng.random()
+            if roll < messageShare:
+                gui.sendGroupMessage(group.members[0], group, "see you in the library")
+            elif roll < (1 + messageShare) / 2:
+                gui.joinStudyGroup(group.groupID, rng.choice(users))
+            else:
+                gui.removeFromStudyGroup(group.groupID, rng.choice(users))
+
+    start, cpu = time.perf_counter(), time.process_time()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(work, range(threads)))
+    return operations / (time.perf_counter() - start), (time.process_time() - cpu) / operations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--operations", type=int, default=100000)
+    parser.add_argument("--threads", type=int, default=64, help="concurrent callers, e.g. gateway connections")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--groups", type=int, default=2000)
+    parser.add_argument("--message-share", type=float, default=0.5, help="the rest is half joins, half leaves")
+    parser.add_argument("--inbox-reads", type=int, default=200)
+    args = parser.parse_args()
+
+    configureLogging(silent=True)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    users = [User(f"shardUser{i}", "password", f"shardUser{i}@example.com") for i in range(args.users)]
+    for user in users:
+        dbmngr.saveUser(user)
+    readers = random.Random(22).sample(users, min(args.inbox_reads, len(users)))
+
+    print(f"{os.cpu_count()} CPU(s); {args.threads} callers; {args.message_share:.0%} group messages")
+    print(f"{'deployment':>18}{'ops/s':>12}{'speedup':>10}{'front CPU (us/op)':>19}{'inbox read (ms)':>18}")
+    baseline = None
+    deployments = [("single process", None)] + [(f"{workers} worker(s)", workers) for workers in args.workers]
+    for label, workers in deployments:
+        router = ShardRouter(workers) if workers is not None else None
+        gui = router if router is not None else StudyGroupGUI(StudyGroupController(dbmngr), MessageController(dbmngr))
+        groups = setUp(gui, users, args.groups)
+        rate, cpu = run(gui, users, groups, args.threads, args.operations, args.message_share)
+        start = time.perf_counter()
+        for user in readers:
+            gui.getMessage(user)
+        readMs = (time.perf_counter() - start) / len(readers) * 1e3
+        if router is not None:
+            router.close()
+            baseline = baseline or rate
+        speedup = f"{rate / baseline:.2f}x" if baseline is not None else ""
+        print(f"{label:>18}{rate:>12.0f}{speedup:>10}{cpu:>19.1f}{readMs:>18.2f}")
+    dbmngr.useStorage(MemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
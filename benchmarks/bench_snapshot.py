@@ -0,0 +1,121 @@
+"""Time to ready after a restart: snapshot plus journal tail versus journal only, SQLite, and rebuilding through the API.
+
+Run from the repository root:
+    python -m benchmarks.bench_snapshot [--users 20000] [--groups 2000] [--messages 1000000] [--tail 10000]
+
+Also reports the snapshot's size and write time, and send throughput while a snapshot is being written.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from auth import PasswordHasher
+from benchmarks.cohort import CHEAP_HASHER, generateCohort
+from logconfig import configureLogging
+from main import DatabaseManager, MessageController, StudyGroupController, User
+from snapshot import SnapshotStorage
+from storage import MemoryStorage, SQLiteStorage
+
+
+def ready(dbmngr, storage):
+    # "Ready" means the backend is open and DatabaseManager has every user, group and membership loaded.
+    start = time.perf_counter()
+    dbmngr.useStorage(storage())
+    return time.perf_counter() - start
+
+
+def sendRate(messenger, cohort, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        messenger.sendMessage(cohort.rng.choice(cohort.users), cohort.rng.choice(cohort.users), cohort.sentence())
+    return count / (time.perf_counter() - start)
+
+
+def apiRebuild(cohort, messages, samples):
+    """Seconds to rebuild the cohort object by object, extrapolated from timed samples of each call."""
+    dbmngr = DatabaseManager()
+    controller, messenger = StudyGroupController(dbmngr), MessageController(dbmngr)
+    dbmngr.useStorage(MemoryStorage())
+    users = [User(f"rebuildUser{i}", "password", f"rebuildUser{i}@example.com") for i in range(samples)]
+    dbmngr.usePasswordHasher(PasswordHasher())
+    start = time.perf_counter()
+    for user in users[:20]:
+        dbmngr.saveUser(user)
+    perUser = (time.perf_counter() - start) / 20
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    for user in users[20:]:
+        dbmngr.saveUser(user)
+    start = time.perf_counter()
+    created = [controller.createStudyGroup(f"rebuildGroup{i}", group.course, group.location, group.date, len(users),
+                                           users[i], group.duration)
+               for i, group in enumerate(cohort.groups[:max(samples // 10, 1)])]
+    perGroup = (time.perf_counter() - start) / len(created)
+    start = time.perf_counter()
+    for i, user in enumerate(users):
+        controller.joinStudyGroup(created[i % len(created)].groupID, user)
+    perJoin = (time.perf_counter() - start) / len(users)
+    start = time.perf_counter()
+    for i in range(samples):
+        messenger.sendMessage(users[i], users[-i], "rebuilt message")
+    perMessage = (time.perf_counter() - start) / samples
+    memberships = sum(len(group.members) for group in cohort.groups) - len(cohort.groups)
+    return perUser * len(cohort.users) + perGroup * len(cohort.groups) + perJoin * memberships + perMessage * messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--groups", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--tail", type=int, default=10000, help="messages sent after the snapshot")
+    parser.add_argument("--samples", type=int, default=2000, help="calls timed per operation for the API estimate")
+    parser.add_argument("--seed", type=int, default=21)
+    args = parser.parse_args()
+
+    configureLogging(silent=True)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    cohort = generateCohort(dbmngr, args.users, args.groups, args.messages, args.seed)
+    messenger = MessageController(dbmngr)
+    messages = len(dbmngr.messages)
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        snapshots, database = os.path.join(directory, "snapshots"), os.path.join(directory, "cohort.db")
+        # Write the same store to both backends the way a long-running server would have, one change at a time.
+        for backend in (SnapshotStorage(snapshots, snapshotEvery=None), SQLiteStorage(database)):
+            with backend.transaction():
+                for user in dbmngr.users:
+                    backend.saveUser(user)
+                for group in dbmngr.studyGroups:
+                    backend.saveStudyGroup(group)
+                for message in dbmngr.messages:
+                    backend.saveMessage(message)
+            backend.close()
+
+        rows.append(("SQLite", ready(dbmngr, lambda: SQLiteStorage(database))))
+        rows.append((f"journal only ({messages} entries)", ready(dbmngr, lambda: SnapshotStorage(snapshots, snapshotEvery=None))))
+        idleRate = sendRate(messenger, cohort, args.tail // 2)
+        start = time.perf_counter()
+        thread = dbmngr.storage.snapshot(wait=False)
+        busyRate = sendRate(messenger, cohort, args.tail - args.tail // 2)
+        thread.join()
+        snapshotSeconds = time.perf_counter() - start
+        snapshotBytes = sum(os.path.getsize(os.path.join(snapshots, name)) for name in os.listdir(snapshots)
+                            if name.endswith(".snap"))
+        dbmngr.storage.close()
+        seconds = ready(dbmngr, lambda: SnapshotStorage(snapshots, snapshotEvery=None))
+        rows.append((f"snapshot + {dbmngr.storage.journaled}-entry tail", seconds))
+        dbmngr.useStorage(MemoryStorage())
+    rows.append(("API rebuild (estimated)", apiRebuild(cohort, messages, args.samples)))
+    dbmngr.useStorage(MemoryStorage())
+
+    print(f"{messages} messages; snapshot of {snapshotBytes / 2 ** 20:.1f} MiB written in the background in {snapshotSeconds:.1f}s")
+    print(f"sends/s while idle {idleRate:.0f}, while the snapshot was written {busyRate:.0f}")
+    print(f"{'restart from':>36}{'time to ready (s)':>19}")
+    for label, seconds in rows:
+        print(f"{label:>36}{seconds:>19.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Per-operation latency of the controllers on the in-memory and SQLite backends.
+
+Run from the repository root:
+    python -m benchmarks.bench_storage [--users 2000] [--groups 200] [--messages 20000]
+"""
+import argparse
+import contextlib
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.cohort import CHEAP_HASHER
+from main import DatabaseManager, MessageController, StudyGroupController, StudyGroupGUI, User
+from storage import MemoryStorage, SQLiteStorage
+
+
+def timeEach(label, calls, results):
+    start = time.perf_counter()
+    for call in calls:
+        call()
+    elapsed = time.perf_counter() - start
+    results[label] = elapsed / max(len(calls), 1) * 1e6
+
+
+def runBackend(storage, users, groups, messages, seed):
+    rng = random.Random(seed)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(storage)
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    gui = StudyGroupGUI(StudyGroupController(dbmngr), MessageController(dbmngr))
+    courses, locations = dbmngr.getValidCourses(), dbmngr.getValidLocations()
+    results = {}
+
+    people = [User(f"benchUser{i}", f"password{i}", f"benchUser{i}@example.com") for i in range(users)]
+    timeEach("saveUser", [lambda u=u: dbmngr.saveUser(u) for u in people], results)
+
+    created = []
+    timeEach("createStudyGroup", [
+        lambda i=i: created.append(gui.createStudyGroup(
+            f"benchGroup{i}", rng.choice(courses), rng.choice(locations), datetime.now(), 50, people[i % users]))
+        for i in range(groups)
+    ], results)
+
+    joins = [(group, rng.choice(people)) for group in created for _ in range(10)]
+    timeEach("joinStudyGroup", [lambda g=g, u=u: gui.joinStudyGroup(g.groupID, u) for g, u in joins], results)
+
+    direct = [(rng.choice(people), rng.choice(people)) for _ in range(messages // 2)]
+    timeEach("sendDirectMessage", [lambda s=s, r=r: gui.sendDirectMessage(s, r, "hello there") for s, r in direct], results)
+
+    grouped = [rng.choice(created) for _ in range(messages - messages // 2)]
+    timeEach("sendGroupMessage", [lambda g=g: gui.sendGroupMessage(g.members[0], g, "hello group") for g in grouped], results)
+    dbmngr.flush()
+
+    readers = [rng.choice(people) for _ in range(500)]
+    timeEach("getMessage", [lambda u=u: gui.getMessage(u) for u in readers], results)
+    timeEach("getMessagePage", [lambda u=u: list(gui.getMessagePage(u, limit=20)) for u in readers], results)
+    timeEach("getStudyGroup", [lambda g=g: dbmngr.getStudyGroup(g.groupID) for g in created], results)
+
+    leaves = [(group, group.members[-1]) for group in created if len(group.members) > 1]
+    timeEach("removeFromStudyGroup", [lambda g=g, u=u: gui.removeFromStudyGroup(g.groupID, u) for g, u in leaves], results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        backends = {
+            "memory": MemoryStorage(),
+            "sqlite": SQLiteStorage(os.path.join(tempdir, "bench.db")),
+        }
+        table = {}
+        for name, storage in backends.items():
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                table[name] = runBackend(storage, args.users, args.groups, args.messages, args.seed)
+        DatabaseManager().useStorage(MemoryStorage())
+
+    print(f"{'operation':<22}" + "".join(f"{name + ' (us/op)':>18}" for name in table))
+    for operation in table["memory"]:
+        print(f"{operation:<22}" + "".join(f"{table[name][operation]:>18.2f}" for name in table))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+"""Every public operation of the GUI, controllers and DatabaseManager timed against one synthetic cohort.
+
+Run from the repository root:
+    python -m benchmarks.bench_suite [--scale small|medium|large] [--backend memory|sqlite|segmentlog]
+                                     [--output run.json] [--baseline previous.json] [--only 'MessageController.*']
+
+Each operation is called --calls times with freshly drawn arguments (prepared outside the timed
+region) and reported as ops/s, p50 and p99. A shorter pass under tracemalloc records the largest
+allocation peak of a single call. --output saves the run as JSON; --baseline compares against a
+saved run and exits non-zero when any operation regressed by more than --tolerance.
+"""
+import argparse
+import contextlib
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from itertools import count
+
+from benchmarks.cohort import PRESETS, generateCohort
+from logconfig import configureLogging
+from main import DatabaseManager, Message, MessageController, StudyGroup, StudyGroupController, StudyGroupGUI, User
+from segmentlog import SegmentLogStorage
+from storage import MemoryStorage, SQLiteStorage
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CLASSES = (DatabaseManager, StudyGroupController, MessageController, StudyGroupGUI)
+# Public methods with no case of their own, and why.
+SKIPPED = {
+    "DatabaseManager.useStorage": "reloads the whole backend; see bench_storage and bench_roster",
+    "DatabaseManager.addMessageListener": "listener registration",
+    "DatabaseManager.removeMessageListener": "listener registration",
+    "DatabaseManager.addGroupListener": "listener registration",
+    "DatabaseManager.removeGroupListener": "listener registration",
+    "DatabaseManager.notifyGroupChanged": "timed through every group and membership write",
+    "DatabaseManager.postingLists": "index maintenance, timed through saveStudyGroup",
+    "DatabaseManager.indexGroup": "index maintenance, timed through saveStudyGroup",
+    "DatabaseManager.unindexGroup": "index maintenance, timed through removeStudyGroup",
+    "DatabaseManager.indexSchedule": "index maintenance, timed through saveStudyGroup",
+    "DatabaseManager.indexSeats": "index maintenance, timed through the membership calls",
+    "DatabaseManager.useArchive": "attaches a backend's cold archive; see bench_retention",
+    "DatabaseManager.applyRetention": "periodic maintenance pass; see bench_retention",
+    "DatabaseManager.useInboxCache": "configuration; see bench_inboxcache",
+    "DatabaseManager.usePasswordHasher": "configuration; see bench_auth",
+    "DatabaseManager.loadMessageView": "builds the search index and unread counters; timed through loadUnreadCounts",
+    "DatabaseManager.trackSaved": "view maintenance, timed through saveMessage",
+    "DatabaseManager.stampMessage": "seq and timestamp assignment, timed through saveMessage",
+    "DatabaseManager.hashPasswords": "timed through importRoster; see bench_roster",
+    "DatabaseManager.rollBackImport": "error path of importRoster",
+    "DatabaseManager.applyReadCursors": "part of the unread counter build, timed through loadUnreadCounts",
+}
+SEARCH_QUERIES = ("exam", "review graph", '"meet tonight"', "rec*")
+
+
+def publicMethods():
+    return [f"{cls.__name__}.{name}" for cls in CLASSES for name, value in vars(cls).items()
+            if callable(value) and not name.startswith("_")]
+
+
+def buildCases(cohort, gui):
+    """name -> (prepare(n) returning n argument tuples, operation, max calls or None)."""
+    db, controller, messenger = cohort.dbManager, gui.controller, gui.messageController
+    rng, users, groups = cohort.rng, cohort.users, cohort.groups
+    courses, locations = db.getValidCourses(), db.getValidLocations()
+    serial = count()
+
+    def randomUsers(n):
+        return [(rng.choice(users),) for _ in range(n)]
+
+    def freshUsers(n):
+        names = [f"suiteUser{next(serial)}" for _ in range(n)]
+        return [(User(name, "password", f"{name}@example.com"),) for name in names]
+
+    def savedUsers(n):
+        fresh = freshUsers(n)
+        for (user,) in fresh:
+            db.saveUser(user)
+        return fresh
+
+    def groupArgs(n):
+        return [(f"suiteGroup{next(serial)}", rng.choice(courses), rng.choice(locations), cohort.randomDate(),
+                 rng.randint(4, 30), rng.choice(users)) for _ in range(n)]
+
+    def createdGroups(n):
+        return [(controller.createStudyGroup(*args),) for args in groupArgs(n)]
+
+    def groupAndUser(n):
+        return [(rng.choice(groups), rng.choice(users)) for _ in range(n)]
+
+    def idAndUser(n):
+        return [(group.groupID, user) for group, user in groupAndUser(n)]
+
+    def groupAndMember(n):
+        shared = [group for group in groups if len(group.members) > 1]
+        return [(group, rng.choice(group.members)) for group in (rng.choice(shared) for _ in range(n if shared else 0))]
+
+    def idAndMember(n):
+        return [(group.groupID, member) for group, member in groupAndMember(n)]
+
+    def waiting(n):
+        full = [group for group in groups if len(group.members) >= group.maxSize] or groups
+        pairs = [(rng.choice(full), rng.choice(users)) for _ in range(n)]
+        for group, user in pairs:
+            controller.joinStudyGroup(group.groupID, user, waitlist=True)
+        return [(group.groupID, user) for group, user in pairs]
+
+    def nonMembers(n):
+        return [(group, user) for group, user in groupAndUser(n) if group not in user.groups]
+
+    def waitlistEntries(n):
+        pairs = nonMembers(n)
+        for pair in pairs:
+            db.saveWaitlistEntry(*pair)
+        return pairs
+
+    def searches(n):
+        queries = []
+        for _ in range(n):
+            since = cohort.randomDate()
+            queries.append((rng.choice(courses), rng.choice(locations), since, since + timedelta(days=7), 1))
+        return queries
+
+    def sessions(n):
+        return [(rng.choice(locations), date, date + timedelta(hours=1)) for date in (cohort.randomDate() for _ in range(n))]
+
+    def directMessages(n):
+        return [(rng.choice(users), rng.choice(users), cohort.sentence()) for _ in range(n)]
+
+    def groupMessages(n):
+        return [(member, group, cohort.sentence()) for group, member in groupAndMember(n)]
+
+    def messageBatches(n):
+        return [(sender, [Message(sender.userName, recipient.userName, content) for _ in range(10)])
+                for sender, recipient, content in directMessages(n)]
+
+    def broadcasts(n):
+        # A member of several groups posting the same announcement to all of them.
+        senders = [user for user in users if len(user.groups) > 1] or users
+        return [(sender, list(sender.groups), cohort.sentence()) for sender in (rng.choice(senders) for _ in range(n))]
+
+    def newestMessages(n):
+        found = []
+        for _ in range(20 * n):
+            if len(found) == n:
+                break
+            found.extend((message,) for message in messenger.getMessagePage(rng.choice(users), limit=1))
+        return found
+
+    def rosters(n):
+        batches = []
+        for _ in range(n):
+            names = [f"suiteUser{next(serial)}" for _ in range(100)]
+            userRows = [{"name": name, "password": "password", "email": f"{name}@example.com"} for name in names]
+            groupRows = [{"groupName": f"suiteGroup{next(serial)}", "course": rng.choice(courses),
+                          "location": rng.choice(locations), "date": cohort.randomDate(), "maxSize": 12,
+                          "creator": names[i * 10]} for i in range(10)]
+            memberRows = [{"groupName": groupRows[i // 10]["groupName"], "userName": names[i]}
+                          for i in range(100) if i % 10]
+            batches.append((userRows, groupRows, memberRows))
+        return batches
+
+    def credentials(n):
+        return [(user.userName, "password") for (user,) in savedUsers(n)]
+
+    def sessionTokens(n):
+        # Issued directly: a login per token would spend the whole preparation in the KDF.
+        return [(db.sessions.issue(user.userName),) for (user,) in randomUsers(n)]
+
+    def textSearches(n):
+        return [(rng.choice(users), rng.choice(SEARCH_QUERIES)) for _ in range(n)]
+
+    def conversations(n):
+        # Half the user's groups, half direct conversations.
+        chats = [(member, group) for group, member in groupAndMember(n // 2)]
+        return chats + [(rng.choice(users), rng.choice(users)) for _ in range(n - len(chats))]
+
+    def conversationBatches(n):
+        return [(user, conversation, [cohort.sentence() for _ in range(10)]) for user, conversation in conversations(n)]
+
+    def page(operation):
+        return lambda user: list(operation(user))
+
+    # Anything that saves users or logs in pays the password KDF (tens of ms), so those cases take few calls.
+    return {
+        "DatabaseManager.flush": (lambda n: [()] * n, db.flush, None),
+        "DatabaseManager.getValidCourses": (lambda n: [()] * n, db.getValidCourses, None),
+        "DatabaseManager.getValidLocations": (lambda n: [()] * n, db.getValidLocations, None),
+        "DatabaseManager.getUser": (lambda n: [(user.userID,) for (user,) in randomUsers(n)], db.getUser, None),
+        "DatabaseManager.getUserByName": (lambda n: [(user.userName,) for (user,) in randomUsers(n)], db.getUserByName, None),
+        "DatabaseManager.saveUser": (freshUsers, db.saveUser, 50),
+        "DatabaseManager.removeUser": (savedUsers, db.removeUser, 50),
+        "DatabaseManager.getStudyGroup": (lambda n: [(group.groupID,) for group, _ in groupAndUser(n)], db.getStudyGroup, None),
+        "DatabaseManager.getStudyGroupByName": (lambda n: [(group.groupName,) for group, _ in groupAndUser(n)],
+                                                db.getStudyGroupByName, None),
+        "DatabaseManager.saveStudyGroup": (lambda n: [(StudyGroup(*args[:5]),) for args in groupArgs(n)], db.saveStudyGroup, None),
+        "DatabaseManager.removeStudyGroup": (createdGroups, db.removeStudyGroup, None),
+        "DatabaseManager.saveMembership": (groupAndMember, db.saveMembership, None),
+        "DatabaseManager.removeMembership": (nonMembers, db.removeMembership, None),
+        "DatabaseManager.saveWaitlistEntry": (nonMembers, db.saveWaitlistEntry, None),
+        "DatabaseManager.removeWaitlistEntry": (waitlistEntries, db.removeWaitlistEntry, None),
+        "DatabaseManager.findRoomConflicts": (sessions, db.findRoomConflicts, None),
+        "DatabaseManager.describeRoomConflict": (sessions, db.describeRoomConflict, None),
+        "DatabaseManager.findTimeClashes": (lambda n: [(user, group) for group, user in groupAndUser(n)], db.findTimeClashes, None),
+        "DatabaseManager.searchStudyGroups": (searches, db.searchStudyGroups, None),
+        "DatabaseManager.saveMessage": (lambda n: [(sender, Message(sender.userName, recipient.userName, content))
+                                                   for sender, recipient, content in directMessages(n)], db.saveMessage, None),
+        "DatabaseManager.saveMessages": (messageBatches, db.saveMessages, None),
+        "DatabaseManager.getMessagesForUser": (randomUsers, db.getMessagesForUser, None),
+        "DatabaseManager.iterMessagesForUser": (randomUsers, page(lambda user: db.iterMessagesForUser(user, limit=50)), None),
+        "DatabaseManager.loadMessagesForUser": (randomUsers, db.loadMessagesForUser, None),
+        "DatabaseManager.clearInboxCache": (lambda n: [()] * n, db.clearInboxCache, None),
+        "DatabaseManager.invalidateInboxes": (lambda n: [([user.userName],) for (user,) in randomUsers(n)], db.invalidateInboxes, None),
+        "DatabaseManager.audienceOf": (newestMessages, db.audienceOf, None),
+        "DatabaseManager.searchMessages": (textSearches, db.searchMessages, None),
+        "DatabaseManager.markRead": (conversations, db.markRead, None),
+        "DatabaseManager.getUnreadCounts": (randomUsers, db.getUnreadCounts, None),
+        "DatabaseManager.loadUnreadCounts": (lambda n: [()] * n, db.loadUnreadCounts, None),
+        "DatabaseManager.importRoster": (rosters, db.importRoster, 3),
+        "DatabaseManager.login": (credentials, db.login, 20),
+        "DatabaseManager.authenticate": (sessionTokens, db.authenticate, None),
+        "DatabaseManager.logout": (sessionTokens, db.logout, None),
+        "MessageController.broadcastGroupMessage": (broadcasts, messenger.broadcastGroupMessage, None),
+        "MessageController.sendMessages": (conversationBatches, messenger.sendMessages, None),
+        "MessageController.markRead": (conversations, messenger.markRead, None),
+        "MessageController.getUnreadCounts": (randomUsers, messenger.getUnreadCounts, None),
+        "StudyGroupController.createStudyGroup": (groupArgs, controller.createStudyGroup, None),
+        "StudyGroupController.searchStudyGroups": (searches, controller.searchStudyGroups, None),
+        "StudyGroupController.joinStudyGroup": (idAndUser, controller.joinStudyGroup, None),
+        "StudyGroupController.removeFromStudyGroup": (idAndMember, controller.removeFromStudyGroup, None),
+        "StudyGroupController.leaveWaitlist": (waiting, controller.leaveWaitlist, None),
+        "StudyGroupController.getWaitlistPosition": (waiting, controller.getWaitlistPosition, None),
+        "StudyGroupController.getTimeClashes": (idAndUser, controller.getTimeClashes, None),
+        "StudyGroupController.warnClashes": (lambda n: [(user, group, db.findTimeClashes(user, group))
+                                                        for group, user in groupAndUser(n)], controller.warnClashes, None),
+        "MessageController.sendMessage": (directMessages, messenger.sendMessage, None),
+        "MessageController.sendGroupMessage": (groupMessages, messenger.sendGroupMessage, None),
+        "MessageController.getMessage": (randomUsers, messenger.getMessage, None),
+        "MessageController.getMessagePage": (randomUsers, page(messenger.getMessagePage), None),
+        "MessageController.getMessageCursor": (newestMessages, messenger.getMessageCursor, None),
+        "MessageController.searchMessages": (textSearches, messenger.searchMessages, None),
+        "StudyGroupGUI.createStudyGroup": (groupArgs, gui.createStudyGroup, None),
+        "StudyGroupGUI.searchStudyGroups": (searches, gui.searchStudyGroups, None),
+        "StudyGroupGUI.joinStudyGroup": (idAndUser, gui.joinStudyGroup, None),
+        "StudyGroupGUI.removeFromStudyGroup": (idAndMember, gui.removeFromStudyGroup, None),
+        "StudyGroupGUI.leaveWaitlist": (waiting, gui.leaveWaitlist, None),
+        "StudyGroupGUI.getWaitlistPosition": (waiting, gui.getWaitlistPosition, None),
+        "StudyGroupGUI.getTimeClashes": (idAndUser, gui.getTimeClashes, None),
+        "StudyGroupGUI.sendDirectMessage": (directMessages, gui.sendDirectMessage, None),
+        "StudyGroupGUI.sendGroupMessage": (groupMessages, gui.sendGroupMessage, None),
+        "StudyGroupGUI.getMessage": (randomUsers, gui.getMessage, None),
+        "StudyGroupGUI.getMessagePage": (randomUsers, page(gui.getMessagePage), None),
+        "StudyGroupGUI.getMessageCursor": (newestMessages, gui.getMessageCursor, None),
+        "StudyGroupGUI.searchMessages": (textSearches, gui.searchMessages, None),
+        "StudyGroupGUI.broadcastGroupMessage": (broadcasts, gui.broadcastGroupMessage, None),
+        "StudyGroupGUI.sendMessages": (conversationBatches, gui.sendMessages, None),
+        "StudyGroupGUI.markRead": (conversations, gui.markRead, None),
+        "StudyGroupGUI.getUnreadCounts": (randomUsers, gui.getUnreadCounts, None),
+        "StudyGroupGUI.login": (credentials, gui.login, 20),
+        "StudyGroupGUI.authenticate": (sessionTokens, gui.authenticate, None),
+        "StudyGroupGUI.logout": (sessionTokens, gui.logout, None),
+    }
+
+
+def percentile(ordered, fraction):
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def runCase(prepare, operation, calls, memoryCalls):
+    timedArgs, memoryArgs = prepare(calls), prepare(memoryCalls)
+    if not timedArgs:
+        return None
+    latencies = []
+    for args in timedArgs:
+        start = time.perf_counter_ns()
+        operation(*args)
+        latencies.append(time.perf_counter_ns() - start)
+    peak = 0
+    tracemalloc.start()
+    for args in memoryArgs:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        operation(*args)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    latencies.sort()
+    return {
+        "calls": len(latencies),
+        "opsPerSec": len(latencies) / (sum(latencies) / 1e9 or 1e-9),
+        "p50Us": percentile(latencies, 0.5) / 1e3,
+        "p99Us": percentile(latencies, 0.99) / 1e3,
+        "peakKiB": peak / 1024,
+    }
+
+
+def peakRssMiB():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Print each operation against the baseline run; return the names that got slower than `tolerance` allows."""
+    regressions = []
+    print(f"\n{'operation':<42}{'ops/s':>12}{'baseline':>12}{'change':>9}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        change = current["opsPerSec"] / previous["opsPerSec"] - 1
+        slower = change < -tolerance and current["p50Us"] > previous["p50Us"] * (1 + tolerance)
+        if slower:
+            regressions.append(name)
+        print(f"{name:<42}{current['opsPerSec']:>12.0f}{previous['opsPerSec']:>12.0f}{change:>+9.0%}"
+              f"{'  REGRESSION' if slower else ''}")
+    return regressions
+
+
+@contextlib.contextmanager
+def openBackend(backend):
+    with tempfile.TemporaryDirectory() as directory:
+        if backend == "sqlite":
+            yield SQLiteStorage(os.path.join(directory, "cohort.db"))
+        elif backend == "segmentlog":
+            yield SegmentLogStorage(directory)
+        else:
+            yield MemoryStorage()
+        DatabaseManager().useStorage(MemoryStorage())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--users", type=int, help="override the preset")
+    parser.add_argument("--groups", type=int, help="override the preset")
+    parser.add_argument("--messages", type=int, help="override the preset")
+    parser.add_argument("--backend", choices=["memory", "sqlite", "segmentlog"], default="memory")
+    parser.add_argument("--calls", type=int, default=1000, help="timed calls per operation")
+    parser.add_argument("--memory-calls", type=int, default=20, help="calls per operation traced for peak memory")
+    parser.add_argument("--only", nargs="+", default=["*"], help="glob patterns of operations to run")
+    parser.add_argument("--seed", type=int, default=15)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    users, groups, messages = PRESETS[args.scale]
+    users, groups, messages = args.users or users, args.groups or groups, args.messages or messages
+    configureLogging(silent=True)
+    with openBackend(args.backend) as storage:
+        dbmngr = DatabaseManager()
+        dbmngr.useStorage(storage)
+        start = time.perf_counter()
+        cohort = generateCohort(dbmngr, users, groups, messages, args.seed)
+        setUp = time.perf_counter() - start
+        print(f"{args.backend}: {users} users, {groups} groups, {messages} messages generated in {setUp:.1f}s "
+              f"(seed {args.seed})")
+        gui = StudyGroupGUI(StudyGroupController(dbmngr), MessageController(dbmngr))
+        cases = buildCases(cohort, gui)
+
+        results = {}
+        print(f"{'operation':<42}{'ops/s':>12}{'p50 (us)':>11}{'p99 (us)':>11}{'peak KiB':>10}")
+        for name, (prepare, operation, limit) in cases.items():
+            if not any(fnmatch.fnmatchcase(name, pattern) for pattern in args.only):
+                continue
+            calls = min(args.calls, limit) if limit else args.calls
+            result = runCase(prepare, operation, calls, min(args.memory_calls, calls))
+            if result is None:
+                print(f"{name:<42}{'(no arguments)':>12}")
+                continue
+            results[name] = result
+            print(f"{name:<42}{result['opsPerSec']:>12.0f}{result['p50Us']:>11.1f}{result['p99Us']:>11.1f}"
+                  f"{result['peakKiB']:>10.1f}")
+        dbmngr.flush()
+
+    uncovered = [name for name in publicMethods() if name not in cases and name not in SKIPPED]
+    if uncovered:
+        print(f"\nNo case for: {', '.join(uncovered)}")
+    run = {
+        "commit": gitCommit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "seed": args.seed,
+        "users": users,
+        "groups": groups,
+        "messages": messages,
+        "setUpSeconds": setUp,
+        "peakRssMiB": peakRssMiB(),
+        "uncovered": uncovered,
+        "results": results,
+    }
+    print(f"peak RSS: {run['peakRssMiB']:.0f} MiB" if run["peakRssMiB"] is not None else "peak RSS: unavailable")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline["backend"], baseline["users"], baseline["groups"], baseline["messages"]) != (args.backend, users, groups, messages):
+            print("warning: the baseline was run with a different backend or cohort size")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} operation(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Full-text message search through the inverted index versus scanning each user's visible history.
+
+Run from the repository root:
+    python -m benchmarks.bench_textsearch [--users 20000] [--groups 2000] [--messages 1000000] [--queries 500]
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.cohort import generateCohort
+from logconfig import configureLogging
+from main import DatabaseManager, MessageController
+from storage import MemoryStorage
+from textsearch import tokenize
+
+QUERIES = {
+    "term": "exam",
+    "two terms": "review graph",
+    "phrase": '"practice exam link"',
+    "prefix": "rec*",
+    "rare term": "cs4349",
+}
+
+
+def scan(dbmngr, user, query, limit=20):
+    # What callers did before: pull everything the user can see and filter it.
+    words = tokenize(query.replace("*", "").replace('"', ""))
+    matches = []
+    for message in reversed(dbmngr.getMessagesForUser(user)):
+        tokens = tokenize(message.content)
+        if all(any(token.startswith(word) for token in tokens) for word in words):
+            matches.append(message)
+            if len(matches) >= limit:
+                break
+    return matches
+
+
+def timed(search, users, query):
+    latencies = []
+    for user in users:
+        start = time.perf_counter()
+        search(user, query)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.mean(latencies) * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--groups", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=17)
+    args = parser.parse_args()
+
+    configureLogging(silent=True)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    cohort = generateCohort(dbmngr, args.users, args.groups, args.messages, args.seed)
+    messenger = MessageController(dbmngr)
+    for group in cohort.groups[::10]:
+        messenger.sendGroupMessage(group.members[0], group, "CS4349 practice exam link: https://example.com/exam.pdf")
+
+    start = time.perf_counter()
+    dbmngr.searchMessages(cohort.users[0], "warm up")
+    build = time.perf_counter() - start
+    index = dbmngr.messageIndex
+    print(f"{len(index)} messages indexed in {build:.1f}s, {len(index.postings)} distinct tokens")
+
+    users = [cohort.rng.choice(cohort.users) for _ in range(args.queries)]
+    # The members of the most groups, whose visible history is largest.
+    busiest = sorted(cohort.users, key=lambda user: len(user.groups), reverse=True)[:max(args.queries // 10, 1)]
+    visible = statistics.mean(len(dbmngr.getMessagesForUser(user)) for user in busiest)
+    print(f"random users and the {len(busiest)} busiest (about {visible:.0f} visible messages each); mean us, p99 in brackets")
+    print(f"{'query':>12}{'index':>20}{'index, busiest':>20}{'scan':>20}{'scan, busiest':>20}")
+    for label, query in QUERIES.items():
+        cells = [timed(dbmngr.searchMessages, users, query), timed(dbmngr.searchMessages, busiest, query),
+                 timed(lambda user, q: scan(dbmngr, user, q), users[:100], query),
+                 timed(lambda user, q: scan(dbmngr, user, q), busiest[:20], query)]
+        print(f"{label:>12}" + "".join(f"{f'{mean:.0f} ({p99:.0f})':>20}" for mean, p99 in cells))
+    dbmngr.useStorage(MemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
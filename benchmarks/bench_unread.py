@@ -0,0 +1,103 @@
+"""Unread badges for a user: the incremental counters versus scanning the whole inbox from getMessagesForUser.
+
+Run from the repository root:
+    python -m benchmarks.bench_unread [--users 2000] [--messages 200000] [--reads 2000]
+
+Readers mark every conversation read halfway through the messages, so the scan compares every message with a cursor.
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+from benchmarks.cohort import CHEAP_HASHER
+from logconfig import configureLogging
+from inbox import InboxCache
+from main import DatabaseManager, MessageController, StudyGroupController, StudyGroupGUI, User
+from storage import MemoryStorage
+
+
+def scanBadges(dbmngr, user, cursors):
+    # Without counters: fetch everything and count what is past the user's cursors.
+    counts = {}
+    for message in dbmngr.getMessagesForUser(user):
+        if message.sender == user.userName:
+            continue
+        key = message.group or message.sender
+        if message.seq > cursors.get(key, 0):
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def timePerCall(operation, readers):
+    start = time.perf_counter()
+    for user in readers:
+        operation(user)
+    return (time.perf_counter() - start) / len(readers) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=24)
+    args = parser.parse_args()
+
+    configureLogging(silent=True)
+    rng = random.Random(args.seed)
+    dbmngr = DatabaseManager()
+    dbmngr.useStorage(MemoryStorage())
+    dbmngr.usePasswordHasher(CHEAP_HASHER)
+    dbmngr.useInboxCache(None)
+    gui = StudyGroupGUI(StudyGroupController(dbmngr), MessageController(dbmngr))
+    users = [User(f"unreadUser{i}", "password", f"unreadUser{i}@example.com") for i in range(args.users)]
+    for user in users:
+        dbmngr.saveUser(user)
+    groups = [gui.createStudyGroup(f"unreadGroup{i}", "CS3377", "ECSW", datetime(2024, 9, 1), 40, users[i % len(users)])
+              for i in range(args.groups)]
+    for user in users:
+        for group in rng.sample(groups, 3):
+            gui.joinStudyGroup(group.groupID, user)
+
+    def send(count):
+        for i in range(count):
+            if i % 2:
+                group = rng.choice(groups)
+                gui.sendGroupMessage(rng.choice(group.members), group, "see you at the library")
+            else:
+                gui.sendDirectMessage(rng.choice(users), rng.choice(users), "see you at the library")
+
+    readers = [rng.choice(users) for _ in range(args.reads)]
+    send(args.messages // 2)
+    start = time.perf_counter()
+    dbmngr.loadUnreadCounts()
+    buildMs = (time.perf_counter() - start) * 1e3
+    halfway = dbmngr.storage.lastMessageSeq()
+    scanCursors = {}
+    for user in set(readers):
+        cursors = scanCursors[user.userName] = {}
+        for partner in dbmngr.getUnreadCounts(user)["direct"]:
+            dbmngr.markRead(user, dbmngr.getUserByName(partner))
+            cursors[partner] = halfway
+        for group in user.groups:
+            dbmngr.markRead(user, group)
+            cursors[group.groupName] = halfway
+    send(args.messages - args.messages // 2)
+
+    conversations = sum(len(counts) for user in readers for counts in dbmngr.getUnreadCounts(user).values()) / len(readers)
+    inbox = sum(len(dbmngr.getMessagesForUser(user)) for user in readers) / len(readers)
+    print(f"{args.messages} messages; a user has {conversations:.0f} conversations and {inbox:.0f} messages on average")
+    print(f"counters built from storage in {buildMs:.0f} ms (once, on first use)")
+    print(f"{'badges via':>14}{'us/user':>12}")
+    counters = timePerCall(gui.getUnreadCounts, readers)
+    scan = timePerCall(lambda user: scanBadges(dbmngr, user, scanCursors[user.userName]), readers)
+    print(f"{'counters':>14}{counters:>12.1f}")
+    print(f"{'inbox scan':>14}{scan:>12.1f}{scan / counters:>10.0f}x")
+    dbmngr.useInboxCache(InboxCache())
+    dbmngr.useStorage(MemoryStorage())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Seeded synthetic cohort: users, scheduled study groups with members, and direct and group messages.
+
+The same seed and sizes always produce the same cohort, so benchmark runs on different commits compare like with like.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+from auth import PasswordHasher
+from compact import toMicros
+from main import DatabaseManager, Message, StudyGroup, User
+
+SEMESTER = datetime(2024, 8, 19, 8)
+WEEKS = 16
+HOURS_PER_DAY = 14
+WORDS = (
+    "exam", "quiz", "homework", "project", "lecture", "notes", "proof", "lab", "deadline", "review", "chapter",
+    "graph", "tree", "heap", "recursion", "pointer", "thread", "lock", "query", "schema", "test", "bug", "merge",
+    "meet", "library", "tonight", "tomorrow", "friday", "room", "slides", "question", "answer", "problem", "set",
+)
+# Synthetic accounts never log in, so they are hashed at a token cost; at the real KDF cost every
+# benchmark that creates users would measure little but scrypt (the 100k-user preset would take hours).
+CHEAP_HASHER = PasswordHasher(n=2 ** 2, iterations=1)
+# (users, groups, messages)
+PRESETS = {
+    "small": (2000, 200, 50000),
+    "medium": (20000, 2000, 1000000),
+    "large": (100000, 10000, 10000000),
+}
+
+
+class Cohort:
+    def __init__(self, dbManager: DatabaseManager, users: List[User], groups: List[StudyGroup], seed: int):
+        self.dbManager = dbManager
+        self.users = users
+        self.groups = groups
+        self.rng = random.Random(seed)
+        self.start = SEMESTER
+        self.end = SEMESTER + timedelta(weeks=WEEKS)
+
+    def randomDate(self) -> datetime:
+        return self.start + timedelta(days=self.rng.randrange(WEEKS * 7), hours=self.rng.randrange(HOURS_PER_DAY))
+
+    def sentence(self) -> str:
+        return sentence(self.rng)
+
+
+def sentence(rng: random.Random) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(3, 12)))
+
+
+def generateCohort(dbManager: DatabaseManager, users: int, groups: int, messages: int, seed: int = 0,
+                   directShare: float = 0.7, fullShare: float = 0.1) -> Cohort:
+    """Load a reproducible cohort into `dbManager`, which should be on an empty backend.
+
+    Groups get one-hour sessions in distinct room slots across the semester (extra groups beyond the
+    available slots are unscheduled), a random size up to capacity, and `fullShare` of them are full.
+    Messages are spread evenly over the semester in seq order.
+    """
+    rng = random.Random(seed)
+    courses, locations = dbManager.getValidCourses(), dbManager.getValidLocations()
+    userRows = [{"name": f"cohortUser{i}", "password": f"password{i}", "email": f"cohortUser{i}@example.com"}
+                for i in range(users)]
+    roomSlots = len(locations) * WEEKS * 7 * HOURS_PER_DAY
+    slots = rng.sample(range(roomSlots), min(groups, roomSlots))
+    groupRows, memberRows = [], []
+    for i in range(groups):
+        maxSize = rng.randint(4, 30)
+        if i < len(slots):
+            slot, hour = slots[i], slots[i] // len(locations)
+            location, duration = locations[slot % len(locations)], 60
+        else:
+            hour, location, duration = rng.randrange(WEEKS * 7 * HOURS_PER_DAY), rng.choice(locations), None
+        date = SEMESTER + timedelta(days=hour // HOURS_PER_DAY, hours=hour % HOURS_PER_DAY)
+        size = maxSize if rng.random() < fullShare else rng.randint(1, maxSize)
+        people = rng.sample(range(users), min(size, users))
+        groupRows.append({"groupName": f"cohortGroup{i}", "course": rng.choice(courses), "location": location,
+                          "date": date, "maxSize": maxSize, "duration": duration, "creator": f"cohortUser{people[0]}"})
+        memberRows.extend({"groupName": f"cohortGroup{i}", "userName": f"cohortUser{j}"} for j in people[1:])
+    hasher = dbManager.passwordHasher
+    dbManager.usePasswordHasher(CHEAP_HASHER)
+    try:
+        dbManager.importRoster(userRows, groupRows, memberRows)
+    finally:
+        dbManager.usePasswordHasher(hasher)
+
+    people = [dbManager.getUserByName(row["name"]) for row in userRows]
+    studyGroups = [dbManager.getStudyGroupByName(row["groupName"]) for row in groupRows]
+    begin = toMicros(SEMESTER)
+    step = max(WEEKS * 7 * 86400 * 1000000 // max(messages, 1), 1)
+    batch = []
+    for i in range(messages):
+        if rng.random() < directShare or not studyGroups:
+            record = (None, rng.choice(people).userName, rng.choice(people).userName, None, sentence(rng), begin + i * step)
+        else:
+            group = rng.choice(studyGroups)
+            record = (None, rng.choice(group.members).userName, None, group.groupName, sentence(rng), begin + i * step)
+        batch.append(Message.fromRecord(record))
+    dbManager.messages = batch
+    return Cohort(dbManager, people, studyGroups, seed + 1)
@@ -0,0 +1,55 @@
+"""Compact encodings shared by the models and the storage backends."""
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def toMicros(value: datetime) -> int:
+    """Microseconds since the epoch. Naive datetimes are taken as-is (no timezone conversion) so they round-trip exactly."""
+    return (value.replace(tzinfo=None) - EPOCH) // ONE_MICROSECOND
+
+
+def fromMicros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class CodeTable:
+    """Interns a small vocabulary (courses, locations) as dense integer codes.
+
+    Codes below 257 are CPython's cached small ints, so storing one costs a pointer and nothing else.
+    """
+
+    def __init__(self, names=()):
+        self.names: List[str] = []
+        self.codes: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name: str) -> int:
+        code = self.codes.get(name)
+        if code is None:
+            with self.lock:
+                code = self.codes.get(name)
+                if code is None:
+                    code = len(self.names)
+                    self.names.append(name)
+                    self.codes[name] = code
+        return code
+
+    def code(self, name: str) -> int:
+        """Code of an already interned name; KeyError otherwise."""
+        return self.codes[name]
+
+    def name(self, code: int) -> str:
+        return self.names[code]
+
+    def __len__(self):
+        return len(self.names)
+
+
+courseCodes = CodeTable()
+locationCodes = CodeTable()
@@ -0,0 +1,186 @@
+"""Change feed: typed events for users, study groups, memberships and messages, in one numbered sequence.
+
+Publishing stamps the next seq and appends to a bounded in-memory log, and that is all the write path
+pays. Subscribers read the log in batches on their own thread or asyncio task, so a slow one only
+falls behind and never holds up a writer, and any subscriber can resume from a seq still in the log.
+"""
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, List, Optional, Sequence, Tuple, Type
+
+from logconfig import logger
+
+
+class Event:
+    __slots__ = ("seq",)
+    fields: Tuple[str, ...] = ()
+
+    def __init__(self, *values):
+        self.seq = 0  # Assigned by EventBus.publish
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(seq={self.seq})"
+
+
+class UserSaved(Event):
+    __slots__ = fields = ("user",)
+
+
+class UserRemoved(Event):
+    __slots__ = fields = ("user",)
+
+
+class StudyGroupSaved(Event):
+    # Members added before the save (the creator, an imported roster) come with the group, not as MemberAdded.
+    __slots__ = fields = ("studyGroup",)
+
+
+class StudyGroupRemoved(Event):
+    __slots__ = fields = ("studyGroup",)
+
+
+class MemberAdded(Event):
+    __slots__ = fields = ("studyGroup", "user")
+
+
+class MemberRemoved(Event):
+    __slots__ = fields = ("studyGroup", "user")
+
+
+class MessageSaved(Event):
+    __slots__ = fields = ("message",)
+
+
+EventTypes = Optional[Sequence[Type[Event]]]
+
+
+class EventBus:
+    """The last `retain` events, readable from any seq after the oldest one kept.
+
+    A subscriber that falls more than `retain` events behind skips ahead to the oldest kept event; the
+    number skipped is added to its `missed` count and logged, and it should rebuild what it derives
+    from the events (e.g. reload a list) rather than trust its state.
+    """
+
+    def __init__(self, retain: int = 100000):
+        self.retain = retain
+        self.lock = threading.Condition()
+        self.log: List[Event] = []
+        self.first = 1  # seq of log[0]
+        self.lastSeq = 0
+        # asyncio streams waiting for the next event, woken (once) by the next publish.
+        self.sleepers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def publish(self, event: Event) -> Event:
+        self.publishAll((event,))
+        return event
+
+    def publishAll(self, events: Sequence[Event]) -> None:
+        """Publish several events with consecutive seqs, waking subscribers once."""
+        with self.lock:
+            for event in events:
+                self.lastSeq += 1
+                event.seq = self.lastSeq
+            self.log.extend(events)
+            if len(self.log) >= 2 * self.retain:
+                # Trim in bulk so appends stay amortized O(1).
+                del self.log[:len(self.log) - self.retain]
+                self.first = self.log[0].seq
+            self.lock.notify_all()
+            sleepers, self.sleepers = self.sleepers, []
+        for loop, ready in sleepers:
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:  # loop already closed
+                pass
+
+    def read(self, since: int = 0, limit: Optional[int] = None) -> Tuple[List[Event], int]:
+        """Events after seq `since`, oldest first, and how many were skipped because they are no longer kept."""
+        with self.lock:
+            return self.take(since, limit)
+
+    def take(self, since: int, limit: Optional[int]) -> Tuple[List[Event], int]:
+        # Caller holds self.lock.
+        missed = max(self.first - 1 - since, 0)
+        start = max(since + 1 - self.first, 0)
+        return self.log[start:start + limit if limit is not None else None], missed
+
+    def subscribe(self, handler: Callable[[List[Event]], None], since: Optional[int] = None, types: EventTypes = None,
+                  batchSize: int = 256) -> "Subscription":
+        """Call `handler(events)` on a dedicated thread with every event after `since` (default: from now on)."""
+        return Subscription(self, handler, self.lastSeq if since is None else since, types, batchSize)
+
+    async def stream(self, since: Optional[int] = None, types: EventTypes = None,
+                     batchSize: int = 256) -> AsyncIterator[List[Event]]:
+        """The asyncio counterpart of subscribe: `async for events in bus.stream(): ...`."""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        position = self.lastSeq if since is None else since
+        while True:
+            with self.lock:
+                batch, missed = self.take(position, batchSize)
+                if not batch:
+                    ready.clear()
+                    self.sleepers.append((loop, ready))
+            if missed:
+                logger.warning("Event stream fell %s events behind and skipped them.", missed)
+            if not batch:
+                await ready.wait()
+                continue
+            position = batch[-1].seq
+            batch = select(batch, types)
+            if batch:
+                yield batch
+
+
+def select(events: List[Event], types: EventTypes) -> List[Event]:
+    if types is None:
+        return events
+    types = tuple(types)
+    return [event for event in events if isinstance(event, types)]
+
+
+class Subscription:
+    """A thread delivering batches of events to one handler; `position` is the last seq it has handled."""
+
+    def __init__(self, bus: EventBus, handler: Callable[[List[Event]], None], since: int, types: EventTypes,
+                 batchSize: int):
+        self.bus = bus
+        self.handler = handler
+        self.position = since
+        self.types = types
+        self.batchSize = batchSize
+        self.missed = 0
+        self.active = True
+        self.thread = threading.Thread(target=self.run, name="event-subscriber", daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        bus = self.bus
+        while True:
+            with bus.lock:
+                while self.active and bus.lastSeq <= self.position:
+                    bus.lock.wait()
+                if not self.active:
+                    return
+                batch, missed = bus.take(self.position, self.batchSize)
+            if missed:
+                self.missed += missed
+                logger.warning("Event subscriber %s fell %s events behind and skipped them.", self.handler, missed)
+            self.position = batch[-1].seq
+            batch = select(batch, self.types)
+            if not batch:
+                continue
+            try:
+                self.handler(batch)
+            except Exception:
+                logger.exception("Event handler %s failed on events up to %s.", self.handler, self.position)
+
+    def close(self) -> None:
+        with self.bus.lock:
+            self.active = False
+            self.bus.lock.notify_all()
+        if threading.current_thread() is not self.thread:
+            self.thread.join()
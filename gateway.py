@@ -0,0 +1,448 @@
+"""asyncio WebSocket gateway in front of MessageController/StudyGroupController.
+
+Clients log in first (AuthController.login), open a WebSocket, identify with
+{"type": "hello", "token": <session token>} and then send
+{"type": "send", "to": <userName>, "content": ...}, {"type": "sendGroup", "groupID": ..., "content": ...},
+{"type": "join" | "leave", "groupID": ...} or {"type": "history", "limit": ..., "cursor": ...}. Every
+saved direct or group message is pushed to the connected recipients as {"type": "message", ...}.
+Requests may carry an "id" that is echoed in the {"type": "ack"} reply. Controller and storage calls
+run in worker threads, so a slow commit or a long history page never stalls the event loop.
+The token is checked again before every request and, for push subscriptions, every
+`sessionCheckInterval` seconds: a connection whose session was logged out or expired is closed.
+
+Only the parts of RFC 6455 the gateway needs are implemented here (text frames, fragmentation,
+ping/pong and close), so it runs with the standard library alone:
+    python gateway.py [--host 127.0.0.1] [--port 8765] [--db cohort.db | --snapshot-dir data]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from logconfig import logger
+from main import AuthController, DatabaseManager, Message, MessageController, StudyGroupController, User
+from snapshot import SnapshotStorage
+from storage import SQLiteStorage
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+MAX_FRAME_SIZE = 1 << 20
+CLOSE_NORMAL, CLOSE_PROTOCOL_ERROR, CLOSE_POLICY, CLOSE_TOO_BIG = 1000, 1002, 1008, 1009
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def acceptKey(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+
+
+def applyMask(payload: bytes, mask: bytes) -> bytes:
+    if not payload:
+        return payload
+    # XOR the whole payload at once as one big integer instead of byte by byte.
+    repeated = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")).to_bytes(len(payload), "big")
+
+
+def encodeFrame(payload: bytes, opcode: int = OP_TEXT, mask: bool = False) -> bytes:
+    length = len(payload)
+    maskBit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, maskBit | length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, maskBit | 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, maskBit | 127, length)
+    if not mask:
+        return header + payload
+    key = os.urandom(4)
+    return header + key + applyMask(payload, key)
+
+
+def encodeJson(payload: dict) -> bytes:
+    return encodeFrame(json.dumps(payload, separators=(",", ":")).encode())
+
+
+async def readFrame(reader: asyncio.StreamReader, fromClient: bool = True) -> Tuple[bool, int, bytes]:
+    """Next frame as (fin, opcode, payload). Frames from a client must be masked and frames from a server
+    must not be (RFC 6455 section 5.1)."""
+    first, second = await reader.readexactly(2)
+    fin, opcode = bool(first & 0x80), first & 0x0F
+    masked, length = bool(second & 0x80), second & 0x7F
+    if masked != fromClient:
+        raise ProtocolError("client frames must be masked" if fromClient else "server frames must not be masked")
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError("frame too large")
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    return fin, opcode, applyMask(payload, mask) if mask else payload
+
+
+async def readMessage(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, maskReplies: bool = False) -> Optional[bytes]:
+    """Next complete text/binary message, answering pings on the way. None once the peer closes.
+    Clients must mask what they send (maskReplies=True); servers must not."""
+    parts = []
+    while True:
+        fin, opcode, payload = await readFrame(reader, fromClient=not maskReplies)
+        if opcode == OP_CLOSE:
+            return None
+        if opcode == OP_PING:
+            writer.write(encodeFrame(payload, OP_PONG, mask=maskReplies))
+            continue
+        if opcode == OP_PONG:
+            continue
+        if opcode not in (OP_TEXT, OP_BINARY, OP_CONTINUATION):
+            raise ProtocolError(f"unknown opcode {opcode}")
+        parts.append(payload)
+        if sum(map(len, parts)) > MAX_FRAME_SIZE:
+            raise ProtocolError("message too large")
+        if fin:
+            return b"".join(parts)
+
+
+def stringField(request: dict, name: str, default: Optional[str] = None) -> Optional[str]:
+    value = request.get(name, default)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    return value
+
+
+def limitField(request: dict, default: int = 50, maximum: int = 500) -> int:
+    value = request.get("limit", default)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise ValueError("limit must be a non-negative integer")
+    return min(value, maximum)
+
+
+def messagePayload(message: Message) -> dict:
+    return {
+        "type": "message",
+        "seq": message.seq,
+        "sender": message.sender,
+        "recipient": message.recipient,
+        "group": message.group,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat(),
+    }
+
+
+class Connection:
+    """One client socket. Outgoing frames wait in a bounded queue drained by a writer task; a client
+    that falls `queueSize` frames behind is disconnected and can catch up with a history request."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, queueSize: int):
+        self.reader = reader
+        self.writer = writer
+        self.outbox: asyncio.Queue = asyncio.Queue(queueSize)
+        self.userName: Optional[str] = None
+        self.token: Optional[str] = None
+        self.closed = False
+        self.dropped = False
+
+    def push(self, frame: bytes) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.outbox.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            self.dropped = True
+            self.close(CLOSE_POLICY, "client too slow")
+            return False
+
+    def close(self, code: int = CLOSE_NORMAL, reason: str = "") -> None:
+        if self.closed:
+            return
+        self.closed = True
+        # Bypass the (possibly full) queue so the close frame goes out right away.
+        self.writer.write(encodeFrame(struct.pack("!H", code) + reason.encode(), OP_CLOSE))
+        if not self.outbox.full():
+            self.outbox.put_nowait(None)
+        self.writer.close()
+
+    async def drainOutbox(self) -> None:
+        try:
+            while True:
+                frame = await self.outbox.get()
+                if frame is None or self.closed:
+                    return
+                self.writer.write(frame)
+                # Per-connection backpressure: wait for the socket buffer before taking the next frame.
+                await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            return
+
+
+class MessageGateway:
+    def __init__(self, dbManager: DatabaseManager, studyGroupController: Optional[StudyGroupController] = None,
+                 messageController: Optional[MessageController] = None, host: str = "127.0.0.1", port: int = 8765,
+                 queueSize: int = 256, authController: Optional[AuthController] = None,
+                 sessionCheckInterval: float = 30.0):
+        self.dbManager = dbManager
+        self.studyGroupController = studyGroupController or StudyGroupController(dbManager)
+        self.messageController = messageController or MessageController(dbManager)
+        self.authController = authController or AuthController(dbManager)
+        self.host = host
+        self.port = port
+        self.queueSize = queueSize
+        self.sessionCheckInterval = sessionCheckInterval
+        self.connections: Dict[str, Set[Connection]] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loopThread: Optional[int] = None
+        self.sessionChecker: Optional[asyncio.Task] = None
+        self.pushed = 0
+        self.dropped = 0
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.loopThread = threading.get_ident()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.dbManager.addMessageListener(self.onMessage)
+        self.sessionChecker = asyncio.create_task(self.checkSessions())
+        logger.info("Message gateway listening on ws://%s:%s", self.host, self.port)
+
+    async def stop(self) -> None:
+        self.dbManager.removeMessageListener(self.onMessage)
+        if self.sessionChecker is not None:
+            self.sessionChecker.cancel()
+        for connections in list(self.connections.values()):
+            for connection in list(connections):
+                connection.close(1001, "server shutting down")
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def serveForever(self) -> None:
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def sessionUser(self, connection: Connection) -> Optional[User]:
+        """The user the connection said hello as, while its session is still live."""
+        user = self.authController.authenticate(connection.token) if connection.token is not None else None
+        return user if user is not None and user.userName == connection.userName else None
+
+    def endSession(self, connection: Connection) -> None:
+        self.unsubscribe(connection)
+        connection.close(CLOSE_POLICY, "session expired")
+
+    async def checkSessions(self) -> None:
+        # A subscriber may only ever receive pushes, so requests alone would not notice its session ending.
+        while True:
+            await asyncio.sleep(self.sessionCheckInterval)
+            for connections in list(self.connections.values()):
+                for connection in list(connections):
+                    if self.sessionUser(connection) is None:
+                        self.endSession(connection)
+
+    def unsubscribe(self, connection: Connection) -> None:
+        subscribers = self.connections.get(connection.userName) if connection.userName is not None else None
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.connections[connection.userName]
+
+    def onMessage(self, message: Message) -> None:
+        if self.loop is None:
+            return
+        if threading.get_ident() == self.loopThread:
+            self.fanOut(message)
+        else:
+            self.loop.call_soon_threadsafe(self.fanOut, message)
+
+    def fanOut(self, message: Message) -> None:
+        # Encode once, then hand the same frame to every connected recipient in a single pass.
+        frame = encodeJson(messagePayload(message))
+        if message.group:
+            group = self.dbManager.getStudyGroupByName(message.group)
+            recipients = [member.userName for member in group.members] if group else []
+        else:
+            recipients = [message.recipient] if message.recipient == message.sender else [message.recipient, message.sender]
+        for userName in recipients:
+            for connection in self.connections.get(userName, ()):
+                if connection.push(frame):
+                    self.pushed += 1
+                else:
+                    self.dropped += 1
+
+    async def handshake(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        request = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        headers = {}
+        for line in request.split("\r\n")[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if headers.get("upgrade", "").lower() != "websocket" or not key:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return False
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {acceptKey(key)}\r\n\r\n").encode())
+        return True
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            if not await self.handshake(reader, writer):
+                writer.close()
+                return
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        connection = Connection(reader, writer, self.queueSize)
+        drainer = asyncio.create_task(connection.drainOutbox())
+        try:
+            while not connection.closed:
+                data = await readMessage(reader, writer)
+                if data is None:
+                    break
+                await self.dispatch(connection, data)
+        except ProtocolError as e:
+            connection.close(CLOSE_TOO_BIG if "large" in str(e) else CLOSE_PROTOCOL_ERROR, str(e))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            connection.close()
+            drainer.cancel()
+            self.unsubscribe(connection)
+
+    def reply(self, connection: Connection, request: dict, ok: bool, **fields) -> None:
+        connection.push(encodeJson({"type": "ack", "id": request.get("id"), "ok": ok, **fields}))
+
+    async def dispatch(self, connection: Connection, data: bytes) -> None:
+        try:
+            request = json.loads(data)
+            kind = request["type"]
+        except (ValueError, KeyError, TypeError):
+            connection.push(encodeJson({"type": "ack", "id": None, "ok": False, "error": "invalid request"}))
+            return
+        # A bad field or a failing call answers this request only; the connection stays open.
+        try:
+            await self.serve(connection, request, kind)
+        except ValueError as e:
+            self.reply(connection, request, False, error=str(e))
+        except Exception:
+            logger.exception("Gateway request %r failed.", kind)
+            self.reply(connection, request, False, error="internal error")
+
+    async def serve(self, connection: Connection, request: dict, kind) -> None:
+        if kind == "hello":
+            # Only a live session token identifies the connection; a bare user name is not proof of anything.
+            token = request.get("token")
+            user = self.authController.authenticate(token) if isinstance(token, str) else None
+            if user is None:
+                self.reply(connection, request, False, error="invalid session")
+                return
+            self.unsubscribe(connection)
+            connection.userName, connection.token = user.userName, token
+            self.connections.setdefault(user.userName, set()).add(connection)
+            self.reply(connection, request, True)
+            return
+        if connection.userName is None:
+            self.reply(connection, request, False, error="say hello first")
+            return
+        sender = self.sessionUser(connection)
+        if sender is None:
+            self.endSession(connection)
+        elif kind == "send":
+            recipient = self.dbManager.getUserByName(stringField(request, "to"))
+            content = stringField(request, "content", "")
+            ok = recipient is not None and await asyncio.to_thread(self.messageController.sendMessage, sender, recipient, content)
+            self.reply(connection, request, ok)
+        elif kind == "sendGroup":
+            group = self.dbManager.getStudyGroup(stringField(request, "groupID"))
+            content = stringField(request, "content", "")
+            ok = group is not None and await asyncio.to_thread(self.messageController.sendGroupMessage, sender, group, content)
+            self.reply(connection, request, ok)
+        elif kind in ("join", "leave"):
+            groupID = stringField(request, "groupID")
+            if kind == "join":
+                ok = await asyncio.to_thread(self.studyGroupController.joinStudyGroup, groupID, sender)
+            else:
+                ok = await asyncio.to_thread(self.studyGroupController.removeFromStudyGroup, groupID, sender)
+            self.reply(connection, request, ok)
+        elif kind == "history":
+            limit, cursor = limitField(request), stringField(request, "cursor")
+
+            def page():
+                messages = list(self.messageController.getMessagePage(sender, limit=limit, cursor=cursor))
+                return messages, self.messageController.getMessageCursor(messages[-1]) if messages else None
+
+            messages, nextCursor = await asyncio.to_thread(page)
+            self.reply(connection, request, True, messages=[messagePayload(m) for m in messages], cursor=nextCursor)
+        else:
+            self.reply(connection, request, False, error=f"unknown request type {kind!r}")
+
+
+class WebSocketClient:
+    """Minimal client for tests and load generation."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str, port: int, path: str = "/") -> "WebSocketClient":
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        response = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        if " 101 " not in response.split("\r\n")[0] or acceptKey(key) not in response:
+            writer.close()
+            raise ProtocolError(f"handshake failed: {response.splitlines()[0]}")
+        return cls(reader, writer)
+
+    async def send(self, payload: dict) -> None:
+        self.writer.write(encodeFrame(json.dumps(payload).encode(), mask=True))
+        await self.writer.drain()
+
+    async def receive(self) -> Optional[dict]:
+        data = await readMessage(self.reader, self.writer, maskReplies=True)
+        return None if data is None else json.loads(data)
+
+    async def close(self) -> None:
+        try:
+            self.writer.write(encodeFrame(struct.pack("!H", CLOSE_NORMAL), OP_CLOSE, mask=True))
+            self.writer.close()
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the chat WebSocket gateway.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--db", help="SQLite database to serve (default: an empty in-memory store)")
+    parser.add_argument("--snapshot-dir", help="serve from memory, restored from and journaled to this directory")
+    args = parser.parse_args()
+    dbManager = DatabaseManager()
+    if args.db:
+        dbManager.useStorage(SQLiteStorage(args.db))
+    elif args.snapshot_dir:
+        dbManager.useStorage(SnapshotStorage(args.snapshot_dir))
+    gateway = MessageGateway(dbManager, host=args.host, port=args.port, queueSize=args.queue_size)
+    try:
+        asyncio.run(gateway.serveForever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dbManager.storage.close()
+
+
+if __name__ == "__main__":
+    main()
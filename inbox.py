@@ -0,0 +1,251 @@
+import base64
+import heapq
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from itertools import islice
+from operator import attrgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from compact import toMicros
+
+# Messages are appended in save order, so every log is already sorted by seq (and by timestamp).
+bySeq = attrgetter("seq")
+byTimestamp = attrgetter("timestampUs")
+
+CURSOR_PREFIX = "m1:"
+
+
+def encodeCursor(message) -> str:
+    """Opaque cursor pointing just past `message` when paging towards older messages."""
+    return base64.urlsafe_b64encode(f"{CURSOR_PREFIX}{message.seq}".encode()).decode()
+
+
+def decodeCursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    if not raw.startswith(CURSOR_PREFIX) or not raw[len(CURSOR_PREFIX):].isdigit():
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return int(raw[len(CURSOR_PREFIX):])
+
+
+def iterNewestFirst(log: List, since: Optional[datetime], before: Optional[datetime], beforeSeq: Optional[int]) -> Iterator:
+    start = bisect_left(log, toMicros(since), key=byTimestamp) if since is not None else 0
+    end = len(log)
+    if before is not None:
+        end = min(end, bisect_left(log, toMicros(before), key=byTimestamp))
+    if beforeSeq is not None:
+        end = min(end, bisect_left(log, beforeSeq, key=bySeq))
+    for i in range(end - 1, start - 1, -1):
+        yield log[i]
+
+
+class Inbox:
+    """Per-recipient direct-message logs and per-group message logs."""
+
+    def __init__(self):
+        self.directLogs: Dict[str, List] = defaultdict(list)
+        self.groupLogs: Dict[str, List] = defaultdict(list)
+
+    def append(self, message) -> None:
+        if message.group:
+            self.groupLogs[message.group].append(message)
+        else:
+            self.directLogs[message.recipient].append(message)
+
+    def logsFor(self, userName: str, groupNames: Iterable[str]) -> List[List]:
+        logs = []
+        direct = self.directLogs.get(userName)
+        if direct:
+            logs.append(direct)
+        for groupName in groupNames:
+            log = self.groupLogs.get(groupName)
+            if log:
+                logs.append(log)
+        return logs
+
+    def messagesFor(self, userName: str, groupNames: Iterable[str]) -> List:
+        logs = self.logsFor(userName, groupNames)
+        if not logs:
+            return []
+        if len(logs) == 1:
+            return list(logs[0])
+        return list(heapq.merge(*logs, key=bySeq))
+
+    def iterMessagesFor(self, userName: str, groupNames: Iterable[str], since: Optional[datetime] = None,
+                        before: Optional[datetime] = None, limit: Optional[int] = None,
+                        cursor: Optional[str] = None) -> Iterator:
+        """Lazily yield a user's messages newest first, within [since, before) and older than `cursor`."""
+        beforeSeq = decodeCursor(cursor) if cursor is not None else None
+        streams = [iterNewestFirst(log, since, before, beforeSeq) for log in self.logsFor(userName, groupNames)]
+        if len(streams) == 1:
+            merged = streams[0]
+        else:
+            merged = heapq.merge(*streams, key=bySeq, reverse=True)
+        return islice(merged, limit)
+
+    def clear(self) -> None:
+        self.directLogs.clear()
+        self.groupLogs.clear()
+
+
+class InboxCache:
+    """Bounded LRU of whole inbox results keyed by user name, for callers that reread unchanged histories.
+
+    An entry is a sequence of messages shared with every reader; getMessagesForUser stores tuples, so no
+    reader can modify it. The cache holds at most `maxEntries` inboxes and roughly `maxBytes` of list storage
+    plus `MESSAGE_BYTES` per message; the least recently read entries go first. A lookup returns a stamp
+    that `put` checks, so a result computed while the user's inbox changed is dropped instead of cached stale.
+    """
+
+    MESSAGE_BYTES = 200  # Rough footprint of a short message, for backends that build fresh objects per read.
+
+    def __init__(self, maxEntries: int = 10000, maxBytes: int = 64 * 2 ** 20):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, Tuple[List, int]]" = OrderedDict()
+        self.stamps: Dict[str, int] = {}
+        self.epoch = 0  # Bumped by clear, which covers users with no stamp yet.
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, userName: str) -> Tuple[Optional[List], Optional[tuple]]:
+        """The cached inbox (or None) and the stamp to pass to `put` after a miss."""
+        with self.lock:
+            entry = self.entries.get(userName)
+            if entry is None:
+                self.misses += 1
+                return None, (self.epoch, self.stamps.get(userName, 0))
+            self.entries.move_to_end(userName)
+            self.hits += 1
+            return entry[0], None
+
+    def put(self, userName: str, stamp: tuple, messages: List) -> None:
+        size = sys.getsizeof(messages) + len(messages) * self.MESSAGE_BYTES
+        if size > self.maxBytes:
+            return
+        with self.lock:
+            if (self.epoch, self.stamps.get(userName, 0)) != stamp or userName in self.entries:
+                return
+            self.entries[userName] = (messages, size)
+            self.bytes += size
+            while len(self.entries) > self.maxEntries or self.bytes > self.maxBytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, userNames: Iterable[str]) -> None:
+        with self.lock:
+            for userName in userNames:
+                self.stamps[userName] = self.stamps.get(userName, 0) + 1
+                entry = self.entries.pop(userName, None)
+                if entry is not None:
+                    self.bytes -= entry[1]
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.epoch += 1
+            self.stamps.clear()
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "bytes": self.bytes, "maxEntries": self.maxEntries,
+                    "maxBytes": self.maxBytes, "hits": self.hits, "misses": self.misses,
+                    "hitRate": self.hits / lookups if lookups else 0.0, "evictions": self.evictions,
+                    "invalidations": self.invalidations}
+
+
+class Conversation:
+    __slots__ = ("seqs", "bySender")
+
+    def __init__(self):
+        self.seqs = array("q")
+        self.bySender: Dict[str, array] = {}
+
+
+class UnreadCounts:
+    """Per-conversation message seqs and per-user read cursors, so unread badges never touch messages.
+
+    A conversation is a group or a pair of users; users name them "#groupName" and "@partner". Each
+    keeps the seqs of its messages, all together and per sender, in arrays. A read cursor records how
+    many of each were at or before the last message read, so an unread count (messages since, less
+    the user's own) is two subtractions. Until a user first marks a conversation read, all of it is unread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups: Dict[str, Conversation] = {}
+        # userName -> partner -> the conversation both of them share.
+        self.direct: Dict[str, Dict[str, Conversation]] = defaultdict(dict)
+        # userName -> conversation -> (seq, messages up to seq, own messages up to seq)
+        self.cursors: Dict[str, Dict[Conversation, Tuple[int, int, int]]] = defaultdict(dict)
+
+    def conversation(self, userName: str, key: str, create: bool = False) -> Optional[Conversation]:
+        # Caller holds self.lock.
+        if key.startswith("#"):
+            found = self.groups.get(key[1:])
+            if found is None and create:
+                found = self.groups[key[1:]] = Conversation()
+            return found
+        partner = key[1:]
+        found = self.direct[userName].get(partner) if userName in self.direct else None
+        if found is None and create:
+            found = self.direct[userName][partner] = self.direct[partner][userName] = Conversation()
+        return found
+
+    def add(self, message) -> None:
+        """Count a saved message; messages must arrive in seq order."""
+        with self.lock:
+            if message.group:
+                conversation = self.conversation(message.sender, "#" + message.group, create=True)
+            else:
+                conversation = self.conversation(message.sender, "@" + message.recipient, create=True)
+            conversation.seqs.append(message.seq)
+            own = conversation.bySender.get(message.sender)
+            if own is None:
+                own = conversation.bySender[message.sender] = array("q")
+            own.append(message.seq)
+
+    def markRead(self, userName: str, key: str, seq: Optional[int] = None) -> int:
+        """Move the user's cursor to `seq` (default: the latest message) and return the seq it now points at."""
+        with self.lock:
+            conversation = self.conversation(userName, key)
+            if conversation is None:
+                # Nothing to read yet, and every message to come is past any cursor.
+                return seq if seq is not None else 0
+            if seq is None:
+                seq = conversation.seqs[-1] if conversation.seqs else 0
+            own = conversation.bySender.get(userName, ())
+            self.cursors[userName][conversation] = (seq, bisect_right(conversation.seqs, seq), bisect_right(own, seq))
+            return seq
+
+    def counts(self, userName: str, groupNames: Iterable[str]) -> Dict[str, Dict[str, int]]:
+        """Unread counts for every direct partner and every group named, by partner and group name."""
+        with self.lock:
+            cursors = self.cursors.get(userName, {})
+
+            def unread(conversation: Optional[Conversation]) -> int:
+                if conversation is None:
+                    return 0
+                _, read, ownRead = cursors.get(conversation, (0, 0, 0))
+                own = conversation.bySender.get(userName)
+                return len(conversation.seqs) - read - (len(own) - ownRead if own is not None else 0)
+
+            return {
+                "direct": {partner: unread(conversation) for partner, conversation in self.direct.get(userName, {}).items()},
+                "groups": {groupName: unread(self.groups.get(groupName)) for groupName in groupNames},
+            }
@@ -0,0 +1,52 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Optional, TextIO
+
+logger = logging.getLogger("classcohort")
+# Library default: stay quiet until the application calls configureLogging().
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configureLogging(level: int = logging.INFO, silent: bool = False, stream: Optional[TextIO] = None,
+                     fmt: str = "%(message)s", queued: bool = True) -> None:
+    """Route the classcohort logger through a QueueHandler so callers never block on the output stream.
+
+    A background QueueListener writes records to `stream` (stdout by default). silent=True drops
+    everything, which is the production setting for hot paths. queued=False writes synchronously,
+    keeping log lines in order with the caller's own prints (used by the interactive demo).
+    """
+    global listener
+    stopLogging()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    if silent:
+        logger.addHandler(logging.NullHandler())
+        logger.setLevel(logging.CRITICAL + 1)
+        return
+    target = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    target.setFormatter(logging.Formatter(fmt))
+    logger.setLevel(level)
+    if not queued:
+        logger.addHandler(target)
+        return
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, target)
+    listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+
+
+def stopLogging() -> None:
+    """Drain queued records and stop the background writer."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+atexit.register(stopLogging)
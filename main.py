@@ -1,9 +1,34 @@
-from datetime import datetime
-from typing import List, Optional
-from dataclasses import dataclass
+import argparse
+import csv
+import heapq
+import json
+import logging
+import sys
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from uuid import uuid4
-@dataclass
+from itertools import count, islice
+from archive import MessageArchive, RetentionPolicy
+from auth import PasswordHasher, SessionCache
+from compact import courseCodes, fromMicros, locationCodes, toMicros
+from events import (EventBus, MemberAdded, MemberRemoved, MessageSaved, StudyGroupRemoved, StudyGroupSaved, UserRemoved,
+                    UserSaved)
+from inbox import InboxCache, UnreadCounts, bySeq, decodeCursor, encodeCursor
+from logconfig import configureLogging, logger
+from metrics import Metrics
+from schedule import IntervalIndex
+from storage import MemoryStorage, SQLiteStorage, Storage
+from textsearch import MessageIndex
 class User:
+    # Slotted to keep 100k+ users compact. Equality and hashing are by identity: two users are the
+    # same only if they are the same object, which is what every `in`/`not in` membership check wants.
+    __slots__ = ("userID", "userName", "password", "passwordHashed", "email", "groups", "lock")
+
     def __init__(self, name, password, email, study_group=None):
         if not name or not isinstance(name, str) or not name.strip():
             raise ValueError("Invalid username: Username cannot be empty or None.")
@@ -17,132 +42,270 @@ class User:
         self.userID = str(uuid4())
         self.userName = name
         self.password = password
+        self.passwordHashed = False  # Set once saveUser has replaced the plaintext with a hash
         self.email = email
         self.groups = study_group if study_group is not None else []
+        # Guards self.groups. Lock order: a group's lock is always taken before a user's.
+        self.lock = threading.RLock()
+
+    @classmethod
+    def fromRecord(cls, record) -> "User":
+        # Rebuild a stored user without re-running validation or issuing a new ID.
+        user = cls.__new__(cls)
+        user.userID, user.userName, user.password, user.email = record
+        # Stored passwords are hashes, or legacy plaintext that login verifies and upgrades; never hash them again.
+        user.passwordHashed = True
+        user.groups = []
+        user.lock = threading.RLock()
+        return user
 
     def addToStudyGroup(self, studyGroup: "StudyGroup") -> bool:
-        if studyGroup not in self.groups:
-            self.groups.append(studyGroup)
-            return True
-        return False
+        with self.lock:
+            if studyGroup not in self.groups:
+                self.groups.append(studyGroup)
+                return True
+            return False
 
     def removeStudyGroup(self, studyGroup: "StudyGroup") -> bool:
-        memberIndex = next((i for i, group in enumerate(self.groups) if group.groupID == studyGroup.groupID), None)
-    #    if memberIndex is not None:
-     #       self.groups.pop(memberIndex)
-      #      return True
-      #  return False
-        if studyGroup in self.groups:
-            self.groups.pop(memberIndex)
-            return True
-        return False
+        with self.lock:
+            memberIndex = next((i for i, group in enumerate(self.groups) if group.groupID == studyGroup.groupID), None)
+        #    if memberIndex is not None:
+         #       self.groups.pop(memberIndex)
+          #      return True
+          #  return False
+            if studyGroup in self.groups:
+                self.groups.pop(memberIndex)
+                return True
+            return False
+
+    def groupNames(self) -> List[str]:
+        with self.lock:
+            return [group.groupName for group in self.groups]
 
 class StudyGroup:
-    def __init__(self, groupName: Optional[str], course: Optional[str], location: Optional[str], date: Optional[datetime], maxSize: int):
+    # Course and location are held as codes into the shared courseCodes/locationCodes tables.
+    # A group with a duration books its room for [date, date + duration); without one it is unscheduled
+    # and takes part in neither room conflicts nor time clashes.
+    __slots__ = ("is_valid", "error", "lock", "groupName", "groupID", "courseCode", "locationCode", "date", "duration",
+                 "maxSize", "members", "waitlist")
+
+    def __init__(self, groupName: Optional[str], course: Optional[str], location: Optional[str], date: Optional[datetime], maxSize: int,
+                 duration: Optional[timedelta] = None):
         dbManager = DatabaseManager()
+        self.error: Optional[str] = None  # Why validation failed; None for a valid group
+        self.lock = threading.RLock()  # Guards self.members and self.waitlist
+        # FIFO of users waiting for a seat, keyed by userID: O(1) enqueue, promotion and leaving.
+        self.waitlist: "OrderedDict[str, User]" = OrderedDict()
 
         # Validate group name
         if not groupName or not groupName.strip():
-            print("Error: Group name cannot be empty.")
+            self.error = "Group name cannot be empty."
             self.is_valid = False
             return
 
-        if any(group.groupName == groupName for group in dbManager.studyGroups):
-            print(f"Error: Group name '{groupName}' already exists.")
+        if dbManager.getStudyGroupByName(groupName) is not None:
+            self.error = f"Group name '{groupName}' already exists."
             self.is_valid = False
             return
 
         # Validate course
         if not course or not course.strip():
-            print("Error: Course name cannot be empty.")
+            self.error = "Course name cannot be empty."
             self.is_valid = False
             return
 
         if course.strip() not in dbManager.getValidCourses():
-            print(f"Error: Invalid course: {course}. Valid courses are {', '.join(dbManager.getValidCourses())}.")
+            self.error = f"Invalid course: {course}. Valid courses are {', '.join(dbManager.getValidCourses())}."
             self.is_valid = False
             return
 
         # Validate location
         if not location or not location.strip():
-            print("Error: Location cannot be empty.")
+            self.error = "Location cannot be empty."
             self.is_valid = False
             return
 
         if location.strip() not in dbManager.getValidLocations():
-            print(f"Error: Invalid location: {location}. Valid locations are {', '.join(dbManager.getValidLocations())}.")
+            self.error = f"Invalid location: {location}. Valid locations are {', '.join(dbManager.getValidLocations())}."
             self.is_valid = False
             return
 
         # Validate date
         if not isinstance(date, datetime):
-            print("Error: Invalid date. Date must be a datetime object.")
+            self.error = "Invalid date. Date must be a datetime object."
             self.is_valid = False
             return
 
         # Validate max size
         if maxSize <= 0:
-            print("Error: Invalid max size. The size of the group must be greater than 0.")
+            self.error = "Invalid max size. The size of the group must be greater than 0."
             self.is_valid = False
             return
 
+        # Validate duration and room availability
+        if duration is not None:
+            if not isinstance(duration, timedelta) or duration <= timedelta(0):
+                self.error = "Invalid duration. A session must last longer than zero."
+                self.is_valid = False
+                return
+
+            conflict = dbManager.describeRoomConflict(location.strip(), date, date + duration)
+            if conflict is not None:
+                self.error = conflict
+                self.is_valid = False
+                return
+
         # All validations passed
         self.is_valid = True
         self.groupName = groupName
         self.groupID = str(uuid4())
-        self.course = course
-        self.location = location
+        self.course = course.strip()
+        self.location = location.strip()
         self.date = date
+        self.duration = duration
         self.maxSize = maxSize
         self.members: List[User] = []
 
-    def addMember(self, user: User) -> bool:
+    @classmethod
+    def fromRecord(cls, record) -> "StudyGroup":
+        studyGroup = cls.__new__(cls)
+        studyGroup.is_valid = True
+        studyGroup.error = None
+        studyGroup.lock = threading.RLock()
+        studyGroup.waitlist = OrderedDict()
+        (studyGroup.groupID, studyGroup.groupName, studyGroup.course, studyGroup.location, studyGroup.date,
+         studyGroup.maxSize, studyGroup.duration) = record
+        studyGroup.members = []
+        return studyGroup
+
+    @property
+    def end(self) -> Optional[datetime]:
+        return self.date + self.duration if self.duration is not None else None
+
+    @property
+    def course(self) -> str:
+        return courseCodes.name(self.courseCode)
+
+    @course.setter
+    def course(self, course: str):
+        self.courseCode = courseCodes.intern(course)
+
+    @property
+    def location(self) -> str:
+        return locationCodes.name(self.locationCode)
+
+    @location.setter
+    def location(self, location: str):
+        self.locationCode = locationCodes.intern(location)
+
+    def addMember(self, user: User, waitlist: bool = False) -> bool:
+        """Add `user` if there is a seat. With waitlist=True a full group queues them instead (still returning
+        False); they are added automatically when removeMember frees a seat."""
         if not self.is_valid:
-            print(f"Error: Cannot add member to invalid group {self.groupName}.")
-            return False
-
-        if any(member.userID == user.userID for member in self.members):
-            print(f"{user.userName} is already a member of the group {self.groupName}.")
+            logger.warning("Cannot add member to invalid group %s.", getattr(self, "groupName", None))
             return False
 
-        if len(self.members) >= self.maxSize:
-            print(f"{self.groupName} is full. Cannot add {user.userName}.")
-            return False
-
-        self.members.append(user)
-        user.addToStudyGroup(self)
+        with self.lock:
+            if any(member.userID == user.userID for member in self.members):
+                logger.info("%s is already a member of the group %s.", user.userName, self.groupName)
+                return False
+
+            if len(self.members) >= self.maxSize:
+                if waitlist:
+                    if user.userID not in self.waitlist:
+                        self.waitlist[user.userID] = user
+                        DatabaseManager().saveWaitlistEntry(self, user)
+                    logger.info("%s is full. %s is number %s on the waitlist.", self.groupName, user.userName,
+                                self.waitlistPosition(user))
+                else:
+                    logger.info("%s is full. Cannot add %s.", self.groupName, user.userName)
+                return False
+
+            self.members.append(user)
+            user.addToStudyGroup(self)
+            DatabaseManager().saveMembership(self, user)
         return True
 
     def removeMember(self, user: User) -> bool:
         if not self.is_valid:
-            print(f"Error: Cannot remove member from an invalid group {self.groupName}.")
+            logger.warning("Cannot remove member from an invalid group %s.", getattr(self, "groupName", None))
             return False
 
-        memberIndex = next((i for i, member in enumerate(self.members) if member.userID == user.userID), None)
+        with self.lock:
+            memberIndex = next((i for i, member in enumerate(self.members) if member.userID == user.userID), None)
 
-        if memberIndex is None:
-            print(f"{user.userName} is not a member of the group {self.groupName}.")
-            return False
+            if memberIndex is None:
+                logger.info("%s is not a member of the group %s.", user.userName, self.groupName)
+                return False
 
-        if len(self.members) == 1:
-            print(f"{self.groupName} will be empty. Cannot remove {user.userName}.")
-            return False
+            if len(self.members) == 1:
+                logger.info("%s will be empty. Cannot remove %s.", self.groupName, user.userName)
+                return False
 
-        print(f"Removing {user.userName} with ID {user.userID} from {self.groupName}.")
-        removed_user = self.members.pop(memberIndex)
-        print(f"Removed user: {removed_user.userName}.")
+            removed_user = self.members.pop(memberIndex)
+            logger.debug("Removed %s with ID %s from %s.", removed_user.userName, removed_user.userID, self.groupName)
 
-        user.removeStudyGroup(self)
+            user.removeStudyGroup(self)
+            DatabaseManager().removeMembership(self, user)
+            self.promoteWaitlisted()
 
         return True
 
+    def promoteWaitlisted(self) -> None:
+        # Caller holds self.lock. Fill free seats from the head of the waitlist.
+        dbManager = DatabaseManager()
+        while self.waitlist and len(self.members) < self.maxSize:
+            _, user = self.waitlist.popitem(last=False)
+            dbManager.removeWaitlistEntry(self, user)
+            self.members.append(user)
+            user.addToStudyGroup(self)
+            dbManager.saveMembership(self, user)
+            logger.info("%s was promoted from the waitlist of %s.", user.userName, self.groupName)
+
+    def leaveWaitlist(self, user: User) -> bool:
+        with self.lock:
+            if self.waitlist.pop(user.userID, None) is None:
+                return False
+            DatabaseManager().removeWaitlistEntry(self, user)
+        return True
+
+    def waitlistPosition(self, user: User) -> Optional[int]:
+        """1-based place of `user` in the waitlist, or None if they are not waiting."""
+        with self.lock:
+            if user.userID not in self.waitlist:
+                return None
+            for position, userID in enumerate(self.waitlist, 1):
+                if userID == user.userID:
+                    return position
+
 class Message:
+    __slots__ = ("sender", "recipient", "content", "timestampUs", "group", "seq")
+
     def __init__(self, sender, recipient, content, group=None):
         self.sender = sender
         self.recipient = recipient
         self.content = content
-        self.timestamp = datetime.now()
+        self.timestampUs = toMicros(datetime.now())  # Epoch microseconds, see compact.toMicros
         self.group = group  # Optional - For group messages
+        self.seq: Optional[int] = None  # Assigned by DatabaseManager.saveMessage
+
+    @classmethod
+    def fromRecord(cls, record) -> "Message":
+        message = cls.__new__(cls)
+        message.seq, sender, recipient, group, message.content, message.timestampUs = record
+        # Names decoded by a backend are fresh strings; intern them so loaded messages share one copy per name.
+        message.sender = sys.intern(sender)
+        message.recipient = sys.intern(recipient) if recipient else recipient
+        message.group = sys.intern(group) if group else group
+        return message
+
+    @property
+    def timestamp(self) -> datetime:
+        return fromMicros(self.timestampUs)
+
+    @timestamp.setter
+    def timestamp(self, timestamp: datetime):
+        self.timestampUs = toMicros(timestamp)
 
     def __str__(self):
         if self.group:
@@ -152,24 +315,192 @@ class Message:
 
 class DatabaseManager:
     _instance = None
+    _instanceLock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(DatabaseManager, cls).__new__(cls)
+            with cls._instanceLock:
+                if cls._instance is None:
+                    cls._instance = super(DatabaseManager, cls).__new__(cls)
         return cls._instance
 
     def __init__(self):
-        if not hasattr(self, "initialized"):
-            self.initialized = True
-            self.users: List[User] = []
-            self.studyGroups: List[StudyGroup] = []
+        if hasattr(self, "initialized"):
+            return
+        with self._instanceLock:
+            if hasattr(self, "initialized"):
+                return
+            # Short locks for the unique indexes and the message sequence. Memberships are guarded by
+            # the per-group and per-user locks, so joins to different groups never contend here.
+            self.userLock = threading.RLock()
+            self.groupLock = threading.RLock()
+            self.messageLock = threading.Lock()
+            # Primary-key and unique indexes; the users/studyGroups lists are views over these.
+            self.usersByID: Dict[str, User] = {}
+            self.usersByName: Dict[str, User] = {}
+            self.groupsByID: Dict[str, StudyGroup] = {}
+            self.groupsByName: Dict[str, StudyGroup] = {}
+            # Search indexes, guarded by searchLock (a leaf lock, never held while taking another). Every
+            # posting list holds (date, groupID) pairs kept sorted, so a date range is one bisect in any of them.
+            self.searchLock = threading.Lock()
+            self.groupsByCourse: Dict[int, List[Tuple[datetime, str]]] = {}
+            self.groupsByLocation: Dict[int, List[Tuple[datetime, str]]] = {}
+            self.groupDates: List[Tuple[datetime, str]] = []
+            self.openGroups: Dict[str, StudyGroup] = {}
+            # Scheduled sessions by room (location code) and by member, also guarded by searchLock.
+            self.roomSchedules: Dict[int, IntervalIndex] = {}
+            self.userSchedules: Dict[str, IntervalIndex] = {}
+            # userName -> {"passwordHash", "email"}; see saveUser, login and authenticate.
             self.userCredentials = {}
+            self.passwordHasher = PasswordHasher()
+            self.sessions = SessionCache()
             self.validCourses = [
                 "ECS1100", "CS1200", "CS2305", "CS2336", "CS2340", "CS3162", "CS3341", "CS3354", "CS3377", "ECS2390",
                 "CS4141", "CS4337", "CS4341", "CS4347", "CS4348", "CS4349", "CS4384", "CS4485", "CS4365", "CS4375"
             ]
             self.validLocations = ["SCI", "SLC", "JO", "GR", "Library", "FO", "ECSW", "ECSS", "ECSN", "JSOM"]
-            self.messages: List[Message] = []
+            self.messageListeners: List[Callable[[Message], None]] = []
+            self.groupListeners: List[Callable[[StudyGroup, Optional[User]], None]] = []
+            # Change feed of every save and removal below; subscribe with events.subscribe or events.stream.
+            self.events = EventBus()
+            # Full-text index over message content, built on the first search and kept current by saveMessage.
+            self.messageIndex: Optional[MessageIndex] = None
+            # Unread badges and read cursors, built on first use and kept current by saveMessage and markRead.
+            self.unreadCounts: Optional[UnreadCounts] = None
+            # Both are built by loadMessageView outside messageLock: saves made meanwhile queue up in
+            # viewBacklogs, and messageGeneration moves on whenever the history is replaced under them.
+            self.viewBuildLock = threading.Lock()
+            self.viewBacklogs: Dict[str, List[Message]] = {}
+            self.messageGeneration = 0
+            # Cold archive for messages past the retention window; see useArchive and applyRetention.
+            self.retentionLock = threading.Lock()
+            self.archive: Optional[MessageArchive] = None
+            self.retention: Optional[RetentionPolicy] = None
+            # Whole-inbox results for getMessagesForUser, invalidated per user by saveMessage and membership changes.
+            self.inboxCache: Optional[InboxCache] = InboxCache()
+            self.useStorage(MemoryStorage())
+            self.initialized = True
+
+    def useStorage(self, storage: Storage) -> None:
+        """Switch backends: closes the current one and loads users, groups and memberships from `storage`."""
+        current = getattr(self, "storage", None)
+        if current is not None and current is not storage:
+            current.close()
+        storage.messageFactory = Message.fromRecord
+        self.storage = storage
+        self.users = [User.fromRecord(record) for record in storage.loadUsers()]
+        studyGroups = {record[0]: StudyGroup.fromRecord(record) for record in storage.loadStudyGroups()}
+        # Rows left behind by a user or group deleted before removals cascaded are skipped.
+        for groupID, userID in storage.loadMemberships():
+            studyGroup, user = studyGroups.get(groupID), self.usersByID.get(userID)
+            if studyGroup is None or user is None:
+                logger.warning("Skipping membership of unknown user %s or group %s.", userID, groupID)
+                continue
+            studyGroup.members.append(user)
+            user.groups.append(studyGroup)
+        for groupID, userID in storage.loadWaitlists():
+            if groupID not in studyGroups or userID not in self.usersByID:
+                logger.warning("Skipping waitlist entry of unknown user %s or group %s.", userID, groupID)
+                continue
+            studyGroups[groupID].waitlist[userID] = self.usersByID[userID]
+        self.studyGroups = list(studyGroups.values())
+        # Rows written before passwords were hashed hold plaintext; login upgrades them on first use.
+        self.userCredentials = {
+            user.userName: {"passwordHash": user.password, "email": user.email} for user in self.usersByID.values()
+        }
+        self.sessions.clear()
+        self.messageSeq = count(storage.lastMessageSeq() + 1)
+        self.lastTimestampUs = 0
+        with self.messageLock:
+            self.messageIndex = None
+            self.unreadCounts = None
+            self.messageGeneration += 1
+        self.archive, self.retention = None, None
+        self.clearInboxCache()
+
+    def flush(self) -> None:
+        self.storage.flush()
+
+    def useArchive(self, archive: Optional[MessageArchive], retention: Optional[RetentionPolicy] = None) -> None:
+        """Attach the cold archive that belongs with the current backend (call after useStorage).
+
+        Reads merge archived messages back in transparently; applyRetention moves messages older than
+        `retention` allows out of the backend and into the archive.
+        """
+        with self.messageLock:
+            if archive is not None:
+                archive.messageFactory = Message.fromRecord
+                # Seqs must keep rising even if every stored message has been archived.
+                self.messageSeq = count(max(next(self.messageSeq), archive.lastSeq + 1))
+            self.archive, self.retention = archive, retention
+        self.clearInboxCache()
+
+    def applyRetention(self, now: Optional[datetime] = None) -> int:
+        """Move expired messages to the archive; returns how many moved. Run it periodically, e.g. nightly."""
+        if self.archive is None or self.retention is None:
+            return 0
+        now = now if now is not None else datetime.now()
+        with self.retentionLock:
+            # Only messages older than the shortest window can expire, and new ones are never among them,
+            # so candidates are chosen and archived without blocking senders.
+            candidates = self.storage.messagesBefore(toMicros(now - self.retention.shortest()))
+            expired = [message for message in candidates if self.retention.expired(message, now)]
+            if not expired:
+                return 0
+            # Appending skips already archived messages, so a pass that failed before the removal is finished by the next.
+            self.archive.append(expired)
+            with self.messageLock:
+                self.storage.removeMessages(expired)
+                self.messageIndex = None
+                self.messageGeneration += 1
+            self.clearInboxCache()
+        logger.info("Archived %s messages older than the retention window.", len(expired))
+        return len(expired)
+
+    @property
+    def users(self) -> List[User]:
+        return list(self.usersByID.values())
+
+    @users.setter
+    def users(self, users: List[User]):
+        # Assigning a list replaces the whole table, so rebuild both user indexes from it.
+        self.usersByID = {user.userID: user for user in users}
+        self.usersByName = {user.userName: user for user in users}
+
+    @property
+    def messages(self) -> List[Message]:
+        return self.storage.allMessages()
+
+    @messages.setter
+    def messages(self, messages: List[Message]):
+        for message in messages:
+            if message.seq is None:
+                message.seq = next(self.messageSeq)
+        with self.messageLock:
+            self.storage.replaceMessages(messages)
+            self.messageIndex = None
+            self.unreadCounts = None
+            self.messageGeneration += 1
+        self.clearInboxCache()
+
+    @property
+    def studyGroups(self) -> List[StudyGroup]:
+        return list(self.groupsByID.values())
+
+    @studyGroups.setter
+    def studyGroups(self, studyGroups: List[StudyGroup]):
+        self.groupsByID = {group.groupID: group for group in studyGroups}
+        self.groupsByName = {group.groupName: group for group in studyGroups}
+        with self.searchLock:
+            self.groupsByCourse, self.groupsByLocation, self.groupDates, self.openGroups = {}, {}, [], {}
+            self.roomSchedules, self.userSchedules = {}, {}
+            for group in sorted(studyGroups, key=lambda group: (group.date, group.groupID)):
+                entry = (group.date, group.groupID)
+                self.groupsByCourse.setdefault(group.courseCode, []).append(entry)
+                self.groupsByLocation.setdefault(group.locationCode, []).append(entry)
+                self.groupDates.append(entry)
+                self.indexSeats(group)
+                self.indexSchedule(group)
 
     def getValidCourses(self) -> List[str]:
         return self.validCourses
@@ -178,66 +509,754 @@ class DatabaseManager:
         return self.validLocations
 
     def saveUser(self, user: User) -> bool:
-        if user not in self.users:
-            self.users.append(user)
+        """Add `user`, replacing their plaintext password with a salted hash before it is stored anywhere."""
+        if user.userID in self.usersByID or user.userName in self.usersByName:
+            return False
+        # Hash outside the lock: it is deliberately slow. Only the flag says a password is already hashed, never
+        # its format, so a plaintext password that happens to look like a hash is still hashed.
+        if not user.passwordHashed:
+            user.password = self.passwordHasher.hash(user.password)
+            user.passwordHashed = True
+        with self.userLock:
+            if user.userID in self.usersByID or user.userName in self.usersByName:
+                return False
+            self.usersByID[user.userID] = user
+            self.usersByName[user.userName] = user
+            self.storage.saveUser(user)
             self.userCredentials[user.userName] = {
-                "password": user.password,
+                "passwordHash": user.password,
                 "email": user.email,
             }
-            return True
-        return False
+            self.events.publish(UserSaved(user))
+        return True
+
+    def hashPasswords(self, users: Iterable[User]) -> None:
+        """Hash the passwords of users about to be saved, across a thread pool; saveUser then stores them as they are."""
+        pending = [user for user in users if not user.passwordHashed]
+        if not pending:
+            return
+        hasher = self.passwordHasher
+        # hashlib's KDFs release the GIL, so the threads hash on every core.
+        with ThreadPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as pool:
+            for user, hashed in zip(pending, pool.map(lambda user: hasher.hash(user.password), pending)):
+                user.password, user.passwordHashed = hashed, True
+
+    def removeUser(self, user: User) -> bool:
+        """Delete a user with their memberships and waitlist places; seats they free go to the waitlists."""
+        with self.userLock:
+            if self.usersByID.get(user.userID) is not user:
+                return False
+            del self.usersByID[user.userID]
+            del self.usersByName[user.userName]
+            self.userCredentials.pop(user.userName, None)
+        # One transaction, so no stored membership or waitlist row is left pointing at a missing user.
+        with self.storage.transaction():
+            for studyGroup in list(user.groups):
+                with studyGroup.lock:
+                    if user in studyGroup.members:
+                        studyGroup.members.remove(user)
+                        user.removeStudyGroup(studyGroup)
+                        self.removeMembership(studyGroup, user)
+                        studyGroup.promoteWaitlisted()
+            for studyGroup in list(self.groupsByID.values()):
+                if user.userID in studyGroup.waitlist:
+                    studyGroup.leaveWaitlist(user)
+            self.storage.removeUser(user)
+        self.events.publish(UserRemoved(user))
+        self.sessions.revokeUser(user.userName)
+        self.invalidateInboxes([user.userName])
+        return True
+
+    def usePasswordHasher(self, hasher: PasswordHasher) -> None:
+        """Hash new passwords with `hasher`, e.g. at a different cost. Existing hashes still verify and are upgraded on login."""
+        self.passwordHasher = hasher
+
+    def login(self, userName: str, password: str) -> Optional[str]:
+        """Verify a password and open a session; returns its token, or None. Only this step pays the KDF cost."""
+        hasher = self.passwordHasher
+        credentials = self.userCredentials.get(userName)
+        if credentials is None:
+            hasher.verifyUnknown(password)
+            logger.info("Failed login for unknown user %s.", userName)
+            return None
+        if not hasher.verify(password, credentials["passwordHash"]):
+            logger.info("Failed login for %s.", userName)
+            return None
+        user = self.usersByName.get(userName)
+        if user is not None and hasher.needsRehash(credentials["passwordHash"]):
+            upgraded = hasher.hash(password)
+            with self.userLock:
+                user.password = upgraded
+                credentials["passwordHash"] = upgraded
+                self.storage.updatePassword(user)
+            logger.info("Upgraded the password hash for %s.", userName)
+        return self.sessions.issue(userName)
+
+    def authenticate(self, token: str) -> Optional[User]:
+        """The user a live session token belongs to, or None; a dict lookup, with no KDF involved."""
+        userName = self.sessions.verify(token)
+        return self.usersByName.get(userName) if userName is not None else None
+
+    def logout(self, token: str) -> bool:
+        return self.sessions.revoke(token)
+
+    def getUser(self, userID: str) -> Optional[User]:
+        return self.usersByID.get(userID)
+
+    def getUserByName(self, userName: str) -> Optional[User]:
+        return self.usersByName.get(userName)
 
     def saveStudyGroup(self, studyGroup: StudyGroup) -> bool:
-        if studyGroup not in self.studyGroups:
-            self.studyGroups.append(studyGroup)
-            return True
-        return False
+        with self.groupLock:
+            if studyGroup.groupID in self.groupsByID or studyGroup.groupName in self.groupsByName:
+                return False
+            if studyGroup.duration is not None and self.findRoomConflicts(studyGroup.location, studyGroup.date, studyGroup.end):
+                return False
+            with studyGroup.lock:
+                self.groupsByID[studyGroup.groupID] = studyGroup
+                self.groupsByName[studyGroup.groupName] = studyGroup
+                self.storage.saveStudyGroup(studyGroup)
+                with self.searchLock:
+                    self.indexGroup(studyGroup)
+                # Members added before the save (e.g. by importRoster) now see the group log, which a reused name may have filled.
+                self.invalidateInboxes(member.userName for member in studyGroup.members)
+                self.events.publish(StudyGroupSaved(studyGroup))
+        self.notifyGroupChanged(studyGroup)
+        return True
+
+    def removeStudyGroup(self, studyGroup: StudyGroup) -> bool:
+        with self.groupLock:
+            if self.groupsByID.get(studyGroup.groupID) is not studyGroup:
+                return False
+            with studyGroup.lock:
+                del self.groupsByID[studyGroup.groupID]
+                del self.groupsByName[studyGroup.groupName]
+                for member in list(studyGroup.members):
+                    member.removeStudyGroup(studyGroup)
+                self.storage.removeStudyGroup(studyGroup)
+                with self.searchLock:
+                    self.unindexGroup(studyGroup)
+                self.invalidateInboxes(member.userName for member in studyGroup.members)
+                self.events.publish(StudyGroupRemoved(studyGroup))
+        self.notifyGroupChanged(studyGroup)
+        return True
 
     def getStudyGroup(self, groupID: str) -> Optional[StudyGroup]:
-        return next((group for group in self.studyGroups if group.groupID == groupID), None)
+        return self.groupsByID.get(groupID)
+
+    def getStudyGroupByName(self, groupName: str) -> Optional[StudyGroup]:
+        return self.groupsByName.get(groupName)
+
+    def saveMembership(self, studyGroup: StudyGroup, user: User) -> None:
+        # Members added before the group is saved are persisted by saveStudyGroup.
+        if self.groupsByID.get(studyGroup.groupID) is studyGroup:
+            self.storage.saveMembership(studyGroup, user)
+            with self.searchLock:
+                self.indexSeats(studyGroup)
+                if studyGroup.duration is not None:
+                    self.userSchedules.setdefault(user.userID, IntervalIndex()).add(studyGroup.groupID, studyGroup.date, studyGroup.end)
+            self.invalidateInboxes([user.userName])
+            self.events.publish(MemberAdded(studyGroup, user))
+            self.notifyGroupChanged(studyGroup, user)
+
+    def removeMembership(self, studyGroup: StudyGroup, user: User) -> None:
+        if self.groupsByID.get(studyGroup.groupID) is studyGroup:
+            self.storage.removeMembership(studyGroup, user)
+            with self.searchLock:
+                self.indexSeats(studyGroup)
+                if user.userID in self.userSchedules:
+                    self.userSchedules[user.userID].remove(studyGroup.groupID, studyGroup.date)
+            self.invalidateInboxes([user.userName])
+            self.events.publish(MemberRemoved(studyGroup, user))
+            self.notifyGroupChanged(studyGroup, user)
+
+    def postingLists(self, studyGroup: StudyGroup) -> List[List[Tuple[datetime, str]]]:
+        return [self.groupsByCourse.setdefault(studyGroup.courseCode, []),
+                self.groupsByLocation.setdefault(studyGroup.locationCode, []), self.groupDates]
+
+    def saveWaitlistEntry(self, studyGroup: StudyGroup, user: User) -> None:
+        if self.groupsByID.get(studyGroup.groupID) is studyGroup:
+            self.storage.saveWaitlistEntry(studyGroup, user)
+
+    def removeWaitlistEntry(self, studyGroup: StudyGroup, user: User) -> None:
+        if self.groupsByID.get(studyGroup.groupID) is studyGroup:
+            self.storage.removeWaitlistEntry(studyGroup, user)
+
+    def indexGroup(self, studyGroup: StudyGroup) -> None:
+        for entries in self.postingLists(studyGroup):
+            insort(entries, (studyGroup.date, studyGroup.groupID))
+        self.indexSeats(studyGroup)
+        self.indexSchedule(studyGroup)
+
+    def unindexGroup(self, studyGroup: StudyGroup) -> None:
+        entry = (studyGroup.date, studyGroup.groupID)
+        for entries in self.postingLists(studyGroup):
+            i = bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+        self.openGroups.pop(studyGroup.groupID, None)
+        if studyGroup.duration is not None:
+            self.roomSchedules[studyGroup.locationCode].remove(studyGroup.groupID, studyGroup.date)
+            for member in studyGroup.members:
+                if member.userID in self.userSchedules:
+                    self.userSchedules[member.userID].remove(studyGroup.groupID, studyGroup.date)
+
+    def indexSchedule(self, studyGroup: StudyGroup) -> None:
+        if studyGroup.duration is None:
+            return
+        self.roomSchedules.setdefault(studyGroup.locationCode, IntervalIndex()).add(studyGroup.groupID, studyGroup.date, studyGroup.end)
+        for member in studyGroup.members:
+            self.userSchedules.setdefault(member.userID, IntervalIndex()).add(studyGroup.groupID, studyGroup.date, studyGroup.end)
+
+    def indexSeats(self, studyGroup: StudyGroup) -> None:
+        if len(studyGroup.members) < studyGroup.maxSize:
+            self.openGroups[studyGroup.groupID] = studyGroup
+        else:
+            self.openGroups.pop(studyGroup.groupID, None)
+
+    def findRoomConflicts(self, location: str, start: datetime, end: datetime) -> List[StudyGroup]:
+        """Scheduled groups booked into `location` at some point of [start, end)."""
+        locationCode = locationCodes.codes.get(location.strip())
+        with self.searchLock:
+            schedule = self.roomSchedules.get(locationCode)
+            groupIDs = schedule.overlapping(start, end) if schedule is not None else []
+            return [self.groupsByID[groupID] for groupID in groupIDs]
+
+    def describeRoomConflict(self, location: str, start: datetime, end: datetime) -> Optional[str]:
+        conflicts = self.findRoomConflicts(location, start, end)
+        if not conflicts:
+            return None
+        booked = conflicts[0]
+        return (f"Room {location.strip()} is booked by '{booked.groupName}' from {booked.date:%Y-%m-%d %H:%M} "
+                f"to {booked.end:%Y-%m-%d %H:%M}.")
+
+    def findTimeClashes(self, user: User, studyGroup: StudyGroup) -> List[StudyGroup]:
+        """The user's scheduled groups, other than `studyGroup`, that overlap its session."""
+        if studyGroup.duration is None:
+            return []
+        with self.searchLock:
+            schedule = self.userSchedules.get(user.userID)
+            groupIDs = schedule.overlapping(studyGroup.date, studyGroup.end) if schedule is not None else []
+            return [self.groupsByID[groupID] for groupID in groupIDs if groupID != studyGroup.groupID]
+
+    def searchStudyGroups(self, course: Optional[str] = None, location: Optional[str] = None,
+                          since: Optional[datetime] = None, before: Optional[datetime] = None,
+                          minOpenSeats: int = 0, limit: Optional[int] = None) -> List[StudyGroup]:
+        """Groups matching every given filter, soonest first. Dates are in [since, before).
+
+        Candidates are the date range bisected out of whichever posting list (course, location or all
+        groups) is shortest there, or the open groups if fewer still; the remaining filters are checked
+        on those candidates only.
+        """
+        courseCode = courseCodes.codes.get(course.strip()) if course is not None else None
+        locationCode = locationCodes.codes.get(location.strip()) if location is not None else None
+        if (course is not None and courseCode is None) or (location is not None and locationCode is None):
+            return []  # No group has ever used that course or location
+        with self.searchLock:
+            ranges = []
+            for entries in (self.groupsByCourse.get(courseCode, []) if courseCode is not None else None,
+                            self.groupsByLocation.get(locationCode, []) if locationCode is not None else None,
+                            self.groupDates):
+                if entries is not None:
+                    lo = bisect_left(entries, (since,)) if since is not None else 0
+                    hi = bisect_left(entries, (before,)) if before is not None else len(entries)
+                    ranges.append((max(hi - lo, 0), entries, lo, hi))
+            size, entries, lo, hi = min(ranges, key=lambda r: r[0])
+            byDate = minOpenSeats <= 0 or size <= len(self.openGroups)
+            if byDate:
+                candidates = [self.groupsByID[groupID] for _, groupID in entries[lo:hi]]
+            else:
+                candidates = list(self.openGroups.values())
+        matches = [
+            group for group in candidates
+            if (courseCode is None or group.courseCode == courseCode)
+            and (locationCode is None or group.locationCode == locationCode)
+            and (since is None or group.date >= since)
+            and (before is None or group.date < before)
+            and group.maxSize - len(group.members) >= minOpenSeats
+        ]
+        if not byDate:
+            matches.sort(key=lambda group: (group.date, group.groupID))
+        return matches[:limit]
 
     def saveMessage(self, sender: User, message: Message) -> bool:
         if not sender or not message:
-            print("Sender and message must be valid.")
+            logger.warning("Sender and message must be valid.")
             return False
         try:
-            self.messages.append(message)
-            print("Message saved.")
-            return True
+            # Seq assignment and append happen together so every log stays sorted by seq.
+            with self.messageLock:
+                self.stampMessage(message)
+                self.storage.saveMessage(message)
+                self.trackSaved(message)
+                # Published under the lock so MessageSaved events come in message seq order.
+                self.events.publish(MessageSaved(message))
+            self.invalidateInboxes(self.audienceOf(message))
+            logger.debug("Message %s saved.", message.seq)
         except Exception as e:
-            print(f"Error saving message: {e}")
+            logger.error("Error saving message: %s", e)
             return False
+        for listener in self.messageListeners:
+            try:
+                listener(message)
+            except Exception:
+                logger.exception("Message listener failed for message %s.", message.seq)
+        return True
 
-    def getMessagesForUser(self, user: User) -> List[Message]:
-        user_messages = [msg for msg in self.messages if msg.recipient == user.userName]
-        group_messages = [
-            msg for msg in self.messages
-            if msg.group and any(group.groupName == msg.group for group in user.groups)
-        ]
-        return user_messages + group_messages
+    def stampMessage(self, message: Message) -> None:
+        # Caller holds messageLock. The timestamp is taken with the seq, and never steps back even if the clock
+        # does, so timestamps rise with seq as the paging bisects expect.
+        message.seq = next(self.messageSeq)
+        message.timestampUs = self.lastTimestampUs = max(toMicros(datetime.now()), self.lastTimestampUs)
+
+    def trackSaved(self, message: Message) -> None:
+        # Caller holds messageLock. Views still being built get the message once their scan is done.
+        if self.messageIndex is not None:
+            self.messageIndex.add(message)
+        if self.unreadCounts is not None:
+            self.unreadCounts.add(message)
+        for backlog in self.viewBacklogs.values():
+            backlog.append(message)
+
+    def saveMessages(self, sender: User, messages: List[Message]) -> bool:
+        """saveMessage for a batch: consecutive seqs, one storage append and one wake-up for event subscribers."""
+        if not sender or not messages:
+            logger.warning("Sender and messages must be valid.")
+            return False
+        try:
+            with self.messageLock:
+                for message in messages:
+                    self.stampMessage(message)
+                self.storage.saveMessages(messages)
+                for message in messages:
+                    self.trackSaved(message)
+                self.events.publishAll([MessageSaved(message) for message in messages])
+            # Once per group or recipient: a batch to one group would otherwise list its members per message.
+            targets = {(message.group, message.recipient): message for message in messages}
+            audience = set()
+            for message in targets.values():
+                audience.update(self.audienceOf(message))
+            self.invalidateInboxes(audience)
+            logger.debug("Messages %s to %s saved.", messages[0].seq, messages[-1].seq)
+        except Exception as e:
+            logger.error("Error saving messages: %s", e)
+            return False
+        for message in messages:
+            for listener in self.messageListeners:
+                try:
+                    listener(message)
+                except Exception:
+                    logger.exception("Message listener failed for message %s.", message.seq)
+        return True
+
+    def addMessageListener(self, listener: Callable[[Message], None]) -> None:
+        """Call `listener` with every message after it is saved, on the saving thread."""
+        self.messageListeners.append(listener)
+
+    def removeMessageListener(self, listener: Callable[[Message], None]) -> None:
+        if listener in self.messageListeners:
+            self.messageListeners.remove(listener)
+
+    def addGroupListener(self, listener: Callable[[StudyGroup, Optional[User]], None]) -> None:
+        """Call `listener(studyGroup, user)` when a group is saved or removed (user is None) or a member joins or leaves.
+
+        Membership changes are reported while the group's lock is held, so listeners must be quick and must
+        not call back into DatabaseManager.
+        """
+        self.groupListeners.append(listener)
+
+    def removeGroupListener(self, listener: Callable[[StudyGroup, Optional[User]], None]) -> None:
+        if listener in self.groupListeners:
+            self.groupListeners.remove(listener)
+
+    def notifyGroupChanged(self, studyGroup: StudyGroup, user: Optional[User] = None) -> None:
+        for listener in self.groupListeners:
+            try:
+                listener(studyGroup, user)
+            except Exception:
+                logger.exception("Group listener failed for group %s.", studyGroup.groupName)
+
+    def useInboxCache(self, cache: Optional[InboxCache]) -> None:
+        """Replace the inbox cache, e.g. InboxCache(maxBytes=...) for a different memory budget; None disables it."""
+        self.inboxCache = cache
+
+    def clearInboxCache(self) -> None:
+        cache = self.inboxCache
+        if cache is not None:
+            cache.clear()
+
+    def invalidateInboxes(self, userNames: Iterable[str]) -> None:
+        cache = self.inboxCache
+        if cache is not None:
+            cache.invalidate(userNames)
+
+    def audienceOf(self, message: Message) -> List[str]:
+        # Whose inbox a message lands in: the recipient of a direct message, every member of a group's.
+        if not message.group:
+            return [message.recipient]
+        studyGroup = self.groupsByName.get(message.group)
+        return [member.userName for member in list(studyGroup.members)] if studyGroup is not None else []
+
+    def getMessagesForUser(self, user: User) -> Tuple[Message, ...]:
+        """The user's whole history, oldest first, as a tuple: cached inboxes are shared by every reader, read-only."""
+        cache = self.inboxCache
+        if cache is None:
+            return tuple(self.loadMessagesForUser(user))
+        messages, stamp = cache.get(user.userName)
+        if messages is None:
+            messages = tuple(self.loadMessagesForUser(user))
+            cache.put(user.userName, stamp, messages)
+        return messages
+
+    def loadMessagesForUser(self, user: User) -> List[Message]:
+        # Merge the user's direct log with the logs of their groups, oldest first.
+        groupNames = user.groupNames()
+        messages = self.storage.messagesFor(user.userName, groupNames)
+        archive = self.archive
+        if archive is not None and len(archive):
+            archived = archive.messagesFor(user.userName, groupNames)
+            if archived:
+                messages = list(heapq.merge(archived, messages, key=bySeq))
+        return messages
+
+    def iterMessagesForUser(self, user: User, since: Optional[datetime] = None, before: Optional[datetime] = None,
+                            limit: Optional[int] = None, cursor: Optional[str] = None) -> Iterator[Message]:
+        groupNames = user.groupNames()
+        hot = self.storage.iterMessagesFor(user.userName, groupNames, since=since, before=before, limit=limit, cursor=cursor)
+        archive = self.archive
+        if archive is None or not len(archive):
+            return hot
+        beforeSeq = decodeCursor(cursor) if cursor is not None else None
+        return islice(archive.withArchived(hot, user.userName, groupNames, since, before, beforeSeq), limit)
+
+    def searchMessages(self, user: User, query: str, limit: Optional[int] = 20) -> List[Message]:
+        """Messages visible to `user` matching `query` (words, "quoted phrases", prefix*), newest first."""
+        index = self.messageIndex
+        if index is None:
+            index = self.loadMessageView("messageIndex", MessageIndex)
+        # Hits archived since the index was taken are gone from storage and drop out here.
+        return self.storage.messagesBySeq(index.search(user.userName, user.groupNames(), query, limit))
+
+    def loadMessageView(self, attribute: str, create: Callable[[], Union[MessageIndex, UnreadCounts]],
+                        finish: Optional[Callable] = None) -> Union[MessageIndex, UnreadCounts]:
+        """Build the view of message history kept in `attribute` (messageIndex or unreadCounts) and install it.
+
+        The history is scanned without holding messageLock, so senders carry on meanwhile. Their messages
+        wait in a backlog that is replayed under the lock just before the swap; a build overtaken by
+        retention or a storage switch starts again.
+        """
+        with self.viewBuildLock:
+            while True:
+                with self.messageLock:
+                    view = getattr(self, attribute)
+                    if view is not None:
+                        return view
+                    generation = self.messageGeneration
+                    backlog = self.viewBacklogs[attribute] = []
+                view, lastSeq = create(), 0
+                try:
+                    for message in self.storage.allMessages():
+                        view.add(message)
+                        lastSeq = message.seq
+                    if finish is not None:
+                        finish(view)
+                except BaseException:
+                    with self.messageLock:
+                        del self.viewBacklogs[attribute]
+                    raise
+                with self.messageLock:
+                    del self.viewBacklogs[attribute]
+                    if generation != self.messageGeneration:
+                        continue
+                    # The scan may already have reached some of them; history is in seq order.
+                    for message in backlog:
+                        if message.seq > lastSeq:
+                            view.add(message)
+                    setattr(self, attribute, view)
+                    return view
+
+    def markRead(self, user: User, conversation: Union[User, StudyGroup], upTo: Optional[Message] = None) -> bool:
+        """Mark a group, or the direct conversation with another user, read up to `upTo` (default: its latest message)."""
+        if isinstance(conversation, StudyGroup):
+            if user not in conversation.members:
+                logger.warning("%s is not a member of %s.", user.userName, conversation.groupName)
+                return False
+            key = "#" + conversation.groupName
+        else:
+            key = "@" + conversation.userName
+        seq = self.loadUnreadCounts().markRead(user.userName, key, upTo.seq if upTo is not None else None)
+        self.storage.saveReadCursor(user.userName, key, seq)
+        return True
+
+    def getUnreadCounts(self, user: User) -> Dict[str, Dict[str, int]]:
+        """Unread messages per direct partner and per group of the user's, e.g. {"direct": {"bob": 2}, "groups": {...}}."""
+        return self.loadUnreadCounts().counts(user.userName, user.groupNames())
+
+    def loadUnreadCounts(self) -> UnreadCounts:
+        counts = self.unreadCounts
+        if counts is None:
+            counts = self.loadMessageView("unreadCounts", UnreadCounts, self.applyReadCursors)
+        return counts
+
+    def applyReadCursors(self, counts: UnreadCounts) -> None:
+        # Stored cursors never point past the history being scanned, so they can go in before the backlog.
+        for userName, conversation, seq in self.storage.loadReadCursors():
+            counts.markRead(userName, conversation, seq)
+
+    def importRoster(self, users: Iterable[dict] = (), groups: Iterable[dict] = (), memberships: Iterable[dict] = (),
+                     strict: bool = False) -> "RosterReport":
+        """Validate a whole roster in one pass, then insert every valid row in a single storage transaction.
+
+        User rows need name/password/email, group rows groupName/course/location/date/maxSize/creator
+        (a userName, added as the first member) plus an optional duration in minutes, and membership rows
+        groupName/userName. Invalid rows, including sessions whose room is already booked, are
+        skipped and listed in the report; with strict=True nothing is inserted unless every row is valid.
+        """
+        report = RosterReport()
+        validCourses = frozenset(self.validCourses)
+        validLocations = frozenset(self.validLocations)
+
+        newUsers: Dict[str, User] = {}
+        userLines: Dict[str, int] = {}
+        for line, row in enumerate(users, 1):
+            name = row.get("name")
+            if name in self.usersByName or name in newUsers:
+                report.error("users", line, f"Username '{name}' already exists.")
+                continue
+            try:
+                newUsers[name] = User(name, row.get("password"), row.get("email"))
+                userLines[name] = line
+            except ValueError as e:
+                report.error("users", line, str(e))
+
+        def findUser(userName):
+            return newUsers.get(userName) or self.usersByName.get(userName)
+
+        newGroups: Dict[str, StudyGroup] = {}
+        groupLines: Dict[str, int] = {}
+        newBookings: Dict[str, IntervalIndex] = {}
+        seats: Dict[str, int] = {}
+        for line, row in enumerate(groups, 1):
+            groupName, course, location = row.get("groupName"), row.get("course"), row.get("location")
+            if not groupName or not str(groupName).strip():
+                report.error("groups", line, "Group name cannot be empty.")
+            elif groupName in self.groupsByName or groupName in newGroups:
+                report.error("groups", line, f"Group name '{groupName}' already exists.")
+            elif not course or course.strip() not in validCourses:
+                report.error("groups", line, f"Invalid course: {course}.")
+            elif not location or location.strip() not in validLocations:
+                report.error("groups", line, f"Invalid location: {location}.")
+            elif findUser(row.get("creator")) is None:
+                report.error("groups", line, f"Unknown creator: {row.get('creator')}.")
+            else:
+                try:
+                    date = row["date"] if isinstance(row.get("date"), datetime) else datetime.fromisoformat(row.get("date"))
+                    maxSize = int(row.get("maxSize"))
+                    duration = timedelta(minutes=int(row["duration"])) if row.get("duration") else None
+                except (TypeError, ValueError):
+                    report.error("groups", line, "Invalid date, max size or duration.")
+                    continue
+                if maxSize <= 0:
+                    report.error("groups", line, "Invalid max size. The size of the group must be greater than 0.")
+                    continue
+                if duration is not None:
+                    if duration <= timedelta(0):
+                        report.error("groups", line, "Invalid duration. A session must last longer than zero.")
+                        continue
+                    conflict = self.describeRoomConflict(location, date, date + duration)
+                    bookings = newBookings.setdefault(location.strip(), IntervalIndex())
+                    clashing = bookings.overlapping(date, date + duration)
+                    if conflict is None and clashing:
+                        conflict = f"Room {location.strip()} is booked by '{clashing[0]}' in this roster."
+                    if conflict is not None:
+                        report.error("groups", line, conflict)
+                        continue
+                    bookings.add(groupName, date, date + duration)
+                studyGroup = StudyGroup.fromRecord((str(uuid4()), groupName, course.strip(), location.strip(), date, maxSize, duration))
+                studyGroup.members.append(findUser(row.get("creator")))
+                newGroups[groupName] = studyGroup
+                groupLines[groupName] = line
+                seats[groupName] = maxSize - 1
+
+        newMemberships: List[Tuple[StudyGroup, User, int]] = []
+        memberNames: Dict[str, set] = {}
+        for line, row in enumerate(memberships, 1):
+            groupName, userName = row.get("groupName"), row.get("userName")
+            studyGroup = newGroups.get(groupName) or self.groupsByName.get(groupName)
+            user = findUser(userName)
+            if studyGroup is None:
+                report.error("memberships", line, f"Unknown group: {groupName}.")
+                continue
+            if user is None:
+                report.error("memberships", line, f"Unknown user: {userName}.")
+                continue
+            if groupName not in memberNames:
+                memberNames[groupName] = {member.userName for member in studyGroup.members}
+                seats.setdefault(groupName, studyGroup.maxSize - len(studyGroup.members))
+            if userName in memberNames[groupName]:
+                report.error("memberships", line, f"{userName} is already a member of the group {groupName}.")
+                continue
+            if seats[groupName] <= 0:
+                report.error("memberships", line, f"{groupName} is full. Cannot add {userName}.")
+                continue
+            seats[groupName] -= 1
+            memberNames[groupName].add(userName)
+            newMemberships.append((studyGroup, user, line))
+
+        if strict and report.errors:
+            return report
+
+        # Hashed before the transaction opens, so the backend's write lock is never held while the KDF runs.
+        self.hashPasswords(newUsers.values())
+        # Other writers may have taken a name, a room or a seat since validation. Rows that lose such a race
+        # are reported like invalid ones, and only rows that were saved are counted.
+        joined: List[Tuple[StudyGroup, User]] = []
+        try:
+            with self.storage.transaction():
+                lost = set()
+                for name, user in newUsers.items():
+                    if self.saveUser(user):
+                        report.users += 1
+                    else:
+                        lost.add(user)
+                        report.error("users", userLines[name], f"Username '{name}' already exists.")
+                existingMemberships = []
+                for studyGroup, user, line in newMemberships:
+                    if user in lost:
+                        report.error("memberships", line, f"Unknown user: {user.userName}.")
+                    elif studyGroup.groupName in newGroups:
+                        studyGroup.members.append(user)
+                    else:
+                        existingMemberships.append((studyGroup, user, line))
+                for groupName, studyGroup in newGroups.items():
+                    if studyGroup.members[0] in lost:
+                        report.error("groups", groupLines[groupName], f"Unknown creator: {studyGroup.members[0].userName}.")
+                        continue
+                    for member in studyGroup.members:
+                        member.groups.append(studyGroup)
+                    if not self.saveStudyGroup(studyGroup):
+                        for member in studyGroup.members:
+                            member.removeStudyGroup(studyGroup)
+                        report.error("groups", groupLines[groupName],
+                                     f"Group '{groupName}' could not be saved: its name or room was taken.")
+                        continue
+                    report.groups += 1
+                    report.memberships += len(studyGroup.members) - 1
+                for studyGroup, user, line in existingMemberships:
+                    with studyGroup.lock, user.lock:
+                        if self.groupsByID.get(studyGroup.groupID) is not studyGroup:
+                            report.error("memberships", line, f"Unknown group: {studyGroup.groupName}.")
+                        elif user in studyGroup.members or len(studyGroup.members) >= studyGroup.maxSize:
+                            report.error("memberships", line, f"{studyGroup.groupName} is full or already has {user.userName}.")
+                        else:
+                            joined.append((studyGroup, user))
+                            studyGroup.members.append(user)
+                            user.groups.append(studyGroup)
+                            self.saveMembership(studyGroup, user)
+                            report.memberships += 1
+        except Exception:
+            self.rollBackImport(list(newUsers.values()), list(newGroups.values()), joined)
+            raise
+        return report
+
+    def rollBackImport(self, users: List[User], groups: List[StudyGroup], joined: List[Tuple[StudyGroup, User]]) -> None:
+        """Undo a failed importRoster in memory, as its storage transaction was undone; events already sent stay sent."""
+        for studyGroup, user in joined:
+            with studyGroup.lock, user.lock:
+                if user in studyGroup.members:
+                    studyGroup.members.remove(user)
+                user.removeStudyGroup(studyGroup)
+            with self.searchLock:
+                self.indexSeats(studyGroup)
+                if user.userID in self.userSchedules:
+                    self.userSchedules[user.userID].remove(studyGroup.groupID, studyGroup.date)
+        with self.groupLock:
+            for studyGroup in groups:
+                for member in list(studyGroup.members):
+                    member.removeStudyGroup(studyGroup)
+                if self.groupsByID.get(studyGroup.groupID) is studyGroup:
+                    del self.groupsByID[studyGroup.groupID]
+                    del self.groupsByName[studyGroup.groupName]
+                    with self.searchLock:
+                        self.unindexGroup(studyGroup)
+        with self.userLock:
+            for user in users:
+                if self.usersByID.get(user.userID) is user:
+                    del self.usersByID[user.userID]
+                    del self.usersByName[user.userName]
+                    self.userCredentials.pop(user.userName, None)
+        self.invalidateInboxes([user.userName for _, user in joined] +
+                               [member.userName for studyGroup in groups for member in studyGroup.members])
+
+
+class RosterReport:
+    def __init__(self):
+        self.users = 0
+        self.groups = 0
+        self.memberships = 0
+        self.errors: List[Tuple[str, int, str]] = []  # (section, row number, message)
+
+    def error(self, section: str, line: int, message: str) -> None:
+        self.errors.append((section, line, message))
+
+    def __str__(self):
+        lines = [f"Imported {self.users} users, {self.groups} groups, {self.memberships} memberships."]
+        lines.extend(f"{section} row {line}: {message}" for section, line, message in self.errors)
+        return "\n".join(lines)
+
+
+def readRoster(path: str) -> List[dict]:
+    """Rows of a .csv (with a header line) or .jsonl roster file."""
+    with open(path, newline="") as file:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in file if line.strip()]
+        return list(csv.DictReader(file))
 
 
 class StudyGroupController:
     def __init__(self, dbManager: DatabaseManager):
         self.dbManager = dbManager
 
-    def createStudyGroup(self, groupName: str, course: str, location: str, date: datetime, maxSize: int, creator: User) -> Optional[StudyGroup]:
-        studyGroup = StudyGroup(groupName, course, location, date, maxSize)
+    def createStudyGroup(self, groupName: str, course: str, location: str, date: datetime, maxSize: int, creator: User,
+                         duration: Optional[timedelta] = None) -> Optional[StudyGroup]:
+        studyGroup = StudyGroup(groupName, course, location, date, maxSize, duration)
         if studyGroup.is_valid:
+            clashes = self.dbManager.findTimeClashes(creator, studyGroup)
             studyGroup.addMember(creator)
-            self.dbManager.saveStudyGroup(studyGroup)
-            print(f"Study group '{groupName}' created successfully.")
+            if not self.dbManager.saveStudyGroup(studyGroup):
+                # Another thread registered the same name or booked the room after our validation ran.
+                creator.removeStudyGroup(studyGroup)
+                studyGroup.is_valid = False
+                if studyGroup.duration is not None and self.dbManager.getStudyGroupByName(groupName) is None:
+                    studyGroup.error = self.dbManager.describeRoomConflict(location, studyGroup.date, studyGroup.end)
+                else:
+                    studyGroup.error = f"Group name '{groupName}' already exists."
+                logger.warning("Failed to create study group '%s': %s", groupName, studyGroup.error)
+                return None
+            self.warnClashes(creator, studyGroup, clashes)
+            logger.info("Study group '%s' created successfully.", groupName)
             return studyGroup
         else:
-            print(f"Failed to create study group '{groupName}'.")
+            logger.warning("Failed to create study group '%s': %s", groupName, studyGroup.error)
             return None
 
-    def joinStudyGroup(self, groupID: str, user: User) -> bool:
+    def searchStudyGroups(self, course: Optional[str] = None, location: Optional[str] = None,
+                          since: Optional[datetime] = None, before: Optional[datetime] = None,
+                          minOpenSeats: int = 0, limit: Optional[int] = None) -> List[StudyGroup]:
+        return self.dbManager.searchStudyGroups(course=course, location=location, since=since, before=before,
+                                                minOpenSeats=minOpenSeats, limit=limit)
+
+    def joinStudyGroup(self, groupID: str, user: User, waitlist: bool = False) -> bool:
+        # waitlist=True queues the user when the group is full, instead of making them retry.
         studyGroup = self.dbManager.getStudyGroup(groupID)
         if studyGroup and studyGroup.is_valid:
-            return studyGroup.addMember(user)
+            clashes = self.dbManager.findTimeClashes(user, studyGroup)
+            if not studyGroup.addMember(user, waitlist=waitlist):
+                return False
+            self.warnClashes(user, studyGroup, clashes)
+            return True
         else:
-            print(f"Study group {groupID} not found or invalid.")
+            logger.warning("Study group %s not found or invalid.", groupID)
             return False
 
     def removeFromStudyGroup(self, groupID: str, user: User) -> bool:
@@ -245,9 +1264,27 @@ class StudyGroupController:
         if studyGroup and studyGroup.is_valid:
             return studyGroup.removeMember(user)
         else:
-            print(f"Study group {groupID} not found or invalid.")
+            logger.warning("Study group %s not found or invalid.", groupID)
             return False
 
+    def leaveWaitlist(self, groupID: str, user: User) -> bool:
+        studyGroup = self.dbManager.getStudyGroup(groupID)
+        return studyGroup.leaveWaitlist(user) if studyGroup else False
+
+    def getWaitlistPosition(self, groupID: str, user: User) -> Optional[int]:
+        studyGroup = self.dbManager.getStudyGroup(groupID)
+        return studyGroup.waitlistPosition(user) if studyGroup else None
+
+    def getTimeClashes(self, groupID: str, user: User) -> List[StudyGroup]:
+        """Groups of `user` whose sessions overlap the given group's; joining is allowed but flagged."""
+        studyGroup = self.dbManager.getStudyGroup(groupID)
+        return self.dbManager.findTimeClashes(user, studyGroup) if studyGroup else []
+
+    def warnClashes(self, user: User, studyGroup: StudyGroup, clashes: List[StudyGroup]) -> None:
+        if clashes:
+            logger.warning("%s joined %s, which clashes with %s.", user.userName, studyGroup.groupName,
+                           ", ".join(group.groupName for group in clashes))
+
 
 class MessageController:
     def __init__(self, dbManager: DatabaseManager):
@@ -255,41 +1292,154 @@ class MessageController:
 
     def sendMessage(self, sender: User, recipient: User, content: str) -> bool:
         if not sender or not recipient or not content.strip():
-            print("Error: Sender, recipient, and message content must be valid.")
+            logger.warning("Sender, recipient, and message content must be valid.")
             return False
         message = Message(sender.userName, recipient.userName, content)
         return self.dbManager.saveMessage(sender, message)
 
-    def getMessage(self, recipient: User) -> List[Message]:
+    def getMessage(self, recipient: User) -> Tuple[Message, ...]:
         return self.dbManager.getMessagesForUser(recipient)
     # return [message for message in self.dbManager.messages if message.recipient == recipient.userName]
 
+    def getMessagePage(self, recipient: User, since: Optional[datetime] = None, before: Optional[datetime] = None,
+                       limit: Optional[int] = 50, cursor: Optional[str] = None) -> Iterator[Message]:
+        # Streams newest first; pass getMessageCursor(lastMessage) as `cursor` to fetch the next older page.
+        return self.dbManager.iterMessagesForUser(recipient, since=since, before=before, limit=limit, cursor=cursor)
+
+    def getMessageCursor(self, message: Message) -> str:
+        return encodeCursor(message)
+
+    def searchMessages(self, user: User, query: str, limit: Optional[int] = 20) -> List[Message]:
+        return self.dbManager.searchMessages(user, query, limit=limit)
+
+    def broadcastGroupMessage(self, sender: User, groups: Iterable[StudyGroup], content: str) -> Dict[str, bool]:
+        """Send `content` to each of `groups`, saved as one batch; whether it went to each, by groupID."""
+        groups = list(groups)
+        if not sender or not content.strip():
+            logger.warning("Sender and message content must be valid.")
+            return {group.groupID: False for group in groups}
+        # One pass over the sender's groups, then a set lookup per target instead of a scan of its members.
+        with sender.lock:
+            memberOf = {group.groupID for group in sender.groups}
+        status: Dict[str, bool] = {}
+        messages = []
+        for group in groups:
+            if group.groupID in status:
+                continue
+            status[group.groupID] = group.groupID in memberOf
+            if status[group.groupID]:
+                messages.append(Message(sender.userName, None, content, group=group.groupName))
+        skipped = len(status) - len(messages)
+        if skipped:
+            logger.warning("%s is not a member of %s of the groups; not sent there.", sender.userName, skipped)
+        if messages and not self.dbManager.saveMessages(sender, messages):
+            logger.error("Failed to save broadcast from %s.", sender.userName)
+            return dict.fromkeys(status, False)
+        return status
+
+    def sendMessages(self, sender: User, conversation: Union[User, StudyGroup], contents: Iterable[str]) -> List[bool]:
+        """Send several messages, in order, to a group or another user as one batch; whether each was sent."""
+        contents = list(contents)
+        if not sender or not conversation:
+            logger.warning("Sender and conversation must be valid.")
+            return [False] * len(contents)
+        if isinstance(conversation, StudyGroup):
+            with sender.lock:
+                isMember = any(group.groupID == conversation.groupID for group in sender.groups)
+            if not isMember:
+                logger.warning("Sender must be a member of the group.")
+                return [False] * len(contents)
+            recipient, groupName = None, conversation.groupName
+        else:
+            recipient, groupName = conversation.userName, None
+        status = [bool(content.strip()) for content in contents]
+        messages = [Message(sender.userName, recipient, content, group=groupName)
+                    for content, valid in zip(contents, status) if valid]
+        if len(messages) < len(contents):
+            logger.warning("Skipped %s empty messages.", len(contents) - len(messages))
+        if messages and not self.dbManager.saveMessages(sender, messages):
+            logger.error("Failed to save messages from %s.", sender.userName)
+            return [False] * len(contents)
+        return status
+
+    def markRead(self, user: User, conversation: Union[User, StudyGroup], upTo: Optional[Message] = None) -> bool:
+        if not user or not conversation:
+            logger.warning("User and conversation must be valid.")
+            return False
+        return self.dbManager.markRead(user, conversation, upTo=upTo)
+
+    def getUnreadCounts(self, user: User) -> Dict[str, Dict[str, int]]:
+        return self.dbManager.getUnreadCounts(user)
+
     def sendGroupMessage(self, sender: User, group: StudyGroup, content: str) -> bool:
         if sender not in group.members:
-            print("Error: Sender must be a member of the group.")
+            logger.warning("Sender must be a member of the group.")
             return False
         if not content.strip():
-            print("Message content must be valid")
+            logger.warning("Message content must be valid")
             return False
         group_message = Message(sender.userName, None, content, group=group.groupName)
         if self.dbManager.saveMessage(sender, group_message):
-            print(f"Group message sent to '{group.groupName}' by {sender.userName}.")
+            logger.debug("Group message sent to '%s' by %s.", group.groupName, sender.userName)
             return True
         else:
-            print("Error: Failed to save group message.")
+            logger.error("Failed to save group message.")
             return False
 
 
+class AuthController:
+    def __init__(self, dbManager: DatabaseManager):
+        self.dbManager = dbManager
+
+    def login(self, userName: str, password: str) -> Optional[str]:
+        if not userName or not password:
+            logger.warning("User name and password must be valid.")
+            return None
+        return self.dbManager.login(userName, password)
+
+    def authenticate(self, token: str) -> Optional[User]:
+        if not token:
+            return None
+        return self.dbManager.authenticate(token)
+
+    def logout(self, token: str) -> bool:
+        return bool(token) and self.dbManager.logout(token)
+
+
 class StudyGroupGUI:
-    def __init__(self, controller: StudyGroupController, messageController: MessageController):
+    def __init__(self, controller: StudyGroupController, messageController: MessageController,
+                 authController: Optional[AuthController] = None):
         self.controller = controller
         self.messageController = messageController
+        self.authController = authController if authController is not None else AuthController(controller.dbManager)
+
+    def login(self, userName: str, password: str) -> Optional[str]:
+        return self.authController.login(userName, password)
+
+    def authenticate(self, token: str) -> Optional[User]:
+        return self.authController.authenticate(token)
+
+    def logout(self, token: str) -> bool:
+        return self.authController.logout(token)
+
+    def createStudyGroup(self, groupName: str, course: str, location: str, date: datetime, maxSize: int, creator: User,
+                         duration: Optional[timedelta] = None) -> Optional[StudyGroup]:
+        return self.controller.createStudyGroup(groupName, course, location, date, maxSize, creator, duration)
+
+    def joinStudyGroup(self, groupID: str, user: User, waitlist: bool = False) -> bool:
+        return self.controller.joinStudyGroup(groupID, user, waitlist=waitlist)
+
+    def leaveWaitlist(self, groupID: str, user: User) -> bool:
+        return self.controller.leaveWaitlist(groupID, user)
 
-    def createStudyGroup(self, groupName: str, course: str, location: str, date: datetime, maxSize: int, creator: User) -> Optional[StudyGroup]:
-        return self.controller.createStudyGroup(groupName, course, location, date, maxSize, creator)
+    def getWaitlistPosition(self, groupID: str, user: User) -> Optional[int]:
+        return self.controller.getWaitlistPosition(groupID, user)
 
-    def joinStudyGroup(self, groupID: str, user: User) -> bool:
-        return self.controller.joinStudyGroup(groupID, user)
+    def searchStudyGroups(self, course: Optional[str] = None, location: Optional[str] = None,
+                          since: Optional[datetime] = None, before: Optional[datetime] = None,
+                          minOpenSeats: int = 0, limit: Optional[int] = None) -> List[StudyGroup]:
+        return self.controller.searchStudyGroups(course=course, location=location, since=since, before=before,
+                                                 minOpenSeats=minOpenSeats, limit=limit)
 
     def sendDirectMessage(self, sender: User, recipient: User, content: str) -> bool:
         return self.messageController.sendMessage(sender, recipient, content)
@@ -297,15 +1447,69 @@ class StudyGroupGUI:
     def sendGroupMessage(self, sender: User, group: StudyGroup, content: str) -> bool:
         return self.messageController.sendGroupMessage(sender, group, content)
 
-    def getMessage(self, recipient: User) -> List[Message]:
+    def getMessage(self, recipient: User) -> Tuple[Message, ...]:
         return self.messageController.getMessage(recipient)
 
+    def getMessagePage(self, recipient: User, since: Optional[datetime] = None, before: Optional[datetime] = None,
+                       limit: Optional[int] = 50, cursor: Optional[str] = None) -> Iterator[Message]:
+        return self.messageController.getMessagePage(recipient, since=since, before=before, limit=limit, cursor=cursor)
+
+    def getMessageCursor(self, message: Message) -> str:
+        return self.messageController.getMessageCursor(message)
+
+    def searchMessages(self, user: User, query: str, limit: Optional[int] = 20) -> List[Message]:
+        return self.messageController.searchMessages(user, query, limit=limit)
+
+    def broadcastGroupMessage(self, sender: User, groups: Iterable[StudyGroup], content: str) -> Dict[str, bool]:
+        return self.messageController.broadcastGroupMessage(sender, groups, content)
+
+    def sendMessages(self, sender: User, conversation: Union[User, StudyGroup], contents: Iterable[str]) -> List[bool]:
+        return self.messageController.sendMessages(sender, conversation, contents)
+
+    def markRead(self, user: User, conversation: Union[User, StudyGroup], upTo: Optional[Message] = None) -> bool:
+        return self.messageController.markRead(user, conversation, upTo=upTo)
+
+    def getUnreadCounts(self, user: User) -> Dict[str, Dict[str, int]]:
+        return self.messageController.getUnreadCounts(user)
+
     def removeFromStudyGroup(self, groupID: str, user: User) -> bool:
         return self.controller.removeFromStudyGroup(groupID, user)
 
+    def getTimeClashes(self, groupID: str, user: User) -> List[StudyGroup]:
+        return self.controller.getTimeClashes(groupID, user)
+
+
+activeMetrics: Optional[Metrics] = None
+
+
+def enableMetrics(port: Optional[int] = None) -> Metrics:
+    """Start counting and timing every controller and DatabaseManager call; with `port`, also serve /metrics there.
+
+    Off by default: until this is called the classes run their original, unwrapped methods.
+    """
+    global activeMetrics
+    if activeMetrics is None:
+        activeMetrics = Metrics()
+        activeMetrics.instrument(StudyGroupController, failsWithNone=("createStudyGroup",))
+        activeMetrics.instrument(MessageController)
+        activeMetrics.instrument(AuthController, failsWithNone=("login", "authenticate"))
+        activeMetrics.instrument(DatabaseManager)
+    if port is not None:
+        activeMetrics.serve(port)
+    return activeMetrics
+
+
+def disableMetrics() -> None:
+    global activeMetrics
+    if activeMetrics is not None:
+        activeMetrics.uninstrument()
+        activeMetrics.stopServing()
+        activeMetrics = None
+
 
 def main():
 
+    configureLogging(logging.DEBUG, queued=False)
     print("\n \n now in main")
     user1 = User("testUser1", "testPassword1", "testUser1@exampleEmail.com")
     user2 = User("testUser2", "testPassword2", "testUser2@exampleEmail.com")
@@ -387,6 +1591,30 @@ def main():
     for msg in dbmngr.messages:
         print(msg)
 
+def importRosterMain(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="main.py import-roster", description="Bulk import users, study groups and memberships.")
+    parser.add_argument("--users", help="CSV/JSONL rows with name, password, email")
+    parser.add_argument("--groups", help="CSV/JSONL rows with groupName, course, location, date, maxSize, creator")
+    parser.add_argument("--memberships", help="CSV/JSONL rows with groupName, userName")
+    parser.add_argument("--db", help="SQLite database file to import into")
+    parser.add_argument("--strict", action="store_true", help="import nothing unless every row is valid")
+    args = parser.parse_args(argv)
+
+    dbmngr = DatabaseManager()
+    if args.db:
+        dbmngr.useStorage(SQLiteStorage(args.db))
+    report = dbmngr.importRoster(
+        users=readRoster(args.users) if args.users else (),
+        groups=readRoster(args.groups) if args.groups else (),
+        memberships=readRoster(args.memberships) if args.memberships else (),
+        strict=args.strict,
+    )
+    dbmngr.flush()
+    print(report)
+    return 1 if report.errors else 0
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["import-roster"]:
+        sys.exit(importRosterMain(sys.argv[2:]))
     main()
 
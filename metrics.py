@@ -0,0 +1,200 @@
+"""Opt-in per-operation counters and latency histograms, with a Prometheus text-format endpoint."""
+import functools
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Histogram upper bounds in seconds; a final +Inf bucket catches the rest.
+BUCKETS = (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class OperationStats:
+    __slots__ = ("count", "errors", "seconds", "buckets")
+
+    def __init__(self, bucketCount: int):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * bucketCount
+
+
+class Metrics:
+    """Counts, error counts and latency histograms per operation name.
+
+    Every thread records into its own shard, so the hot path takes no locks; snapshot() sums the
+    shards and may trail in-flight calls by a few counts. Instrumented classes have their public
+    methods replaced by timing wrappers, and uninstrument() puts the original functions back, so
+    metrics cost nothing at all until they are enabled.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.bounds = tuple(buckets)
+        self.local = threading.local()
+        self.shards: List[Dict[str, OperationStats]] = []
+        self.shardLock = threading.Lock()  # Taken once per thread, by its first record.
+        self.originals: Dict[Tuple[type, str], Callable] = {}
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def shard(self) -> Dict[str, OperationStats]:
+        stats = getattr(self.local, "stats", None)
+        if stats is None:
+            stats = self.local.stats = {}
+            with self.shardLock:
+                self.shards.append(stats)
+        return stats
+
+    def stats(self, name: str) -> OperationStats:
+        """The calling thread's stats for `name`."""
+        shard = self.shard()
+        stats = shard.get(name)
+        if stats is None:
+            stats = shard[name] = OperationStats(len(self.bounds) + 1)
+        return stats
+
+    def record(self, name: str, seconds: float, failed: bool = False) -> None:
+        stats = self.stats(name)
+        stats.count += 1
+        stats.errors += failed
+        stats.seconds += seconds
+        stats.buckets[bisect_left(self.bounds, seconds)] += 1
+
+    def wrap(self, name: str, function: Callable, failsWithNone: bool = False) -> Callable:
+        # A call fails if it raises or returns False (or None, for operations that report failure that way).
+        # Each wrapper caches the calling thread's stats object, so a call costs two clock reads, one
+        # thread-local lookup and a bisect.
+        clock, bounds, slot = time.perf_counter, self.bounds, threading.local()
+
+        @functools.wraps(function)
+        def timedCall(*args, **kwargs):
+            start = clock()
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = result is False or (failsWithNone and result is None)
+                return result
+            finally:
+                elapsed = clock() - start
+                try:
+                    stats = slot.stats
+                except AttributeError:
+                    stats = slot.stats = self.stats(name)
+                stats.count += 1
+                stats.errors += failed
+                stats.seconds += elapsed
+                stats.buckets[bisect_left(bounds, elapsed)] += 1
+
+        return timedCall
+
+    def instrument(self, cls: type, failsWithNone: Iterable[str] = ()) -> None:
+        """Time every public method of `cls` as "<class>.<method>"."""
+        failsWithNone = set(failsWithNone)
+        for name, value in list(vars(cls).items()):
+            if name.startswith("_") or not callable(value) or isinstance(value, (type, staticmethod, classmethod)):
+                continue
+            if (cls, name) in self.originals:
+                continue
+            self.originals[(cls, name)] = value
+            setattr(cls, name, self.wrap(f"{cls.__name__}.{name}", value, name in failsWithNone))
+
+    def uninstrument(self) -> None:
+        for (cls, name), function in self.originals.items():
+            setattr(cls, name, function)
+        self.originals.clear()
+
+    def reset(self) -> None:
+        # Zeroed in place: wrappers keep references to their thread's stats objects.
+        with self.shardLock:
+            shards = list(self.shards)
+        for shard in shards:
+            for stats in list(shard.values()):
+                stats.count, stats.errors, stats.seconds = 0, 0, 0.0
+                stats.buckets[:] = [0] * len(stats.buckets)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """operation -> count, errors, seconds, meanSeconds, p50/p99 (bucket upper bounds) and cumulative buckets."""
+        totals: Dict[str, OperationStats] = {}
+        with self.shardLock:
+            shards = list(self.shards)
+        for shard in shards:
+            for name, stats in list(shard.items()):
+                total = totals.get(name)
+                if total is None:
+                    total = totals[name] = OperationStats(len(self.bounds) + 1)
+                total.count += stats.count
+                total.errors += stats.errors
+                total.seconds += stats.seconds
+                total.buckets = [a + b for a, b in zip(total.buckets, stats.buckets)]
+        return {name: self.summarize(stats) for name, stats in sorted(totals.items())}
+
+    def summarize(self, stats: OperationStats) -> dict:
+        cumulative, running = [], 0
+        for bound, count in zip(self.bounds + (float("inf"),), stats.buckets):
+            running += count
+            cumulative.append((bound, running))
+        return {
+            "count": stats.count,
+            "errors": stats.errors,
+            "seconds": stats.seconds,
+            "meanSeconds": stats.seconds / stats.count if stats.count else 0.0,
+            "p50Seconds": self.quantile(cumulative, stats.count, 0.5),
+            "p99Seconds": self.quantile(cumulative, stats.count, 0.99),
+            "buckets": cumulative,
+        }
+
+    @staticmethod
+    def quantile(cumulative: List[Tuple[float, int]], count: int, fraction: float) -> Optional[float]:
+        if not count:
+            return None
+        for bound, seen in cumulative:
+            if seen >= fraction * count:
+                return bound
+        return cumulative[-1][0]
+
+    def prometheus(self, prefix: str = "classcohort") -> str:
+        """The snapshot in Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [f"# HELP {prefix}_operation_seconds Latency of controller and DatabaseManager operations.",
+                 f"# TYPE {prefix}_operation_seconds histogram"]
+        for name, stats in snapshot.items():
+            for bound, seen in stats["buckets"]:
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{prefix}_operation_seconds_bucket{{operation="{name}",le="{le}"}} {seen}')
+            lines.append(f'{prefix}_operation_seconds_sum{{operation="{name}"}} {stats["seconds"]!r}')
+            lines.append(f'{prefix}_operation_seconds_count{{operation="{name}"}} {stats["count"]}')
+        lines += [f"# HELP {prefix}_operation_errors_total Operations that raised or reported failure.",
+                  f"# TYPE {prefix}_operation_errors_total counter"]
+        lines += [f'{prefix}_operation_errors_total{{operation="{name}"}} {stats["errors"]}' for name, stats in snapshot.items()]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve GET /metrics on a daemon thread; port 0 picks a free port (see server.server_address)."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.stopServing()
+        server = self.server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+    def stopServing(self) -> None:
+        server, self.server = self.server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,273 @@
+"""Study group recommendations: every user x group pair scored with NumPy matrix products.
+
+Needs numpy, which the rest of the package does not; importing this module without it works,
+constructing a RecommendationEngine does not.
+"""
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from compact import courseCodes, locationCodes, toMicros
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+DEFAULT_WEIGHTS = {"course": 1.0, "members": 0.5, "location": 0.3, "time": 0.2, "capacity": 0.1}
+TIME_SLOTS = 8  # three-hour buckets of the day
+
+
+def timeSlot(date: datetime) -> int:
+    return date.hour * TIME_SLOTS // 24
+
+
+class RecommendationEngine:
+    """Top-k study group suggestions for every user.
+
+    A user is described by the course, location and time-of-day mix of the groups they belong to; a
+    group by its course, location and time slot, the course mix of its members and its open capacity.
+    score(user, group) = U[user] . G[group] + capacity weight * open fraction, computed batchSize users
+    at a time. Groups the user is in, full or removed groups and, with upcomingOnly, past sessions are
+    never suggested.
+
+    build() is the nightly batch for the whole cohort. attach() then subscribes to DatabaseManager group
+    changes, and the next recommend() rescores only the changed groups' columns and the changed users'
+    rows. A user's new profile reaches the member mix of their other groups at the next build().
+    """
+
+    def __init__(self, dbManager, k: int = 10, weights: Optional[Dict[str, float]] = None, batchSize: int = 1024,
+                 upcomingOnly: bool = True):
+        if np is None:
+            raise ImportError("RecommendationEngine requires numpy")
+        self.dbManager = dbManager
+        self.k = k
+        self.depth = 2 * k  # Spare candidates, so entries that went stale since scoring can be skipped
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.batchSize = batchSize
+        self.upcomingOnly = upcomingOnly
+        self.lock = threading.Lock()  # Guards the matrices below
+        self.pendingLock = threading.Lock()  # Guards the change sets filled by onGroupChanged
+        self.pendingGroups: Dict[str, object] = {}
+        self.pendingUsers: Dict[str, object] = {}
+        self.built = False
+
+    def attach(self) -> None:
+        self.dbManager.addGroupListener(self.onGroupChanged)
+
+    def detach(self) -> None:
+        self.dbManager.removeGroupListener(self.onGroupChanged)
+
+    def onGroupChanged(self, studyGroup, user=None) -> None:
+        # Runs under the group's lock: only record what changed.
+        with self.pendingLock:
+            self.pendingGroups[studyGroup.groupID] = studyGroup
+            if user is not None:
+                self.pendingUsers[user.userID] = user
+
+    @property
+    def width(self) -> int:
+        return 2 * self.courseWidth + self.locationWidth + TIME_SLOTS
+
+    def build(self) -> None:
+        """Rebuild every feature matrix and everyone's top-k from the current DatabaseManager state."""
+        with self.pendingLock:
+            self.pendingGroups, self.pendingUsers = {}, {}
+        with self.lock:
+            self.buildLocked()
+
+    def buildLocked(self) -> None:
+        self.courseWidth, self.locationWidth = len(courseCodes), len(locationCodes)
+        self.users = self.dbManager.users
+        self.userRows = {user.userID: row for row, user in enumerate(self.users)}
+        self.groups = self.dbManager.studyGroups
+        self.groupColumns = {group.groupID: column for column, group in enumerate(self.groups)}
+        self.U = self.userFeatures(self.users)
+        self.G, self.bias, self.valid, self.groupMicros = self.groupFeatures(self.groups)
+        self.topColumns = np.full((len(self.users), self.depth), -1, np.int32)
+        self.topScores = np.full((len(self.users), self.depth), -np.inf, np.float32)
+        self.scoreUsers(np.arange(len(self.users)))
+        self.built = True
+
+    def userFeatures(self, users: List) -> "np.ndarray":
+        C, L = self.courseWidth, self.locationWidth
+        features = np.zeros((len(users), self.width), np.float32)
+        rows, courses, locations, slots = [], [], [], []
+        for row, user in enumerate(users):
+            for group in list(user.groups):
+                rows.append(row)
+                courses.append(group.courseCode)
+                locations.append(group.locationCode)
+                slots.append(timeSlot(group.date))
+        if rows:
+            rows = np.array(rows, np.intp)
+            np.add.at(features, (rows, np.array(courses, np.intp)), 1)
+            np.add.at(features, (rows, 2 * C + np.array(locations, np.intp)), 1)
+            np.add.at(features, (rows, 2 * C + L + np.array(slots, np.intp)), 1)
+            features /= np.maximum(np.bincount(rows, minlength=len(users)), 1)[:, None]
+            features[:, C:2 * C] = features[:, :C]  # Matched against each group's member course mix
+        return features
+
+    def groupFeatures(self, groups: List) -> tuple:
+        """Weighted feature rows, capacity bias, suggestable flags and session times for `groups` (None = removed)."""
+        C, L, w = self.courseWidth, self.locationWidth, self.weights
+        features = np.zeros((len(groups), self.width), np.float32)
+        bias = np.zeros(len(groups), np.float32)
+        valid = np.zeros(len(groups), bool)
+        micros = np.zeros(len(groups), np.int64)
+        memberRows, memberColumns = [], []
+        for column, group in enumerate(groups):
+            if group is None:
+                continue
+            members = list(group.members)
+            features[column, group.courseCode] = w["course"]
+            features[column, 2 * C + group.locationCode] = w["location"]
+            features[column, 2 * C + L + timeSlot(group.date)] = w["time"]
+            openSeats = group.maxSize - len(members)
+            bias[column] = w["capacity"] * openSeats / group.maxSize
+            valid[column] = openSeats > 0
+            micros[column] = toMicros(group.date)
+            for member in members:
+                row = self.userRows.get(member.userID)
+                if row is not None:
+                    memberRows.append(row)
+                    memberColumns.append(column)
+        if memberRows:
+            mix = np.zeros((len(groups), C), np.float32)
+            np.add.at(mix, np.array(memberColumns, np.intp), self.U[memberRows, :C])
+            mix /= np.maximum(np.bincount(memberColumns, minlength=len(groups)), 1)[:, None]
+            features[:, C:2 * C] = w["members"] * mix
+        return features, bias, valid, micros
+
+    def columnPenalty(self) -> "np.ndarray":
+        """Per-group additive term: the capacity bias, or -inf for groups that must not be suggested."""
+        penalty = self.bias.copy()
+        blocked = ~self.valid
+        if self.upcomingOnly:
+            blocked |= self.groupMicros < toMicros(datetime.now())
+        penalty[blocked] = -np.inf
+        return penalty
+
+    def topOf(self, columns: "np.ndarray", scores: "np.ndarray") -> tuple:
+        """The `depth` best (column, score) pairs of every row, best first, padded with (-1, -inf)."""
+        rows, width = scores.shape
+        topColumns = np.full((rows, self.depth), -1, np.int32)
+        topScores = np.full((rows, self.depth), -np.inf, np.float32)
+        depth = min(self.depth, width)
+        if depth == 0:
+            return topColumns, topScores
+        if depth < width:
+            picked = np.argpartition(-scores, depth - 1, axis=1)[:, :depth]
+        else:
+            picked = np.broadcast_to(np.arange(width), scores.shape)
+        pickedScores = np.take_along_axis(scores, picked, axis=1)
+        order = np.argsort(-pickedScores, axis=1, kind="stable")
+        topColumns[:, :depth] = np.take_along_axis(np.take_along_axis(columns, picked, axis=1), order, axis=1)
+        topScores[:, :depth] = np.take_along_axis(pickedScores, order, axis=1)
+        return topColumns, topScores
+
+    def scoreUsers(self, rows: "np.ndarray") -> None:
+        """Recompute the full top-k of the given user rows against every group."""
+        penalty = self.columnPenalty()
+        allColumns = np.arange(len(self.groups), dtype=np.int32)[None, :]
+        for start in range(0, len(rows), self.batchSize):
+            chunk = rows[start:start + self.batchSize]
+            scores = self.U[chunk] @ self.G.T
+            scores += penalty
+            joinedRows, joinedColumns = [], []
+            for i, row in enumerate(chunk.tolist()):
+                for group in list(self.users[row].groups):
+                    column = self.groupColumns.get(group.groupID)
+                    if column is not None:
+                        joinedRows.append(i)
+                        joinedColumns.append(column)
+            scores[joinedRows, joinedColumns] = -np.inf
+            columns = np.broadcast_to(allColumns, scores.shape)
+            self.topColumns[chunk], self.topScores[chunk] = self.topOf(columns, scores)
+
+    def scoreColumns(self, changed: List[int]) -> None:
+        """Rescore every user against the changed groups only and merge them into the existing top-k."""
+        penalty = self.columnPenalty()
+        for start in range(0, len(changed), 64):
+            columns = np.array(changed[start:start + 64], np.int32)
+            scores = self.U @ self.G[columns].T
+            scores += penalty[columns]
+            for j, column in enumerate(columns.tolist()):
+                group = self.groups[column]
+                members = [self.userRows.get(member.userID) for member in list(group.members)] if group is not None else []
+                scores[[row for row in members if row is not None], j] = -np.inf
+            kept = np.where(np.isin(self.topColumns, columns), -np.inf, self.topScores)
+            mergedColumns = np.hstack([self.topColumns, np.broadcast_to(columns, scores.shape)])
+            self.topColumns, self.topScores = self.topOf(mergedColumns, np.hstack([kept, scores]))
+
+    def refresh(self) -> None:
+        """Apply the group and membership changes recorded since the last build or refresh."""
+        with self.pendingLock:
+            groups, users = self.pendingGroups, self.pendingUsers
+            self.pendingGroups, self.pendingUsers = {}, {}
+        if not groups and not users:
+            return
+        with self.lock:
+            if (not self.built or len(courseCodes) != self.courseWidth or len(locationCodes) != self.locationWidth
+                    or len(groups) > len(self.groups) // 4 + 64):
+                self.buildLocked()
+                return
+            for group in groups.values():
+                for member in list(group.members):
+                    users[member.userID] = member
+            newUsers = [user for userID, user in users.items() if userID not in self.userRows]
+            if newUsers:
+                for user in newUsers:
+                    self.userRows[user.userID] = len(self.users)
+                    self.users.append(user)
+                self.U = np.vstack([self.U, np.zeros((len(newUsers), self.width), np.float32)])
+                self.topColumns = np.vstack([self.topColumns, np.full((len(newUsers), self.depth), -1, np.int32)])
+                self.topScores = np.vstack([self.topScores, np.full((len(newUsers), self.depth), -np.inf, np.float32)])
+            rows = np.array([self.userRows[userID] for userID in users], np.intp)
+            self.U[rows] = self.userFeatures(list(users.values()))
+
+            newGroups = [groupID for groupID in groups if groupID not in self.groupColumns]
+            if newGroups:
+                for groupID in newGroups:
+                    self.groupColumns[groupID] = len(self.groups)
+                    self.groups.append(None)
+                grow = len(newGroups)
+                self.G = np.vstack([self.G, np.zeros((grow, self.width), np.float32)])
+                self.bias = np.concatenate([self.bias, np.zeros(grow, np.float32)])
+                self.valid = np.concatenate([self.valid, np.zeros(grow, bool)])
+                self.groupMicros = np.concatenate([self.groupMicros, np.zeros(grow, np.int64)])
+            columns = [self.groupColumns[groupID] for groupID in groups]
+            for groupID, column in zip(groups, columns):
+                group = groups[groupID]
+                self.groups[column] = group if self.dbManager.getStudyGroup(groupID) is group else None
+            changed = [self.groups[column] for column in columns]
+            self.G[columns], self.bias[columns], self.valid[columns], self.groupMicros[columns] = self.groupFeatures(changed)
+            self.scoreColumns(columns)
+            self.scoreUsers(rows)
+
+    def recommend(self, user, k: Optional[int] = None) -> List:
+        """Up to k (default self.k) groups for `user`, best first."""
+        if not self.built:
+            self.build()
+        if user.userID not in self.userRows:
+            with self.pendingLock:
+                self.pendingUsers[user.userID] = user
+        self.refresh()
+        k = self.k if k is None else k
+        with self.lock:
+            row = self.userRows[user.userID]
+            columns, scores = self.topColumns[row].tolist(), self.topScores[row].tolist()
+        # Entries can have gone stale since they were scored; skip those rather than rescoring.
+        joined = set(list(user.groups))
+        now = datetime.now()
+        suggestions = []
+        for column, score in zip(columns, scores):
+            if column < 0 or score == float("-inf") or len(suggestions) == k:
+                break
+            group = self.groups[column]
+            if group is None or group in joined or len(group.members) >= group.maxSize:
+                continue
+            if self.upcomingOnly and group.date < now:
+                continue
+            suggestions.append(group)
+        return suggestions
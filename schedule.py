@@ -0,0 +1,43 @@
+"""Interval indexes for room bookings and personal calendars."""
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+
+class IntervalIndex:
+    """Half-open intervals [start, end) keyed by id, kept sorted by start.
+
+    Every interval overlapping [start, end) begins in (start - longest, end), where `longest` is the
+    longest interval ever added, so a query is two bisections plus a scan of just that window:
+    O(log n + k) for k hits when durations are bounded, as study sessions are.
+    """
+
+    __slots__ = ("entries", "ends", "longest")
+
+    def __init__(self):
+        self.entries: List[Tuple[datetime, str]] = []
+        self.ends: Dict[str, datetime] = {}
+        self.longest = timedelta(0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key: str, start: datetime, end: datetime) -> None:
+        if key in self.ends:
+            return
+        insort(self.entries, (start, key))
+        self.ends[key] = end
+        self.longest = max(self.longest, end - start)
+
+    def remove(self, key: str, start: datetime) -> None:
+        if self.ends.pop(key, None) is None:
+            return
+        i = bisect_left(self.entries, (start, key))
+        if i < len(self.entries) and self.entries[i] == (start, key):
+            del self.entries[i]
+
+    def overlapping(self, start: datetime, end: datetime) -> List[str]:
+        """Keys of the intervals that overlap [start, end), in start order."""
+        lo = bisect_left(self.entries, (start - self.longest,))
+        hi = bisect_left(self.entries, (end,))
+        return [key for _, key in self.entries[lo:hi] if self.ends[key] > start]
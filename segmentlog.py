@@ -0,0 +1,577 @@
+import heapq
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from itertools import count, islice
+from operator import attrgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from inbox import decodeCursor
+from compact import toMicros
+from storage import MemoryStorage, Storage
+
+MAGIC = b"CCSEG001"
+# recordLength, crc32 of everything after it, seq, timestampMicros, senderLength, recipientLength, groupLength, contentLength
+HEADER = struct.Struct("<IIqqHHHI")
+CHECKED_FROM = 8
+byFirstSeq = attrgetter("firstSeq")
+NONE_LENGTH = 0xFFFF
+SEGMENT_SUFFIX = ".seg"
+MANIFEST_FILE = "manifest.json"
+
+Record = Tuple[int, str, Optional[str], Optional[str], str, int]  # seq, sender, recipient, group, content, timestampMicros
+
+
+def encodeRecord(seq: int, sender: str, recipient: Optional[str], group: Optional[str], content: str, timestamp: int) -> bytes:
+    senderBytes = sender.encode()
+    recipientBytes = recipient.encode() if recipient is not None else b""
+    groupBytes = group.encode() if group is not None else b""
+    contentBytes = content.encode()
+    if max(len(senderBytes), len(recipientBytes), len(groupBytes)) >= NONE_LENGTH:
+        raise ValueError("Sender, recipient and group names must be shorter than 65535 bytes.")
+    length = HEADER.size + len(senderBytes) + len(recipientBytes) + len(groupBytes) + len(contentBytes)
+    header = HEADER.pack(length, 0, seq, timestamp, len(senderBytes),
+                         NONE_LENGTH if recipient is None else len(recipientBytes),
+                         NONE_LENGTH if group is None else len(groupBytes), len(contentBytes))
+    encoded = bytearray(header)
+    encoded += senderBytes + recipientBytes + groupBytes + contentBytes
+    struct.pack_into("<I", encoded, 4, zlib.crc32(memoryview(encoded)[CHECKED_FROM:]))
+    return bytes(encoded)
+
+
+def conversationOf(recipient: Optional[str], group: Optional[str]) -> str:
+    # Keyed like the archive's audiences: group messages by group, direct messages by recipient.
+    return f"g:{group}" if group else f"u:{recipient}"
+
+
+def segmentGeneration(path: str) -> int:
+    return int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)].split("-")[1])
+
+
+def decodeString(view: memoryview, start: int, length: int) -> Tuple[Optional[str], int]:
+    if length == NONE_LENGTH:
+        return None, start
+    # Decoding a memoryview slice reads straight from the mapped pages, without an intermediate bytes copy.
+    return str(view[start:start + length], "utf-8"), start + length
+
+
+def decodeRecord(view: memoryview, offset: int) -> Record:
+    _, _, seq, timestamp, senderLength, recipientLength, groupLength, contentLength = HEADER.unpack_from(view, offset)
+    position = offset + HEADER.size
+    sender, position = decodeString(view, position, senderLength)
+    recipient, position = decodeString(view, position, recipientLength)
+    group, position = decodeString(view, position, groupLength)
+    content, position = decodeString(view, position, contentLength)
+    return seq, sender, recipient, group, content, timestamp
+
+
+class Segment:
+    """One segment file. The active segment is preallocated to `size` bytes; sealed ones may be shorter after compaction."""
+
+    def __init__(self, path: str, size: int = 0, indexInterval: int = 64):
+        if size:
+            with open(path, "wb") as file:
+                file.write(MAGIC)
+                file.truncate(size)
+        self.path = path
+        self.file = open(path, "r+b")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        if self.view[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a message segment: {path}")
+        self.size = len(self.map)
+        self.indexInterval = indexInterval
+        # Sparse offset index: every indexInterval-th record's (seq, offset).
+        self.indexSeqs = array("q")
+        self.indexOffsets = array("q")
+        self.count = 0
+        self.firstSeq = 0
+        self.lastSeq = 0
+        self.end = len(MAGIC)
+        self.dirty = False
+        self.file.seek(self.end)
+
+    def scan(self) -> Iterator[Tuple[int, Record]]:
+        """Recover the write position and offset index, yielding (offset, record) for every stored record."""
+        offset = len(MAGIC)
+        while offset + HEADER.size <= self.size:
+            length, crc = HEADER.unpack_from(self.view, offset)[:2]
+            # A zero length marks the preallocated tail; a bad checksum marks a torn final write.
+            if length < HEADER.size or offset + length > self.size:
+                break
+            if zlib.crc32(self.view[offset + CHECKED_FROM:offset + length]) != crc:
+                break
+            record = decodeRecord(self.view, offset)
+            self.track(record[0], offset)
+            yield offset, record
+            offset += length
+        self.end = offset
+        self.file.seek(self.end)
+
+    def track(self, seq: int, offset: int) -> None:
+        if self.count % self.indexInterval == 0:
+            self.indexSeqs.append(seq)
+            self.indexOffsets.append(offset)
+        if self.count == 0:
+            self.firstSeq = seq
+        self.lastSeq = seq
+        self.count += 1
+
+    def fits(self, length: int) -> bool:
+        return self.end + length <= self.size
+
+    def append(self, seq: int, encoded: bytes) -> None:
+        offset = self.end
+        self.file.write(encoded)
+        self.end += len(encoded)
+        self.dirty = True
+        self.track(seq, offset)
+
+    def flush(self) -> None:
+        if self.dirty:
+            self.file.flush()
+            self.dirty = False
+
+    def records(self, startOffset: Optional[int] = None) -> Iterator[Tuple[int, Record]]:
+        self.flush()
+        offset = len(MAGIC) if startOffset is None else startOffset
+        while offset < self.end:
+            length = HEADER.unpack_from(self.view, offset)[0]
+            yield offset, decodeRecord(self.view, offset)
+            offset += length
+
+    def liveFrom(self, lowWater: int) -> int:
+        """Offset of the first record with seq >= lowWater (records are in seq order)."""
+        for offset, record in self.records():
+            if record[0] >= lowWater:
+                return offset
+        return self.end
+
+    def raw(self, startOffset: int) -> Iterator[Tuple[int, bytes]]:
+        for offset, record in self.records(startOffset):
+            length = HEADER.unpack_from(self.view, offset)[0]
+            yield record[0], bytes(self.view[offset:offset + length])
+
+    def find(self, seq: int) -> Optional[Record]:
+        slot = bisect_right(self.indexSeqs, seq) - 1
+        if slot < 0:
+            return None
+        self.flush()
+        offset = self.indexOffsets[slot]
+        # Walk headers only; decode just the record asked for.
+        while offset < self.end:
+            length, _, recordSeq = HEADER.unpack_from(self.view, offset)[:3]
+            if recordSeq >= seq:
+                return decodeRecord(self.view, offset) if recordSeq == seq else None
+            offset += length
+        return None
+
+    def close(self) -> None:
+        self.flush()
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+class SegmentedLog:
+    """Append-only message log split across fixed-size segment files, read back through mmap.
+
+    Appends go to one buffered file write on the active segment. Sealed segments are immutable, so
+    compaction (dropping expired records and merging sparse neighbours) can rewrite them in the
+    background without blocking appends. Expiry cut points, one for the whole log and one per
+    conversation, are kept in manifest.json, so records expired before a restart stay hidden.
+    """
+
+    def __init__(self, directory: str, segmentSize: int = 64 * 1024 * 1024, indexInterval: int = 64):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.indexInterval = indexInterval
+        self.lock = threading.RLock()
+        self.compactionLock = threading.Lock()
+        self.segments: List[Segment] = []
+        self.generation = count(1)
+        self.manifestPath = os.path.join(directory, MANIFEST_FILE)
+        self.lowWater = 0
+        self.cuts: Dict[str, int] = {}  # Per-conversation cut points above lowWater
+        self.lastSeq = 0
+        self.compactor: Optional[threading.Thread] = None
+        self.stopCompactor = threading.Event()
+
+    def open(self) -> Iterator[Record]:
+        """Load existing segments, yielding every live record in seq order (used to rebuild indexes)."""
+        if os.path.exists(self.manifestPath):
+            with open(self.manifestPath) as f:
+                manifest = json.load(f)
+            self.lowWater = manifest["lowWater"]
+            self.cuts = manifest.get("conversations", {})
+        loaded = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(SEGMENT_SUFFIX):
+                loaded.append(Segment(os.path.join(self.directory, name), indexInterval=self.indexInterval))
+        self.generation = count(max((segmentGeneration(segment.path) for segment in loaded), default=0) + 1)
+        pending = []
+        for segment in loaded:
+            records = [record for _, record in segment.scan()]
+            pending.append((segment, records))
+        # A crash during compaction can leave both the merged segment and its sources; keep the newest copy.
+        pending.sort(key=lambda item: (item[0].firstSeq, -segmentGeneration(item[0].path)))
+        for segment, records in pending:
+            if segment.count and segment.firstSeq > self.lastSeq:
+                self.segments.append(segment)
+                self.lastSeq = segment.lastSeq
+                yield from filter(self.visible, records)
+            else:
+                segment.close()
+                os.unlink(segment.path)
+
+    def newSegment(self, baseSeq: int, size: int) -> Segment:
+        name = f"{baseSeq:020d}-{next(self.generation):06d}{SEGMENT_SUFFIX}"
+        return Segment(os.path.join(self.directory, name), size=size, indexInterval=self.indexInterval)
+
+    def append(self, record: Record) -> None:
+        seq = record[0]
+        encoded = encodeRecord(*record)
+        if len(MAGIC) + len(encoded) > self.segmentSize:
+            raise ValueError(f"Message {seq} is larger than the segment size.")
+        with self.lock:
+            if seq <= self.lastSeq:
+                raise ValueError(f"Sequence numbers must increase: {seq} after {self.lastSeq}.")
+            active = self.segments[-1] if self.segments else None
+            if active is None or not active.fits(len(encoded)):
+                if active is not None:
+                    active.flush()
+                active = self.newSegment(seq, self.segmentSize)
+                self.segments.append(active)
+            active.append(seq, encoded)
+            self.lastSeq = seq
+
+    def read(self, seq: int) -> Optional[Record]:
+        with self.lock:
+            if seq < self.lowWater:
+                return None
+            slot = bisect_right(self.segments, seq, key=byFirstSeq) - 1
+            record = self.segments[slot].find(seq) if slot >= 0 else None
+            return record if record is not None and self.visible(record) else None
+
+    def scan(self) -> Iterator[Record]:
+        with self.lock:
+            for segment in self.segments:
+                for _, record in segment.records():
+                    if self.visible(record):
+                        yield record
+
+    def visible(self, record: Record) -> bool:
+        seq = record[0]
+        if seq < self.lowWater:
+            return False
+        return not self.cuts or seq >= self.cuts.get(conversationOf(record[2], record[3]), 0)
+
+    def expire(self, beforeSeq: int, conversations: Optional[Dict[str, int]] = None) -> None:
+        """Hide records older than `beforeSeq`, and each conversation's records older than its own cut point.
+
+        Compaction reclaims the space below `beforeSeq`.
+        """
+        with self.lock:
+            changed = beforeSeq > self.lowWater
+            self.lowWater = max(self.lowWater, beforeSeq)
+            for conversation, cut in (conversations or {}).items():
+                if cut > max(self.lowWater, self.cuts.get(conversation, 0)):
+                    self.cuts[conversation] = cut
+                    changed = True
+            if changed:
+                self.cuts = {conversation: cut for conversation, cut in self.cuts.items() if cut > self.lowWater}
+                self.saveManifest()
+
+    def saveManifest(self) -> None:
+        # Written aside and swapped in with os.replace, so a crash leaves either the old cut point or the new one.
+        with open(self.manifestPath + ".tmp", "w") as f:
+            json.dump({"lowWater": self.lowWater, "conversations": self.cuts}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.manifestPath + ".tmp", self.manifestPath)
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.segments:
+                self.segments[-1].flush()
+
+    def compact(self) -> int:
+        """Rewrite sealed segments that hold expired records or could be merged. Returns segments removed."""
+        with self.compactionLock:
+            with self.lock:
+                sealed = self.segments[:-1]
+                lowWater = self.lowWater
+            runs, run, runBytes = [], [], 0
+            for segment in sealed:
+                liveBytes = self.liveBytes(segment, lowWater)
+                if run and runBytes + liveBytes > self.segmentSize:
+                    runs.append(run)
+                    run, runBytes = [], 0
+                run.append(segment)
+                runBytes += liveBytes
+            if run:
+                runs.append(run)
+            removed = 0
+            for run in runs:
+                if len(run) == 1 and run[0].firstSeq >= lowWater:
+                    continue
+                removed += self.rewrite(run, lowWater)
+            return removed
+
+    def liveBytes(self, segment: Segment, lowWater: int) -> int:
+        if segment.firstSeq >= lowWater:
+            return segment.end - len(MAGIC)
+        return segment.end - segment.liveFrom(lowWater)
+
+    def rewrite(self, run: List[Segment], lowWater: int) -> int:
+        live = [item for segment in run for item in segment.raw(segment.liveFrom(lowWater))]
+        replacement = None
+        if live:
+            replacement = self.newSegment(live[0][0], len(MAGIC) + sum(len(encoded) for _, encoded in live))
+            for seq, encoded in live:
+                replacement.append(seq, encoded)
+            replacement.flush()
+            os.fsync(replacement.file.fileno())
+        with self.lock:
+            start = self.segments.index(run[0])
+            self.segments[start:start + len(run)] = [replacement] if replacement else []
+            for segment in run:
+                segment.close()
+                os.unlink(segment.path)
+        return len(run) - (1 if replacement else 0)
+
+    def startCompactor(self, interval: float = 60.0) -> None:
+        def loop():
+            while not self.stopCompactor.wait(interval):
+                self.compact()
+
+        self.stopCompactor.clear()
+        self.compactor = threading.Thread(target=loop, name="segment-compactor", daemon=True)
+        self.compactor.start()
+
+    def close(self) -> None:
+        if self.compactor is not None:
+            self.stopCompactor.set()
+            self.compactor.join()
+            self.compactor = None
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+            self.segments = []
+
+    def clear(self) -> None:
+        """Delete every segment; sequence numbers restart."""
+        with self.compactionLock, self.lock:
+            paths = [segment.path for segment in self.segments]
+            for segment in self.segments:
+                segment.close()
+            for path in paths:
+                os.unlink(path)
+            if os.path.exists(self.manifestPath):
+                os.unlink(self.manifestPath)
+            self.segments = []
+            self.lowWater = 0
+            self.cuts = {}
+            self.lastSeq = 0
+
+
+class SeqLog:
+    """Seqs and timestamps of one inbox log, kept as packed arrays instead of Message objects."""
+
+    __slots__ = ("seqs", "timestamps")
+
+    def __init__(self):
+        self.seqs = array("q")
+        self.timestamps = array("q")
+
+    def append(self, seq: int, timestamp: int) -> None:
+        self.seqs.append(seq)
+        self.timestamps.append(timestamp)
+
+    def trim(self, beforeSeq: int) -> None:
+        cut = bisect_left(self.seqs, beforeSeq)
+        del self.seqs[:cut]
+        del self.timestamps[:cut]
+
+    def newestFirst(self, since: Optional[int], before: Optional[int], beforeSeq: Optional[int]) -> Iterator[int]:
+        start = bisect_left(self.timestamps, since) if since is not None else 0
+        end = len(self.seqs)
+        if before is not None:
+            end = min(end, bisect_left(self.timestamps, before))
+        if beforeSeq is not None:
+            end = min(end, bisect_left(self.seqs, beforeSeq))
+        for i in range(end - 1, start - 1, -1):
+            yield self.seqs[i]
+
+
+class SegmentLogStorage(Storage):
+    """Storage whose messages live in a SegmentedLog; users, groups and memberships go to `metadata`.
+
+    Only per-recipient and per-group arrays of seqs and timestamps stay in memory, so message history
+    can grow past RAM. Messages are decoded from the mapped segments on read.
+    """
+
+    def __init__(self, directory: str, metadata: Optional[Storage] = None, segmentSize: int = 64 * 1024 * 1024,
+                 compactionInterval: Optional[float] = None):
+        self.metadata = metadata if metadata is not None else MemoryStorage()
+        self.log = SegmentedLog(directory, segmentSize=segmentSize)
+        self.directLogs: Dict[str, SeqLog] = {}
+        self.groupLogs: Dict[str, SeqLog] = {}
+        for record in self.log.open():
+            self.index(record)
+        if compactionInterval is not None:
+            self.log.startCompactor(compactionInterval)
+
+    def index(self, record: Record) -> None:
+        seq, _, recipient, group, _, timestamp = record
+        logs, key = (self.groupLogs, group) if group else (self.directLogs, recipient)
+        log = logs.get(key)
+        if log is None:
+            log = logs[key] = SeqLog()
+        log.append(seq, timestamp)
+
+    def toMessage(self, record: Record):
+        return self.messageFactory(record)
+
+    def saveUser(self, user) -> None:
+        self.metadata.saveUser(user)
+
+    def removeUser(self, user) -> None:
+        self.metadata.removeUser(user)
+
+    def updatePassword(self, user) -> None:
+        self.metadata.updatePassword(user)
+
+    def saveStudyGroup(self, studyGroup) -> None:
+        self.metadata.saveStudyGroup(studyGroup)
+
+    def removeStudyGroup(self, studyGroup) -> None:
+        self.metadata.removeStudyGroup(studyGroup)
+
+    def saveMembership(self, studyGroup, user) -> None:
+        self.metadata.saveMembership(studyGroup, user)
+
+    def removeMembership(self, studyGroup, user) -> None:
+        self.metadata.removeMembership(studyGroup, user)
+
+    def saveWaitlistEntry(self, studyGroup, user) -> None:
+        self.metadata.saveWaitlistEntry(studyGroup, user)
+
+    def removeWaitlistEntry(self, studyGroup, user) -> None:
+        self.metadata.removeWaitlistEntry(studyGroup, user)
+
+    def saveReadCursor(self, userName: str, conversation: str, seq: int) -> None:
+        self.metadata.saveReadCursor(userName, conversation, seq)
+
+    def loadReadCursors(self):
+        return self.metadata.loadReadCursors()
+
+    def loadUsers(self):
+        return self.metadata.loadUsers()
+
+    def loadStudyGroups(self):
+        return self.metadata.loadStudyGroups()
+
+    def loadMemberships(self):
+        return self.metadata.loadMemberships()
+
+    def loadWaitlists(self):
+        return self.metadata.loadWaitlists()
+
+    def transaction(self):
+        return self.metadata.transaction()
+
+    def saveMessage(self, message) -> None:
+        record = (message.seq, message.sender, message.recipient, message.group, message.content, message.timestampUs)
+        self.log.append(record)
+        self.index(record)
+
+    def logsFor(self, userName: str, groupNames: Iterable[str]) -> List[SeqLog]:
+        logs = [self.directLogs.get(userName)] + [self.groupLogs.get(groupName) for groupName in groupNames]
+        return [log for log in logs if log is not None and log.seqs]
+
+    def readAll(self, seqs: Iterable[int]) -> Iterator:
+        for seq in seqs:
+            record = self.log.read(seq)
+            if record is not None:
+                yield self.toMessage(record)
+
+    def messagesFor(self, userName: str, groupNames: Iterable[str]) -> List:
+        logs = self.logsFor(userName, groupNames)
+        return list(self.readAll(heapq.merge(*(log.seqs for log in logs))))
+
+    def iterMessagesFor(self, userName: str, groupNames: Iterable[str], since: Optional[datetime] = None,
+                        before: Optional[datetime] = None, limit: Optional[int] = None,
+                        cursor: Optional[str] = None) -> Iterator:
+        beforeSeq = decodeCursor(cursor) if cursor is not None else None
+        sinceMicros = toMicros(since) if since is not None else None
+        beforeMicros = toMicros(before) if before is not None else None
+        streams = [log.newestFirst(sinceMicros, beforeMicros, beforeSeq) for log in self.logsFor(userName, groupNames)]
+        return self.readAll(islice(heapq.merge(*streams, reverse=True), limit))
+
+    def allMessages(self) -> List:
+        return [self.toMessage(record) for record in self.log.scan()]
+
+    def messagesBySeq(self, seqs: Iterable[int]) -> List:
+        return list(self.readAll(seqs))
+
+    def replaceMessages(self, messages: List) -> None:
+        self.log.clear()
+        self.directLogs.clear()
+        self.groupLogs.clear()
+        for message in sorted(messages, key=attrgetter("seq")):
+            self.saveMessage(message)
+
+    def messagesBefore(self, timestampUs: int) -> List:
+        # Read through the inbox logs: records they no longer reference are already gone from the hot store.
+        logs = list(self.directLogs.values()) + list(self.groupLogs.values())
+        return list(self.readAll(heapq.merge(*(log.seqs[:bisect_left(log.timestamps, timestampUs)] for log in logs))))
+
+    def removeMessages(self, messages: List) -> None:
+        # Each log's archived messages are its oldest, so trimming past the newest one removes exactly them.
+        cuts: Dict[str, int] = {}
+        for message in messages:
+            conversation = conversationOf(message.recipient, message.group)
+            cuts[conversation] = max(cuts.get(conversation, 0), message.seq + 1)
+        for conversation, beforeSeq in cuts.items():
+            logs = self.groupLogs if conversation.startswith("g:") else self.directLogs
+            name = conversation[2:]
+            if name in logs:
+                logs[name].trim(beforeSeq)
+                if not logs[name].seqs:
+                    del logs[name]
+        # Logs expire on their own schedules, so the log-wide cut point is only as far as the oldest survivor;
+        # the per-conversation cut points hide the rest, on reads and after a reopen.
+        remaining = [log.seqs[0] for logs in (self.directLogs, self.groupLogs) for log in logs.values()]
+        if remaining:
+            self.log.expire(min(remaining), cuts)
+        elif cuts:
+            self.log.expire(max(cuts.values()))
+
+    def expireBefore(self, beforeSeq: int) -> None:
+        """Drop messages with a seq below `beforeSeq` from the inbox indexes; compaction reclaims the disk space."""
+        self.log.expire(beforeSeq)
+        for logs in (self.directLogs, self.groupLogs):
+            for key in list(logs):
+                logs[key].trim(beforeSeq)
+                if not logs[key].seqs:
+                    del logs[key]
+
+    def lastMessageSeq(self) -> int:
+        return self.log.lastSeq
+
+    def flush(self) -> None:
+        self.log.flush()
+        self.metadata.flush()
+
+    def close(self) -> None:
+        self.log.close()
+        self.metadata.close()
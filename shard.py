@@ -0,0 +1,511 @@
+"""Sharded deployment: study groups and their messages partitioned by groupID across worker processes.
+
+Each worker process runs its own DatabaseManager (in memory) holding the groups whose groupID hashes to
+it, with their members, waitlists and group messages, plus the direct messages of recipients whose name
+hashes to it. ShardRouter, in the front process, has the StudyGroupGUI API: a call about one group goes
+to that group's shard, and reads that span shards (a user's inbox, searches, time clashes) are sent to
+every shard at once and merged. Users, passwords and sessions stay with the front process's
+DatabaseManager; a shard gets a copy of a user, without the password, the first time a change there
+involves them.
+"""
+import base64
+import heapq
+import logging
+import multiprocessing
+import os
+import threading
+import zlib
+from collections import deque
+from datetime import datetime, timedelta
+from itertools import count, islice
+from operator import attrgetter
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from uuid import uuid4
+
+from auth import PBKDF2, PasswordHasher
+from compact import fromMicros
+from logconfig import configureLogging, logger
+from main import (AuthController, DatabaseManager, Message, MessageController, StudyGroup, StudyGroupController,
+                  User)
+from storage import GroupRecord, MessageRecord, UserRecord
+
+messageRow = attrgetter("seq", "sender", "recipient", "group", "content", "timestampUs")
+# One order for messages from every shard: seqs are only unique across shards, not ordered across them.
+messageKey = attrgetter("timestampUs", "seq")
+groupKey = attrgetter("date", "groupID")
+# (group record, member userIDs): what a shard returns for a group.
+GroupResult = Tuple[GroupRecord, List[str]]
+CURSOR_PREFIX = "s1:"
+
+
+def shardOf(key: str, shards: int) -> int:
+    # crc32 rather than hash(): str hashes are salted per process, and every process must agree.
+    return zlib.crc32(key.encode()) % shards
+
+
+def encodeCursor(message: Message) -> str:
+    # A seq only orders messages within its own shard, so the cursor also carries the timestamp.
+    return base64.urlsafe_b64encode(f"{CURSOR_PREFIX}{message.timestampUs}:{message.seq}".encode()).decode()
+
+
+def decodeCursor(cursor: str) -> Tuple[int, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    timestampUs, _, seq = raw[len(CURSOR_PREFIX):].partition(":")
+    if not raw.startswith(CURSOR_PREFIX) or not timestampUs.isdigit() or not seq.isdigit():
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return int(timestampUs), int(seq)
+
+
+def groupRecord(studyGroup: StudyGroup) -> GroupRecord:
+    return (studyGroup.groupID, studyGroup.groupName, studyGroup.course, studyGroup.location, studyGroup.date,
+            studyGroup.maxSize, studyGroup.duration)
+
+
+class ShardWorker:
+    """One shard's DatabaseManager and controllers, driven by requests from the router."""
+
+    def __init__(self, index: int, shards: int):
+        self.dbManager = DatabaseManager()
+        # Shards never check passwords (the front process does), so the copies they keep are hashed at a token cost.
+        self.dbManager.usePasswordHasher(PasswordHasher(PBKDF2, iterations=1))
+        # Seqs ≡ index (mod shards): unique across shards, so a seq alone tells which shard a message is from.
+        self.dbManager.messageSeq = count(shards + index, shards)
+        self.controller = StudyGroupController(self.dbManager)
+        self.messageController = MessageController(self.dbManager)
+
+    def handle(self, operation: str, args: tuple) -> Tuple[bool, object]:
+        try:
+            return True, getattr(self, operation)(*args)
+        except Exception as e:
+            logger.exception("Shard operation %s failed.", operation)
+            return False, f"{type(e).__name__}: {e}"
+
+    def adopt(self, record: UserRecord) -> User:
+        user = self.dbManager.getUser(record[0])
+        if user is None:
+            user = User.fromRecord(record)
+            # The record's password is an empty placeholder; hash it like a new one so it can never match as plaintext.
+            user.passwordHashed = False
+            self.dbManager.saveUser(user)
+            user = self.dbManager.getUser(record[0])
+        return user
+
+    def describe(self, studyGroup: StudyGroup) -> GroupResult:
+        with studyGroup.lock:
+            return groupRecord(studyGroup), [member.userID for member in studyGroup.members]
+
+    def checkStudyGroup(self, groupName: str, location: str, date: datetime, duration: Optional[timedelta]) -> Optional[str]:
+        """Why this shard rules out the group, or None. Malformed fields are left for createStudyGroup to report."""
+        if groupName and self.dbManager.getStudyGroupByName(groupName) is not None:
+            return f"Group name '{groupName}' already exists."
+        if (location and location.strip() and isinstance(date, datetime) and isinstance(duration, timedelta)
+                and duration > timedelta(0)):
+            return self.dbManager.describeRoomConflict(location, date, date + duration)
+        return None
+
+    def createStudyGroup(self, groupID: str, groupName: str, course: str, location: str, date: datetime, maxSize: int,
+                         creator: UserRecord, duration: Optional[timedelta]) -> Optional[GroupResult]:
+        studyGroup = StudyGroup(groupName, course, location, date, maxSize, duration)
+        if not studyGroup.is_valid:
+            logger.warning("Failed to create study group '%s': %s", groupName, studyGroup.error)
+            return None
+        # The router chose the ID, and with it this shard.
+        studyGroup.groupID = groupID
+        user = self.adopt(creator)
+        studyGroup.addMember(user)
+        if not self.dbManager.saveStudyGroup(studyGroup):
+            user.removeStudyGroup(studyGroup)
+            logger.warning("Failed to create study group '%s': it was registered concurrently.", groupName)
+            return None
+        logger.info("Study group '%s' created successfully.", groupName)
+        return self.describe(studyGroup)
+
+    def getStudyGroup(self, groupID: str) -> Optional[GroupResult]:
+        studyGroup = self.dbManager.getStudyGroup(groupID)
+        return self.describe(studyGroup) if studyGroup is not None else None
+
+    def joinStudyGroup(self, groupID: str, user: UserRecord, waitlist: bool) -> bool:
+        return self.controller.joinStudyGroup(groupID, self.adopt(user), waitlist=waitlist)
+
+    def removeFromStudyGroup(self, groupID: str, user: UserRecord) -> bool:
+        return self.controller.removeFromStudyGroup(groupID, self.adopt(user))
+
+    def leaveWaitlist(self, groupID: str, user: UserRecord) -> bool:
+        return self.controller.leaveWaitlist(groupID, self.adopt(user))
+
+    def getWaitlistPosition(self, groupID: str, user: UserRecord) -> Optional[int]:
+        return self.controller.getWaitlistPosition(groupID, self.adopt(user))
+
+    def searchStudyGroups(self, course: Optional[str], location: Optional[str], since: Optional[datetime],
+                          before: Optional[datetime], minOpenSeats: int, limit: Optional[int]) -> List[GroupResult]:
+        return [self.describe(group) for group in self.controller.searchStudyGroups(
+            course=course, location=location, since=since, before=before, minOpenSeats=minOpenSeats, limit=limit)]
+
+    def timeClashes(self, user: UserRecord, group: GroupRecord) -> List[GroupResult]:
+        # The group itself may live on another shard; findTimeClashes only needs its ID and session.
+        known = self.dbManager.getUser(user[0])
+        if known is None:
+            return []
+        return [self.describe(clash) for clash in self.dbManager.findTimeClashes(known, StudyGroup.fromRecord(group))]
+
+    def sendDirectMessage(self, sender: UserRecord, recipient: UserRecord, content: str) -> bool:
+        return self.messageController.sendMessage(self.adopt(sender), self.adopt(recipient), content)
+
+    def sendGroupMessage(self, sender: UserRecord, groupID: str, content: str) -> bool:
+        studyGroup = self.dbManager.getStudyGroup(groupID)
+        if studyGroup is None:
+            logger.warning("Study group %s not found.", groupID)
+            return False
+        return self.messageController.sendGroupMessage(self.adopt(sender), studyGroup, content)
+
+    def broadcastGroupMessage(self, sender: UserRecord, groupIDs: List[str], content: str) -> Dict[str, bool]:
+        groups = [self.dbManager.getStudyGroup(groupID) for groupID in groupIDs]
+        status = self.messageController.broadcastGroupMessage(self.adopt(sender), [group for group in groups if group],
+                                                              content)
+        return {groupID: status.get(groupID, False) for groupID in groupIDs}
+
+    def sendMessages(self, sender: UserRecord, groupID: Optional[str], recipient: Optional[UserRecord],
+                     contents: List[str]) -> List[bool]:
+        if groupID is not None:
+            conversation = self.dbManager.getStudyGroup(groupID)
+            if conversation is None:
+                logger.warning("Study group %s not found.", groupID)
+                return [False] * len(contents)
+        else:
+            conversation = self.adopt(recipient)
+        return self.messageController.sendMessages(self.adopt(sender), conversation, contents)
+
+    def getMessage(self, recipient: UserRecord) -> List[MessageRecord]:
+        user = self.dbManager.getUser(recipient[0])
+        return [messageRow(message) for message in self.dbManager.getMessagesForUser(user)] if user is not None else []
+
+    def getMessagePage(self, recipient: UserRecord, since: Optional[datetime], before: Optional[datetime],
+                       limit: Optional[int], after: Optional[Tuple[int, int]]) -> List[MessageRecord]:
+        """Newest first, like MessageController.getMessagePage, but resuming below the (timestampUs, seq) key `after`."""
+        user = self.dbManager.getUser(recipient[0])
+        if user is None:
+            return []
+        messages: Iterator[Message]
+        if after is None:
+            messages = self.dbManager.iterMessagesForUser(user, since=since, before=before)
+        else:
+            # Messages stamped in the cursor's own microsecond may come either side of it, so read that far and filter.
+            bound = fromMicros(after[0] + 1)
+            messages = (message for message in self.dbManager.iterMessagesForUser(
+                user, since=since, before=bound if before is None else min(before, bound)) if messageKey(message) < after)
+        return [messageRow(message) for message in islice(messages, limit)]
+
+    def searchMessages(self, user: UserRecord, query: str, limit: Optional[int]) -> List[MessageRecord]:
+        known = self.dbManager.getUser(user[0])
+        return [messageRow(message) for message in self.dbManager.searchMessages(known, query, limit)] if known is not None else []
+
+    def markRead(self, user: UserRecord, groupID: Optional[str], partner: Optional[UserRecord],
+                 upTo: Optional[Tuple[int, int]]) -> bool:
+        """MessageController.markRead for a group here or, with `partner`, direct messages to `user`."""
+        known = self.adopt(user)
+        if groupID is not None:
+            conversation = self.dbManager.getStudyGroup(groupID)
+            if conversation is None:
+                logger.warning("Study group %s not found.", groupID)
+                return False
+        else:
+            conversation = self.adopt(partner)
+        last = None
+        if upTo is not None:
+            # `upTo` may come from another shard, whose seqs are not comparable with these: read up to the
+            # newest message here at or before its (timestampUs, seq) key instead.
+            messages = self.dbManager.iterMessagesForUser(known, before=fromMicros(upTo[0] + 1))
+            last = next((message for message in messages if messageKey(message) <= upTo), None)
+            if last is None:
+                return True
+        return self.messageController.markRead(known, conversation, upTo=last)
+
+    def getUnreadCounts(self, user: UserRecord) -> Dict[str, Dict[str, int]]:
+        known = self.dbManager.getUser(user[0])
+        return self.dbManager.getUnreadCounts(known) if known is not None else {"direct": {}, "groups": {}}
+
+
+def serve(connection, index: int, shards: int, logLevel: int) -> None:
+    """Worker process entry point: answer batches of (operation, args), in order, until one ends with None."""
+    if logLevel > logging.CRITICAL:
+        configureLogging(silent=True)
+    elif logLevel:
+        configureLogging(logLevel)
+    worker = ShardWorker(index, shards)
+    while True:
+        try:
+            batch = connection.recv()
+        except EOFError:
+            break
+        stop = batch[-1] is None
+        connection.send([worker.handle(*request) for request in batch if request is not None])
+        if stop:
+            break
+    connection.close()
+
+
+class Reply:
+    """The answer to one call; result() blocks until the receiver thread fills it in."""
+    __slots__ = ("ready", "ok", "value")
+
+    def __init__(self):
+        # A bare lock is the cheapest one-shot event: held until set() releases it.
+        self.ready = threading.Lock()
+        self.ready.acquire()
+        self.ok, self.value = False, None
+
+    def set(self, ok: bool, value) -> None:
+        self.ok, self.value = ok, value
+        self.ready.release()
+
+    def result(self):
+        with self.ready:
+            pass
+        if not self.ok:
+            raise RuntimeError(self.value)
+        return self.value
+
+
+class Shard:
+    """The router's handle on one worker process.
+
+    At most one batch of calls is in flight to the worker at a time. Calls made while it is out queue
+    up and leave together as soon as its replies arrive, so under load each round trip carries many
+    calls, while an idle shard still sends a lone call at once. A receiver thread hands out the replies.
+    """
+
+    def __init__(self, index: int, shards: int, context, logLevel: int):
+        self.index = index
+        self.connection, workerEnd = context.Pipe()
+        self.process = context.Process(target=serve, args=(workerEnd, index, shards, logLevel), name=f"shard-{index}",
+                                       daemon=True)
+        self.process.start()
+        workerEnd.close()
+        self.lock = threading.Lock()  # Guards outbox, pending, inFlight and closed
+        self.outbox: List[Optional[tuple]] = []
+        # The worker answers in the order it was asked, so replies are matched up by position.
+        self.pending: Deque[Reply] = deque()
+        self.inFlight = False
+        self.closed = False
+        self.receiver = threading.Thread(target=self.receive, name=f"shard-{index}-receiver", daemon=True)
+        self.receiver.start()
+
+    def submit(self, operation: str, *args) -> Reply:
+        reply = Reply()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError(f"Shard {self.index} is closed.")
+            self.pending.append(reply)
+            self.outbox.append((operation, args))
+            batch = self.takeBatch()
+        if batch is not None:
+            self.connection.send(batch)
+        return reply
+
+    def call(self, operation: str, *args):
+        return self.submit(operation, *args).result()
+
+    def takeBatch(self) -> Optional[List[Optional[tuple]]]:
+        # Caller holds self.lock; whoever gets a batch here is the only one allowed to send until its replies return.
+        if self.inFlight or not self.outbox:
+            return None
+        batch, self.outbox = self.outbox, []
+        self.inFlight = True
+        return batch
+
+    def receive(self) -> None:
+        while True:
+            try:
+                results = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                replies = [self.pending.popleft() for _ in results]
+                self.inFlight = False
+                batch = self.takeBatch()
+            if batch is not None:
+                try:
+                    self.connection.send(batch)
+                except OSError:
+                    pass
+            for reply, (ok, value) in zip(replies, results):
+                reply.set(ok, value if ok else f"Shard {self.index}: {value}")
+        with self.lock:
+            self.closed = True
+            pending, self.pending = self.pending, deque()
+        for reply in pending:
+            reply.set(False, f"Shard {self.index} exited.")
+
+    def close(self) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            # None asks the worker to stop once the calls queued ahead of it are answered.
+            self.outbox.append(None)
+            batch = self.takeBatch()
+        if batch is not None:
+            self.connection.send(batch)
+        self.process.join()
+        self.receiver.join()
+        self.connection.close()
+
+
+class ShardRouter:
+    """StudyGroupGUI over `shards` worker processes; see the module docstring.
+
+    Groups returned here are copies of the shard's group as of the call; pass them (or their groupID)
+    back in as usual. Creation is serialized in the router because names and rooms are unique across
+    shards, and joins warn about time clashes within the group's own shard only (getTimeClashes checks
+    all of them). Every call is a round trip to a worker, so throughput comes from many concurrent callers.
+    """
+
+    def __init__(self, shards: Optional[int] = None, authController: Optional[AuthController] = None,
+                 startMethod: str = "spawn"):
+        # spawn, not fork: a forked worker would inherit the front process's users, groups and threads.
+        context = multiprocessing.get_context(startMethod)
+        size = shards if shards is not None else os.cpu_count() or 1
+        self.shards = [Shard(index, size, context, logger.level) for index in range(size)]
+        self.authController = authController if authController is not None else AuthController(DatabaseManager())
+        self.createLock = threading.Lock()
+        # Every User passed in, by userID, so members reported by the shards come back as the caller's objects.
+        self.users: Dict[str, User] = {}
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
+
+    def shardFor(self, key: str) -> Shard:
+        return self.shards[shardOf(key, len(self.shards))]
+
+    def gather(self, operation: str, *args) -> List:
+        futures = [shard.submit(operation, *args) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    def userRecord(self, user: User) -> UserRecord:
+        self.users[user.userID] = user
+        return user.userID, user.userName, "", user.email
+
+    def studyGroupFrom(self, result: GroupResult) -> StudyGroup:
+        record, memberIDs = result
+        studyGroup = StudyGroup.fromRecord(record)
+        studyGroup.members = [self.users[userID] for userID in memberIDs if userID in self.users]
+        return studyGroup
+
+    def login(self, userName: str, password: str) -> Optional[str]:
+        return self.authController.login(userName, password)
+
+    def authenticate(self, token: str) -> Optional[User]:
+        return self.authController.authenticate(token)
+
+    def logout(self, token: str) -> bool:
+        return self.authController.logout(token)
+
+    def createStudyGroup(self, groupName: str, course: str, location: str, date: datetime, maxSize: int, creator: User,
+                         duration: Optional[timedelta] = None) -> Optional[StudyGroup]:
+        with self.createLock:
+            error = next((error for error in self.gather("checkStudyGroup", groupName, location, date, duration)
+                          if error is not None), None)
+            if error is not None:
+                logger.warning("Failed to create study group '%s': %s", groupName, error)
+                return None
+            groupID = str(uuid4())
+            result = self.shardFor(groupID).call("createStudyGroup", groupID, groupName, course, location, date, maxSize,
+                                                 self.userRecord(creator), duration)
+        return self.studyGroupFrom(result) if result is not None else None
+
+    def joinStudyGroup(self, groupID: str, user: User, waitlist: bool = False) -> bool:
+        return self.shardFor(groupID).call("joinStudyGroup", groupID, self.userRecord(user), waitlist)
+
+    def leaveWaitlist(self, groupID: str, user: User) -> bool:
+        return self.shardFor(groupID).call("leaveWaitlist", groupID, self.userRecord(user))
+
+    def getWaitlistPosition(self, groupID: str, user: User) -> Optional[int]:
+        return self.shardFor(groupID).call("getWaitlistPosition", groupID, self.userRecord(user))
+
+    def searchStudyGroups(self, course: Optional[str] = None, location: Optional[str] = None,
+                          since: Optional[datetime] = None, before: Optional[datetime] = None,
+                          minOpenSeats: int = 0, limit: Optional[int] = None) -> List[StudyGroup]:
+        # Each shard returns its own first `limit` matches, soonest first; the overall first `limit` are among them.
+        results = self.gather("searchStudyGroups", course, location, since, before, minOpenSeats, limit)
+        groups = heapq.merge(*([self.studyGroupFrom(result) for result in shard] for shard in results), key=groupKey)
+        return list(islice(groups, limit))
+
+    def sendDirectMessage(self, sender: User, recipient: User, content: str) -> bool:
+        return self.shardFor(recipient.userName).call("sendDirectMessage", self.userRecord(sender),
+                                                      self.userRecord(recipient), content)
+
+    def sendGroupMessage(self, sender: User, group: StudyGroup, content: str) -> bool:
+        return self.shardFor(group.groupID).call("sendGroupMessage", self.userRecord(sender), group.groupID, content)
+
+    def broadcastGroupMessage(self, sender: User, groups: Iterable[StudyGroup], content: str) -> Dict[str, bool]:
+        # One batch per shard, all shards at once; statuses come back in the order the groups were given.
+        groupIDs = list(dict.fromkeys(group.groupID for group in groups))
+        byShard: Dict[int, List[str]] = {}
+        for groupID in groupIDs:
+            byShard.setdefault(shardOf(groupID, len(self.shards)), []).append(groupID)
+        record = self.userRecord(sender)
+        futures = [self.shards[index].submit("broadcastGroupMessage", record, shardGroupIDs, content)
+                   for index, shardGroupIDs in byShard.items()]
+        status: Dict[str, bool] = {}
+        for future in futures:
+            status.update(future.result())
+        return {groupID: status[groupID] for groupID in groupIDs}
+
+    def sendMessages(self, sender: User, conversation: Union[User, StudyGroup], contents: Iterable[str]) -> List[bool]:
+        if isinstance(conversation, StudyGroup):
+            return self.shardFor(conversation.groupID).call("sendMessages", self.userRecord(sender), conversation.groupID,
+                                                            None, list(contents))
+        return self.shardFor(conversation.userName).call("sendMessages", self.userRecord(sender), None,
+                                                         self.userRecord(conversation), list(contents))
+
+    def getMessage(self, recipient: User) -> Tuple[Message, ...]:
+        results = self.gather("getMessage", self.userRecord(recipient))
+        return tuple(heapq.merge(*(map(Message.fromRecord, rows) for rows in results), key=messageKey))
+
+    def getMessagePage(self, recipient: User, since: Optional[datetime] = None, before: Optional[datetime] = None,
+                       limit: Optional[int] = 50, cursor: Optional[str] = None) -> Iterator[Message]:
+        after = decodeCursor(cursor) if cursor is not None else None
+        results = self.gather("getMessagePage", self.userRecord(recipient), since, before, limit, after)
+        return islice(heapq.merge(*(map(Message.fromRecord, rows) for rows in results), key=messageKey, reverse=True),
+                      limit)
+
+    def getMessageCursor(self, message: Message) -> str:
+        return encodeCursor(message)
+
+    def searchMessages(self, user: User, query: str, limit: Optional[int] = 20) -> List[Message]:
+        results = self.gather("searchMessages", self.userRecord(user), query, limit)
+        return list(islice(heapq.merge(*(map(Message.fromRecord, rows) for rows in results), key=messageKey,
+                                       reverse=True), limit))
+
+    def markRead(self, user: User, conversation: Union[User, StudyGroup], upTo: Optional[Message] = None) -> bool:
+        after = messageKey(upTo) if upTo is not None else None
+        if isinstance(conversation, StudyGroup):
+            return self.shardFor(conversation.groupID).call("markRead", self.userRecord(user), conversation.groupID,
+                                                            None, after)
+        # Direct messages live with their recipient, so the ones `user` reads are all on the user's shard.
+        return self.shardFor(user.userName).call("markRead", self.userRecord(user), None, self.userRecord(conversation),
+                                                 after)
+
+    def getUnreadCounts(self, user: User) -> Dict[str, Dict[str, int]]:
+        # Each shard counts the groups and the direct messages it holds; a partner can appear on several.
+        totals: Dict[str, Dict[str, int]] = {"direct": {}, "groups": {}}
+        for counts in self.gather("getUnreadCounts", self.userRecord(user)):
+            for kind, byName in counts.items():
+                for name, unread in byName.items():
+                    totals[kind][name] = totals[kind].get(name, 0) + unread
+        return totals
+
+    def removeFromStudyGroup(self, groupID: str, user: User) -> bool:
+        return self.shardFor(groupID).call("removeFromStudyGroup", groupID, self.userRecord(user))
+
+    def getTimeClashes(self, groupID: str, user: User) -> List[StudyGroup]:
+        result = self.shardFor(groupID).call("getStudyGroup", groupID)
+        if result is None:
+            return []
+        clashes = [self.studyGroupFrom(clash) for clashes in self.gather("timeClashes", self.userRecord(user), result[0])
+                   for clash in clashes]
+        return sorted(clashes, key=groupKey)
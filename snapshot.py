@@ -0,0 +1,462 @@
+"""In-memory backend made durable by binary snapshots plus a write-ahead journal of later changes.
+
+Startup loads the newest snapshot and replays only the journal written since it, so a restart costs
+roughly one sequential read of the store instead of re-running every save and join.
+"""
+import glob
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from array import array
+from operator import attrgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from logconfig import logger
+from storage import GroupRecord, MembershipRecord, MemoryStorage, MessageRecord, UserRecord
+
+SNAPSHOT_MAGIC = b"CCSNAP01"
+# pickle length, pickle crc32, out-of-band buffer count
+SNAPSHOT_HEADER = struct.Struct("<QII")
+BUFFER_HEADER = struct.Struct("<QI")  # length, crc32
+# Every journal entry is a pickled (operation, argument) pair behind its length and crc32.
+FRAME_HEADER = struct.Struct("<II")
+SNAPSHOT_SUFFIX = ".snap"
+JOURNAL_SUFFIX = ".journal"
+messageRow = attrgetter("seq", "sender", "recipient", "group", "content", "timestampUs")
+
+
+def generationOf(path: str) -> int:
+    return int(os.path.basename(path).split(".")[0])
+
+
+def rowsOf(messages: List, chunk: int = 2048) -> Iterator[MessageRecord]:
+    # Runs on the snapshot thread: yield the GIL between chunks so request threads are not starved meanwhile.
+    for start in range(0, len(messages), chunk):
+        yield from map(messageRow, messages[start:start + chunk])
+        time.sleep(0)
+
+
+def encodeNames(values: Iterable[Optional[str]], names: Dict[Optional[str], int]) -> array:
+    # Sender, recipient and group names repeat heavily, so each column is stored as codes into one shared table.
+    codes = array("i")
+    for value in values:
+        code = names.get(value)
+        if code is None:
+            code = names[value] = len(names)
+        codes.append(code)
+    return codes
+
+
+def encodeMessages(rows: List[MessageRecord]) -> dict:
+    if not rows:
+        return {"count": 0}
+    seqs, senders, recipients, groups, contents, timestamps = zip(*rows)
+    names: Dict[Optional[str], int] = {None: 0}
+    columns = {
+        "count": len(rows),
+        "seqs": array("q", seqs),
+        "timestamps": array("q", timestamps),
+        "senders": encodeNames(senders, names),
+        "recipients": encodeNames(recipients, names),
+        "groups": encodeNames(groups, names),
+        "contents": list(contents),
+    }
+    columns["names"] = list(names)
+    # Arrays travel as out-of-band buffers: written and read back as raw bytes, never copied through pickle.
+    return {key: pickle.PickleBuffer(value) if isinstance(value, array) else value for key, value in columns.items()}
+
+
+def decodeMessages(columns: dict) -> List[MessageRecord]:
+    if not columns["count"]:
+        return []
+    arrays = {}
+    for key, typecode in (("seqs", "q"), ("timestamps", "q"), ("senders", "i"), ("recipients", "i"), ("groups", "i")):
+        arrays[key] = array(typecode)
+        arrays[key].frombytes(columns[key])
+    lookup = columns["names"].__getitem__
+    return list(zip(arrays["seqs"], map(lookup, arrays["senders"]), map(lookup, arrays["recipients"]),
+                    map(lookup, arrays["groups"]), columns["contents"], arrays["timestamps"]))
+
+
+class SnapshotStorage(MemoryStorage):
+    """MemoryStorage that journals every change to `directory` and restores from it on open.
+
+    Like SQLiteStorage's batched commits, journal entries are flushed and fsynced within about
+    `flushInterval` seconds, by a background thread once writes stop, and at once by flush() and
+    close(). Once `snapshotEvery` changes have been
+    journaled, a snapshot starts in the background: the store is copied under the lock (pointer
+    copies only), the journal rotates to a new generation, and a writer thread encodes and writes
+    the copy while new changes keep going to the new journal. Files from before the finished
+    snapshot are then deleted.
+    """
+
+    def __init__(self, directory: str, snapshotEvery: Optional[int] = 1000000, flushInterval: float = 0.05):
+        super().__init__()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.snapshotEvery = snapshotEvery
+        self.flushInterval = flushInterval
+        self.lock = threading.RLock()
+        self.users: Dict[str, UserRecord] = {}
+        self.groups: Dict[str, GroupRecord] = {}
+        # Dicts as insertion-ordered sets, so loadMemberships/loadWaitlists keep join order.
+        self.memberships: Dict[MembershipRecord, None] = {}
+        self.waitlists: Dict[MembershipRecord, None] = {}
+        # Message records until DatabaseManager attaches its messageFactory; see the property below.
+        self.records: Optional[List[MessageRecord]] = []
+        self.factory = tuple
+        self.snapshotThread: Optional[threading.Thread] = None
+        self.journaled = 0
+        self.lastFlush = time.monotonic()
+        self.closed = False
+        self.unsynced = False  # Entries written since the last fsync
+        self.generation = self.restore()
+        self.journal = open(self.path(self.generation, JOURNAL_SUFFIX), "ab")
+        self.stopSyncer = threading.Event()
+        self.syncer = threading.Thread(target=self.syncDue, name="journal-syncer", daemon=True)
+        self.syncer.start()
+
+    @property
+    def messageFactory(self):
+        return self.factory
+
+    @messageFactory.setter
+    def messageFactory(self, factory) -> None:
+        # Restored messages are plain records; they become the caller's objects once it says how to build them.
+        with self.lock:
+            self.factory = factory
+            if self.records is not None:
+                records, self.records = self.records, None
+                MemoryStorage.replaceMessages(self, [factory(record) for record in records])
+
+    def path(self, generation: int, suffix: str) -> str:
+        return os.path.join(self.directory, f"{generation:08d}{suffix}")
+
+    def files(self, suffix: str) -> List[Tuple[int, str]]:
+        return sorted((generationOf(path), path) for path in glob.glob(os.path.join(self.directory, "*" + suffix)))
+
+    def restore(self) -> int:
+        """Load the newest snapshot and replay the journals after it; returns the generation to append to."""
+        snapshots = self.files(SNAPSHOT_SUFFIX)
+        generation = 0
+        if snapshots:
+            generation, path = snapshots[-1]
+            self.readSnapshot(path)
+        replayed = 0
+        for journalGeneration, path in self.files(JOURNAL_SUFFIX):
+            if journalGeneration >= generation:
+                replayed += self.replay(path)
+                generation = journalGeneration
+        self.journaled = replayed
+        if snapshots or replayed:
+            logger.info("Restored %s users, %s groups and %s messages from %s (%s journal entries replayed).",
+                        len(self.users), len(self.groups), len(self.records), self.directory, replayed)
+        return generation
+
+    def readSnapshot(self, path: str) -> None:
+        with open(path, "rb") as f:
+            data = memoryview(f.read())
+        if bytes(data[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            raise ValueError(f"Not a snapshot file: {path}")
+        position = len(SNAPSHOT_MAGIC)
+        length, checksum, bufferCount = SNAPSHOT_HEADER.unpack_from(data, position)
+        position += SNAPSHOT_HEADER.size
+        payload = data[position:position + length]
+        position += length
+        buffers = []
+        for _ in range(bufferCount):
+            bufferLength, bufferChecksum = BUFFER_HEADER.unpack_from(data, position)
+            position += BUFFER_HEADER.size
+            buffers.append(data[position:position + bufferLength])
+            position += bufferLength
+            if zlib.crc32(buffers[-1]) != bufferChecksum:
+                raise ValueError(f"Corrupt snapshot buffer in {path}")
+        if zlib.crc32(payload) != checksum:
+            raise ValueError(f"Corrupt snapshot in {path}")
+        state = pickle.loads(payload, buffers=buffers)
+        self.users = {record[0]: record for record in state["users"]}
+        self.groups = {record[0]: record for record in state["groups"]}
+        self.memberships = dict.fromkeys(state["memberships"])
+        self.waitlists = dict.fromkeys(state["waitlists"])
+        # Snapshots written before read cursors existed have none.
+        self.readCursors = {(userName, conversation): seq for userName, conversation, seq in state.get("readCursors", ())}
+        self.records = decodeMessages(state["messages"])
+
+    def replay(self, path: str) -> int:
+        with open(path, "rb") as f:
+            data = f.read()
+        position = replayed = 0
+        while position + FRAME_HEADER.size <= len(data):
+            length, checksum = FRAME_HEADER.unpack_from(data, position)
+            frame = data[position + FRAME_HEADER.size:position + FRAME_HEADER.size + length]
+            if len(frame) < length or zlib.crc32(frame) != checksum:
+                break
+            operation, argument = pickle.loads(frame)
+            self.apply(operation, argument)
+            position += FRAME_HEADER.size + length
+            replayed += 1
+        if position < len(data):
+            # A torn final write: drop it so new entries are not appended after garbage.
+            logger.warning("Discarding %s bytes of incomplete journal at the end of %s.", len(data) - position, path)
+            with open(path, "r+b") as f:
+                f.truncate(position)
+        return replayed
+
+    def apply(self, operation: str, argument) -> None:
+        # Replays one journal entry onto the restored records; live writes update the same state directly.
+        if operation == "saveUser":
+            self.users[argument[0]] = argument
+        elif operation == "removeUser":
+            self.dropUser(argument)
+        elif operation == "updatePassword":
+            userID, password = argument
+            self.users[userID] = self.users[userID][:2] + (password,) + self.users[userID][3:]
+        elif operation == "saveStudyGroup":
+            record, memberIDs, waitlistIDs = argument
+            self.groups[record[0]] = record
+            self.memberships.update(dict.fromkeys((record[0], userID) for userID in memberIDs))
+            self.waitlists.update(dict.fromkeys((record[0], userID) for userID in waitlistIDs))
+        elif operation == "removeStudyGroup":
+            self.dropGroup(argument)
+        elif operation == "saveMembership":
+            self.memberships[argument] = None
+        elif operation == "removeMembership":
+            self.memberships.pop(argument, None)
+        elif operation == "saveWaitlistEntry":
+            self.waitlists[argument] = None
+        elif operation == "removeWaitlistEntry":
+            self.waitlists.pop(argument, None)
+        elif operation == "saveMessage":
+            self.records.append(argument)
+        elif operation == "saveMessages":
+            self.records.extend(argument)
+        elif operation == "replaceMessages":
+            self.records = list(argument)
+        elif operation == "removeMessages":
+            seqs = set(argument)
+            self.records = [record for record in self.records if record[0] not in seqs]
+        elif operation == "saveReadCursor":
+            userName, conversation, seq = argument
+            self.readCursors[(userName, conversation)] = seq
+        else:
+            raise ValueError(f"Unknown journal operation: {operation}")
+
+    def dropUser(self, userID: str) -> None:
+        # Memberships and waitlist places go with the user, even in journals written before removals cascaded.
+        self.users.pop(userID, None)
+        for entries in (self.memberships, self.waitlists):
+            for key in [key for key in entries if key[1] == userID]:
+                del entries[key]
+
+    def dropGroup(self, groupID: str) -> None:
+        self.groups.pop(groupID, None)
+        for entries in (self.memberships, self.waitlists):
+            for key in [key for key in entries if key[0] == groupID]:
+                del entries[key]
+
+    def write(self, operation: str, argument) -> None:
+        # Caller holds self.lock, so journal order is the order changes were applied in.
+        frame = pickle.dumps((operation, argument), protocol=5)
+        self.journal.write(FRAME_HEADER.pack(len(frame), zlib.crc32(frame)) + frame)
+        self.journaled += 1
+        self.unsynced = True
+        now = time.monotonic()
+        if now - self.lastFlush >= self.flushInterval:
+            self.journal.flush()
+            self.lastFlush = now
+        if self.snapshotEvery is not None and self.journaled >= self.snapshotEvery and self.snapshotThread is None:
+            self.snapshot(wait=False)
+
+    def saveUser(self, user) -> None:
+        record = (user.userID, user.userName, user.password, user.email)
+        with self.lock:
+            self.write("saveUser", record)
+            self.users[user.userID] = record
+
+    def removeUser(self, user) -> None:
+        with self.lock:
+            self.write("removeUser", user.userID)
+            self.dropUser(user.userID)
+
+    def updatePassword(self, user) -> None:
+        with self.lock:
+            self.write("updatePassword", (user.userID, user.password))
+            self.apply("updatePassword", (user.userID, user.password))
+
+    def saveStudyGroup(self, studyGroup) -> None:
+        record = (studyGroup.groupID, studyGroup.groupName, studyGroup.course, studyGroup.location, studyGroup.date,
+                  studyGroup.maxSize, studyGroup.duration)
+        argument = (record, [member.userID for member in studyGroup.members], list(studyGroup.waitlist))
+        with self.lock:
+            self.write("saveStudyGroup", argument)
+            self.apply("saveStudyGroup", argument)
+
+    def removeStudyGroup(self, studyGroup) -> None:
+        with self.lock:
+            self.write("removeStudyGroup", studyGroup.groupID)
+            self.dropGroup(studyGroup.groupID)
+
+    def saveMembership(self, studyGroup, user) -> None:
+        with self.lock:
+            self.write("saveMembership", (studyGroup.groupID, user.userID))
+            self.memberships[(studyGroup.groupID, user.userID)] = None
+
+    def removeMembership(self, studyGroup, user) -> None:
+        with self.lock:
+            self.write("removeMembership", (studyGroup.groupID, user.userID))
+            self.memberships.pop((studyGroup.groupID, user.userID), None)
+
+    def saveWaitlistEntry(self, studyGroup, user) -> None:
+        with self.lock:
+            self.write("saveWaitlistEntry", (studyGroup.groupID, user.userID))
+            self.waitlists[(studyGroup.groupID, user.userID)] = None
+
+    def removeWaitlistEntry(self, studyGroup, user) -> None:
+        with self.lock:
+            self.write("removeWaitlistEntry", (studyGroup.groupID, user.userID))
+            self.waitlists.pop((studyGroup.groupID, user.userID), None)
+
+    def saveMessage(self, message) -> None:
+        with self.lock:
+            self.write("saveMessage", messageRow(message))
+            if self.records is not None:
+                self.records.append(messageRow(message))
+            else:
+                super().saveMessage(message)
+
+    def saveMessages(self, messages: List) -> None:
+        rows = [messageRow(message) for message in messages]
+        with self.lock:
+            self.write("saveMessages", rows)
+            if self.records is not None:
+                self.records.extend(rows)
+            else:
+                super().saveMessages(messages)
+
+    def replaceMessages(self, messages: List) -> None:
+        with self.lock:
+            self.write("replaceMessages", [messageRow(message) for message in messages])
+            if self.records is not None:
+                self.records = [messageRow(message) for message in messages]
+            else:
+                super().replaceMessages(messages)
+
+    def removeMessages(self, messages: List) -> None:
+        seqs = {message.seq for message in messages}
+        with self.lock:
+            self.write("removeMessages", sorted(seqs))
+            if self.records is not None:
+                self.apply("removeMessages", seqs)
+            else:
+                MemoryStorage.replaceMessages(self, [message for message in self.messages if message.seq not in seqs])
+
+    def saveReadCursor(self, userName: str, conversation: str, seq: int) -> None:
+        with self.lock:
+            self.write("saveReadCursor", (userName, conversation, seq))
+            self.readCursors[(userName, conversation)] = seq
+
+    def loadUsers(self) -> Iterable[UserRecord]:
+        return list(self.users.values())
+
+    def loadStudyGroups(self) -> Iterable[GroupRecord]:
+        return list(self.groups.values())
+
+    def loadMemberships(self) -> Iterable[MembershipRecord]:
+        return list(self.memberships)
+
+    def loadWaitlists(self) -> Iterable[MembershipRecord]:
+        return list(self.waitlists)
+
+    def lastMessageSeq(self) -> int:
+        if self.records is not None:
+            return self.records[-1][0] if self.records else 0
+        return super().lastMessageSeq()
+
+    def snapshot(self, wait: bool = True) -> Optional[threading.Thread]:
+        """Start a snapshot of the current state; with wait=False return the writer thread instead of joining it."""
+        with self.lock:
+            if self.snapshotThread is not None:
+                thread = self.snapshotThread
+            else:
+                state = {"users": list(self.users.values()), "groups": list(self.groups.values()),
+                         "memberships": list(self.memberships), "waitlists": list(self.waitlists),
+                         "readCursors": self.loadReadCursors()}
+                messages = list(self.records) if self.records is not None else list(self.messages)
+                isRecords = self.records is not None
+                # Everything after this point goes to the next generation's journal.
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+                self.journal.close()
+                self.generation += 1
+                self.journal = open(self.path(self.generation, JOURNAL_SUFFIX), "ab")
+                self.journaled = 0
+                thread = self.snapshotThread = threading.Thread(
+                    target=self.writeSnapshot, args=(state, messages, isRecords, self.generation),
+                    name="snapshot-writer", daemon=True)
+                thread.start()
+        if wait:
+            thread.join()
+            return None
+        return thread
+
+    def writeSnapshot(self, state: dict, messages: List, isRecords: bool, generation: int) -> None:
+        try:
+            started = time.monotonic()
+            if not isRecords:
+                messages = list(rowsOf(messages))
+            state["messages"] = encodeMessages(messages)
+            buffers: List[pickle.PickleBuffer] = []
+            payload = pickle.dumps(state, protocol=5, buffer_callback=buffers.append)
+            path = self.path(generation, SNAPSHOT_SUFFIX)
+            with open(path + ".tmp", "wb") as f:
+                f.write(SNAPSHOT_MAGIC + SNAPSHOT_HEADER.pack(len(payload), zlib.crc32(payload), len(buffers)))
+                f.write(payload)
+                for buffer in buffers:
+                    raw = buffer.raw()
+                    f.write(BUFFER_HEADER.pack(raw.nbytes, zlib.crc32(raw)))
+                    f.write(raw)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            # The new snapshot plus its journal now cover everything, so older files can go.
+            for suffix in (SNAPSHOT_SUFFIX, JOURNAL_SUFFIX):
+                for oldGeneration, oldPath in self.files(suffix):
+                    if oldGeneration < generation:
+                        os.remove(oldPath)
+            logger.info("Snapshot %s written in %.2fs: %s messages, %s bytes.", generation, time.monotonic() - started,
+                        len(messages), os.path.getsize(path))
+        except Exception:
+            logger.exception("Snapshot %s failed; the journal still holds every change.", generation)
+        finally:
+            with self.lock:
+                self.snapshotThread = None
+
+    def syncDue(self) -> None:
+        while not self.stopSyncer.wait(self.flushInterval):
+            if self.unsynced:
+                self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            if not self.closed:
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+                self.lastFlush = time.monotonic()
+                self.unsynced = False
+
+    def close(self) -> None:
+        self.stopSyncer.set()
+        if threading.current_thread() is not self.syncer:
+            self.syncer.join()
+        thread = self.snapshotThread
+        if thread is not None:
+            thread.join()
+        with self.lock:
+            if self.closed:
+                return
+            self.flush()
+            self.journal.close()
+            self.closed = True
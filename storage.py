@@ -0,0 +1,552 @@
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from compact import ONE_MICROSECOND, fromMicros, toMicros
+from inbox import Inbox, bySeq, decodeCursor
+
+# Plain records exchanged with the backends, so storage never has to import the models.
+UserRecord = Tuple[str, str, str, str]  # userID, userName, password, email
+GroupRecord = Tuple[str, str, str, str, datetime, int, Optional[timedelta]]  # groupID, groupName, course, location, date, maxSize, duration
+MembershipRecord = Tuple[str, str]  # groupID, userID
+MessageRecord = Tuple[int, str, Optional[str], Optional[str], str, int]  # seq, sender, recipient, group, content, timestampUs
+ReadCursorRecord = Tuple[str, str, int]  # userName, conversation ("#groupName" or "@userName"), seq of the last message read
+
+
+class Storage(ABC):
+    """Persistence interface behind DatabaseManager: users, groups, memberships, waitlists and messages.
+
+    DatabaseManager keeps the live User/StudyGroup objects and writes every change through to the
+    backend. Messages are read back from the backend, built with `messageFactory` when the backend
+    does not hold Message objects itself.
+    """
+
+    messageFactory: Callable[[MessageRecord], object] = tuple
+
+    @abstractmethod
+    def saveUser(self, user) -> None: ...
+
+    @abstractmethod
+    def removeUser(self, user) -> None: ...
+
+    def updatePassword(self, user) -> None:
+        """Persist a new password hash for an already saved user."""
+
+    @abstractmethod
+    def saveStudyGroup(self, studyGroup) -> None: ...
+
+    @abstractmethod
+    def removeStudyGroup(self, studyGroup) -> None: ...
+
+    @abstractmethod
+    def saveMembership(self, studyGroup, user) -> None: ...
+
+    @abstractmethod
+    def removeMembership(self, studyGroup, user) -> None: ...
+
+    @abstractmethod
+    def saveWaitlistEntry(self, studyGroup, user) -> None:
+        """Append `user` to the group's waitlist; loadWaitlists returns entries in this order."""
+
+    @abstractmethod
+    def removeWaitlistEntry(self, studyGroup, user) -> None: ...
+
+    @abstractmethod
+    def saveMessage(self, message) -> None: ...
+
+    def saveMessages(self, messages: List) -> None:
+        """Append a batch of messages, in seq order, as one write where the backend allows."""
+        for message in messages:
+            self.saveMessage(message)
+
+    @abstractmethod
+    def messagesFor(self, userName: str, groupNames: Iterable[str]) -> List:
+        """All messages visible to a user, oldest first."""
+
+    @abstractmethod
+    def iterMessagesFor(self, userName: str, groupNames: Iterable[str], since: Optional[datetime] = None,
+                        before: Optional[datetime] = None, limit: Optional[int] = None,
+                        cursor: Optional[str] = None) -> Iterator:
+        """Lazily yield visible messages newest first, within [since, before) and older than `cursor`."""
+
+    @abstractmethod
+    def allMessages(self) -> List: ...
+
+    @abstractmethod
+    def replaceMessages(self, messages: List) -> None: ...
+
+    @abstractmethod
+    def loadUsers(self) -> Iterable[UserRecord]: ...
+
+    @abstractmethod
+    def loadStudyGroups(self) -> Iterable[GroupRecord]: ...
+
+    @abstractmethod
+    def loadMemberships(self) -> Iterable[MembershipRecord]: ...
+
+    @abstractmethod
+    def loadWaitlists(self) -> Iterable[MembershipRecord]: ...
+
+    @abstractmethod
+    def lastMessageSeq(self) -> int: ...
+
+    def saveReadCursor(self, userName: str, conversation: str, seq: int) -> None:
+        """Persist how far a user has read a conversation, replacing any earlier cursor for it."""
+
+    def loadReadCursors(self) -> Iterable[ReadCursorRecord]:
+        return []
+
+    def messagesBySeq(self, seqs: Iterable[int]) -> List:
+        """The messages with these seqs, in the order given; seqs no longer in the store are skipped."""
+        seqs = list(seqs)
+        wanted = set(seqs)
+        found = {message.seq: message for message in self.allMessages() if message.seq in wanted}
+        return [found[seq] for seq in seqs if seq in found]
+
+    def messagesBefore(self, timestampUs: int) -> List:
+        """Messages older than `timestampUs`, oldest first: the candidates for archiving."""
+        return [message for message in self.allMessages() if message.timestampUs < timestampUs]
+
+    def removeMessages(self, messages: List) -> None:
+        """Drop messages that have been archived from the hot store."""
+        seqs = {message.seq for message in messages}
+        self.replaceMessages([message for message in self.allMessages() if message.seq not in seqs])
+
+    @contextmanager
+    def transaction(self):
+        yield
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class MemoryStorage(Storage):
+    """Default backend. The live objects held by DatabaseManager are the user/group store, so only messages
+    and read cursors are kept here."""
+
+    def __init__(self):
+        self.messages: List = []
+        self.inbox = Inbox()
+        self.readCursors: Dict[Tuple[str, str], int] = {}
+
+    def saveUser(self, user) -> None:
+        pass
+
+    def removeUser(self, user) -> None:
+        pass
+
+    def saveStudyGroup(self, studyGroup) -> None:
+        pass
+
+    def removeStudyGroup(self, studyGroup) -> None:
+        pass
+
+    def saveMembership(self, studyGroup, user) -> None:
+        pass
+
+    def removeMembership(self, studyGroup, user) -> None:
+        pass
+
+    def saveWaitlistEntry(self, studyGroup, user) -> None:
+        pass
+
+    def removeWaitlistEntry(self, studyGroup, user) -> None:
+        pass
+
+    def saveMessage(self, message) -> None:
+        self.messages.append(message)
+        self.inbox.append(message)
+
+    def saveMessages(self, messages: List) -> None:
+        self.messages.extend(messages)
+        for message in messages:
+            self.inbox.append(message)
+
+    def messagesFor(self, userName: str, groupNames: Iterable[str]) -> List:
+        return self.inbox.messagesFor(userName, groupNames)
+
+    def iterMessagesFor(self, userName: str, groupNames: Iterable[str], since: Optional[datetime] = None,
+                        before: Optional[datetime] = None, limit: Optional[int] = None,
+                        cursor: Optional[str] = None) -> Iterator:
+        return self.inbox.iterMessagesFor(userName, groupNames, since=since, before=before, limit=limit, cursor=cursor)
+
+    def allMessages(self) -> List:
+        return self.messages
+
+    def messagesBySeq(self, seqs: Iterable[int]) -> List:
+        # messages is in seq order, so each lookup is a bisection.
+        messages = self.messages
+        found = []
+        for seq in seqs:
+            i = bisect_left(messages, seq, key=bySeq)
+            if i < len(messages) and messages[i].seq == seq:
+                found.append(messages[i])
+        return found
+
+    def replaceMessages(self, messages: List) -> None:
+        self.messages = messages
+        self.inbox.clear()
+        for message in messages:
+            self.inbox.append(message)
+
+    def saveReadCursor(self, userName: str, conversation: str, seq: int) -> None:
+        self.readCursors[(userName, conversation)] = seq
+
+    def loadReadCursors(self) -> Iterable[ReadCursorRecord]:
+        return [(userName, conversation, seq) for (userName, conversation), seq in self.readCursors.items()]
+
+    def loadUsers(self) -> Iterable[UserRecord]:
+        return []
+
+    def loadStudyGroups(self) -> Iterable[GroupRecord]:
+        return []
+
+    def loadMemberships(self) -> Iterable[MembershipRecord]:
+        return []
+
+    def loadWaitlists(self) -> Iterable[MembershipRecord]:
+        return []
+
+    def lastMessageSeq(self) -> int:
+        return self.messages[-1].seq if self.messages else 0
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    userID TEXT PRIMARY KEY,
+    userName TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    email TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS studyGroups (
+    groupID TEXT PRIMARY KEY,
+    groupName TEXT NOT NULL UNIQUE,
+    course TEXT NOT NULL,
+    location TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    maxSize INTEGER NOT NULL,
+    duration INTEGER
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    groupID TEXT NOT NULL,
+    userID TEXT NOT NULL,
+    UNIQUE (groupID, userID)
+);
+CREATE INDEX IF NOT EXISTS membershipsByUser ON memberships (userID);
+CREATE TABLE IF NOT EXISTS waitlists (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    groupID TEXT NOT NULL,
+    userID TEXT NOT NULL,
+    UNIQUE (groupID, userID)
+);
+CREATE INDEX IF NOT EXISTS waitlistsByUser ON waitlists (userID);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY,
+    sender TEXT NOT NULL,
+    recipient TEXT,
+    groupName TEXT,
+    content TEXT NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directMessages ON messages (recipient, seq) WHERE groupName IS NULL;
+CREATE INDEX IF NOT EXISTS groupMessages ON messages (groupName, seq) WHERE groupName IS NOT NULL;
+CREATE TABLE IF NOT EXISTS readCursors (
+    userName TEXT NOT NULL,
+    conversation TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (userName, conversation)
+);
+"""
+
+INSERT_USER = "INSERT INTO users (userID, userName, password, email) VALUES (?, ?, ?, ?)"
+DELETE_USER = "DELETE FROM users WHERE userID = ?"
+DELETE_USER_MEMBERSHIPS = "DELETE FROM memberships WHERE userID = ?"
+DELETE_USER_WAITLISTS = "DELETE FROM waitlists WHERE userID = ?"
+UPDATE_PASSWORD = "UPDATE users SET password = ? WHERE userID = ?"
+INSERT_GROUP = "INSERT INTO studyGroups (groupID, groupName, course, location, date, maxSize, duration) VALUES (?, ?, ?, ?, ?, ?, ?)"
+DELETE_GROUP = "DELETE FROM studyGroups WHERE groupID = ?"
+DELETE_GROUP_MEMBERSHIPS = "DELETE FROM memberships WHERE groupID = ?"
+INSERT_MEMBERSHIP = "INSERT OR IGNORE INTO memberships (groupID, userID) VALUES (?, ?)"
+DELETE_MEMBERSHIP = "DELETE FROM memberships WHERE groupID = ? AND userID = ?"
+DELETE_GROUP_WAITLIST = "DELETE FROM waitlists WHERE groupID = ?"
+INSERT_WAITLIST_ENTRY = "INSERT OR IGNORE INTO waitlists (groupID, userID) VALUES (?, ?)"
+DELETE_WAITLIST_ENTRY = "DELETE FROM waitlists WHERE groupID = ? AND userID = ?"
+DELETE_MESSAGE = "DELETE FROM messages WHERE seq = ?"
+INSERT_MESSAGE = "INSERT INTO messages (seq, sender, recipient, groupName, content, timestamp) VALUES (?, ?, ?, ?, ?, ?)"
+UPSERT_READ_CURSOR = "INSERT OR REPLACE INTO readCursors (userName, conversation, seq) VALUES (?, ?, ?)"
+MESSAGE_COLUMNS = "seq, sender, recipient, groupName, content, timestamp"
+
+
+class SQLiteStorage(Storage):
+    """SQLite backend in WAL mode. Writes are batched into one transaction and committed every
+    `batchSize` writes or within `flushInterval` seconds of the batch's first write, by a background
+    thread if no later write does it; call flush() or close() to force a commit."""
+
+    def __init__(self, path: str = ":memory:", batchSize: int = 256, flushInterval: float = 0.05):
+        # Autocommit mode: transactions are opened and committed explicitly below.
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False, cached_statements=512)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.migrate()
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.pendingWrites = 0
+        self.batchStarted = 0.0
+        self.transactionDepth = 0
+        self.lock = threading.RLock()
+        self.closed = False
+        self.stopCommitter = threading.Event()
+        self.committer = threading.Thread(target=self.commitDue, name="sqlite-committer", daemon=True)
+        self.committer.start()
+
+    def commitDue(self) -> None:
+        # Commits a batch that no later write has, so a lone or final write is durable within flushInterval too.
+        timeout = self.flushInterval
+        while not self.stopCommitter.wait(timeout):
+            with self.lock:
+                timeout = self.flushInterval
+                if self.closed:
+                    return
+                if self.transactionDepth == 0 and self.connection.in_transaction:
+                    age = time.monotonic() - self.batchStarted
+                    if age >= self.flushInterval:
+                        self.commit()
+                    else:
+                        timeout = self.flushInterval - age
+
+    def migrate(self) -> None:
+        # Files created before sessions had a duration (stored in microseconds, NULL for unscheduled groups).
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(studyGroups)")}
+        if "duration" not in columns:
+            self.connection.execute("ALTER TABLE studyGroups ADD COLUMN duration INTEGER")
+
+    def begin(self) -> None:
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN")
+            self.batchStarted = time.monotonic()
+
+    def write(self, sql: str, params: tuple) -> None:
+        with self.lock:
+            self.begin()
+            self.connection.execute(sql, params)
+            self.batched(1)
+
+    def batched(self, writes: int) -> None:
+        # Caller holds self.lock. Count writes into the open batch and commit it once it is due.
+        self.pendingWrites += writes
+        if self.transactionDepth == 0 and (
+            self.pendingWrites >= self.batchSize or time.monotonic() - self.batchStarted >= self.flushInterval
+        ):
+            self.commit()
+
+    def writeMany(self, sql: str, rows: Iterable[tuple]) -> None:
+        with self.lock:
+            self.begin()
+            self.connection.executemany(sql, rows)
+            self.pendingWrites += 1
+            if self.transactionDepth == 0:
+                self.commit()
+
+    def commit(self) -> None:
+        if self.connection.in_transaction:
+            self.connection.execute("COMMIT")
+        self.pendingWrites = 0
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            if self.transactionDepth == 0:
+                # Commit the pending batch first so a rollback only discards this transaction's writes.
+                self.commit()
+                self.begin()
+            self.transactionDepth += 1
+            try:
+                yield
+            except BaseException:
+                self.transactionDepth -= 1
+                if self.transactionDepth == 0 and self.connection.in_transaction:
+                    self.connection.execute("ROLLBACK")
+                    self.pendingWrites = 0
+                raise
+            self.transactionDepth -= 1
+            if self.transactionDepth == 0:
+                self.commit()
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.transactionDepth == 0:
+                self.commit()
+
+    def close(self) -> None:
+        self.stopCommitter.set()
+        if threading.current_thread() is not self.committer:
+            self.committer.join()
+        with self.lock:
+            if self.closed:
+                return
+            self.flush()
+            self.connection.close()
+            self.closed = True
+
+    def saveUser(self, user) -> None:
+        self.write(INSERT_USER, (user.userID, user.userName, user.password, user.email))
+
+    def removeUser(self, user) -> None:
+        with self.transaction():
+            self.write(DELETE_USER_MEMBERSHIPS, (user.userID,))
+            self.write(DELETE_USER_WAITLISTS, (user.userID,))
+            self.write(DELETE_USER, (user.userID,))
+
+    def updatePassword(self, user) -> None:
+        self.write(UPDATE_PASSWORD, (user.password, user.userID))
+
+    def saveStudyGroup(self, studyGroup) -> None:
+        with self.transaction():
+            self.write(INSERT_GROUP, (studyGroup.groupID, studyGroup.groupName, studyGroup.course,
+                                      studyGroup.location, toMicros(studyGroup.date), studyGroup.maxSize,
+                                      studyGroup.duration // ONE_MICROSECOND if studyGroup.duration is not None else None))
+            for member in studyGroup.members:
+                self.write(INSERT_MEMBERSHIP, (studyGroup.groupID, member.userID))
+            for user in studyGroup.waitlist.values():
+                self.write(INSERT_WAITLIST_ENTRY, (studyGroup.groupID, user.userID))
+
+    def removeStudyGroup(self, studyGroup) -> None:
+        with self.transaction():
+            self.write(DELETE_GROUP_MEMBERSHIPS, (studyGroup.groupID,))
+            self.write(DELETE_GROUP_WAITLIST, (studyGroup.groupID,))
+            self.write(DELETE_GROUP, (studyGroup.groupID,))
+
+    def saveMembership(self, studyGroup, user) -> None:
+        self.write(INSERT_MEMBERSHIP, (studyGroup.groupID, user.userID))
+
+    def removeMembership(self, studyGroup, user) -> None:
+        self.write(DELETE_MEMBERSHIP, (studyGroup.groupID, user.userID))
+
+    def saveWaitlistEntry(self, studyGroup, user) -> None:
+        self.write(INSERT_WAITLIST_ENTRY, (studyGroup.groupID, user.userID))
+
+    def removeWaitlistEntry(self, studyGroup, user) -> None:
+        self.write(DELETE_WAITLIST_ENTRY, (studyGroup.groupID, user.userID))
+
+    @staticmethod
+    def messageRow(message) -> tuple:
+        return (message.seq, message.sender, message.recipient, message.group, message.content, message.timestampUs)
+
+    def saveMessage(self, message) -> None:
+        self.write(INSERT_MESSAGE, self.messageRow(message))
+
+    def saveMessages(self, messages: List) -> None:
+        # One executemany, committed on the same schedule as single saves.
+        rows = [self.messageRow(message) for message in messages]
+        with self.lock:
+            self.begin()
+            self.connection.executemany(INSERT_MESSAGE, rows)
+            self.batched(len(rows))
+
+    def toMessage(self, row: tuple):
+        return self.messageFactory(row)
+
+    def visibleClause(self, userName: str, groupNames: List[str]) -> Tuple[str, list]:
+        clause = "(groupName IS NULL AND recipient = ?)"
+        params: list = [userName]
+        if groupNames:
+            clause = f"({clause} OR groupName IN ({', '.join('?' * len(groupNames))}))"
+            params.extend(groupNames)
+        return clause, params
+
+    def messagesFor(self, userName: str, groupNames: Iterable[str]) -> List:
+        clause, params = self.visibleClause(userName, list(groupNames))
+        with self.lock:
+            rows = self.connection.execute(f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE {clause} ORDER BY seq", params).fetchall()
+        return [self.toMessage(row) for row in rows]
+
+    def iterMessagesFor(self, userName: str, groupNames: Iterable[str], since: Optional[datetime] = None,
+                        before: Optional[datetime] = None, limit: Optional[int] = None,
+                        cursor: Optional[str] = None) -> Iterator:
+        clause, params = self.visibleClause(userName, list(groupNames))
+        if cursor is not None:
+            clause += " AND seq < ?"
+            params.append(decodeCursor(cursor))
+        if since is not None:
+            clause += " AND timestamp >= ?"
+            params.append(toMicros(since))
+        if before is not None:
+            clause += " AND timestamp < ?"
+            params.append(toMicros(before))
+        params.append(-1 if limit is None else limit)
+        sql = f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE {clause} ORDER BY seq DESC LIMIT ?"
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        return (self.toMessage(row) for row in rows)
+
+    def allMessages(self) -> List:
+        with self.lock:
+            rows = self.connection.execute(f"SELECT {MESSAGE_COLUMNS} FROM messages ORDER BY seq").fetchall()
+        return [self.toMessage(row) for row in rows]
+
+    def messagesBySeq(self, seqs: Iterable[int]) -> List:
+        seqs = list(seqs)
+        rows = {}
+        # In chunks, to stay under SQLite's limit on bound parameters.
+        for start in range(0, len(seqs), 500):
+            chunk = seqs[start:start + 500]
+            with self.lock:
+                rows.update((row[0], row) for row in self.connection.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE seq IN ({', '.join('?' * len(chunk))})", chunk))
+        return [self.toMessage(rows[seq]) for seq in seqs if seq in rows]
+
+    def replaceMessages(self, messages: List) -> None:
+        with self.transaction():
+            self.write("DELETE FROM messages", ())
+            self.writeMany(INSERT_MESSAGE, (self.messageRow(message) for message in messages))
+
+    def messagesBefore(self, timestampUs: int) -> List:
+        with self.lock:
+            rows = self.connection.execute(f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE timestamp < ? ORDER BY seq",
+                                           (timestampUs,)).fetchall()
+        return [self.toMessage(row) for row in rows]
+
+    def removeMessages(self, messages: List) -> None:
+        with self.transaction():
+            self.writeMany(DELETE_MESSAGE, ((message.seq,) for message in messages))
+
+    def saveReadCursor(self, userName: str, conversation: str, seq: int) -> None:
+        self.write(UPSERT_READ_CURSOR, (userName, conversation, seq))
+
+    def loadReadCursors(self) -> Iterable[ReadCursorRecord]:
+        with self.lock:
+            return self.connection.execute("SELECT userName, conversation, seq FROM readCursors").fetchall()
+
+    def loadUsers(self) -> Iterable[UserRecord]:
+        with self.lock:
+            return self.connection.execute("SELECT userID, userName, password, email FROM users ORDER BY rowid").fetchall()
+
+    def loadStudyGroups(self) -> Iterable[GroupRecord]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT groupID, groupName, course, location, date, maxSize, duration FROM studyGroups ORDER BY rowid").fetchall()
+        return [(groupID, groupName, course, location, fromMicros(date), maxSize,
+                 timedelta(microseconds=duration) if duration is not None else None)
+                for groupID, groupName, course, location, date, maxSize, duration in rows]
+
+    def loadMemberships(self) -> Iterable[MembershipRecord]:
+        with self.lock:
+            return self.connection.execute("SELECT groupID, userID FROM memberships ORDER BY id").fetchall()
+
+    def loadWaitlists(self) -> Iterable[MembershipRecord]:
+        with self.lock:
+            return self.connection.execute("SELECT groupID, userID FROM waitlists ORDER BY id").fetchall()
+
+    def lastMessageSeq(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM messages").fetchone()[0]
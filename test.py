@@ -1,6 +1,43 @@
+import asyncio
+import contextlib
+import inspect
+import io
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
-from datetime import datetime
-from main import User, DatabaseManager, StudyGroupController, StudyGroupGUI, MessageController
+from datetime import datetime, timedelta
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from main import User, StudyGroup, Message, DatabaseManager, StudyGroupController, StudyGroupGUI, MessageController, importRosterMain
+from main import disableMetrics, enableMetrics
+from storage import MemoryStorage, SQLiteStorage
+from archive import MessageArchive, RetentionPolicy
+from auth import PasswordHasher, SessionCache
+from inbox import InboxCache
+from compact import toMicros
+from segmentlog import SegmentLogStorage
+from snapshot import SnapshotStorage
+from shard import ShardRouter, shardOf
+from events import EventBus, MemberAdded, MemberRemoved, MessageSaved, StudyGroupSaved, UserSaved
+from logconfig import configureLogging, stopLogging
+from gateway import OP_CLOSE, MessageGateway, WebSocketClient, encodeFrame, readFrame
+from schedule import IntervalIndex
+from recommend import DEFAULT_WEIGHTS, RecommendationEngine, np, timeSlot
+
+
+def setUpModule():
+    # Most tests create users but never log in; a cheap KDF keeps them fast. TestAuth checks real costs itself.
+    DatabaseManager().usePasswordHasher(PasswordHasher(n=2 ** 4, iterations=1))
+
+
+def tearDownModule():
+    DatabaseManager().usePasswordHasher(PasswordHasher())
 
 class TestStudyGroupMatrix(unittest.TestCase):
     def setUp(self):
@@ -431,5 +468,2056 @@ class TestStudyGroupMatrix(unittest.TestCase):
             self.assertEqual(len(receive), 0, "Expected no messages to be received by new_user19")
 
 
+class TestDatabaseIndexes(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.users = []
+        self.dbmngr.studyGroups = []
+        self.controller = StudyGroupController(self.dbmngr)
+        self.creator = User("indexCreator", "indexPassword", "indexCreator@example.com")
+        self.dbmngr.saveUser(self.creator)
+
+    def test_user_lookup_by_id_and_name(self):
+        self.assertIs(self.dbmngr.getUser(self.creator.userID), self.creator)
+        self.assertIs(self.dbmngr.getUserByName("indexCreator"), self.creator)
+        self.assertIn(self.creator, self.dbmngr.users)
+
+    def test_duplicate_user_rejected(self):
+        self.assertFalse(self.dbmngr.saveUser(self.creator))
+        duplicate = User("indexCreator", "otherPassword", "other@example.com")
+        self.assertFalse(self.dbmngr.saveUser(duplicate))
+        other = User("indexOther", "otherPassword", "other@example.com")
+        self.assertTrue(self.dbmngr.saveUser(other))
+        self.assertEqual(len(self.dbmngr.users), 2)
+
+    def test_group_lookup_and_unique_name(self):
+        group = self.controller.createStudyGroup("IndexGroup", "CS3377", "ECSW", datetime.now(), 5, self.creator)
+        self.assertIs(self.dbmngr.getStudyGroup(group.groupID), group)
+        self.assertIs(self.dbmngr.getStudyGroupByName("IndexGroup"), group)
+        again = self.controller.createStudyGroup("IndexGroup", "CS3377", "ECSW", datetime.now(), 5, self.creator)
+        self.assertIsNone(again)
+
+    def test_remove_keeps_indexes_in_sync(self):
+        group = self.controller.createStudyGroup("IndexRemoved", "CS3377", "ECSW", datetime.now(), 5, self.creator)
+        self.assertTrue(self.dbmngr.removeStudyGroup(group))
+        self.assertIsNone(self.dbmngr.getStudyGroup(group.groupID))
+        self.assertNotIn(group, self.creator.groups)
+        recreated = self.controller.createStudyGroup("IndexRemoved", "CS3377", "ECSW", datetime.now(), 5, self.creator)
+        self.assertIsNotNone(recreated)
+
+        self.assertTrue(self.dbmngr.removeUser(self.creator))
+        self.assertIsNone(self.dbmngr.getUserByName("indexCreator"))
+        self.assertNotIn("indexCreator", self.dbmngr.userCredentials)
+        self.assertFalse(self.dbmngr.removeUser(self.creator))
+
+    def test_list_assignment_rebuilds_indexes(self):
+        self.dbmngr.users = []
+        self.assertIsNone(self.dbmngr.getUser(self.creator.userID))
+        self.assertTrue(self.dbmngr.saveUser(self.creator))
+
+
+class TestInbox(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.users = []
+        self.dbmngr.studyGroups = []
+        self.dbmngr.messages = []
+        self.controller = StudyGroupController(self.dbmngr)
+        self.messageController = MessageController(self.dbmngr)
+        self.alice = User("inboxAlice", "alicePassword", "alice@example.com")
+        self.bob = User("inboxBob", "bobPassword", "bob@example.com")
+        self.carol = User("inboxCarol", "carolPassword", "carol@example.com")
+        for user in (self.alice, self.bob, self.carol):
+            self.dbmngr.saveUser(user)
+
+    def test_direct_messages_only_reach_recipient(self):
+        self.messageController.sendMessage(self.alice, self.bob, "hi bob")
+        self.assertEqual([m.content for m in self.messageController.getMessage(self.bob)], ["hi bob"])
+        self.assertEqual(self.messageController.getMessage(self.carol), ())
+
+    def test_merge_interleaves_logs_in_send_order(self):
+        groupA = self.controller.createStudyGroup("InboxGroupA", "CS3377", "ECSW", datetime.now(), 5, self.alice)
+        groupB = self.controller.createStudyGroup("InboxGroupB", "CS4337", "ECSS", datetime.now(), 5, self.carol)
+        self.controller.joinStudyGroup(groupA.groupID, self.bob)
+        self.controller.joinStudyGroup(groupB.groupID, self.bob)
+        self.messageController.sendGroupMessage(self.alice, groupA, "a1")
+        self.messageController.sendMessage(self.carol, self.bob, "d1")
+        self.messageController.sendGroupMessage(self.carol, groupB, "b1")
+        self.messageController.sendGroupMessage(self.alice, groupA, "a2")
+        received = self.messageController.getMessage(self.bob)
+        self.assertEqual([m.content for m in received], ["a1", "d1", "b1", "a2"])
+        self.assertEqual([m.content for m in self.messageController.getMessage(self.carol)], ["b1"])
+
+    def test_leaving_group_hides_its_log(self):
+        group = self.controller.createStudyGroup("InboxGroupC", "CS3377", "ECSW", datetime.now(), 5, self.alice)
+        self.controller.joinStudyGroup(group.groupID, self.bob)
+        self.messageController.sendGroupMessage(self.alice, group, "before leaving")
+        self.controller.removeFromStudyGroup(group.groupID, self.bob)
+        self.assertEqual(self.messageController.getMessage(self.bob), ())
+
+
+class TestMessagePaging(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.users = []
+        self.dbmngr.studyGroups = []
+        self.dbmngr.messages = []
+        self.controller = StudyGroupController(self.dbmngr)
+        self.messageController = MessageController(self.dbmngr)
+        self.gui = StudyGroupGUI(self.controller, self.messageController)
+        self.sender = User("pageSender", "senderPassword", "sender@example.com")
+        self.reader = User("pageReader", "readerPassword", "reader@example.com")
+        self.dbmngr.saveUser(self.sender)
+        self.dbmngr.saveUser(self.reader)
+        self.group = self.gui.createStudyGroup("PageGroup", "CS3377", "ECSW", datetime.now(), 5, self.sender)
+        self.gui.joinStudyGroup(self.group.groupID, self.reader)
+        for i in range(10):
+            if i % 2:
+                self.gui.sendGroupMessage(self.sender, self.group, f"msg{i}")
+            else:
+                self.gui.sendDirectMessage(self.sender, self.reader, f"msg{i}")
+
+    def test_timestamps_are_taken_with_the_seq(self):
+        first = Message("pageSender", "pageReader", "written first")
+        time.sleep(0.002)
+        second = Message("pageSender", "pageReader", "written second")
+        # Saved in the opposite order to the one they were written in.
+        self.assertTrue(self.dbmngr.saveMessage(self.sender, second))
+        self.assertTrue(self.dbmngr.saveMessage(self.sender, first))
+        self.assertLess(second.seq, first.seq)
+        self.assertLessEqual(second.timestampUs, first.timestampUs)
+        timestamps = [m.timestampUs for m in self.dbmngr.messages]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_page_is_lazy_and_newest_first(self):
+        page = self.gui.getMessagePage(self.reader, limit=3)
+        self.assertNotIsInstance(page, list)
+        self.assertEqual([m.content for m in page], ["msg9", "msg8", "msg7"])
+
+    def test_cursor_walks_whole_history(self):
+        seen = []
+        cursor = None
+        while True:
+            page = list(self.gui.getMessagePage(self.reader, limit=4, cursor=cursor))
+            if not page:
+                break
+            seen.extend(m.content for m in page)
+            cursor = self.gui.getMessageCursor(page[-1])
+        self.assertEqual(seen, [f"msg{i}" for i in range(9, -1, -1)])
+
+    def test_since_and_before_bound_the_window(self):
+        history = self.gui.getMessage(self.reader)
+        since, before = history[2].timestamp, history[6].timestamp
+        window = [m.content for m in self.gui.getMessagePage(self.reader, since=since, before=before, limit=None)]
+        expected = [m.content for m in reversed(history) if since <= m.timestamp < before]
+        self.assertEqual(window, expected)
+
+    def test_invalid_cursor_rejected(self):
+        with self.assertRaises(ValueError):
+            list(self.gui.getMessagePage(self.reader, cursor="not-a-cursor"))
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "cohort.db")
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(SQLiteStorage(self.path))
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.alice = User("sqlAlice", "alicePassword", "alice@example.com")
+        self.bob = User("sqlBob", "bobPassword", "bob@example.com")
+        self.dbmngr.saveUser(self.alice)
+        self.dbmngr.saveUser(self.bob)
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+        self.tempdir.cleanup()
+
+    def test_controllers_work_unchanged(self):
+        group = self.gui.createStudyGroup("SqlGroup", "CS3377", "ECSW", datetime.now(), 5, self.alice)
+        self.assertTrue(self.gui.joinStudyGroup(group.groupID, self.bob))
+        self.assertTrue(self.gui.sendDirectMessage(self.alice, self.bob, "direct"))
+        self.assertTrue(self.gui.sendGroupMessage(self.alice, group, "to the group"))
+        self.assertEqual([m.content for m in self.gui.getMessage(self.bob)], ["direct", "to the group"])
+        page = list(self.gui.getMessagePage(self.bob, limit=1))
+        self.assertEqual([m.content for m in page], ["to the group"])
+        older = self.gui.getMessagePage(self.bob, cursor=self.gui.getMessageCursor(page[0]))
+        self.assertEqual([m.content for m in older], ["direct"])
+
+    def test_state_survives_restart(self):
+        group = self.gui.createStudyGroup("SqlRestart", "CS4337", "ECSS", datetime(2024, 11, 5, 14, 30), 5, self.alice)
+        self.gui.joinStudyGroup(group.groupID, self.bob)
+        self.gui.sendGroupMessage(self.bob, group, "persisted")
+        self.dbmngr.useStorage(SQLiteStorage(self.path))
+
+        restored = self.dbmngr.getStudyGroupByName("SqlRestart")
+        self.assertIsNotNone(restored)
+        self.assertEqual(restored.date, datetime(2024, 11, 5, 14, 30))
+        self.assertEqual([member.userName for member in restored.members], ["sqlAlice", "sqlBob"])
+        bob = self.dbmngr.getUserByName("sqlBob")
+        self.assertEqual([g.groupName for g in bob.groups], ["SqlRestart"])
+        self.assertEqual([m.content for m in self.dbmngr.getMessagesForUser(bob)], ["persisted"])
+
+        self.gui.sendDirectMessage(self.alice, bob, "after restart")
+        self.assertEqual([m.seq for m in self.dbmngr.messages], [1, 2])
+
+    def test_removed_user_leaves_groups_and_waitlists(self):
+        carol = User("sqlCarol", "carolPassword", "carol@example.com")
+        self.dbmngr.saveUser(carol)
+        group = self.gui.createStudyGroup("SqlRemove", "CS4337", "ECSS", datetime.now(), 2, self.alice)
+        self.gui.joinStudyGroup(group.groupID, self.bob)
+        self.gui.joinStudyGroup(group.groupID, carol, waitlist=True)
+        other = self.gui.createStudyGroup("SqlRemoveFull", "CS4337", "SCI", datetime.now(), 1, self.alice)
+        self.gui.joinStudyGroup(other.groupID, self.bob, waitlist=True)
+        self.assertTrue(self.dbmngr.removeUser(self.bob))
+        self.assertEqual(group.members, [self.alice, carol])
+        self.assertEqual(list(other.waitlist), [])
+        self.dbmngr.useStorage(SQLiteStorage(self.path))
+        restored = self.dbmngr.getStudyGroupByName("SqlRemove")
+        self.assertEqual([member.userName for member in restored.members], ["sqlAlice", "sqlCarol"])
+        self.assertEqual(list(restored.waitlist), [])
+        self.assertIsNone(self.dbmngr.getUserByName("sqlBob"))
+
+    def test_orphaned_rows_are_skipped_on_load(self):
+        group = self.gui.createStudyGroup("SqlOrphan", "CS4337", "ECSS", datetime.now(), 5, self.alice)
+        self.gui.joinStudyGroup(group.groupID, self.bob)
+        # As left by a removal from before memberships were cascaded.
+        self.dbmngr.storage.write("DELETE FROM users WHERE userID = ?", (self.bob.userID,))
+        self.dbmngr.useStorage(SQLiteStorage(self.path))
+        restored = self.dbmngr.getStudyGroupByName("SqlOrphan")
+        self.assertEqual([member.userName for member in restored.members], ["sqlAlice"])
+
+    def test_last_write_is_committed_within_the_flush_interval(self):
+        self.dbmngr.useStorage(SQLiteStorage(self.path, batchSize=1000, flushInterval=0.05))
+        self.dbmngr.flush()
+        self.gui.sendDirectMessage(self.alice, self.bob, "nothing comes after me")
+        reader = sqlite3.connect(self.path)
+        deadline = time.monotonic() + 2
+        while reader.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 1)
+        self.assertLess(time.monotonic(), deadline - 1.5)
+        reader.close()
+
+    def test_leave_is_persisted(self):
+        group = self.gui.createStudyGroup("SqlLeave", "CS4337", "ECSS", datetime.now(), 5, self.alice)
+        self.gui.joinStudyGroup(group.groupID, self.bob)
+        self.gui.removeFromStudyGroup(group.groupID, self.bob)
+        self.dbmngr.useStorage(SQLiteStorage(self.path))
+        restored = self.dbmngr.getStudyGroupByName("SqlLeave")
+        self.assertEqual([member.userName for member in restored.members], ["sqlAlice"])
+
+    def test_failed_transaction_rolls_back(self):
+        storage = self.dbmngr.storage
+        with self.assertRaises(RuntimeError):
+            with storage.transaction():
+                self.dbmngr.saveUser(User("sqlCarol", "carolPassword", "carol@example.com"))
+                raise RuntimeError("abort")
+        self.assertEqual([record[1] for record in storage.loadUsers()], ["sqlAlice", "sqlBob"])
+
+
+class TestSegmentLogStorage(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.dbmngr = DatabaseManager()
+        self.storage = SegmentLogStorage(self.tempdir.name, segmentSize=4096)
+        self.dbmngr.useStorage(self.storage)
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.alice = User("segAlice", "alicePassword", "alice@example.com")
+        self.bob = User("segBob", "bobPassword", "bob@example.com")
+        self.dbmngr.saveUser(self.alice)
+        self.dbmngr.saveUser(self.bob)
+        self.group = self.gui.createStudyGroup("SegGroup", "CS3377", "ECSW", datetime.now(), 5, self.alice)
+        self.gui.joinStudyGroup(self.group.groupID, self.bob)
+        for i in range(200):
+            if i % 3:
+                self.gui.sendDirectMessage(self.alice, self.bob, f"direct {i}")
+            else:
+                self.gui.sendGroupMessage(self.alice, self.group, f"group {i}")
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+        self.tempdir.cleanup()
+
+    def test_history_spans_segments(self):
+        self.assertGreater(len(self.storage.log.segments), 1)
+        received = self.gui.getMessage(self.bob)
+        self.assertEqual(len(received), 200)
+        self.assertEqual(received[0].content, "group 0")
+        self.assertEqual(received[-1].content, "direct 199")
+        self.assertEqual([m.content for m in self.gui.getMessagePage(self.bob, limit=2)], ["direct 199", "group 198"])
+        self.assertEqual(len(self.gui.getMessage(self.alice)), 67)
+
+    def test_reopen_rebuilds_indexes(self):
+        before = [(m.seq, m.content, m.timestamp) for m in self.gui.getMessage(self.bob)]
+        self.storage.close()
+        reopened = SegmentLogStorage(self.tempdir.name, segmentSize=4096)
+        reopened.messageFactory = self.storage.messageFactory
+        after = [(m.seq, m.content, m.timestamp) for m in reopened.messagesFor("segBob", ["SegGroup"])]
+        self.assertEqual(after, before)
+        self.assertEqual(reopened.lastMessageSeq(), before[-1][0])
+        reopened.close()
+
+    def test_compaction_reclaims_expired_segments(self):
+        segments = len(self.storage.log.segments)
+        self.storage.expireBefore(150)
+        self.assertGreater(self.storage.log.compact(), 0)
+        self.assertLess(len(self.storage.log.segments), segments)
+        received = self.gui.getMessage(self.bob)
+        self.assertEqual([m.seq for m in received], list(range(150, 201)))
+
+    def test_expired_records_stay_hidden_after_reopen(self):
+        self.storage.expireBefore(150)
+        self.storage.close()
+        reopened = SegmentLogStorage(self.tempdir.name, segmentSize=4096)
+        reopened.messageFactory = self.storage.messageFactory
+        self.assertEqual([m.seq for m in reopened.messagesFor("segBob", ["SegGroup"])], list(range(150, 201)))
+        self.assertEqual(reopened.allMessages()[0].seq, 150)
+        self.assertIsNone(reopened.log.read(100))
+        self.assertEqual(reopened.lastMessageSeq(), 200)
+        reopened.close()
+
+
+class TestRosterImport(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.users = [
+            {"name": "rosterAmy", "password": "amyPassword", "email": "amy@example.com"},
+            {"name": "rosterBen", "password": "benPassword", "email": "ben@example.com"},
+            {"name": "rosterCal", "password": "calPassword", "email": "cal@example.com"},
+        ]
+        self.groups = [
+            {"groupName": "RosterGroup", "course": "CS3377", "location": "ECSW", "date": "2024-11-05T14:30", "maxSize": "2", "creator": "rosterAmy"},
+        ]
+
+    def test_valid_roster_is_linked_both_ways(self):
+        report = self.dbmngr.importRoster(self.users, self.groups, [{"groupName": "RosterGroup", "userName": "rosterBen"}])
+        self.assertEqual(report.errors, [])
+        self.assertEqual((report.users, report.groups, report.memberships), (3, 1, 1))
+        group = self.dbmngr.getStudyGroupByName("RosterGroup")
+        self.assertEqual([member.userName for member in group.members], ["rosterAmy", "rosterBen"])
+        self.assertEqual(self.dbmngr.getUserByName("rosterBen").groups, [group])
+        self.assertEqual(group.date, datetime(2024, 11, 5, 14, 30))
+
+    def test_passwords_are_hashed_before_the_transaction(self):
+        storage = SQLiteStorage()
+        self.dbmngr.useStorage(storage)
+        self.addCleanup(self.dbmngr.useStorage, MemoryStorage())
+        self.addCleanup(self.dbmngr.usePasswordHasher, self.dbmngr.passwordHasher)
+        depths = []
+
+        class RecordingHasher(PasswordHasher):
+            def hash(self, password):
+                depths.append(storage.transactionDepth)
+                return super().hash(password)
+
+        self.dbmngr.usePasswordHasher(RecordingHasher(n=2 ** 4, iterations=1))
+        self.assertEqual(self.dbmngr.importRoster(self.users).users, 3)
+        self.assertEqual(depths, [0, 0, 0])
+        self.assertIsNotNone(self.dbmngr.login("rosterAmy", "amyPassword"))
+
+    def test_rows_that_lose_a_race_are_reported_not_counted(self):
+        def groupsAfterRace():
+            # Someone else registers rosterBen between validation and the insert.
+            self.dbmngr.saveUser(User("rosterBen", "otherPassword", "other@example.com"))
+            yield from self.groups
+
+        report = self.dbmngr.importRoster(self.users, groupsAfterRace(), [{"groupName": "RosterGroup", "userName": "rosterBen"}])
+        rival = self.dbmngr.getUserByName("rosterBen")
+        self.assertEqual([(section, line) for section, line, _ in report.errors], [("users", 2), ("memberships", 1)])
+        self.assertEqual((report.users, report.groups, report.memberships), (2, 1, 0))
+        self.assertEqual(rival.email, "other@example.com")
+        self.assertEqual([member.userName for member in self.dbmngr.getStudyGroupByName("RosterGroup").members], ["rosterAmy"])
+
+    def test_failed_import_is_undone_in_memory_too(self):
+        storage = SQLiteStorage()
+        self.dbmngr.useStorage(storage)
+        self.addCleanup(self.dbmngr.useStorage, MemoryStorage())
+        existing = self.dbmngr.importRoster([{"name": "rosterEve", "password": "evePassword", "email": "eve@example.com"}],
+                                            [{**self.groups[0], "groupName": "EveGroup", "creator": "rosterEve", "maxSize": "5"}])
+        self.assertEqual((existing.users, existing.groups), (1, 1))
+
+        def failingSave(studyGroup, user):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        storage.saveMembership = failingSave
+        with self.assertRaises(sqlite3.OperationalError):
+            self.dbmngr.importRoster(self.users, memberships=[{"groupName": "EveGroup", "userName": "rosterBen"}])
+        self.assertEqual([user.userName for user in self.dbmngr.users], ["rosterEve"])
+        self.assertEqual([member.userName for member in self.dbmngr.getStudyGroupByName("EveGroup").members], ["rosterEve"])
+        self.assertIn(self.dbmngr.getStudyGroupByName("EveGroup").groupID, self.dbmngr.openGroups)
+        self.assertEqual([record[1] for record in storage.loadUsers()], ["rosterEve"])
+        self.assertIsNone(self.dbmngr.login("rosterAmy", "amyPassword"))
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        users = self.users + [{"name": "rosterAmy", "password": "x", "email": "x@example.com"},
+                              {"name": "rosterDee", "password": "", "email": "dee@example.com"}]
+        groups = self.groups + [
+            {"groupName": "BadCourse", "course": "CS9999", "location": "ECSW", "date": "2024-11-05", "maxSize": "5", "creator": "rosterAmy"},
+            {"groupName": "BadDate", "course": "CS3377", "location": "ECSW", "date": "tomorrow", "maxSize": "5", "creator": "rosterAmy"},
+        ]
+        memberships = [
+            {"groupName": "RosterGroup", "userName": "rosterBen"},
+            {"groupName": "RosterGroup", "userName": "rosterCal"},
+            {"groupName": "RosterGroup", "userName": "rosterBen"},
+            {"groupName": "Missing", "userName": "rosterBen"},
+        ]
+        report = self.dbmngr.importRoster(users, groups, memberships)
+        self.assertEqual([(section, line) for section, line, _ in report.errors],
+                         [("users", 4), ("users", 5), ("groups", 2), ("groups", 3),
+                          ("memberships", 2), ("memberships", 3), ("memberships", 4)])
+        self.assertIn("full", report.errors[4][2])
+        self.assertEqual((report.users, report.groups, report.memberships), (3, 1, 1))
+        self.assertIsNone(self.dbmngr.getStudyGroupByName("BadCourse"))
+
+    def test_strict_mode_imports_nothing_on_error(self):
+        report = self.dbmngr.importRoster(self.users, self.groups, [{"groupName": "RosterGroup", "userName": "nobody"}], strict=True)
+        self.assertEqual(len(report.errors), 1)
+        self.assertEqual(self.dbmngr.users, [])
+
+    def test_cli_imports_csv_and_jsonl_into_sqlite(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            usersPath = os.path.join(tempdir, "users.csv")
+            with open(usersPath, "w") as file:
+                file.write("name,password,email\n")
+                file.writelines(f"{u['name']},{u['password']},{u['email']}\n" for u in self.users)
+            groupsPath = os.path.join(tempdir, "groups.jsonl")
+            with open(groupsPath, "w") as file:
+                file.writelines(json.dumps(group) + "\n" for group in self.groups)
+            dbPath = os.path.join(tempdir, "cohort.db")
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                status = importRosterMain(["--users", usersPath, "--groups", groupsPath, "--db", dbPath])
+            self.assertEqual(status, 0)
+            self.assertIn("Imported 3 users, 1 groups", output.getvalue())
+            self.dbmngr.useStorage(SQLiteStorage(dbPath))
+            self.assertEqual(len(self.dbmngr.users), 3)
+            self.assertEqual(self.dbmngr.getStudyGroupByName("RosterGroup").members[0].userName, "rosterAmy")
+            self.dbmngr.useStorage(MemoryStorage())
+
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.user = User("logUser", "logPassword", "log@example.com")
+        self.dbmngr.saveUser(self.user)
+
+    def tearDown(self):
+        configureLogging(silent=True)
+
+    def test_operations_log_through_queue(self):
+        output = io.StringIO()
+        configureLogging(logging.DEBUG, stream=output)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            group = self.gui.createStudyGroup("LogGroup", "CS3377", "ECSW", datetime.now(), 1, self.user)
+            self.gui.sendGroupMessage(self.user, group, "hello")
+        stopLogging()
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertIn("Study group 'LogGroup' created successfully.", output.getvalue())
+        self.assertIn("Group message sent to 'LogGroup' by logUser.", output.getvalue())
+
+    def test_level_filters_and_silent_mode(self):
+        output = io.StringIO()
+        configureLogging(logging.WARNING, stream=output)
+        self.gui.createStudyGroup("LogQuiet", "CS3377", "ECSW", datetime.now(), 5, self.user)
+        self.gui.createStudyGroup("", "CS3377", "ECSW", datetime.now(), 5, self.user)
+        stopLogging()
+        self.assertNotIn("created successfully", output.getvalue())
+        self.assertIn("Failed to create study group '': Group name cannot be empty.", output.getvalue())
+
+        output = io.StringIO()
+        configureLogging(silent=True, stream=output)
+        self.gui.createStudyGroup("", "CS3377", "ECSW", datetime.now(), 5, self.user)
+        self.assertEqual(output.getvalue(), "")
+
+    def test_validation_failure_is_returned_not_printed(self):
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            group = StudyGroup("LogInvalid", "CS3377", "ECSW", datetime.now(), 0)
+        self.assertFalse(group.is_valid)
+        self.assertEqual(group.error, "Invalid max size. The size of the group must be greater than 0.")
+        self.assertEqual(stdout.getvalue(), "")
+
+
+class TestMessageGateway(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.controller = StudyGroupController(self.dbmngr)
+        self.messageController = MessageController(self.dbmngr)
+        self.alice = User("wsAlice", "alicePassword", "alice@example.com")
+        self.bob = User("wsBob", "bobPassword", "bob@example.com")
+        self.carol = User("wsCarol", "carolPassword", "carol@example.com")
+        self.passwords = {"wsAlice": "alicePassword", "wsBob": "bobPassword", "wsCarol": "carolPassword"}
+        for user in (self.alice, self.bob, self.carol):
+            self.dbmngr.saveUser(user)
+        self.group = self.controller.createStudyGroup("WsGroup", "CS3377", "ECSW", datetime.now(), 5, self.alice)
+        self.controller.joinStudyGroup(self.group.groupID, self.bob)
+        self.gateway = MessageGateway(self.dbmngr, self.controller, self.messageController, port=0, queueSize=4)
+        await self.gateway.start()
+        self.clients = []
+        self.tokens = {}
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            await client.close()
+        await self.gateway.stop()
+
+    async def connect(self, userName, gateway=None):
+        client = await WebSocketClient.connect("127.0.0.1", (gateway or self.gateway).port)
+        self.clients.append(client)
+        token = self.tokens[userName] = self.dbmngr.login(userName, self.passwords[userName])
+        await client.send({"type": "hello", "token": token, "id": 1})
+        self.assertEqual(await client.receive(), {"type": "ack", "id": 1, "ok": True})
+        return client
+
+    async def test_hello_requires_a_session_token(self):
+        client = await WebSocketClient.connect("127.0.0.1", self.gateway.port)
+        self.clients.append(client)
+        for i, hello in enumerate(({"user": "wsAlice"}, {"token": "forged"}, {"token": ["not", "a", "token"]})):
+            await client.send({"type": "hello", "id": i, **hello})
+            self.assertEqual(await asyncio.wait_for(client.receive(), 2),
+                             {"type": "ack", "id": i, "ok": False, "error": "invalid session"})
+        await client.send({"type": "send", "to": "wsBob", "content": "hi", "id": 3})
+        self.assertEqual(await asyncio.wait_for(client.receive(), 2), {"type": "ack", "id": 3, "ok": False, "error": "say hello first"})
+        self.assertNotIn("wsAlice", self.gateway.connections)
+
+    async def test_direct_message_is_pushed(self):
+        alice, bob = await self.connect("wsAlice"), await self.connect("wsBob")
+        await alice.send({"type": "send", "to": "wsBob", "content": "hi bob", "id": 2})
+        pushed = await asyncio.wait_for(bob.receive(), 2)
+        self.assertEqual((pushed["type"], pushed["sender"], pushed["content"]), ("message", "wsAlice", "hi bob"))
+        replies = [await asyncio.wait_for(alice.receive(), 2) for _ in range(2)]
+        self.assertIn({"type": "ack", "id": 2, "ok": True}, replies)
+
+    async def test_group_message_fans_out_to_members_only(self):
+        bob, carol = await self.connect("wsBob"), await self.connect("wsCarol")
+        self.messageController.sendGroupMessage(self.alice, self.group, "to the group")
+        pushed = await asyncio.wait_for(bob.receive(), 2)
+        self.assertEqual((pushed["group"], pushed["content"]), ("WsGroup", "to the group"))
+        await carol.send({"type": "history", "id": 3})
+        self.assertEqual(await asyncio.wait_for(carol.receive(), 2),
+                         {"type": "ack", "id": 3, "ok": True, "messages": [], "cursor": None})
+
+    async def test_history_and_invalid_requests(self):
+        self.messageController.sendMessage(self.alice, self.bob, "earlier")
+        bob = await self.connect("wsBob")
+        await bob.send({"type": "history", "limit": 10, "id": 4})
+        reply = await asyncio.wait_for(bob.receive(), 2)
+        self.assertEqual([m["content"] for m in reply["messages"]], ["earlier"])
+        await bob.send({"type": "sendGroup", "groupID": "missing", "content": "x", "id": 5})
+        self.assertEqual(await asyncio.wait_for(bob.receive(), 2), {"type": "ack", "id": 5, "ok": False})
+
+    async def test_malformed_fields_are_answered_without_closing(self):
+        self.messageController.sendMessage(self.alice, self.bob, "earlier")
+        bob = await self.connect("wsBob")
+        malformed = [({"type": "history", "limit": None}, "limit must be a non-negative integer"),
+                     ({"type": "history", "limit": -1}, "limit must be a non-negative integer"),
+                     ({"type": "send", "to": ["wsAlice"], "content": "x"}, "to must be a string"),
+                     ({"type": "sendGroup", "groupID": self.group.groupID, "content": {"x": 1}}, "content must be a string"),
+                     ({"type": "join", "groupID": 7}, "groupID must be a string")]
+        for i, (request, error) in enumerate(malformed):
+            await bob.send({**request, "id": i})
+            self.assertEqual(await asyncio.wait_for(bob.receive(), 2), {"type": "ack", "id": i, "ok": False, "error": error})
+        await bob.send({"type": "history", "id": 9})
+        reply = await asyncio.wait_for(bob.receive(), 2)
+        self.assertEqual([m["content"] for m in reply["messages"]], ["earlier"])
+
+    async def test_controller_calls_run_off_the_event_loop(self):
+        threads = []
+        sendMessage = self.messageController.sendMessage
+
+        def recordingSend(*args):
+            threads.append(threading.get_ident())
+            return sendMessage(*args)
+
+        self.messageController.sendMessage = recordingSend
+        alice = await self.connect("wsAlice")
+        await alice.send({"type": "send", "to": "wsBob", "content": "hi", "id": 2})
+        replies = [await asyncio.wait_for(alice.receive(), 2) for _ in range(2)]
+        self.assertIn({"type": "ack", "id": 2, "ok": True}, replies)
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    async def test_slow_consumer_is_disconnected(self):
+        bob = await self.connect("wsBob")
+        for i in range(10):
+            self.messageController.sendGroupMessage(self.alice, self.group, f"burst {i}")
+        self.assertGreater(self.gateway.dropped, 0)
+        received = []
+        while True:
+            message = await asyncio.wait_for(bob.receive(), 2)
+            if message is None:
+                break
+            received.append(message)
+        self.assertLess(len(received), 10)
+        self.assertNotIn("wsBob", self.gateway.connections)
+
+    async def closeCode(self, client):
+        fin, opcode, payload = await asyncio.wait_for(readFrame(client.reader, fromClient=False), 2)
+        return opcode, int.from_bytes(payload[:2], "big")
+
+    async def test_request_after_logout_closes_the_connection(self):
+        alice = await self.connect("wsAlice")
+        self.dbmngr.logout(self.tokens["wsAlice"])
+        await alice.send({"type": "send", "to": "wsBob", "content": "still here?", "id": 2})
+        self.assertEqual(await self.closeCode(alice), (OP_CLOSE, 1008))
+        self.assertNotIn("wsAlice", self.gateway.connections)
+        self.assertEqual(self.messageController.getMessage(self.bob), ())
+
+    async def test_subscribers_stop_receiving_once_their_session_ends(self):
+        gateway = MessageGateway(self.dbmngr, self.controller, self.messageController, port=0, sessionCheckInterval=0.05)
+        await gateway.start()
+        self.addAsyncCleanup(gateway.stop)
+        bob = await self.connect("wsBob", gateway)
+        self.dbmngr.logout(self.tokens["wsBob"])
+        self.assertEqual(await self.closeCode(bob), (OP_CLOSE, 1008))
+        self.assertNotIn("wsBob", gateway.connections)
+        self.messageController.sendGroupMessage(self.alice, self.group, "after logout")
+        self.assertEqual(gateway.pushed, 0)
+
+    async def test_unmasked_client_frame_is_a_protocol_error(self):
+        alice = await self.connect("wsAlice")
+        alice.writer.write(encodeFrame(json.dumps({"type": "history", "id": 2}).encode()))
+        self.assertEqual(await self.closeCode(alice), (OP_CLOSE, 1002))
+        self.assertNotIn("wsAlice", self.gateway.connections)
+
+
+class TestConcurrency(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.controller = StudyGroupController(self.dbmngr)
+        self.messageController = MessageController(self.dbmngr)
+        self.users = [User(f"threadUser{i}", "password", f"threadUser{i}@example.com") for i in range(120)]
+        for user in self.users:
+            self.dbmngr.saveUser(user)
+
+    def hammer(self, threads, work):
+        barrier = threading.Barrier(threads)
+        errors = []
+
+        def run(index):
+            barrier.wait()
+            try:
+                work(index)
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        return time.perf_counter() - start
+
+    def test_concurrent_joins_and_leaves_keep_invariants(self):
+        groups = [self.controller.createStudyGroup(f"ThreadGroup{i}", "CS3377", "ECSW", datetime.now(), 6, self.users[i])
+                  for i in range(8)]
+        operations = 2000
+
+        def work(index):
+            rng = random.Random(index)
+            for _ in range(operations):
+                group, user = rng.choice(groups), rng.choice(self.users)
+                if rng.random() < 0.6:
+                    self.controller.joinStudyGroup(group.groupID, user)
+                else:
+                    self.controller.removeFromStudyGroup(group.groupID, user)
+
+        elapsed = self.hammer(16, work)
+        self.assertLess(elapsed, 60, f"{16 * operations / elapsed:.0f} ops/sec is far too slow")
+        for group in groups:
+            self.assertLessEqual(len(group.members), group.maxSize)
+            self.assertGreaterEqual(len(group.members), 1)
+            self.assertEqual(len({member.userID for member in group.members}), len(group.members))
+            for member in group.members:
+                self.assertIn(group, member.groups)
+        for user in self.users:
+            for group in user.groups:
+                self.assertIn(user, group.members)
+
+    def test_concurrent_create_with_same_name(self):
+        created = []
+        self.hammer(12, lambda i: created.append(
+            self.controller.createStudyGroup("ThreadDuplicate", "CS3377", "ECSW", datetime.now(), 5, self.users[i])))
+        winners = [group for group in created if group is not None]
+        self.assertEqual(len(winners), 1)
+        self.assertIs(self.dbmngr.getStudyGroupByName("ThreadDuplicate"), winners[0])
+        self.assertEqual(sum(len(user.groups) for user in self.users), 1)
+
+    def test_concurrent_sends_keep_logs_ordered(self):
+        recipient = self.users[0]
+        self.hammer(8, lambda i: [self.messageController.sendMessage(self.users[i + 1], recipient, f"{i}-{n}") for n in range(250)])
+        received = self.messageController.getMessage(recipient)
+        self.assertEqual(len(received), 2000)
+        self.assertEqual([m.seq for m in received], sorted(m.seq for m in received))
+
+
+class TestCompactModels(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.controller = StudyGroupController(self.dbmngr)
+        self.messageController = MessageController(self.dbmngr)
+        self.ann = User("compactAnn", "password", "ann@example.com")
+        self.ben = User("compactBen", "password", "ben@example.com")
+        self.dbmngr.saveUser(self.ann)
+        self.dbmngr.saveUser(self.ben)
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def test_models_are_slotted(self):
+        group = self.controller.createStudyGroup("CompactGroup", "CS3377", "ECSW", datetime.now(), 5, self.ann)
+        self.messageController.sendMessage(self.ann, self.ben, "hi")
+        message = self.messageController.getMessage(self.ben)[0]
+        for model in (self.ann, group, message):
+            self.assertFalse(hasattr(model, "__dict__"), type(model).__name__)
+
+    def test_users_compare_by_identity(self):
+        twin = User("compactAnn", "password", "ann@example.com")
+        self.assertNotEqual(self.ann, twin)
+        self.assertEqual(len({self.ann, twin, self.ann}), 2)
+        group = self.controller.createStudyGroup("CompactIdentity", "CS3377", "ECSW", datetime.now(), 5, self.ann)
+        self.assertIn(self.ann, group.members)
+        self.assertNotIn(self.ben, group.members)
+        self.assertFalse(self.messageController.sendGroupMessage(self.ben, group, "not a member"))
+        self.assertTrue(self.messageController.sendGroupMessage(self.ann, group, "member"))
+
+    def test_course_and_location_are_interned_codes(self):
+        first = self.controller.createStudyGroup("CompactCodes1", " CS4337", "ECSS ", datetime.now(), 5, self.ann)
+        second = self.controller.createStudyGroup("CompactCodes2", "CS4337", "ECSS", datetime.now(), 5, self.ben)
+        self.assertEqual((first.course, first.location), ("CS4337", "ECSS"))
+        self.assertIsInstance(first.courseCode, int)
+        self.assertEqual((first.courseCode, first.locationCode), (second.courseCode, second.locationCode))
+        self.assertIs(first.course, second.course)
+
+    def test_timestamps_are_epoch_micros(self):
+        self.messageController.sendMessage(self.ann, self.ben, "hi")
+        message = self.messageController.getMessage(self.ben)[0]
+        self.assertIsInstance(message.timestampUs, int)
+        self.assertIsInstance(message.timestamp, datetime)
+        self.assertLess(abs((datetime.now() - message.timestamp).total_seconds()), 60)
+        stamp = datetime(2024, 9, 1, 12, 30, 15, 123456)
+        message.timestamp = stamp
+        self.assertEqual(message.timestamp, stamp)
+
+    def test_sqlite_round_trip_keeps_models_compact(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "compact.db")
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            self.dbmngr.saveUser(self.ann)
+            self.dbmngr.saveUser(self.ben)
+            group = self.controller.createStudyGroup("CompactStored", "CS3377", "Library", datetime(2024, 9, 1, 9), 5, self.ann)
+            self.controller.joinStudyGroup(group.groupID, self.ben)
+            self.messageController.sendGroupMessage(self.ben, group, "stored")
+            sent = self.messageController.getMessage(self.ann)[0]
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            loaded = self.dbmngr.getStudyGroupByName("CompactStored")
+            self.assertEqual((loaded.course, loaded.location), ("CS3377", "Library"))
+            received = self.messageController.getMessage(self.dbmngr.getUserByName("compactAnn"))
+            self.assertEqual([(m.content, m.timestampUs, m.group) for m in received], [("stored", sent.timestampUs, "CompactStored")])
+            self.dbmngr.useStorage(MemoryStorage())
+
+
+class TestGroupSearch(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.controller = StudyGroupController(self.dbmngr)
+        self.gui = StudyGroupGUI(self.controller, MessageController(self.dbmngr))
+        self.users = [User(f"searchUser{i}", "password", f"searchUser{i}@example.com") for i in range(10)]
+        for user in self.users:
+            self.dbmngr.saveUser(user)
+        self.monday = datetime(2024, 10, 7, 9)
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def create(self, name, course, location, day, maxSize, creator=0):
+        return self.controller.createStudyGroup(name, course, location, self.monday.replace(day=7 + day), maxSize,
+                                                self.users[creator])
+
+    def test_filters_combine_and_sort_by_date(self):
+        late = self.create("SearchLate", "CS3377", "ECSW", 4, 5)
+        early = self.create("SearchEarly", "CS3377", "ECSW", 1, 5)
+        self.create("SearchOtherRoom", "CS3377", "JO", 2, 5)
+        self.create("SearchOtherCourse", "CS4337", "ECSW", 2, 5)
+        self.create("SearchNextMonth", "CS3377", "ECSW", 20, 5)
+        week = dict(since=self.monday, before=self.monday.replace(day=14))
+        self.assertEqual(self.gui.searchStudyGroups(course="CS3377", location="ECSW", **week), [early, late])
+        self.assertEqual(len(self.gui.searchStudyGroups(course="CS3377")), 4)
+        self.assertEqual(len(self.gui.searchStudyGroups(location="ECSW", **week)), 3)
+        self.assertEqual(self.gui.searchStudyGroups(course="CS3377", location="ECSW", limit=1), [early])
+        self.assertEqual(self.gui.searchStudyGroups(course="CS1200"), [])
+        self.assertEqual(self.gui.searchStudyGroups(location="Nowhere"), [])
+
+    def test_open_seats_track_joins_and_leaves(self):
+        group = self.create("SearchSmall", "CS3377", "ECSW", 1, 2)
+        self.assertEqual(self.controller.searchStudyGroups(course="CS3377", minOpenSeats=1), [group])
+        self.assertEqual(self.controller.searchStudyGroups(course="CS3377", minOpenSeats=2), [])
+        self.controller.joinStudyGroup(group.groupID, self.users[1])
+        self.assertEqual(self.controller.searchStudyGroups(minOpenSeats=1), [])
+        self.controller.removeFromStudyGroup(group.groupID, self.users[1])
+        self.assertEqual(self.controller.searchStudyGroups(minOpenSeats=1), [group])
+        self.dbmngr.removeStudyGroup(group)
+        self.assertEqual(self.controller.searchStudyGroups(course="CS3377"), [])
+        self.assertEqual(self.dbmngr.groupDates, [])
+
+    def test_indexes_are_rebuilt_when_loading(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "search.db")
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            for user in self.users:
+                self.dbmngr.saveUser(user)
+            full = self.create("SearchFull", "CS3377", "ECSW", 1, 2)
+            self.controller.joinStudyGroup(full.groupID, self.users[1])
+            self.create("SearchOpen", "CS3377", "ECSW", 2, 2)
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            self.assertEqual([group.groupName for group in self.dbmngr.searchStudyGroups(course="CS3377")],
+                             ["SearchFull", "SearchOpen"])
+            self.assertEqual([group.groupName for group in self.dbmngr.searchStudyGroups(minOpenSeats=1)], ["SearchOpen"])
+            self.dbmngr.useStorage(MemoryStorage())
+
+    def test_matches_brute_force(self):
+        rng = random.Random(11)
+        courses, locations = self.dbmngr.validCourses[:4], self.dbmngr.validLocations[:3]
+        for i in range(300):
+            group = self.create(f"SearchRandom{i}", rng.choice(courses), rng.choice(locations), rng.randrange(20), rng.randint(1, 4),
+                                creator=rng.randrange(10))
+            for user in rng.sample(self.users, 3):
+                self.controller.joinStudyGroup(group.groupID, user)
+        groups = self.dbmngr.studyGroups
+        for _ in range(200):
+            course = rng.choice(courses + [None])
+            location = rng.choice(locations + [None])
+            since = self.monday.replace(day=7 + rng.randrange(20)) if rng.random() < 0.5 else None
+            before = self.monday.replace(day=7 + rng.randrange(20)) if rng.random() < 0.5 else None
+            seats = rng.randrange(3)
+            expected = sorted((group for group in groups
+                               if course in (None, group.course) and location in (None, group.location)
+                               and (since is None or group.date >= since) and (before is None or group.date < before)
+                               and group.maxSize - len(group.members) >= seats),
+                              key=lambda group: (group.date, group.groupID))
+            self.assertEqual(self.dbmngr.searchStudyGroups(course, location, since, before, seats), expected)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestRecommendations(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.controller = StudyGroupController(self.dbmngr)
+        self.users = [User(f"recUser{i}", "password", f"recUser{i}@example.com") for i in range(40)]
+        for user in self.users:
+            self.dbmngr.saveUser(user)
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def create(self, name, course, location, hour, maxSize, creator, days=1):
+        date = (datetime.now() + timedelta(days=days)).replace(hour=hour, minute=0, second=0, microsecond=0)
+        return self.controller.createStudyGroup(name, course, location, date, maxSize, creator)
+
+    def names(self, groups):
+        return [group.groupName for group in groups]
+
+    def test_prefers_shared_course_location_and_time(self):
+        ann, ben = self.users[0], self.users[1]
+        self.create("RecMine", "CS3377", "ECSW", 10, 5, ann)
+        self.create("RecMatch", "CS3377", "ECSW", 10, 5, ben)
+        self.create("RecOtherRoom", "CS3377", "JO", 19, 5, ben)
+        self.create("RecOtherCourse", "CS4337", "JO", 19, 5, ben)
+        self.create("RecFull", "CS3377", "ECSW", 10, 1, ben)
+        self.create("RecPast", "CS3377", "ECSW", 10, 5, ben, days=-1)
+        engine = RecommendationEngine(self.dbmngr, k=5)
+        engine.build()
+        self.assertEqual(self.names(engine.recommend(ann)), ["RecMatch", "RecOtherRoom", "RecOtherCourse"])
+        self.assertEqual(self.names(engine.recommend(ann, k=1)), ["RecMatch"])
+
+    def test_incremental_changes(self):
+        ann, ben, cat = self.users[:3]
+        self.create("RecAnn", "CS3377", "ECSW", 10, 5, ann)
+        small = self.create("RecSmall", "CS3377", "ECSW", 10, 2, ben)
+        engine = RecommendationEngine(self.dbmngr, k=3)
+        engine.build()
+        engine.attach()
+        self.addCleanup(engine.detach)
+        self.assertEqual(self.names(engine.recommend(ann)), ["RecSmall"])
+        self.controller.joinStudyGroup(small.groupID, cat)
+        self.assertEqual(engine.recommend(ann), [])
+        fresh = self.create("RecFresh", "CS3377", "ECSW", 11, 4, ben)
+        self.assertEqual(self.names(engine.recommend(ann)), ["RecFresh"])
+        self.assertEqual(self.names(engine.recommend(self.users[9])), ["RecAnn", "RecFresh"])
+        newcomer = User("recNewcomer", "password", "new@example.com")
+        self.dbmngr.saveUser(newcomer)
+        self.assertEqual(self.names(engine.recommend(newcomer)), ["RecAnn", "RecFresh"])
+        self.controller.joinStudyGroup(fresh.groupID, newcomer)
+        self.assertEqual(self.names(engine.recommend(newcomer)), ["RecAnn"])
+        self.dbmngr.removeStudyGroup(fresh)
+        self.assertEqual(engine.recommend(ann), [])
+
+    def test_batch_scores_match_per_user_formula(self):
+        rng = random.Random(12)
+        courses, locations = self.dbmngr.validCourses[:5], self.dbmngr.validLocations[:4]
+        groups = [self.create(f"RecRandom{i}", rng.choice(courses), rng.choice(locations), rng.randrange(8, 22),
+                              rng.randint(3, 8), rng.choice(self.users), days=rng.randint(1, 9)) for i in range(60)]
+        for _ in range(150):
+            self.controller.joinStudyGroup(rng.choice(groups).groupID, rng.choice(self.users))
+
+        def mix(user, attribute):
+            values = [attribute(group) for group in user.groups]
+            return {value: values.count(value) / len(values) for value in values}
+
+        def score(user, group):
+            w, courseMix = DEFAULT_WEIGHTS, mix(user, lambda g: g.course)
+            memberMixes = [mix(member, lambda g: g.course) for member in group.members]
+            shared = sum(courseMix.get(course, 0) * share for m in memberMixes for course, share in m.items()) / len(memberMixes)
+            return (w["course"] * courseMix.get(group.course, 0) + w["members"] * shared
+                    + w["location"] * mix(user, lambda g: g.location).get(group.location, 0)
+                    + w["time"] * mix(user, lambda g: timeSlot(g.date)).get(timeSlot(group.date), 0)
+                    + w["capacity"] * (group.maxSize - len(group.members)) / group.maxSize)
+
+        engine = RecommendationEngine(self.dbmngr, k=5, batchSize=7)
+        engine.build()
+        for user in self.users:
+            eligible = [group for group in groups if group not in user.groups and len(group.members) < group.maxSize]
+            expected = sorted((score(user, group) for group in eligible), reverse=True)[:5]
+            actual = [score(user, group) for group in engine.recommend(user)]
+            self.assertEqual(len(actual), len(expected))
+            for a, b in zip(actual, expected):
+                self.assertAlmostEqual(a, b, places=5)
+
+class TestSchedule(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.controller = StudyGroupController(self.dbmngr)
+        self.gui = StudyGroupGUI(self.controller, MessageController(self.dbmngr))
+        self.ann = User("schedAnn", "password", "ann@example.com")
+        self.ben = User("schedBen", "password", "ben@example.com")
+        self.dbmngr.saveUser(self.ann)
+        self.dbmngr.saveUser(self.ben)
+        self.day = datetime(2024, 10, 7)
+
+    def tearDown(self):
+        configureLogging(silent=True)
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def book(self, name, location, hour, hours=1, creator=None):
+        return self.gui.createStudyGroup(name, "CS3377", location, self.day.replace(hour=hour), 5, creator or self.ann,
+                                         duration=timedelta(hours=hours))
+
+    def test_interval_index_matches_brute_force(self):
+        rng = random.Random(13)
+        index, intervals = IntervalIndex(), {}
+        for i in range(400):
+            start = self.day + timedelta(minutes=rng.randrange(0, 7 * 24 * 60, 15))
+            end = start + timedelta(minutes=rng.choice([30, 60, 90, 240]))
+            intervals[str(i)] = (start, end)
+            index.add(str(i), start, end)
+        for key in rng.sample(sorted(intervals), 100):
+            index.remove(key, intervals.pop(key)[0])
+        for _ in range(300):
+            start = self.day + timedelta(minutes=rng.randrange(0, 7 * 24 * 60, 5))
+            end = start + timedelta(minutes=rng.randrange(5, 300))
+            expected = {key for key, (s, e) in intervals.items() if s < end and start < e}
+            self.assertEqual(set(index.overlapping(start, end)), expected)
+        self.assertEqual(len(index), 300)
+
+    def test_room_conflicts_are_rejected(self):
+        first = self.book("SchedFirst", "ECSW", 10, hours=2)
+        self.assertIsNotNone(first)
+        self.assertEqual(first.end, self.day.replace(hour=12))
+        self.assertIsNone(self.book("SchedOverlap", "ECSW", 11, creator=self.ben))
+        self.assertIsNotNone(self.book("SchedAdjacent", "ECSW", 12, creator=self.ben))
+        self.assertIsNotNone(self.book("SchedOtherRoom", "JO", 11, creator=self.ben))
+        unscheduled = self.gui.createStudyGroup("SchedUntimed", "CS3377", "ECSW", self.day.replace(hour=11), 5, self.ben)
+        self.assertIsNotNone(unscheduled)
+        overlap = StudyGroup("SchedOverlap", "CS3377", "ECSW", self.day.replace(hour=9, minute=30), 5, timedelta(hours=1))
+        self.assertFalse(overlap.is_valid)
+        self.assertEqual(overlap.error, "Room ECSW is booked by 'SchedFirst' from 2024-10-07 10:00 to 2024-10-07 12:00.")
+        self.assertEqual(self.dbmngr.findRoomConflicts("ECSW", self.day.replace(hour=11), self.day.replace(hour=13)),
+                         [first, self.dbmngr.getStudyGroupByName("SchedAdjacent")])
+        self.dbmngr.removeStudyGroup(first)
+        self.assertIsNotNone(self.book("SchedReplacement", "ECSW", 10, creator=self.ben))
+        self.assertFalse(StudyGroup("SchedZero", "CS3377", "JO", self.day, 5, timedelta(0)).is_valid)
+
+    def test_joining_flags_time_clashes(self):
+        morning = self.book("SchedMorning", "ECSW", 9, hours=2)
+        overlapping = self.book("SchedOverlapping", "JO", 10, creator=self.ben)
+        later = self.book("SchedLater", "JO", 11, creator=self.ben)
+        self.assertEqual(self.gui.getTimeClashes(overlapping.groupID, self.ann), [morning])
+        self.assertEqual(self.gui.getTimeClashes(later.groupID, self.ann), [])
+        output = io.StringIO()
+        configureLogging(logging.WARNING, stream=output, queued=False)
+        self.assertTrue(self.gui.joinStudyGroup(overlapping.groupID, self.ann))
+        self.assertIn("schedAnn joined SchedOverlapping, which clashes with SchedMorning.", output.getvalue())
+        self.assertEqual(self.gui.getTimeClashes(morning.groupID, self.ann), [overlapping])
+        self.assertTrue(self.gui.removeFromStudyGroup(overlapping.groupID, self.ann))
+        self.assertEqual(self.gui.getTimeClashes(morning.groupID, self.ann), [])
+
+    def test_roster_durations_and_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "schedule.db")
+            legacy = sqlite3.connect(path)
+            legacy.execute("CREATE TABLE studyGroups (groupID TEXT PRIMARY KEY, groupName TEXT NOT NULL UNIQUE, course TEXT NOT NULL, "
+                           "location TEXT NOT NULL, date INTEGER NOT NULL, maxSize INTEGER NOT NULL)")
+            legacy.close()
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            self.dbmngr.saveUser(self.ann)
+            rows = [dict(groupName=f"SchedRoster{i}", course="CS3377", location="Library", date=f"2024-10-07T{hour:02d}:00",
+                         maxSize=4, creator="schedAnn", duration=duration)
+                    for i, (hour, duration) in enumerate([(9, "90"), (10, "60"), (11, ""), (14, "60")])]
+            report = self.dbmngr.importRoster(groups=rows)
+            self.assertEqual(report.groups, 3)
+            self.assertEqual(report.errors, [("groups", 2, "Room Library is booked by 'SchedRoster0' in this roster.")])
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            loaded = self.dbmngr.getStudyGroupByName("SchedRoster0")
+            self.assertEqual(loaded.duration, timedelta(minutes=90))
+            self.assertIsNone(self.dbmngr.getStudyGroupByName("SchedRoster2").duration)
+            self.assertEqual(self.dbmngr.findRoomConflicts("Library", self.day.replace(hour=10), self.day.replace(hour=15)),
+                             [loaded, self.dbmngr.getStudyGroupByName("SchedRoster3")])
+            ann = self.dbmngr.getUserByName("schedAnn")
+            self.assertEqual(self.dbmngr.findTimeClashes(ann, self.dbmngr.getStudyGroupByName("SchedRoster3")), [])
+            self.dbmngr.useStorage(MemoryStorage())
+
+class TestWaitlist(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.users = [User(f"waitUser{i}", "password", f"waitUser{i}@example.com") for i in range(6)]
+        for user in self.users:
+            self.dbmngr.saveUser(user)
+        self.group = self.gui.createStudyGroup("WaitGroup", "CS3377", "ECSW", datetime.now(), 2, self.users[0])
+        self.gui.joinStudyGroup(self.group.groupID, self.users[1])
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def test_full_group_queues_in_fifo_order(self):
+        groupID = self.group.groupID
+        self.assertFalse(self.gui.joinStudyGroup(groupID, self.users[5]))
+        self.assertIsNone(self.gui.getWaitlistPosition(groupID, self.users[5]))
+        for user in self.users[2:5]:
+            self.assertFalse(self.gui.joinStudyGroup(groupID, user, waitlist=True))
+        self.assertFalse(self.gui.joinStudyGroup(groupID, self.users[3], waitlist=True))
+        self.assertEqual([self.gui.getWaitlistPosition(groupID, user) for user in self.users[2:5]], [1, 2, 3])
+        self.assertFalse(self.gui.joinStudyGroup(groupID, self.users[1], waitlist=True))
+        self.assertIsNone(self.gui.getWaitlistPosition(groupID, self.users[1]))
+
+    def test_leaving_promotes_the_next_user(self):
+        groupID = self.group.groupID
+        for user in self.users[2:5]:
+            self.gui.joinStudyGroup(groupID, user, waitlist=True)
+        self.assertTrue(self.gui.leaveWaitlist(groupID, self.users[2]))
+        self.assertFalse(self.gui.leaveWaitlist(groupID, self.users[2]))
+        self.assertTrue(self.gui.removeFromStudyGroup(groupID, self.users[1]))
+        self.assertEqual(self.group.members, [self.users[0], self.users[3]])
+        self.assertIn(self.group, self.users[3].groups)
+        self.assertNotIn(self.group, self.users[1].groups)
+        self.assertIsNone(self.gui.getWaitlistPosition(groupID, self.users[3]))
+        self.assertEqual(self.gui.getWaitlistPosition(groupID, self.users[4]), 1)
+        self.assertEqual(self.dbmngr.searchStudyGroups(minOpenSeats=1), [])
+
+    def test_waitlist_is_persisted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "waitlist.db")
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            for user in self.users:
+                self.dbmngr.saveUser(user)
+            group = self.gui.createStudyGroup("WaitStored", "CS3377", "ECSW", datetime.now(), 2, self.users[0])
+            self.gui.joinStudyGroup(group.groupID, self.users[1])
+            for user in (self.users[4], self.users[2], self.users[3]):
+                self.gui.joinStudyGroup(group.groupID, user, waitlist=True)
+            self.gui.leaveWaitlist(group.groupID, self.users[2])
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            group = self.dbmngr.getStudyGroupByName("WaitStored")
+            self.assertEqual([user.userName for user in group.waitlist.values()], ["waitUser4", "waitUser3"])
+            self.gui.removeFromStudyGroup(group.groupID, self.dbmngr.getUserByName("waitUser0"))
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            group = self.dbmngr.getStudyGroupByName("WaitStored")
+            self.assertEqual([user.userName for user in group.members], ["waitUser1", "waitUser4"])
+            self.assertEqual([user.userName for user in group.waitlist.values()], ["waitUser3"])
+            self.dbmngr.useStorage(MemoryStorage())
+
+    def test_concurrent_joins_and_leaves_never_oversubscribe(self):
+        users = [User(f"waitRush{i}", "password", f"waitRush{i}@example.com") for i in range(64)]
+        for user in users:
+            self.dbmngr.saveUser(user)
+        groupID = self.group.groupID
+        barrier = threading.Barrier(8)
+
+        def work(index):
+            barrier.wait()
+            rng = random.Random(index)
+            for _ in range(300):
+                user = rng.choice(users)
+                if rng.random() < 0.5:
+                    self.gui.joinStudyGroup(groupID, user, waitlist=True)
+                else:
+                    self.gui.removeFromStudyGroup(groupID, user)
+
+        workers = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        members = {user.userID for user in self.group.members}
+        self.assertEqual(len(members), len(self.group.members))
+        self.assertLessEqual(len(members), 2)
+        if self.group.waitlist:
+            self.assertEqual(len(members), 2)
+        self.assertFalse(members & set(self.group.waitlist))
+        for user in users:
+            self.assertEqual(self.group in user.groups, user.userID in members)
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.controller = StudyGroupController(self.dbmngr)
+        self.users = [User(f"metricUser{i}", "password", f"metricUser{i}@example.com") for i in range(3)]
+        for user in self.users:
+            self.dbmngr.saveUser(user)
+
+    def tearDown(self):
+        disableMetrics()
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def test_disabling_restores_the_original_methods(self):
+        original = vars(StudyGroupController)["joinStudyGroup"]
+        enableMetrics()
+        self.assertIsNot(vars(StudyGroupController)["joinStudyGroup"], original)
+        disableMetrics()
+        self.assertIs(vars(StudyGroupController)["joinStudyGroup"], original)
+        self.assertIs(vars(DatabaseManager)["getUser"], DatabaseManager.getUser)
+
+    def test_counts_calls_and_failures(self):
+        metrics = enableMetrics()
+        group = self.controller.createStudyGroup("MetricGroup", "CS3354", "ECSS", datetime.now(), 2, self.users[0])
+        self.assertIsNone(self.controller.createStudyGroup("MetricGroup", "CS3354", "ECSS", datetime.now(), 2, self.users[1]))
+        self.assertTrue(self.controller.joinStudyGroup(group.groupID, self.users[1]))
+        self.assertFalse(self.controller.joinStudyGroup(group.groupID, self.users[2]))
+        snapshot = metrics.snapshot()
+        create, join = snapshot["StudyGroupController.createStudyGroup"], snapshot["StudyGroupController.joinStudyGroup"]
+        self.assertEqual((create["count"], create["errors"]), (2, 1))
+        self.assertEqual((join["count"], join["errors"]), (2, 1))
+        self.assertEqual(join["buckets"][-1], (float("inf"), 2))
+        self.assertGreater(join["seconds"], 0)
+        # The creator's (a no-op before the group is saved) and the join.
+        self.assertEqual(snapshot["DatabaseManager.saveMembership"]["count"], 2)
+
+    def test_threads_record_into_their_own_shards(self):
+        metrics = enableMetrics()
+
+        def lookUp():
+            for _ in range(500):
+                self.dbmngr.getUser(self.users[0].userID)
+
+        threads = [threading.Thread(target=lookUp) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.snapshot()["DatabaseManager.getUser"]["count"], 2000)
+        self.assertGreaterEqual(len(metrics.shards), 4)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot()["DatabaseManager.getUser"]["count"], 0)
+
+    def test_prometheus_endpoint(self):
+        metrics = enableMetrics(port=0)
+        self.dbmngr.getUserByName("metricUser1")
+        url = f"http://127.0.0.1:{metrics.server.server_address[1]}"
+        with urlopen(f"{url}/metrics") as response:
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+            body = response.read().decode()
+        self.assertIn("# TYPE classcohort_operation_seconds histogram", body)
+        self.assertIn('classcohort_operation_seconds_count{operation="DatabaseManager.getUserByName"} 1', body)
+        self.assertIn('classcohort_operation_seconds_bucket{operation="DatabaseManager.getUserByName",le="+Inf"} 1', body)
+        self.assertIn('classcohort_operation_errors_total{operation="DatabaseManager.getUserByName"} 0', body)
+        with self.assertRaises(HTTPError):
+            urlopen(f"{url}/other")
+        disableMetrics()
+        self.assertIsNone(metrics.server)
+
+class TestMessageSearch(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.alice, self.bob, self.carol = [User(name, "password", f"{name}@example.com") for name in ("alice", "bob", "carol")]
+        for user in (self.alice, self.bob, self.carol):
+            self.dbmngr.saveUser(user)
+        self.group = self.gui.createStudyGroup("Algorithms", "CS4349", "ECSS", datetime.now(), 5, self.alice)
+        self.gui.joinStudyGroup(self.group.groupID, self.bob)
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def contents(self, user, query, limit=20):
+        return [message.content for message in self.gui.searchMessages(user, query, limit)]
+
+    def test_index_builds_without_blocking_senders(self):
+        self.gui.sendGroupMessage(self.alice, self.group, "exam before the build")
+        allMessages = self.dbmngr.storage.allMessages
+
+        def scanWhileSending():
+            history = list(allMessages())
+            # A send during the scan must neither wait for it nor be missing from the finished index.
+            sender = threading.Thread(target=self.gui.sendGroupMessage, args=(self.bob, self.group, "exam during the build"))
+            sender.start()
+            sender.join(2)
+            self.assertFalse(sender.is_alive())
+            return history
+
+        self.dbmngr.storage.allMessages = scanWhileSending
+        self.assertEqual(self.contents(self.bob, "exam"), ["exam during the build", "exam before the build"])
+
+    def test_terms_phrases_and_prefixes(self):
+        self.gui.sendGroupMessage(self.alice, self.group, "CS4349 practice exam: https://example.com/exam.pdf")
+        self.gui.sendGroupMessage(self.bob, self.group, "Exam practice starts at noon")
+        self.gui.sendGroupMessage(self.bob, self.group, "Bring notes")
+        self.assertEqual(self.contents(self.bob, "cs4349 EXAM"), ["CS4349 practice exam: https://example.com/exam.pdf"])
+        self.assertEqual(self.contents(self.bob, "practice exam"),
+                         ["Exam practice starts at noon", "CS4349 practice exam: https://example.com/exam.pdf"])
+        self.assertEqual(self.contents(self.bob, '"practice exam"'), ["CS4349 practice exam: https://example.com/exam.pdf"])
+        self.assertEqual(self.contents(self.bob, "exam.pdf"), ["CS4349 practice exam: https://example.com/exam.pdf"])
+        self.assertEqual(self.contents(self.bob, "prac*"),
+                         ["Exam practice starts at noon", "CS4349 practice exam: https://example.com/exam.pdf"])
+        self.assertEqual(self.contents(self.bob, "no* bring"), ["Bring notes"])
+        self.assertEqual(self.contents(self.bob, "midterm"), [])
+        self.assertEqual(self.contents(self.bob, '""'), [])
+
+    def test_results_respect_visibility(self):
+        self.gui.sendGroupMessage(self.alice, self.group, "group secret")
+        self.gui.sendDirectMessage(self.alice, self.carol, "direct secret")
+        self.assertEqual(self.contents(self.alice, "secret"), ["direct secret", "group secret"])
+        self.assertEqual(self.contents(self.bob, "secret"), ["group secret"])
+        self.assertEqual(self.contents(self.carol, "secret"), ["direct secret"])
+        self.gui.removeFromStudyGroup(self.group.groupID, self.bob)
+        self.assertEqual(self.contents(self.bob, "secret"), [])
+
+    def test_newest_first_with_limit_and_incremental_updates(self):
+        for i in range(5):
+            self.gui.sendDirectMessage(self.alice, self.bob, f"reminder {i}")
+        self.assertEqual(self.contents(self.bob, "reminder", limit=2), ["reminder 4", "reminder 3"])
+        self.gui.sendDirectMessage(self.carol, self.bob, "last reminder")
+        self.assertEqual(self.contents(self.bob, "reminder", limit=2), ["last reminder", "reminder 4"])
+        self.assertEqual(len(self.dbmngr.messageIndex), 6)
+
+    def test_new_terms_are_sorted_in_by_the_next_prefix_query(self):
+        self.gui.sendGroupMessage(self.alice, self.group, "graph theory")
+        self.assertEqual(self.contents(self.bob, "gra*"), ["graph theory"])
+        self.gui.sendGroupMessage(self.alice, self.group, "grammar and graphs")
+        index = self.dbmngr.messageIndex
+        self.assertNotIn("grammar", index.vocabulary)
+        self.assertEqual(self.contents(self.bob, "gra*"), ["grammar and graphs", "graph theory"])
+        self.assertEqual(index.vocabulary, sorted(index.postings))
+
+    def test_index_is_rebuilt_from_a_reloaded_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "search.db")
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            self.dbmngr.saveUser(self.alice)
+            self.dbmngr.saveUser(self.bob)
+            self.gui.sendDirectMessage(self.alice, self.bob, "the review session moved to friday")
+            self.assertEqual(self.contents(self.bob, "friday"), ["the review session moved to friday"])
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            self.assertIsNone(self.dbmngr.messageIndex)
+            bob = self.dbmngr.getUserByName("bob")
+            self.assertEqual(self.contents(bob, '"review session"'), ["the review session moved to friday"])
+            self.dbmngr.useStorage(MemoryStorage())
+
+    def test_hits_are_read_back_from_each_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backends = {"memory": MemoryStorage(), "sqlite": SQLiteStorage(),
+                        "segment log": SegmentLogStorage(os.path.join(directory, "log"))}
+            for name, storage in backends.items():
+                with self.subTest(backend=name):
+                    self.dbmngr.useStorage(storage)
+                    for i in range(3):
+                        self.gui.sendDirectMessage(self.alice, self.bob, f"quiz {i}")
+                    self.assertEqual(self.contents(self.bob, "quiz"), ["quiz 2", "quiz 1", "quiz 0"])
+                    index = self.dbmngr.messageIndex
+                    self.assertEqual(list(index.seqs), [message.seq for message in storage.allMessages()])
+                    # The index holds seqs only, so a message gone from storage drops out of the results.
+                    storage.removeMessages(storage.allMessages()[:1])
+                    self.assertEqual(self.contents(self.bob, "quiz"), ["quiz 2", "quiz 1"])
+                    storage.close()
+            self.dbmngr.useStorage(MemoryStorage())
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.alice, self.bob = User("alice", "password", "alice@example.com"), User("bob", "password", "bob@example.com")
+        for user in (self.alice, self.bob):
+            self.dbmngr.saveUser(user)
+        self.group = self.gui.createStudyGroup("Compilers", "CS4348", "ECSS", datetime.now(), 5, self.alice)
+        self.gui.joinStudyGroup(self.group.groupID, self.bob)
+        self.directory = tempfile.TemporaryDirectory()
+        self.now = datetime(2024, 12, 1, 12)
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+        self.directory.cleanup()
+
+    def send(self, daysAgo, content, group=False):
+        if group:
+            self.gui.sendGroupMessage(self.alice, self.group, content)
+        else:
+            self.gui.sendDirectMessage(self.alice, self.bob, content)
+        message = self.dbmngr.messages[-1]
+        message.timestamp = self.now - timedelta(days=daysAgo)
+        return message
+
+    def history(self, days=(50, 40, 35, 20, 10, 1)):
+        # Alternate direct and group messages, oldest first, as they would have been sent.
+        return [self.send(ago, f"message {i}", group=i % 2 == 1) for i, ago in enumerate(days)]
+
+    def test_expired_messages_move_to_the_archive(self):
+        sent = self.history()
+        self.dbmngr.useArchive(MessageArchive(self.directory.name, blockSize=2), RetentionPolicy(timedelta(days=30)))
+        self.assertEqual(self.dbmngr.applyRetention(self.now), 3)
+        self.assertEqual(self.dbmngr.applyRetention(self.now), 0)
+        self.assertEqual([m.content for m in self.dbmngr.messages], ["message 3", "message 4", "message 5"])
+        self.assertEqual(len(self.dbmngr.archive), 3)
+        self.assertEqual([m.seq for m in self.gui.getMessage(self.bob)], [m.seq for m in sent])
+        self.assertEqual([m.content for m in self.gui.getMessage(self.alice)], ["message 1", "message 3", "message 5"])
+
+    def test_paging_reads_past_the_hot_window(self):
+        sent = self.history()
+        self.dbmngr.useArchive(MessageArchive(self.directory.name, blockSize=2), RetentionPolicy(timedelta(days=30)))
+        self.dbmngr.applyRetention(self.now)
+        first = list(self.gui.getMessagePage(self.bob, limit=2))
+        self.assertEqual([m.content for m in first], ["message 5", "message 4"])
+        self.assertEqual(len(self.dbmngr.archive.cache), 0)
+        rest = list(self.gui.getMessagePage(self.bob, limit=None, cursor=self.gui.getMessageCursor(first[-1])))
+        self.assertEqual([m.seq for m in rest], [m.seq for m in reversed(sent[:4])])
+        window = self.gui.getMessagePage(self.bob, since=self.now - timedelta(days=45), before=self.now - timedelta(days=15), limit=None)
+        self.assertEqual([m.content for m in window], ["message 3", "message 2", "message 1"])
+
+    def test_group_windows_override_the_default(self):
+        self.history()
+        policy = RetentionPolicy(timedelta(days=30), groups={"Compilers": timedelta(days=5)})
+        self.dbmngr.useArchive(MessageArchive(self.directory.name), policy)
+        self.assertEqual(self.dbmngr.applyRetention(self.now), 4)
+        self.assertEqual([m.content for m in self.dbmngr.messages], ["message 4", "message 5"])
+        self.assertEqual(len(self.gui.getMessage(self.bob)), 6)
+
+    def test_archive_reopens_and_seqs_keep_rising(self):
+        sent = self.history((60, 50))
+        self.dbmngr.useArchive(MessageArchive(self.directory.name), RetentionPolicy(timedelta(days=30)))
+        self.dbmngr.applyRetention(self.now)
+        self.assertEqual(self.dbmngr.messages, [])
+        self.dbmngr.useStorage(MemoryStorage())
+        self.assertIsNone(self.dbmngr.archive)
+        for user in (self.alice, self.bob):
+            user.groups = []
+            self.dbmngr.saveUser(user)
+        self.dbmngr.useArchive(MessageArchive(self.directory.name))
+        self.gui.sendDirectMessage(self.alice, self.bob, "after the reload")
+        self.assertEqual([m.seq for m in self.gui.getMessage(self.bob)], [sent[0].seq, sent[-1].seq + 1])
+        self.assertEqual(self.gui.getMessage(self.bob)[0].content, "message 0")
+
+    def test_sqlite_backend_deletes_archived_rows(self):
+        self.dbmngr.useStorage(SQLiteStorage())
+        for user in (self.alice, self.bob):
+            user.groups = []
+            self.dbmngr.saveUser(user)
+        self.dbmngr.messages = [Message.fromRecord((None, "alice", "bob", None, f"note {i}", toMicros(self.now - timedelta(days=ago))))
+                                for i, ago in enumerate((90, 45, 2))]
+        self.dbmngr.useArchive(MessageArchive(self.directory.name), RetentionPolicy(timedelta(days=30)))
+        self.assertEqual(self.dbmngr.applyRetention(self.now), 2)
+        self.assertEqual([m.content for m in self.dbmngr.messages], ["note 2"])
+        self.assertEqual([m.content for m in self.gui.getMessagePage(self.bob, limit=None)], ["note 2", "note 1", "note 0"])
+
+    def test_segment_log_keeps_each_conversations_cut_point(self):
+        logDirectory = os.path.join(self.directory.name, "log")
+        self.dbmngr.useStorage(SegmentLogStorage(logDirectory))
+        # The group keeps 5 days and direct messages 30, so the group's survivor is older than the expired direct message.
+        self.dbmngr.messages = [Message.fromRecord((None, "alice", None, "Compilers", "group note", toMicros(self.now - timedelta(days=2)))),
+                                Message.fromRecord((None, "alice", "bob", None, "old note", toMicros(self.now - timedelta(days=40)))),
+                                Message.fromRecord((None, "alice", "bob", None, "new note", toMicros(self.now - timedelta(days=1))))]
+        policy = RetentionPolicy(timedelta(days=30), groups={"Compilers": timedelta(days=5)})
+        self.dbmngr.useArchive(MessageArchive(os.path.join(self.directory.name, "archive")), policy)
+        self.assertEqual(self.dbmngr.applyRetention(self.now), 1)
+        self.assertEqual([m.content for m in self.dbmngr.messages], ["group note", "new note"])
+        self.dbmngr.useStorage(SegmentLogStorage(logDirectory))
+        self.assertEqual([m.content for m in self.dbmngr.messages], ["group note", "new note"])
+
+    def test_interrupted_retention_is_finished_without_archiving_twice(self):
+        self.history()
+        self.dbmngr.useArchive(MessageArchive(self.directory.name), RetentionPolicy(timedelta(days=30)))
+        # As if the last pass archived its messages and failed before removing them from the hot store.
+        expired = self.dbmngr.messages[:3]
+        self.assertEqual(self.dbmngr.archive.append(expired), 3)
+        self.assertEqual(self.dbmngr.applyRetention(self.now), 3)
+        self.assertEqual(len(self.dbmngr.archive), 3)
+        self.assertEqual([m.seq for m in self.gui.getMessage(self.bob)], [m.seq for m in expired] + [m.seq for m in self.dbmngr.messages])
+
+class TestInboxCache(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.dbmngr.useInboxCache(InboxCache())
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.alice, self.bob, self.carol = (User(name, "password", f"{name}@example.com") for name in ("alice", "bob", "carol"))
+        for user in (self.alice, self.bob, self.carol):
+            self.dbmngr.saveUser(user)
+        self.group = self.gui.createStudyGroup("Compilers", "CS4348", "ECSS", datetime.now(), 5, self.alice)
+        self.gui.joinStudyGroup(self.group.groupID, self.bob)
+
+    def tearDown(self):
+        self.dbmngr.useInboxCache(InboxCache())
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def cached(self):
+        return set(self.dbmngr.inboxCache.entries)
+
+    def readAll(self):
+        return {user.userName: self.gui.getMessage(user) for user in (self.alice, self.bob, self.carol)}
+
+    def test_repeated_reads_hit_the_cache(self):
+        self.gui.sendDirectMessage(self.alice, self.bob, "hi bob")
+        first = self.gui.getMessage(self.bob)
+        self.assertEqual([m.content for m in first], ["hi bob"])
+        # The cached inbox itself is handed out, as a tuple no caller can change.
+        self.assertIs(self.gui.getMessage(self.bob), first)
+        self.assertIsInstance(first, tuple)
+        stats = self.dbmngr.inboxCache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_direct_message_invalidates_only_the_recipient(self):
+        self.readAll()
+        self.gui.sendDirectMessage(self.alice, self.carol, "hi carol")
+        self.assertEqual(self.cached(), {"alice", "bob"})
+        self.assertEqual([m.content for m in self.gui.getMessage(self.carol)], ["hi carol"])
+
+    def test_group_message_invalidates_only_members(self):
+        self.readAll()
+        self.gui.sendGroupMessage(self.alice, self.group, "meet at six")
+        self.assertEqual(self.cached(), {"carol"})
+        self.assertEqual([m.content for m in self.gui.getMessage(self.bob)], ["meet at six"])
+
+    def test_join_and_leave_invalidate_the_member(self):
+        self.gui.sendGroupMessage(self.alice, self.group, "meet at six")
+        self.readAll()
+        self.gui.joinStudyGroup(self.group.groupID, self.carol)
+        self.assertEqual(self.cached(), {"alice", "bob"})
+        self.assertEqual([m.content for m in self.gui.getMessage(self.carol)], ["meet at six"])
+        self.gui.removeFromStudyGroup(self.group.groupID, self.carol)
+        self.assertEqual(self.cached(), {"alice", "bob"})
+        self.assertEqual(self.gui.getMessage(self.carol), ())
+
+    def test_memory_budget_evicts_least_recently_read(self):
+        self.dbmngr.useInboxCache(InboxCache(maxBytes=2 * (InboxCache.MESSAGE_BYTES + 100)))
+        for user in (self.alice, self.bob, self.carol):
+            self.gui.sendDirectMessage(self.alice, user, f"hi {user.userName}")
+        self.gui.getMessage(self.alice)
+        self.gui.getMessage(self.bob)
+        self.gui.getMessage(self.alice)
+        self.gui.getMessage(self.carol)
+        stats = self.dbmngr.inboxCache.stats()
+        self.assertLessEqual(stats["bytes"], stats["maxBytes"])
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(self.cached(), {"alice", "carol"})
+
+    def test_stale_result_is_not_cached(self):
+        cache = self.dbmngr.inboxCache
+        messages, stamp = cache.get("bob")
+        self.gui.sendDirectMessage(self.alice, self.bob, "sent while bob's inbox was loading")
+        cache.put("bob", stamp, [])
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(len(self.gui.getMessage(self.bob)), 1)
+
+class TestAuth(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.alice = User("alice", "correct horse", "alice@example.com")
+        self.dbmngr.saveUser(self.alice)
+
+    def tearDown(self):
+        self.dbmngr.sessions = SessionCache()
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def test_passwords_are_stored_hashed(self):
+        stored = self.dbmngr.userCredentials["alice"]["passwordHash"]
+        self.assertNotIn("correct horse", stored)
+        self.assertEqual(self.alice.password, stored)
+        self.assertTrue(self.dbmngr.passwordHasher.verify("correct horse", stored))
+        self.assertFalse(self.dbmngr.passwordHasher.verify("wrong horse", stored))
+
+    def test_passwords_shaped_like_hashes_are_still_hashed(self):
+        for name, password in (("hashlike", "scrypt$a$b$c$d$e"), ("pbkdflike", "pbkdf2_sha256$x$y$z")):
+            self.dbmngr.saveUser(User(name, password, f"{name}@example.com"))
+            self.assertNotEqual(self.dbmngr.userCredentials[name]["passwordHash"], password)
+            self.assertIsNotNone(self.gui.login(name, password))
+
+    def test_login_issues_a_token_that_authenticates(self):
+        token = self.gui.login("alice", "correct horse")
+        self.assertIsNotNone(token)
+        self.assertIs(self.gui.authenticate(token), self.alice)
+        self.assertTrue(self.gui.logout(token))
+        self.assertIsNone(self.gui.authenticate(token))
+
+    def test_bad_credentials_get_no_token(self):
+        self.assertIsNone(self.gui.login("alice", "wrong horse"))
+        self.assertIsNone(self.gui.login("nobody", "correct horse"))
+        self.assertIsNone(self.gui.login("alice", ""))
+        self.assertIsNone(self.gui.authenticate("not a token"))
+        self.assertEqual(len(self.dbmngr.sessions), 0)
+
+    def test_sessions_expire_and_end_with_the_user(self):
+        now = [0.0]
+        self.dbmngr.sessions = SessionCache(ttl=timedelta(minutes=30), clock=lambda: now[0])
+        token = self.gui.login("alice", "correct horse")
+        now[0] = 29 * 60
+        self.assertIs(self.gui.authenticate(token), self.alice)
+        now[0] = 30 * 60
+        self.assertIsNone(self.gui.authenticate(token))
+        token = self.gui.login("alice", "correct horse")
+        self.dbmngr.removeUser(self.alice)
+        self.assertIsNone(self.gui.authenticate(token))
+
+    def test_both_algorithms_verify_and_report_cost_changes(self):
+        for hasher in (PasswordHasher("scrypt", n=2 ** 4), PasswordHasher("pbkdf2_sha256", iterations=10)):
+            encoded = hasher.hash("secret")
+            self.assertTrue(hasher.verify("secret", encoded))
+            self.assertFalse(hasher.verify("Secret", encoded))
+            self.assertFalse(hasher.needsRehash(encoded))
+        self.assertTrue(PasswordHasher("scrypt", n=2 ** 5).needsRehash(PasswordHasher("scrypt", n=2 ** 4).hash("secret")))
+        self.assertTrue(PasswordHasher().needsRehash("plaintext"))
+
+    def test_login_upgrades_legacy_and_weaker_hashes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "users.db")
+            storage = SQLiteStorage(path)
+            legacy = User("legacy", "old password", "legacy@example.com")
+            storage.saveUser(legacy)  # Written directly, as rows were before hashing.
+            storage.close()
+            self.dbmngr.useStorage(SQLiteStorage(path))
+            self.assertEqual(self.dbmngr.userCredentials["legacy"]["passwordHash"], "old password")
+            self.assertIsNotNone(self.dbmngr.login("legacy", "old password"))
+            stored = self.dbmngr.userCredentials["legacy"]["passwordHash"]
+            self.assertFalse(self.dbmngr.passwordHasher.needsRehash(stored))
+            self.dbmngr.flush()
+            with contextlib.closing(sqlite3.connect(path)) as connection:
+                self.assertEqual(connection.execute("SELECT password FROM users").fetchone()[0], stored)
+            self.dbmngr.useStorage(MemoryStorage())
+
+class TestSnapshotStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(SnapshotStorage(self.directory.name))
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.alice, self.bob, self.carol = (User(name, "password", f"{name}@example.com") for name in ("alice", "bob", "carol"))
+        for user in (self.alice, self.bob, self.carol):
+            self.dbmngr.saveUser(user)
+        self.group = self.gui.createStudyGroup("Compilers", "CS4348", "ECSS", datetime(2024, 11, 5, 14), 2, self.alice,
+                                               duration=timedelta(hours=1))
+        self.gui.joinStudyGroup(self.group.groupID, self.bob)
+        self.gui.joinStudyGroup(self.group.groupID, self.carol, waitlist=True)
+        self.gui.sendDirectMessage(self.alice, self.bob, "hi bob")
+        self.gui.sendGroupMessage(self.bob, self.group, "meet at two")
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+        self.directory.cleanup()
+
+    def reopen(self):
+        # As after a restart: the old store is closed before the directory is opened again.
+        self.dbmngr.storage.close()
+        self.dbmngr.useStorage(SnapshotStorage(self.directory.name))
+        return self.dbmngr
+
+    def assertRestored(self, dbmngr, messages):
+        group = dbmngr.getStudyGroupByName("Compilers")
+        self.assertEqual([member.userName for member in group.members], ["alice", "bob"])
+        self.assertEqual([user.userName for user in group.waitlist.values()], ["carol"])
+        self.assertEqual((group.date, group.duration), (datetime(2024, 11, 5, 14), timedelta(hours=1)))
+        self.assertIsNotNone(dbmngr.login("alice", "password"))
+        bob = dbmngr.getUserByName("bob")
+        self.assertEqual([m.content for m in dbmngr.getMessagesForUser(bob)], messages)
+
+    def test_journal_alone_restores_the_store(self):
+        self.assertRestored(self.reopen(), ["hi bob", "meet at two"])
+
+    def test_removed_user_is_replayed_without_their_memberships(self):
+        # A journal that records only the user removal, as written before removals cascaded.
+        self.dbmngr.storage.removeUser(self.bob)
+        self.dbmngr.flush()
+        dbmngr = self.reopen()
+        group = dbmngr.getStudyGroupByName("Compilers")
+        self.assertEqual([member.userName for member in group.members], ["alice"])
+        self.assertIsNone(dbmngr.getUserByName("bob"))
+        dbmngr.removeUser(dbmngr.getUserByName("carol"))
+        dbmngr.storage.snapshot()
+        self.assertEqual(list(self.reopen().getStudyGroupByName("Compilers").waitlist), [])
+
+    def test_journal_reaches_disk_without_a_flush(self):
+        storage = self.dbmngr.storage
+        self.gui.sendDirectMessage(self.alice, self.bob, "last words")
+        deadline = time.monotonic() + 2
+        while storage.unsynced and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(storage.unsynced)
+        # A fresh reader sees every entry without close() or flush() having run.
+        reader = SnapshotStorage(self.directory.name, snapshotEvery=None)
+        self.assertEqual(reader.journaled, storage.journaled)
+        reader.close()
+
+    def test_snapshot_plus_journal_tail(self):
+        self.dbmngr.storage.snapshot()
+        self.gui.sendDirectMessage(self.carol, self.bob, "after the snapshot")
+        files = sorted(os.listdir(self.directory.name))
+        self.assertEqual(files, ["00000001.journal", "00000001.snap"])
+        dbmngr = self.reopen()
+        self.assertEqual(dbmngr.storage.journaled, 1)
+        self.assertRestored(dbmngr, ["hi bob", "meet at two", "after the snapshot"])
+        self.gui.sendDirectMessage(self.carol, self.bob, "and after the restart")
+        self.assertEqual(dbmngr.getMessagesForUser(dbmngr.getUserByName("bob"))[-1].seq, 4)
+
+    def test_writes_continue_during_a_background_snapshot(self):
+        storage = self.dbmngr.storage
+        thread = storage.snapshot(wait=False)
+        for i in range(50):
+            self.gui.sendDirectMessage(self.alice, self.bob, f"during {i}")
+        thread.join()
+        restored = self.reopen()
+        self.assertEqual(len(restored.getMessagesForUser(restored.getUserByName("bob"))), 52)
+
+    def test_removals_survive_a_restart(self):
+        self.dbmngr.storage.snapshot()
+        self.gui.removeFromStudyGroup(self.group.groupID, self.bob)
+        self.dbmngr.removeStudyGroup(self.group)
+        dbmngr = self.reopen()
+        self.assertIsNone(dbmngr.getStudyGroupByName("Compilers"))
+        self.assertEqual(dbmngr.storage.loadMemberships(), [])
+        self.assertEqual(dbmngr.storage.loadWaitlists(), [])
+
+    def test_torn_journal_tail_is_dropped(self):
+        self.dbmngr.flush()
+        path = os.path.join(self.directory.name, "00000000.journal")
+        with open(path, "ab") as f:
+            f.write(b"\x40\x00\x00\x00partial")
+        self.assertRestored(self.reopen(), ["hi bob", "meet at two"])
+        self.gui.sendDirectMessage(self.carol, self.bob, "appended after the repair")
+        self.assertEqual(len(self.reopen().getMessagesForUser(self.dbmngr.getUserByName("bob"))), 3)
+
+class TestShardRouter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.router = ShardRouter(2)
+        cls.days = 0
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.router.close()
+
+    def setUp(self):
+        # The workers live for the whole class, so every test uses its own names and day.
+        self.prefix = self._testMethodName
+        TestShardRouter.days += 1
+        self.day = datetime(2024, 9, 1) + timedelta(days=self.days)
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.users = [User(f"{self.prefix}User{i}", "password", f"{self.prefix}User{i}@example.com") for i in range(4)]
+        for user in self.users:
+            self.dbmngr.saveUser(user)
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def createGroups(self, count, duration=None):
+        return [self.router.createStudyGroup(f"{self.prefix}Group{i}", "CS3377", "ECSW",
+                                             self.day + timedelta(hours=8 + i), 10, self.users[0], duration)
+                for i in range(count)]
+
+    def test_router_keeps_the_gui_api(self):
+        for name, method in inspect.getmembers(StudyGroupGUI, inspect.isfunction):
+            if not name.startswith("_"):
+                self.assertEqual(inspect.signature(getattr(ShardRouter, name)), inspect.signature(method), name)
+
+    def test_groups_are_partitioned_and_messages_gathered(self):
+        groups = self.createGroups(8)
+        self.assertEqual({shardOf(group.groupID, 2) for group in groups}, {0, 1})
+        alice, bob = self.users[1], self.users[2]
+        for group in groups:
+            self.assertTrue(self.router.joinStudyGroup(group.groupID, alice))
+        self.assertFalse(self.router.joinStudyGroup(groups[0].groupID, alice))
+        for group in groups:
+            self.assertTrue(self.router.sendGroupMessage(alice, group, f"hello {group.groupName}"))
+        self.assertFalse(self.router.sendGroupMessage(bob, groups[0], "not a member"))
+        self.assertTrue(self.router.sendDirectMessage(bob, alice, "direct"))
+        inbox = self.router.getMessage(alice)
+        self.assertEqual([message.content for message in inbox],
+                         [f"hello {group.groupName}" for group in groups] + ["direct"])
+        self.assertEqual(len(self.router.getMessage(self.users[0])), 8)
+        self.assertEqual(self.router.getMessage(self.users[3]), ())
+        self.assertEqual(len({message.seq for message in inbox}), 9)
+
+    def test_pages_walk_every_shard_newest_first(self):
+        groups = self.createGroups(4)
+        for i in range(12):
+            self.router.sendGroupMessage(self.users[0], groups[i % 4], f"message {i}")
+        seen, cursor = [], None
+        while True:
+            page = list(self.router.getMessagePage(self.users[0], limit=5, cursor=cursor))
+            if not page:
+                break
+            seen.extend(message.content for message in page)
+            cursor = self.router.getMessageCursor(page[-1])
+        self.assertEqual(seen, [f"message {i}" for i in reversed(range(12))])
+        self.assertEqual([m.content for m in self.router.searchMessages(self.users[0], "message", limit=3)],
+                         ["message 11", "message 10", "message 9"])
+        with self.assertRaises(ValueError):
+            list(self.router.getMessagePage(self.users[0], cursor="not a cursor"))
+
+    def test_names_and_rooms_are_unique_across_shards(self):
+        groups = self.createGroups(4, timedelta(hours=1))
+        self.assertIsNone(self.router.createStudyGroup(groups[1].groupName, "CS3377", "SCI", groups[1].date, 5, self.users[1]))
+        clash = groups[2].date + timedelta(minutes=30)
+        self.assertIsNone(self.router.createStudyGroup(f"{self.prefix}Late", "CS3377", "ECSW", clash, 5, self.users[1],
+                                                       timedelta(hours=1)))
+        self.assertIsNone(self.router.createStudyGroup(f"{self.prefix}Bad", "XX9999", "ECSW", clash, 5, self.users[1]))
+        other = self.router.createStudyGroup(f"{self.prefix}Other", "CS4337", "SCI", clash, 5, self.users[1],
+                                             timedelta(hours=1))
+        self.assertEqual(other.members, [self.users[1]])
+        self.assertEqual([group.groupName for group in self.router.getTimeClashes(other.groupID, self.users[0])],
+                         [groups[2].groupName, groups[3].groupName])
+
+    def test_search_and_waitlists_route_to_the_right_shard(self):
+        groups = self.createGroups(6)
+        found = self.router.searchStudyGroups(course="CS3377", since=groups[0].date, before=groups[5].date, limit=3)
+        self.assertEqual([group.groupID for group in found], [group.groupID for group in groups[:3]])
+        small = self.router.createStudyGroup(f"{self.prefix}Small", "CS3377", "SCI", self.day, 1, self.users[0])
+        self.assertFalse(self.router.joinStudyGroup(small.groupID, self.users[1], waitlist=True))
+        self.assertEqual(self.router.getWaitlistPosition(small.groupID, self.users[1]), 1)
+        self.assertFalse(self.router.joinStudyGroup(small.groupID, self.users[2]))
+        self.assertFalse(self.router.removeFromStudyGroup(small.groupID, self.users[0]))  # would leave it empty
+        self.assertTrue(self.router.leaveWaitlist(small.groupID, self.users[1]))
+        self.assertIsNone(self.router.getWaitlistPosition(small.groupID, self.users[1]))
+        token = self.router.login(self.users[0].userName, "password")
+        self.assertIs(self.router.authenticate(token), self.users[0])
+        self.assertTrue(self.router.logout(token))
+
+    def test_unread_counts_span_shards(self):
+        groups = self.createGroups(4)
+        alice, bob = self.users[1], self.users[2]
+        for group in groups:
+            self.router.joinStudyGroup(group.groupID, alice)
+            self.router.sendGroupMessage(self.users[0], group, "agenda")
+        self.router.sendDirectMessage(bob, alice, "hi")
+        self.router.sendDirectMessage(alice, bob, "hi yourself")
+        self.router.sendDirectMessage(bob, alice, "ready?")
+        counts = self.router.getUnreadCounts(alice)
+        self.assertEqual(counts["direct"], {bob.userName: 2})
+        self.assertEqual(counts["groups"], {group.groupName: 1 for group in groups})
+        # alice's own message lives on bob's shard; reading up to it covers the first "hi" only.
+        own = [message for message in self.router.getMessage(bob) if message.sender == alice.userName][0]
+        self.assertTrue(self.router.markRead(alice, bob, upTo=own))
+        self.assertTrue(self.router.markRead(alice, groups[0]))
+        counts = self.router.getUnreadCounts(alice)
+        self.assertEqual(counts["direct"], {bob.userName: 1})
+        self.assertEqual(counts["groups"][groups[0].groupName], 0)
+        self.assertEqual(self.router.getUnreadCounts(bob)["direct"], {alice.userName: 1})
+
+    def test_batches_span_shards(self):
+        groups = self.createGroups(6)
+        alice = self.users[1]
+        self.router.joinStudyGroup(groups[0].groupID, alice)
+        status = self.router.broadcastGroupMessage(self.users[0], groups, "room change")
+        self.assertEqual(list(status), [group.groupID for group in groups])
+        self.assertTrue(all(status.values()))
+        self.assertEqual(self.router.broadcastGroupMessage(alice, groups[:2], "hi"),
+                         {groups[0].groupID: True, groups[1].groupID: False})
+        self.assertEqual(self.router.sendMessages(alice, self.users[2], ["one", " ", "two"]), [True, False, True])
+        self.assertEqual([m.content for m in self.router.getMessage(self.users[2])], ["one", "two"])
+        self.assertEqual(len(self.router.getMessage(self.users[0])), 7)
+
+
+class TestEventBus(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.bus = self.originalBus = self.dbmngr.events
+        self.users = [User(f"eventUser{i}", "password", f"eventUser{i}@example.com") for i in range(3)]
+
+    def tearDown(self):
+        self.dbmngr.events = self.originalBus
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def populate(self):
+        for user in self.users:
+            self.dbmngr.saveUser(user)
+        group = self.gui.createStudyGroup("eventGroup", "CS3377", "ECSW", datetime(2024, 9, 2), 5, self.users[0])
+        self.gui.joinStudyGroup(group.groupID, self.users[1])
+        self.gui.sendGroupMessage(self.users[1], group, "hello")
+        self.gui.removeFromStudyGroup(group.groupID, self.users[1])
+        return group
+
+    def wait(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_writes_publish_typed_events_in_seq_order(self):
+        start = self.bus.lastSeq
+        group = self.populate()
+        events, missed = self.bus.read(start)
+        self.assertEqual(missed, 0)
+        self.assertEqual([type(event) for event in events],
+                         [UserSaved] * 3 + [StudyGroupSaved, MemberAdded, MessageSaved, MemberRemoved])
+        self.assertEqual([event.seq for event in events], list(range(start + 1, start + 8)))
+        self.assertIs(events[3].studyGroup, group)
+        self.assertEqual(events[3].studyGroup.members, [self.users[0]])
+        self.assertEqual((events[4].studyGroup, events[4].user), (group, self.users[1]))
+        self.assertEqual(events[5].message.content, "hello")
+        self.assertEqual(self.bus.read(start + 5, limit=1)[0], [events[5]])
+
+    def test_subscribers_get_batches_and_can_resume(self):
+        start = self.bus.lastSeq
+        received = []
+        subscription = self.bus.subscribe(received.extend, types=(MemberAdded, MemberRemoved))
+        self.populate()
+        self.wait(lambda: len(received) == 2)
+        subscription.close()
+        self.assertEqual([type(event) for event in received], [MemberAdded, MemberRemoved])
+        self.assertEqual(subscription.position, self.bus.lastSeq)
+        # A new subscriber resuming from the join sees everything after it.
+        batches = []
+        resumed = self.bus.subscribe(batches.append, since=received[0].seq, batchSize=2)
+        self.wait(lambda: sum(map(len, batches)) == 2)
+        resumed.close()
+        self.assertEqual([len(batch) for batch in batches], [2])
+        self.assertEqual([event.seq for batch in batches for event in batch], [start + 6, start + 7])
+
+    def test_slow_subscriber_never_blocks_writers(self):
+        self.dbmngr.events = self.bus = EventBus(retain=10)
+        release = threading.Event()
+        received = []
+
+        def slow(events):
+            release.wait(5)
+            received.extend(events)
+
+        subscription = self.bus.subscribe(slow, batchSize=1)
+        sender, recipient = self.users[0], self.users[1]
+        start = time.monotonic()
+        for i in range(100):
+            self.gui.sendDirectMessage(sender, recipient, f"message {i}")
+        self.assertLess(time.monotonic() - start, 2)
+        release.set()
+        self.wait(lambda: subscription.position == self.bus.lastSeq)
+        subscription.close()
+        self.assertGreater(subscription.missed, 0)
+        self.assertEqual(len(received) + subscription.missed, 100)
+        self.assertEqual(received[-1].message.content, "message 99")
+        self.assertEqual(self.bus.read(0)[1], self.bus.first - 1)
+
+    def test_asyncio_stream_receives_events_from_other_threads(self):
+        async def collect():
+            events = []
+            async for batch in self.bus.stream(types=(MessageSaved,)):
+                events.extend(batch)
+                if len(events) >= 3:
+                    return events
+
+        async def scenario():
+            task = asyncio.create_task(collect())
+            await asyncio.sleep(0)
+            writer = threading.Thread(target=lambda: [self.gui.sendDirectMessage(self.users[0], self.users[1], f"async {i}")
+                                                      for i in range(3)])
+            writer.start()
+            events = await asyncio.wait_for(task, 5)
+            writer.join()
+            return events
+
+        events = asyncio.run(scenario())
+        self.assertEqual([event.message.content for event in events], ["async 0", "async 1", "async 2"])
+
+    def test_failing_handler_keeps_its_subscription(self):
+        received = []
+
+        def handler(events):
+            received.extend(events)
+            raise RuntimeError("boom")
+
+        subscription = self.bus.subscribe(handler, batchSize=1)
+        with self.assertLogs("classcohort", level="ERROR"):
+            self.dbmngr.saveUser(self.users[0])
+            self.dbmngr.saveUser(self.users[1])
+            self.wait(lambda: len(received) == 2)
+        subscription.close()
+        self.assertFalse(subscription.thread.is_alive())
+
+class TestUnreadCounts(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.alice, self.bob, self.carol = (User(name, "password", f"{name}@example.com") for name in ("alice", "bob", "carol"))
+        for user in (self.alice, self.bob, self.carol):
+            self.dbmngr.saveUser(user)
+        self.group = self.gui.createStudyGroup("Compilers", "CS4348", "ECSS", datetime(2024, 11, 5, 14), 5, self.alice)
+        self.gui.joinStudyGroup(self.group.groupID, self.bob)
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def chat(self):
+        self.gui.sendDirectMessage(self.bob, self.alice, "hi alice")
+        self.gui.sendDirectMessage(self.alice, self.bob, "hi bob")
+        self.gui.sendDirectMessage(self.bob, self.alice, "are you coming?")
+        self.gui.sendGroupMessage(self.bob, self.group, "meet at two")
+        self.gui.sendGroupMessage(self.alice, self.group, "see you there")
+
+    def test_counters_build_without_blocking_senders(self):
+        self.chat()
+        self.dbmngr.markRead(self.alice, self.bob)
+        self.dbmngr.unreadCounts = None
+        allMessages = self.dbmngr.storage.allMessages
+
+        def scanWhileSending():
+            history = list(allMessages())
+            sender = threading.Thread(target=self.gui.sendDirectMessage, args=(self.bob, self.alice, "still there?"))
+            sender.start()
+            sender.join(2)
+            self.assertFalse(sender.is_alive())
+            return history
+
+        self.dbmngr.storage.allMessages = scanWhileSending
+        self.assertEqual(self.gui.getUnreadCounts(self.alice), {"direct": {"bob": 1}, "groups": {"Compilers": 1}})
+
+    def test_counts_exclude_own_messages_and_stay_current(self):
+        self.chat()
+        self.assertEqual(self.gui.getUnreadCounts(self.alice), {"direct": {"bob": 2}, "groups": {"Compilers": 1}})
+        self.assertEqual(self.gui.getUnreadCounts(self.bob), {"direct": {"alice": 1}, "groups": {"Compilers": 1}})
+        self.assertEqual(self.gui.getUnreadCounts(self.carol), {"direct": {}, "groups": {}})
+        # Built once, then maintained by saveMessage.
+        self.gui.sendDirectMessage(self.carol, self.alice, "hello")
+        self.gui.sendGroupMessage(self.bob, self.group, "bring snacks")
+        self.assertEqual(self.gui.getUnreadCounts(self.alice), {"direct": {"bob": 2, "carol": 1}, "groups": {"Compilers": 2}})
+
+    def test_mark_read_up_to_a_message(self):
+        self.chat()
+        first = self.gui.getMessage(self.alice)[0]
+        self.assertTrue(self.gui.markRead(self.alice, self.bob, upTo=first))
+        self.assertEqual(self.gui.getUnreadCounts(self.alice)["direct"], {"bob": 1})
+        self.assertTrue(self.gui.markRead(self.alice, self.bob))
+        self.assertTrue(self.gui.markRead(self.alice, self.group))
+        self.assertEqual(self.gui.getUnreadCounts(self.alice), {"direct": {"bob": 0}, "groups": {"Compilers": 0}})
+        self.assertEqual(self.gui.getUnreadCounts(self.bob), {"direct": {"alice": 1}, "groups": {"Compilers": 1}})
+        self.assertFalse(self.gui.markRead(self.carol, self.group))
+        self.gui.sendGroupMessage(self.bob, self.group, "running late")
+        self.assertEqual(self.gui.getUnreadCounts(self.alice)["groups"], {"Compilers": 1})
+
+    def test_cursors_survive_a_reload(self):
+        for storage in (lambda: SQLiteStorage(os.path.join(directory, "study.db")), lambda: SnapshotStorage(directory)):
+            with self.subTest(storage=storage), tempfile.TemporaryDirectory() as directory:
+                self.dbmngr.useStorage(storage())
+                for user in (self.alice, self.bob):
+                    self.dbmngr.saveUser(user)
+                self.gui.sendDirectMessage(self.bob, self.alice, "first")
+                self.gui.sendDirectMessage(self.bob, self.alice, "second")
+                self.gui.markRead(self.alice, self.bob, upTo=self.gui.getMessage(self.alice)[0])
+                self.dbmngr.storage.close()
+                self.dbmngr.useStorage(storage())
+                alice = self.dbmngr.getUserByName("alice")
+                self.assertEqual(self.dbmngr.getUnreadCounts(alice), {"direct": {"bob": 1}, "groups": {}})
+                self.dbmngr.useStorage(MemoryStorage())
+
+    def test_replacing_messages_rebuilds_counts(self):
+        self.chat()
+        self.gui.markRead(self.alice, self.bob)
+        self.dbmngr.messages = [message for message in self.dbmngr.messages if message.group]
+        self.assertEqual(self.gui.getUnreadCounts(self.alice), {"direct": {}, "groups": {"Compilers": 1}})
+
+
+class TestBatchSend(unittest.TestCase):
+    def setUp(self):
+        self.dbmngr = DatabaseManager()
+        self.dbmngr.useStorage(MemoryStorage())
+        self.gui = StudyGroupGUI(StudyGroupController(self.dbmngr), MessageController(self.dbmngr))
+        self.ta, self.alice, self.bob = (User(name, "password", f"{name}@example.com") for name in ("ta", "alice", "bob"))
+        for user in (self.ta, self.alice, self.bob):
+            self.dbmngr.saveUser(user)
+        self.groups = [self.gui.createStudyGroup(f"Section{i}", "CS3377", "ECSW", datetime(2024, 9, 2 + i), 5, self.ta)
+                       for i in range(3)]
+        self.gui.joinStudyGroup(self.groups[0].groupID, self.alice)
+        self.gui.joinStudyGroup(self.groups[1].groupID, self.bob)
+        self.other = self.gui.createStudyGroup("Elsewhere", "CS3377", "SCI", datetime(2024, 9, 2), 5, self.alice)
+
+    def tearDown(self):
+        self.dbmngr.useStorage(MemoryStorage())
+
+    def test_broadcast_reports_each_group(self):
+        status = self.gui.broadcastGroupMessage(self.ta, self.groups + [self.other, self.groups[0]], "Quiz moved to Friday")
+        self.assertEqual(status, {**{group.groupID: True for group in self.groups}, self.other.groupID: False})
+        self.assertEqual([m.group for m in self.gui.getMessage(self.ta)], ["Section0", "Section1", "Section2"])
+        self.assertEqual([m.content for m in self.gui.getMessage(self.alice)], ["Quiz moved to Friday"])
+        self.assertEqual([m.group for m in self.gui.getMessage(self.bob)], ["Section1"])
+        self.assertEqual(self.gui.broadcastGroupMessage(self.ta, self.groups, "  "),
+                         {group.groupID: False for group in self.groups})
+        self.assertEqual(len(self.dbmngr.messages), 3)
+
+    def test_send_messages_keeps_order_and_skips_empty_ones(self):
+        self.assertEqual(self.gui.sendMessages(self.alice, self.bob, ["one", "", "two", "three"]), [True, False, True, True])
+        self.assertEqual(self.gui.sendMessages(self.alice, self.groups[0], ["to the group"]), [True])
+        self.assertEqual(self.gui.sendMessages(self.bob, self.groups[0], ["not a member", "again"]), [False, False])
+        received = self.gui.getMessage(self.bob)
+        self.assertEqual([m.content for m in received], ["one", "two", "three"])
+        self.assertEqual([m.seq for m in received], list(range(received[0].seq, received[0].seq + 3)))
+        self.assertEqual(self.gui.getUnreadCounts(self.bob)["direct"], {"alice": 3})
+        self.assertEqual(self.gui.getUnreadCounts(self.ta)["groups"]["Section0"], 1)
+
+    def test_batch_updates_search_events_and_inbox_cache(self):
+        self.gui.searchMessages(self.alice, "anything")
+        self.gui.getMessage(self.alice)
+        start = self.dbmngr.events.lastSeq
+        self.gui.sendMessages(self.bob, self.alice, ["exam review tonight", "bring the notes"])
+        events, _ = self.dbmngr.events.read(start)
+        self.assertEqual([event.message.content for event in events], ["exam review tonight", "bring the notes"])
+        self.assertEqual([m.content for m in self.gui.searchMessages(self.alice, "review")], ["exam review tonight"])
+        self.assertEqual(len(self.gui.getMessage(self.alice)), 2)
+
+    def test_batch_is_one_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "study.db")
+            self.dbmngr.useStorage(SQLiteStorage(path, batchSize=5))
+            for user in (self.alice, self.bob):
+                self.dbmngr.saveUser(user)
+            self.dbmngr.flush()
+            # Five rows fill the batch, so the executemany is committed at once.
+            self.gui.sendMessages(self.alice, self.bob, [f"message {i}" for i in range(5)])
+            reader = sqlite3.connect(path)
+            self.assertEqual(reader.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 5)
+            reader.close()
+            self.dbmngr.useStorage(SnapshotStorage(directory))
+            for user in (self.alice, self.bob):
+                self.dbmngr.saveUser(user)
+            journaled = self.dbmngr.storage.journaled
+            self.gui.sendMessages(self.alice, self.bob, [f"message {i}" for i in range(5)])
+            self.assertEqual(self.dbmngr.storage.journaled, journaled + 1)
+            self.dbmngr.storage.close()
+            self.dbmngr.useStorage(SnapshotStorage(directory))
+            bob = self.dbmngr.getUserByName("bob")
+            self.assertEqual([m.content for m in self.dbmngr.getMessagesForUser(bob)], [f"message {i}" for i in range(5)])
+            self.dbmngr.useStorage(MemoryStorage())
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
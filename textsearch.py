@@ -0,0 +1,230 @@
+"""Inverted index over message content: term, phrase and prefix queries, newest first, filtered by visibility."""
+import heapq
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+TOKEN = re.compile(r"\w+")
+QUERY = re.compile(r'"([^"]*)"|(\S+)')
+# A posting packs (doc id, token position) into one int, so a token's postings are a single sorted array.
+POSITION_BITS = 12
+MAX_POSITION = (1 << POSITION_BITS) - 1
+# Prefix queries use at most this many vocabulary terms, like most search engines.
+MAX_EXPANSIONS = 64
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.casefold())
+
+
+def contains(entries: array, doc: int) -> bool:
+    i = bisect_left(entries, doc << POSITION_BITS)
+    return i < len(entries) and entries[i] >> POSITION_BITS == doc
+
+
+def positions(entries: array, doc: int) -> Iterator[int]:
+    i = bisect_left(entries, doc << POSITION_BITS)
+    while i < len(entries) and entries[i] >> POSITION_BITS == doc:
+        yield entries[i] & MAX_POSITION
+        i += 1
+
+
+def descending(entries: array) -> Iterator[int]:
+    last = None
+    for entry in reversed(entries):
+        doc = entry >> POSITION_BITS
+        if doc != last:
+            yield doc
+            last = doc
+
+
+def mergeDescending(streams: Iterable[Iterator[int]]) -> Iterator[int]:
+    last = None
+    for doc in heapq.merge(*streams, reverse=True):
+        if doc != last:
+            yield doc
+            last = doc
+
+
+class Term:
+    def __init__(self, entries: array):
+        self.entries = entries
+        self.size = len(entries)
+
+    def descending(self) -> Iterator[int]:
+        return descending(self.entries)
+
+    def contains(self, doc: int) -> bool:
+        return contains(self.entries, doc)
+
+
+class Phrase:
+    def __init__(self, lists: List[array]):
+        self.lists = lists
+        self.rarest = min(lists, key=len)
+        self.size = len(self.rarest)
+
+    def descending(self) -> Iterator[int]:
+        return (doc for doc in descending(self.rarest) if self.contains(doc))
+
+    def contains(self, doc: int) -> bool:
+        for start in positions(self.lists[0], doc):
+            if start + len(self.lists) - 1 > MAX_POSITION:
+                break
+            if all(self.at(entries, doc, start + offset) for offset, entries in enumerate(self.lists[1:], 1)):
+                return True
+        return False
+
+    @staticmethod
+    def at(entries: array, doc: int, position: int) -> bool:
+        packed = doc << POSITION_BITS | position
+        i = bisect_left(entries, packed)
+        return i < len(entries) and entries[i] == packed
+
+
+class Prefix:
+    def __init__(self, lists: List[array]):
+        self.lists = lists
+        self.size = sum(len(entries) for entries in lists)
+
+    def descending(self) -> Iterator[int]:
+        return mergeDescending(descending(entries) for entries in self.lists)
+
+    def contains(self, doc: int) -> bool:
+        return any(contains(entries, doc) for entries in self.lists)
+
+
+class Visible:
+    # The messages a user may see: direct messages they sent or received and their groups' messages.
+    def __init__(self, index: "MessageIndex", userName: str, groupNames: Set[str]):
+        self.index = index
+        # Names the index has never seen get code -1, which no doc carries.
+        self.user = index.names.get(userName, -1)
+        self.groupCodes = {index.names[name] for name in groupNames if name in index.names}
+        self.lists = [entries for entries in [index.directTo.get(userName), index.directFrom.get(userName)]
+                      + [index.groupDocs.get(name) for name in groupNames] if entries]
+        self.size = sum(len(entries) for entries in self.lists)
+
+    def descending(self) -> Iterator[int]:
+        return mergeDescending(reversed(entries) for entries in self.lists)
+
+    def contains(self, doc: int) -> bool:
+        index = self.index
+        group = index.groups[doc]
+        if group:
+            return group in self.groupCodes
+        return index.recipients[doc] == self.user or index.senders[doc] == self.user
+
+
+class MessageIndex:
+    """Incremental inverted index; messages must be added in seq order, so doc ids follow send order.
+
+    Queries are words (all must match), "quoted phrases" and prefix* terms. Matching runs newest
+    first from whichever clause, visibility included, has the fewest candidates, checking the rest
+    by bisection, and stops after `limit` hits: cost follows the rarest clause, not the history size.
+
+    Messages themselves are not kept, only each doc's seq and its conversation as codes into `names`:
+    search returns seqs, which the caller reads back from storage.
+    """
+
+    def __init__(self):
+        self.seqs = array("q")
+        self.names: Dict[Optional[str], int] = {None: 0}
+        self.senders = array("i")
+        self.recipients = array("i")
+        self.groups = array("i")
+        self.postings: Dict[str, array] = {}
+        # Sorted, for prefix lookups. New terms wait in newTerms and are merged in by the next prefix query,
+        # so a save never pays for shifting the whole list.
+        self.vocabulary: List[str] = []
+        self.newTerms: List[str] = []
+        self.termLock = threading.Lock()
+        self.mergeLock = threading.Lock()
+        self.directTo: Dict[str, array] = {}
+        self.directFrom: Dict[str, array] = {}
+        self.groupDocs: Dict[str, array] = {}
+
+    def __len__(self):
+        return len(self.seqs)
+
+    def add(self, message) -> None:
+        doc = len(self.seqs)
+        self.seqs.append(message.seq)
+        self.senders.append(self.code(message.sender))
+        self.recipients.append(self.code(message.recipient))
+        self.groups.append(self.code(message.group))
+        for position, token in enumerate(tokenize(message.content)):
+            entries = self.postings.get(token)
+            if entries is None:
+                entries = self.postings[token] = array("q")
+                with self.termLock:
+                    self.newTerms.append(token)
+            entries.append(doc << POSITION_BITS | min(position, MAX_POSITION))
+        if message.group:
+            self.groupDocs.setdefault(message.group, array("q")).append(doc)
+        else:
+            self.directTo.setdefault(message.recipient, array("q")).append(doc)
+            if message.sender != message.recipient:
+                self.directFrom.setdefault(message.sender, array("q")).append(doc)
+
+    def code(self, name: Optional[str]) -> int:
+        code = self.names.get(name)
+        if code is None:
+            code = self.names[name] = len(self.names)
+        return code
+
+    def parse(self, query: str) -> Optional[list]:
+        """The query's clauses, or None if some clause cannot match anything."""
+        clauses = []
+        for phrase, word in QUERY.findall(query):
+            tokens = tokenize(phrase if phrase else word)
+            if not tokens:
+                continue
+            if word.endswith("*"):
+                clauses.extend(self.term(token) for token in tokens[:-1])
+                clauses.append(self.prefix(tokens[-1]))
+            elif len(tokens) > 1:
+                lists = [self.postings.get(token) for token in tokens]
+                clauses.append(Phrase(lists) if all(lists) else None)
+            else:
+                clauses.append(self.term(tokens[0]))
+        return None if None in clauses else clauses
+
+    def term(self, token: str) -> Optional[Term]:
+        entries = self.postings.get(token)
+        return Term(entries) if entries else None
+
+    def sortedVocabulary(self) -> List[str]:
+        # Searches run concurrently with add, so the pending terms are swapped out under termLock and merged
+        # outside it: saves wait for the swap only, never for the sort.
+        with self.mergeLock:
+            with self.termLock:
+                pending, self.newTerms = self.newTerms, []
+            if pending:
+                self.vocabulary = sorted(self.vocabulary + pending)
+            return self.vocabulary
+
+    def prefix(self, prefix: str) -> Optional[Prefix]:
+        vocabulary = self.sortedVocabulary()
+        start = bisect_left(vocabulary, prefix)
+        tokens = vocabulary[start:start + MAX_EXPANSIONS]
+        lists = [self.postings[token] for token in tokens if token.startswith(prefix)]
+        return Prefix(lists) if lists else None
+
+    def search(self, userName: str, groupNames: Iterable[str], query: str, limit: Optional[int] = 20) -> List[int]:
+        """Seqs of the matching messages `userName` may see, newest first."""
+        clauses = self.parse(query)
+        if not clauses:
+            return []
+        clauses.append(Visible(self, userName, set(groupNames)))
+        driver = min(clauses, key=lambda clause: clause.size)
+        others = [clause for clause in clauses if clause is not driver]
+        results = []
+        for doc in driver.descending():
+            if all(clause.contains(doc) for clause in others):
+                results.append(self.seqs[doc])
+                if limit is not None and len(results) >= limit:
+                    break
+        return results